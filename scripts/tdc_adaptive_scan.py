@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 自适应扫描 (粗到细)
+基于单步命令实现：
+  1. 粗扫描: 以固定间隔稀疏采样整个相位范围
+  2. 细化:   在检测到的环绕点和残差异常点附近二分加密采样
+  3. 重复:   对标准误差超过目标的相位追加重复测量
+直到 INL/DNL 不确定度达到目标或命令预算用完，
+所需命令数远少于逐相位的多次全扫描。
+稀疏采样时 DNL 按采样间隔归一化: 间隔 g 内每步的平均 DNL = (|Δfine| / g - step) / step。
+"""
+
+import numpy as np
+
+from tdc_linearity import unwrap, fit_lines
+
+
+class AdaptiveScanner:
+    """自适应相位扫描控制器"""
+
+    def __init__(self, scanner, channel=0b11, phase_min=0, phase_max=224,
+                 coarse_step=8, initial_repeats=2, target_inl_ps=5.0,
+                 target_dnl_lsb=0.3, outlier_sigma=4.0, max_commands=600,
+                 clk_period=3864, phase_step=17.17, timeout=5.0):
+        """
+        Args:
+            scanner: 已连接的 TDCScanner
+            channel: 通道选择 (0b01=DOWN, 0b10=UP, 0b11=BOTH)
+            phase_min/phase_max: 扫描相位范围
+            coarse_step: 粗扫描相位间隔
+            initial_repeats: 粗扫描每个相位的重复次数 (>=2 才能估计噪声)
+            target_inl_ps: 每个采样相位均值的目标标准误差 (ps)
+            target_dnl_lsb: 相邻采样相位之间平均每步 DNL 的目标标准误差 (LSB)
+            outlier_sigma: 残差异常判定阈值 (倍噪声)
+            max_commands: 单步命令预算
+            clk_period: 时钟周期 (ps)
+            phase_step: 相位步进 (ps)
+            timeout: 单条命令接收超时 (秒)
+        """
+        self.scanner = scanner
+        self.channel = channel
+        self.phase_min = phase_min
+        self.phase_max = phase_max
+        self.coarse_step = max(1, coarse_step)
+        self.initial_repeats = max(1, initial_repeats)
+        self.target_inl_ps = target_inl_ps
+        self.target_dnl_lsb = target_dnl_lsb
+        self.outlier_sigma = outlier_sigma
+        self.max_commands = max_commands
+        self.CLK_PERIOD = clk_period
+        self.PHASE_STEP = phase_step
+        self.timeout = timeout
+
+        self.commands = 0
+        self.data_list = []
+        # {数据类型: {相位: [fine, ...]}}
+        self.samples = {}
+
+    # ------------------------------------------------------------------
+    # 测量
+    # ------------------------------------------------------------------
+    def _channel_types(self):
+        """当前通道选择对应的数据类型列表"""
+        types = []
+        if self.channel & 0b10:
+            types.append(self.scanner.TYPE_UP)
+        if self.channel & 0b01:
+            types.append(self.scanner.TYPE_DOWN)
+        return types
+
+    def _measure(self, phase, repeats):
+        """在指定相位发送 repeats 条单步命令并收集数据"""
+        expected_count = 2 if self.channel == 0b11 else 1
+        for _ in range(repeats):
+            if self.commands >= self.max_commands:
+                return False
+            self.commands += 1
+            if not self.scanner.start_scan(scan_mode=self.scanner.SCAN_SINGLE,
+                                           phase=phase, channel=self.channel):
+                print(f"[ERROR] 相位 {phase} 命令发送失败")
+                continue
+            data = self.scanner.receive_data(expected_count=expected_count,
+                                             timeout=self.timeout)
+            if len(data) == 0:
+                print(f"[WARN] 相位 {phase} 未收到数据")
+                continue
+            for d in data:
+                if d['type'] not in (self.scanner.TYPE_UP, self.scanner.TYPE_DOWN):
+                    continue
+                self.samples.setdefault(d['type'], {}).setdefault(phase, []).append(d['fine'])
+            self.data_list.extend(data)
+        return True
+
+    # ------------------------------------------------------------------
+    # 模型与不确定度
+    # ------------------------------------------------------------------
+    def _phase_values(self, values):
+        """同一相位的重复测量，环绕点附近跨越周期边界的值移到第一个值的同一侧"""
+        v = np.asarray(values, dtype=float)
+        half = self.CLK_PERIOD / 2
+        return v[0] + np.mod(v - v[0] + half, self.CLK_PERIOD) - half
+
+    def _pooled_sigma(self):
+        """由所有重复测量的相位估计合并噪声标准差 (ps)"""
+        ss, dof = 0.0, 0
+        for per_phase in self.samples.values():
+            for values in per_phase.values():
+                if len(values) > 1:
+                    v = self._phase_values(values)
+                    ss += ((v - v.mean())**2).sum()
+                    dof += len(v) - 1
+        if dof == 0:
+            return 1.0
+        # 量化噪声下限: fine 以 1ps 为单位
+        return max(np.sqrt(ss / dof), 1.0 / np.sqrt(12))
+
+    def _channel_curve(self, data_type):
+        """
+        返回某通道已采样相位的展开曲线
+
+        Returns:
+            tuple: (phases, means, counts, unwrapped, residuals)
+        """
+        per_phase = self.samples.get(data_type, {})
+        phases = np.array(sorted(per_phase), dtype=int)
+        means = np.array([np.mod(self._phase_values(per_phase[p]).mean(), self.CLK_PERIOD)
+                          for p in phases], dtype=float)
+        counts = np.array([len(per_phase[p]) for p in phases], dtype=int)
+
+        # 展开环绕: 相邻采样点间的跳变按整周期计入
+        unwrapped, _ = unwrap(means, self.CLK_PERIOD)
+
+        if len(phases) > 2:
+            slope, intercept = fit_lines(phases, unwrapped)
+            residuals = unwrapped - (slope * phases + intercept)
+        else:
+            residuals = np.zeros_like(unwrapped)
+        return phases, means, counts, unwrapped, residuals
+
+    def _plan_refinement(self):
+        """
+        根据当前数据规划下一轮测量
+
+        Returns:
+            dict: {相位: 追加重复次数}
+        """
+        sigma = self._pooled_sigma()
+        plan = {}
+
+        for data_type in self._channel_types():
+            phases, means, counts, unwrapped, residuals = self._channel_curve(data_type)
+            if len(phases) < 2:
+                continue
+
+            # 1. 环绕点与异常残差所在的区间二分加密
+            wrap_mask = np.abs(np.diff(means)) > self.CLK_PERIOD / 2
+            noise = max(sigma, 1.4826 * np.median(np.abs(residuals - np.median(residuals))))
+            outlier = np.abs(residuals) > self.outlier_sigma * noise
+            interesting = wrap_mask | outlier[:-1] | outlier[1:]
+            gaps = np.diff(phases)
+            for i in np.where(interesting & (gaps > 1))[0]:
+                mid = int((phases[i] + phases[i + 1]) // 2)
+                plan[mid] = max(plan.get(mid, 0), self.initial_repeats)
+
+            # 2. 标准误差超标的相位追加重复
+            se = sigma / np.sqrt(counts)
+            need_inl = se > self.target_inl_ps
+            # 间隔 g 内平均每步 DNL 的标准误差: sqrt(se_i² + se_j²) / (g × step)；
+            # 超标的区间两端各需要 target × g × step / √2 的标准误差，取相邻区间中较严的
+            se_dnl = np.sqrt(se[:-1]**2 + se[1:]**2) / (gaps * self.PHASE_STEP)
+            pair_se = np.where(se_dnl > self.target_dnl_lsb,
+                               self.target_dnl_lsb * gaps * self.PHASE_STEP / np.sqrt(2), np.inf)
+            dnl_se = np.full(len(phases), np.inf)
+            dnl_se[:-1] = pair_se
+            dnl_se[1:] = np.minimum(dnl_se[1:], pair_se)
+            need_dnl = np.isfinite(dnl_se)
+
+            for i in np.where(need_inl | need_dnl)[0]:
+                target_se = min(self.target_inl_ps, dnl_se[i])
+                required = int(np.ceil((sigma / target_se)**2))
+                extra = min(required - counts[i], 4 * self.initial_repeats)
+                if extra > 0:
+                    p = int(phases[i])
+                    plan[p] = max(plan.get(p, 0), extra)
+
+        return plan
+
+    # ------------------------------------------------------------------
+    # 主流程
+    # ------------------------------------------------------------------
+    def run(self, max_rounds=20):
+        """
+        执行自适应扫描
+
+        Args:
+            max_rounds: 最大细化轮数
+
+        Returns:
+            list: 接收到的全部数据 (与 receive_data 格式相同)
+        """
+        coarse = list(range(self.phase_min, self.phase_max + 1, self.coarse_step))
+        if coarse[-1] != self.phase_max:
+            coarse.append(self.phase_max)
+
+        print(f"\n[INFO] 自适应扫描: 粗扫描 {len(coarse)} 个相位 (间隔 {self.coarse_step})")
+        for phase in coarse:
+            if not self._measure(phase, self.initial_repeats):
+                break
+
+        for round_idx in range(max_rounds):
+            plan = self._plan_refinement()
+            if not plan:
+                print(f"[INFO] 第 {round_idx+1} 轮: 已达到目标不确定度")
+                break
+            if self.commands >= self.max_commands:
+                print(f"[WARN] 命令预算 ({self.max_commands}) 已用完")
+                break
+
+            print(f"[INFO] 第 {round_idx+1} 轮细化: {len(plan)} 个相位, "
+                  f"{sum(plan.values())} 条命令")
+            for phase in sorted(plan):
+                if not self._measure(phase, plan[phase]):
+                    break
+
+        dense = (self.phase_max - self.phase_min + 1) * self.initial_repeats
+        print(f"[INFO] 自适应扫描完成: 共 {self.commands} 条命令 "
+              f"(等效逐相位扫描 {dense} 条)")
+        return self.data_list
+
+    def summary(self):
+        """
+        汇总每个通道的 INL/DNL 估计及其不确定度
+
+        Returns:
+            dict: {'UP'/'DOWN': {...}}
+        """
+        sigma = self._pooled_sigma()
+        names = {self.scanner.TYPE_UP: 'UP', self.scanner.TYPE_DOWN: 'DOWN'}
+        result = {}
+
+        print("\n" + "="*70)
+        print("自适应扫描结果")
+        print("="*70)
+        print(f"  命令数: {self.commands}")
+        print(f"  合并噪声标准差: {sigma:.3f} ps")
+
+        for data_type in self._channel_types():
+            phases, means, counts, unwrapped, residuals = self._channel_curve(data_type)
+            if len(phases) < 3:
+                continue
+            slope, _ = fit_lines(phases, unwrapped)
+            step = abs(slope)
+            se = sigma / np.sqrt(counts)
+
+            # 按采样间隔归一化的 DNL (间隔 > 1 时为间隔内的平均值)
+            gaps = np.diff(phases)
+            dnl = (np.abs(np.diff(unwrapped)) / gaps - step) / step
+            se_dnl = np.sqrt(se[:-1]**2 + se[1:]**2) / (gaps * step)
+
+            wraps = int(np.sum(np.abs(np.diff(means)) > self.CLK_PERIOD / 2))
+            name = names[data_type]
+            print(f"\n  {name} 通道:")
+            print(f"    采样相位数: {len(phases)} (测量 {counts.sum()} 次)")
+            print(f"    拟合斜率: {slope:.3f} ps/phase (理论: {-self.PHASE_STEP:.2f})")
+            print(f"    环绕点: {wraps}")
+            print(f"    INL RMS: {np.sqrt(np.mean(residuals**2)):.2f} ps "
+                  f"(最大标准误差 {se.max():.2f} ps)")
+            if len(dnl) > 0:
+                print(f"    DNL RMS: {np.sqrt(np.mean(dnl**2)):.3f} LSB "
+                      f"({len(dnl)} 个采样间隔, 其中相邻相位 {int(np.sum(gaps == 1))} 个, "
+                      f"最大标准误差 {se_dnl.max():.3f} LSB)")
+
+            result[name] = {
+                'phases': phases.tolist(),
+                'counts': counts.tolist(),
+                'slope': float(slope),
+                'wrap_points': wraps,
+                'inl_ps': residuals.tolist(),
+                'inl_se_ps': se.tolist(),
+                'inl_rms_ps': float(np.sqrt(np.mean(residuals**2))),
+                'dnl_rms_lsb': float(np.sqrt(np.mean(dnl**2))) if len(dnl) else None,
+                'dnl_max_se_lsb': float(se_dnl.max()) if len(dnl) else None,
+            }
+
+        result['commands'] = self.commands
+        result['noise_sigma_ps'] = float(sigma)
+        print("="*70 + "\n")
+        return result
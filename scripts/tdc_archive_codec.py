@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 采集归档编解码 (.tdcarc)
+32 位数据字中有大量冗余: 通道标志与类型重复，ID 在一次扫描中按顺序递增。
+归档按列拆分后分块压缩，每块可独立解码 (随机访问、并行解码、损坏只影响一块):
+  type    2 bit / 条 (每字节 4 条)
+  id      与前一条的差 (mod 256)，扫描中几乎全是 0/1
+  coarse  与前一条的差 (mod 256)
+  fine    13 bit 紧密排列
+  flag    只记录与类型不一致的例外 (UP 应为 1，其他类型应为 0) 的下标
+各列拼接后用 zlib 或 lzma 压缩。解码完全向量化，逐位还原原始数据字 (无损)。
+
+文件格式 (小端):
+  头部: b'TDCARC' + uint16 版本 + uint32 元数据长度 + JSON 元数据 (含 chunk_records、compression)
+  块:   uint32 条数 + uint32 压缩后长度 + uint32 解压后 CRC32 + 压缩数据
+  索引: CHUNK_INDEX_DTYPE 数组 (每块的文件偏移、第一条记录的序号、条数)
+  尾部: uint64 索引偏移 + uint32 块数 + b'TDCAIX'
+写入中断 (没有尾部) 时，读取方顺序扫描完整的块重建索引。
+
+用法:
+  python tdc_archive_codec.py convert tdc_results/tdc_scan_xxx.txt [-o out.tdcarc] [--lzma]
+  python tdc_archive_codec.py info tdc_results/xxx.tdcarc
+  python tdc_archive_codec.py extract tdc_results/xxx.tdcarc [-o xxx.txt]
+  python tdc_archive_codec.py bench tdc_results/xxx.tdcarc
+"""
+
+import argparse
+import json
+import lzma
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from tdc_words import decode_words, decode_records, encode_words, to_data_list
+
+
+_MAGIC = b'TDCARC'
+_INDEX_MAGIC = b'TDCAIX'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<6sHI')
+_CHUNK_HEADER = struct.Struct('<III')
+_FOOTER = struct.Struct('<QI6s')
+
+CHUNK_INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),              # 块头在文件中的偏移
+    ('first', '<u8'),               # 块内第一条记录的全局序号
+    ('count', '<u4'),
+])
+
+FINE_BITS = 13
+TYPE_UP = 0b00
+
+_COMPRESSORS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+
+# ----------------------------------------------------------------------
+# 列编码
+# ----------------------------------------------------------------------
+def pack_bits(values, bits):
+    """
+    无符号整数数组的低 bits 位紧密排列 (大端位序)
+
+    Returns:
+        numpy.ndarray: uint8，长度 ceil(len × bits / 8)
+    """
+    width = 8 * ((bits + 7) // 8)
+    as_bytes = np.asarray(values).astype(f'>u{width // 8}').view(np.uint8)
+    matrix = np.unpackbits(as_bytes).reshape(-1, width)[:, width - bits:]
+    return np.packbits(matrix)
+
+
+def unpack_bits(packed, bits, count):
+    """
+    pack_bits 的逆运算 (bits <= 16)
+    每个值最多跨 3 个字节: 按位偏移取出 24 位窗口再移位，比逐位展开快约 5 倍
+
+    Returns:
+        numpy.ndarray: uint16
+    """
+    buf = np.zeros(len(packed) + 3, dtype=np.uint32)
+    buf[:len(packed)] = packed
+    offset = np.arange(count, dtype=np.uint32) * bits
+    index = offset >> 3
+    window = (buf[index] << 16) | (buf[index + 1] << 8) | buf[index + 2]
+    return ((window >> (24 - bits - (offset & 0x7))) & ((1 << bits) - 1)).astype(np.uint16)
+
+
+def _pack_types(types):
+    padded = np.zeros(-(-len(types) // 4) * 4, dtype=np.uint8)
+    padded[:len(types)] = types
+    quads = padded.reshape(-1, 4)
+    return (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+
+
+def _unpack_types(packed, count):
+    packed = np.asarray(packed, dtype=np.uint8)
+    quads = np.stack([packed >> 6, packed >> 4, packed >> 2, packed], axis=1) & 0x3
+    return quads.ravel()[:count]
+
+
+def encode_chunk(words):
+    """
+    一块数据字 -> 未压缩的列数据
+
+    Returns:
+        bytes
+    """
+    fields = decode_words(words)
+    data_type = fields['type']
+    # ID / 粗计数与前一条的差 (uint8 自然按 256 折回)
+    id_delta = np.diff(fields['id'], prepend=np.uint8(0)).astype(np.uint8)
+    coarse_delta = np.diff(fields['coarse'], prepend=np.uint8(0)).astype(np.uint8)
+    expected_flag = (data_type == TYPE_UP).astype(np.uint8)
+    exceptions = np.flatnonzero(fields['flag'] != expected_flag).astype('<u4')
+    parts = [
+        _pack_types(data_type).tobytes(),
+        id_delta.tobytes(),
+        coarse_delta.tobytes(),
+        pack_bits(fields['fine'], FINE_BITS).tobytes(),
+        struct.pack('<I', len(exceptions)),
+        exceptions.tobytes(),
+    ]
+    return b''.join(parts)
+
+
+def decode_chunk(raw, count):
+    """
+    未压缩的列数据 -> 数据字
+
+    Returns:
+        numpy.ndarray: uint32
+    """
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    pos = 0
+    n_type = -(-count // 4)
+    data_type = _unpack_types(buf[pos:pos + n_type], count)
+    pos += n_type
+    ids = np.cumsum(buf[pos:pos + count], dtype=np.uint8)
+    pos += count
+    coarse = np.cumsum(buf[pos:pos + count], dtype=np.uint8)
+    pos += count
+    n_fine = -(-count * FINE_BITS // 8)
+    fine = unpack_bits(buf[pos:pos + n_fine], FINE_BITS, count)
+    pos += n_fine
+    (n_exc,) = struct.unpack_from('<I', raw, pos)
+    pos += 4
+    exceptions = np.frombuffer(raw, dtype='<u4', count=n_exc, offset=pos)
+
+    flag = (data_type == TYPE_UP).astype(np.uint8)
+    flag[exceptions] ^= 1
+    return encode_words(data_type, ids, fine, flag, coarse)
+
+
+# ----------------------------------------------------------------------
+# 文件
+# ----------------------------------------------------------------------
+class ArchiveWriter:
+    """按块写入归档文件"""
+
+    def __init__(self, filepath, chunk_records=1 << 16, compression='zlib', level=None,
+                 **metadata):
+        """
+        Args:
+            filepath: 输出文件
+            chunk_records: 每块条数
+            compression: 'zlib' 或 'lzma'
+            level: 压缩级别 (默认 zlib 6 / lzma 6)
+            metadata: 写入头部的附加信息 (来源文件、板卡等)
+        """
+        if compression not in _COMPRESSORS:
+            raise ValueError(f"不支持的压缩方式: {compression}")
+        self.filepath = filepath
+        self.chunk_records = chunk_records
+        self.compression = compression
+        self.level = 6 if level is None else level
+        self._compress = _COMPRESSORS[compression][0]
+        self.index = []
+        self.count = 0
+        self.stored = 0
+        self._pending = np.empty(0, dtype=np.uint32)
+
+        meta = dict(metadata, chunk_records=chunk_records, compression=compression,
+                    created=time.time())
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        self._f = open(filepath, 'wb')
+        self._f.write(_FILE_HEADER.pack(_MAGIC, _VERSION, len(meta_bytes)))
+        self._f.write(meta_bytes)
+
+    def write(self, data_list):
+        """追加一批数据 (receive_data 格式)"""
+        words = np.fromiter((d['raw'] for d in data_list), dtype=np.uint32, count=len(data_list))
+        self.write_words(words)
+
+    def write_words(self, words):
+        """追加一批数据字，满一块即压缩写入"""
+        words = np.concatenate([self._pending, np.asarray(words, dtype=np.uint32)])
+        full = len(words) - len(words) % self.chunk_records
+        for i in range(0, full, self.chunk_records):
+            self._write_chunk(words[i:i + self.chunk_records])
+        self._pending = words[full:]
+
+    def _write_chunk(self, words):
+        raw = encode_chunk(words)
+        payload = self._compress(raw, self.level)
+        offset = self._f.tell()
+        self._f.write(_CHUNK_HEADER.pack(len(words), len(payload), zlib.crc32(raw)))
+        self._f.write(payload)
+        self.index.append((offset, self.count, len(words)))
+        self.count += len(words)
+        self.stored += _CHUNK_HEADER.size + len(payload)
+
+    def close(self):
+        """写入剩余数据、索引与尾部"""
+        if self._f is None:
+            return
+        if len(self._pending):
+            self._write_chunk(self._pending)
+            self._pending = self._pending[:0]
+        index = np.array(self.index, dtype=CHUNK_INDEX_DTYPE)
+        index_offset = self._f.tell()
+        self._f.write(index.tobytes())
+        self._f.write(_FOOTER.pack(index_offset, len(index), _INDEX_MAGIC))
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader:
+    """读取归档文件 (按块随机访问)"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            self._data = f.read()
+        magic, version, meta_len = _FILE_HEADER.unpack_from(self._data)
+        if magic != _MAGIC:
+            raise ValueError(f"{filepath} 不是 TDC 归档文件")
+        if version != _VERSION:
+            raise ValueError(f"不支持的归档文件版本: {version}")
+        start = _FILE_HEADER.size
+        self.metadata = json.loads(self._data[start:start + meta_len].decode('utf-8'))
+        self._decompress = _COMPRESSORS[self.metadata.get('compression', 'zlib')][1]
+        self._data_start = start + meta_len
+        self.index = self._read_index()
+        self.count = int(self.index['count'].sum()) if len(self.index) else 0
+
+    def _read_index(self):
+        data = self._data
+        if len(data) >= self._data_start + _FOOTER.size:
+            offset, n_chunks, magic = _FOOTER.unpack_from(data, len(data) - _FOOTER.size)
+            if magic == _INDEX_MAGIC:
+                return np.frombuffer(data, dtype=CHUNK_INDEX_DTYPE, count=n_chunks, offset=offset)
+
+        # 写入中断: 顺序扫描完整的块
+        print(f"[WARN] {self.filepath} 没有块索引 (写入中断?)，按完整的块重建")
+        entries = []
+        pos = self._data_start
+        first = 0
+        while pos + _CHUNK_HEADER.size <= len(data):
+            count, length, _ = _CHUNK_HEADER.unpack_from(data, pos)
+            if pos + _CHUNK_HEADER.size + length > len(data):
+                break
+            entries.append((pos, first, count))
+            first += count
+            pos += _CHUNK_HEADER.size + length
+        return np.array(entries, dtype=CHUNK_INDEX_DTYPE)
+
+    @property
+    def n_chunks(self):
+        return len(self.index)
+
+    def read_chunk(self, i):
+        """
+        解码第 i 块
+
+        Returns:
+            numpy.ndarray: uint32 数据字
+        """
+        offset = int(self.index['offset'][i])
+        count, length, crc = _CHUNK_HEADER.unpack_from(self._data, offset)
+        start = offset + _CHUNK_HEADER.size
+        raw = self._decompress(self._data[start:start + length])
+        if zlib.crc32(raw) != crc:
+            raise ValueError(f"{self.filepath} 第 {i} 块校验失败")
+        return decode_chunk(raw, count)
+
+    def read_words(self, start=0, stop=None, workers=1):
+        """
+        读取全局序号 [start, stop) 的数据字，只解码涉及的块
+
+        Args:
+            workers: 并行解码的线程数 (解压与 numpy 运算释放 GIL)
+
+        Returns:
+            numpy.ndarray: uint32
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        if stop <= start:
+            return np.empty(0, dtype=np.uint32)
+        first = self.index['first'].astype(np.int64)
+        lo = int(np.searchsorted(first, start, side='right')) - 1
+        hi = int(np.searchsorted(first, stop, side='left'))
+        chunks = range(lo, hi)
+        if workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(workers) as pool:
+                parts = list(pool.map(self.read_chunk, chunks))
+        else:
+            parts = [self.read_chunk(i) for i in chunks]
+        words = np.concatenate(parts)
+        base = int(first[lo])
+        return words[start - base:stop - base]
+
+    def records(self, **kwargs):
+        """全部记录 (RECORD_DTYPE)"""
+        return decode_records(self.read_words(**kwargs))
+
+    def data_list(self, **kwargs):
+        """全部数据 (receive_data 格式)"""
+        return to_data_list(decode_words(self.read_words(**kwargs)))
+
+    def describe(self):
+        """文件摘要文本"""
+        size = len(self._data)
+        ratio = size / (4 * self.count) if self.count else float('nan')
+        lines = [
+            f"文件: {self.filepath}",
+            f"记录数: {self.count}, 块数: {self.n_chunks} (每块 {self.metadata.get('chunk_records')} 条)",
+            f"压缩: {self.metadata.get('compression')}, 大小 {size} 字节 "
+            f"({8 * size / max(self.count, 1):.2f} bit/条, 原始数据字的 {ratio * 100:.1f}%)",
+        ]
+        extra = {k: v for k, v in self.metadata.items()
+                 if k not in ('chunk_records', 'compression', 'created')}
+        if extra:
+            lines.append("元数据: " + json.dumps(extra, ensure_ascii=False))
+        return "\n".join(lines)
+
+
+def archive_path(src):
+    """采集文件 -> 默认归档文件名 (去掉压缩扩展名后替换为 .tdcarc)"""
+    base = src
+    for ext in ('.gz', '.xz', '.bz2'):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return os.path.splitext(base)[0] + '.tdcarc'
+
+
+def convert(src, dst=None, chunk_records=1 << 16, compression='zlib', level=None):
+    """
+    将采集文件 (文本 / 压缩文本 / .tdcblk) 转换为归档文件
+
+    Returns:
+        str: 输出文件路径
+    """
+    from tdc_scan import TDCDataProcessor
+
+    dst = dst or archive_path(src)
+    data_list = TDCDataProcessor.load_from_file(src)
+    with ArchiveWriter(dst, chunk_records, compression, level,
+                       source=os.path.basename(src)) as writer:
+        writer.write(data_list)
+    src_size = os.path.getsize(src)
+    dst_size = os.path.getsize(dst)
+    print(f"[INFO] {len(data_list)} 个数据 -> {len(writer.index)} 块: "
+          f"{dst} ({src_size} -> {dst_size} 字节, {dst_size / max(src_size, 1) * 100:.1f}%)")
+    return dst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 采集归档编解码")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('convert', help="采集文件 -> 归档文件")
+    p.add_argument('file')
+    p.add_argument('-o', '--output', default=None)
+    p.add_argument('--chunk', type=int, default=1 << 16, help="每块条数")
+    p.add_argument('--lzma', action='store_true', help="使用 lzma (更小，更慢)")
+    p.add_argument('--level', type=int, default=None, help="压缩级别")
+
+    p = sub.add_parser('info', help="查看归档文件")
+    p.add_argument('file')
+
+    p = sub.add_parser('extract', help="归档文件 -> 文本采集文件")
+    p.add_argument('file')
+    p.add_argument('-o', '--output', default=None)
+
+    p = sub.add_parser('bench', help="比较归档与原始二进制 / 文本的读取速度")
+    p.add_argument('file')
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert(args.file, args.output, args.chunk, 'lzma' if args.lzma else 'zlib', args.level)
+    elif args.command == 'info':
+        print(ArchiveReader(args.file).describe())
+    elif args.command == 'extract':
+        from tdc_scan import TDCDataProcessor
+        output = args.output or os.path.splitext(args.file)[0] + '.txt'
+        processor = TDCDataProcessor(ArchiveReader(args.file).data_list())
+        processor.save_to_file(os.path.basename(output), os.path.dirname(output) or '.')
+    elif args.command == 'bench':
+        import tempfile
+        start = time.perf_counter()
+        reader = ArchiveReader(args.file)
+        words = reader.read_words()
+        t_archive = time.perf_counter() - start
+        start = time.perf_counter()
+        reader.read_words(workers=args.workers)
+        t_parallel = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as tmp:
+            raw_path = os.path.join(tmp, 'raw.bin')
+            words.astype('>u4').tofile(raw_path)
+            start = time.perf_counter()
+            raw = np.fromfile(raw_path, dtype='>u4').astype(np.uint32)
+            t_raw = time.perf_counter() - start
+            assert np.array_equal(raw, words)
+            raw_size = os.path.getsize(raw_path)
+
+        size = os.path.getsize(args.file)
+        n = len(words)
+        print(f"[INFO] {n} 条记录")
+        print(f"  归档:       {size:>12} 字节 ({size / raw_size * 100:5.1f}%)  "
+              f"{t_archive * 1000:8.1f} ms ({n / t_archive / 1e6:.1f} M/s)")
+        print(f"  归档 ({args.workers} 线程): {'':>6}{t_parallel * 1000:8.1f} ms "
+              f"({n / t_parallel / 1e6:.1f} M/s)")
+        print(f"  原始二进制: {raw_size:>12} 字节 (100.0%)  "
+              f"{t_raw * 1000:8.1f} ms ({n / t_raw / 1e6:.1f} M/s, 页缓存命中)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 批量重分析工具
+将目录中的历史采集文件分发到进程池并行分析:
+  TDCDataProcessor.process / analyze_tdc_performance / plot
+结果 (性能字典、分析报告、图表) 按内容寻址缓存:
+  缓存键 = sha256(文件内容 + 分析版本)
+重复运行时只重新计算新增或内容变化的文件。
+
+用法:
+  python tdc_batch_analysis.py tdc_results [-j 8] [--no-plot] [--force] [--report summary.csv]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use('Agg')  # 工作进程中只保存图片，不弹窗
+import matplotlib.pyplot as plt
+
+from tdc_scan import TDCDataProcessor
+
+
+DEFAULT_CACHE_DIR = '.tdc_cache'
+MIN_PLOT_SAMPLES = 10  # 点数不超过此值时不生成图表
+
+
+def cache_key(filepath):
+    """计算文件的缓存键: sha256(内容 + 分析版本)"""
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    h.update(f"analysis-v{TDCDataProcessor.ANALYSIS_VERSION}".encode())
+    return h.hexdigest()
+
+
+def _cache_paths(cache_dir, key):
+    """缓存键对应的边车文件 (json, png)"""
+    return (os.path.join(cache_dir, f"{key}.json"),
+            os.path.join(cache_dir, f"{key}.png"))
+
+
+def load_cached(cache_dir, key, make_plot=True):
+    """
+    读取缓存结果，不存在或损坏时返回 None
+
+    缓存键不含绘图开关: 需要图表而缓存由 --no-plot 运行写入、
+    或图片已被删除时同样视为未命中，重新分析后覆盖该缓存。
+    """
+    json_path, png_path = _cache_paths(cache_dir, key)
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if result.get('key') != key:
+        return None
+    if make_plot and result.get('samples', 0) > MIN_PLOT_SAMPLES:
+        if not result.get('figure') or not os.path.isfile(png_path):
+            return None
+    return result
+
+
+def analyze_file(filepath, key, cache_dir, make_plot=True):
+    """
+    分析单个文件并写入缓存 (在工作进程中执行)
+
+    Returns:
+        dict: 分析结果
+    """
+    start = time.time()
+    json_path, png_path = _cache_paths(cache_dir, key)
+
+    # 分析过程的打印输出作为报告保存
+    report = io.StringIO()
+    with contextlib.redirect_stdout(report):
+        data_list = TDCDataProcessor.load_from_file(filepath)
+        processor = TDCDataProcessor(data_list)
+        performance = processor.process()
+        figure = None
+        if make_plot and len(data_list) > MIN_PLOT_SAMPLES:
+            processor.plot(save_file=png_path)
+            plt.close('all')
+            figure = os.path.basename(png_path)
+
+    result = {
+        'key': key,
+        'analysis_version': TDCDataProcessor.ANALYSIS_VERSION,
+        'source': os.path.abspath(filepath),
+        'samples': len(data_list),
+        'performance': performance,
+        'figure': figure,
+        'report': report.getvalue(),
+        'elapsed': time.time() - start,
+    }
+
+    # 先写临时文件再替换，避免中断时留下半个缓存文件
+    tmp_path = json_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=1, default=float)
+    os.replace(tmp_path, json_path)
+    return result
+
+
+def find_captures(paths, pattern_ext=('.txt', '.txt.gz', '.txt.xz', '.txt.bz2', '.tdcarc')):
+    """收集待分析的采集文件"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in sorted(names):
+                    if name.endswith(pattern_ext):
+                        files.append(os.path.join(root, name))
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def batch_analyze(files, cache_dir=None, workers=None, make_plot=True, force=False):
+    """
+    并行分析文件列表，命中缓存的文件直接读取结果
+
+    Args:
+        files: 采集文件路径列表
+        cache_dir: 缓存目录 (默认在每个文件所在目录下的 .tdc_cache)
+        workers: 进程数 (默认 CPU 核数)
+        make_plot: 是否生成图表
+        force: 忽略缓存强制重新分析
+
+    Returns:
+        dict: {文件路径: 分析结果}
+    """
+    results = {}
+    pending = []
+
+    for filepath in files:
+        directory = cache_dir or os.path.join(os.path.dirname(os.path.abspath(filepath)),
+                                              DEFAULT_CACHE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        key = cache_key(filepath)
+        cached = None if force else load_cached(directory, key, make_plot)
+        if cached is not None:
+            results[filepath] = cached
+        else:
+            pending.append((filepath, key, directory))
+
+    print(f"[INFO] 共 {len(files)} 个文件: 缓存命中 {len(results)}, 需要分析 {len(pending)}")
+
+    if pending:
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(analyze_file, filepath, key, directory, make_plot): filepath
+                for filepath, key, directory in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                filepath = futures[future]
+                try:
+                    results[filepath] = future.result()
+                except Exception as e:
+                    print(f"[ERROR] 分析失败 {filepath}: {e}")
+                    continue
+                if done % 50 == 0 or done == len(futures):
+                    print(f"[INFO] 进度: {done}/{len(futures)}")
+        print(f"[INFO] 分析完成，耗时 {time.time() - start:.1f} s")
+
+    return results
+
+
+def write_report(results, report_path):
+    """将关键指标汇总为 CSV"""
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write("file,samples,span_ps,avg_step_ps,dnl_rms_lsb,inl_rms_lsb,inl_rms_ps,wrap_points\n")
+        for filepath in sorted(results):
+            r = results[filepath]
+            perf = r.get('performance') or {}
+            row = [
+                filepath,
+                r.get('samples', 0),
+                perf.get('range', {}).get('span', ''),
+                perf.get('resolution', {}).get('avg_step', ''),
+                perf.get('dnl', {}).get('rms', ''),
+                perf.get('inl', {}).get('rms_lsb', ''),
+                perf.get('inl', {}).get('rms_ps', ''),
+                perf.get('inl', {}).get('wrap_points', ''),
+            ]
+            f.write(",".join(str(v) for v in row) + "\n")
+    print(f"[INFO] 汇总报告已保存到: {report_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 批量重分析 (并行 + 结果缓存)")
+    parser.add_argument('paths', nargs='+', help="采集文件或目录")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="并行进程数")
+    parser.add_argument('--cache-dir', default=None, help="缓存目录 (默认与数据文件同目录)")
+    parser.add_argument('--no-plot', action='store_true', help="不生成图表")
+    parser.add_argument('--force', action='store_true', help="忽略缓存")
+    parser.add_argument('--report', default=None, help="汇总 CSV 输出路径")
+    args = parser.parse_args()
+
+    files = find_captures(args.paths)
+    if not files:
+        print("[WARN] 没有找到数据文件")
+        return 1
+
+    results = batch_analyze(files, cache_dir=args.cache_dir, workers=args.jobs,
+                            make_plot=not args.no_plot, force=args.force)
+
+    for filepath in sorted(results):
+        inl = (results[filepath].get('performance') or {}).get('inl', {})
+        print(f"  {os.path.basename(filepath)}: {results[filepath]['samples']} 点, "
+              f"INL RMS = {inl.get('rms_lsb', float('nan')):.3f} LSB")
+
+    if args.report:
+        write_report(results, args.report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 分块采集文件 (.tdcblk) 与块级索引
+数据按固定记录数分块写入 (tdc_words.RECORD_DTYPE 定长记录)，文件末尾是块索引，
+每个块的索引项 (zone map) 记录:
+  相位 ID 的最小/最大值、通道 (类型) 掩码及各类型计数、
+  粗计数与精细时间的最小/最大值、全局记录序号、块内数据的接收时间范围
+按通道 / 相位范围 / 时间窗口等条件查询时先用索引排除不可能命中的块，
+只读取 (memmap) 并解码命中的块，再逐条精确过滤。
+
+文件格式 (小端):
+  头部: b'TDCBLK' + uint16 版本 + uint32 元数据长度 + JSON 元数据 (含 block_records)
+  数据: 连续的 RECORD_DTYPE 记录，除最后一块外每块 block_records 条
+  索引: INDEX_DTYPE 数组
+  尾部: uint64 索引偏移 + uint32 块数 + b'TDCIDX'
+写入中断 (没有尾部) 时，读取方按完整的块重建索引 (时间范围未知，记为 NaN)。
+
+记录本身不带时间戳，时间窗口只能精确到块: 与窗口重叠的块整体返回。
+
+用法:
+  python tdc_block_capture.py convert tdc_results/tdc_scan_xxx.txt [-o out.tdcblk] [--block 4096]
+  python tdc_block_capture.py info tdc_results/xxx.tdcblk
+  python tdc_block_capture.py query tdc_results/xxx.tdcblk [--channel UP] [--phase 0:31]
+                                   [--start 0] [--end 60] [-o subset.txt]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from tdc_words import RECORD_DTYPE, decode_records, to_data_list
+
+
+_MAGIC = b'TDCBLK'
+_INDEX_MAGIC = b'TDCIDX'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<6sHI')
+_FOOTER = struct.Struct('<QI6s')
+
+CHANNEL_TYPES = {'UP': 0b00, 'DOWN': 0b01, 'INFO': 0b10}
+
+INDEX_DTYPE = np.dtype([
+    ('first', '<u8'),               # 块内第一条记录的全局序号
+    ('count', '<u4'),
+    ('type_mask', 'u1'),            # bit k = 含类型 k 的数据
+    ('type_counts', '<u4', (4,)),
+    ('id_min', 'u1'),
+    ('id_max', 'u1'),
+    ('coarse_min', 'u1'),
+    ('coarse_max', 'u1'),
+    ('fine_min', '<u2'),
+    ('fine_max', '<u2'),
+    ('t_first', '<f8'),             # 块内数据的接收时间范围 (秒, epoch)
+    ('t_last', '<f8'),
+])
+
+
+def zone_map(records, first=0, t_first=np.nan, t_last=np.nan):
+    """
+    计算一个块的索引项
+
+    Args:
+        records: RECORD_DTYPE 数组 (非空)
+        first: 第一条记录的全局序号
+        t_first/t_last: 接收时间范围
+
+    Returns:
+        numpy.void: INDEX_DTYPE 记录
+    """
+    entry = np.zeros((), dtype=INDEX_DTYPE)
+    counts = np.bincount(records['type'], minlength=4)
+    entry['first'] = first
+    entry['count'] = len(records)
+    entry['type_counts'] = counts
+    entry['type_mask'] = int(((counts > 0) << np.arange(4)).sum())
+    for field in ('id', 'coarse', 'fine'):
+        entry[f'{field}_min'] = records[field].min()
+        entry[f'{field}_max'] = records[field].max()
+    entry['t_first'] = t_first
+    entry['t_last'] = t_last
+    return entry
+
+
+def records_from_data_list(data_list):
+    """receive_data 格式的数据列表 -> RECORD_DTYPE 数组 (由原始数据字重新解码)"""
+    words = np.fromiter((d['raw'] for d in data_list), dtype=np.uint32, count=len(data_list))
+    return decode_records(words)
+
+
+class BlockWriter:
+    """分块写入器: 缓存满一个块后写盘并记录索引项，关闭时写入索引"""
+
+    def __init__(self, filepath, block_records=4096, **metadata):
+        """
+        Args:
+            filepath: 输出文件路径 (.tdcblk)
+            block_records: 每块的记录数
+            metadata: 写入文件头的附加信息
+        """
+        if block_records <= 0:
+            raise ValueError(f"无效的块大小: {block_records}")
+        self.filepath = filepath
+        self.block_records = block_records
+        self.records = 0
+        self.index = []
+
+        self._buffer = np.empty(block_records, dtype=RECORD_DTYPE)
+        self._fill = 0
+        self._t_first = self._t_last = np.nan
+
+        metadata.setdefault('created', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        metadata['block_records'] = block_records
+        meta = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        self.file = open(filepath, 'wb')
+        self.file.write(_FILE_HEADER.pack(_MAGIC, _VERSION, len(meta)) + meta)
+
+    def write(self, data_list, t=None):
+        """
+        追加一批数据 (receive_data 格式)
+
+        Args:
+            data_list: 数据列表
+            t: 这批数据的接收时间 (默认当前时间)
+        """
+        if data_list:
+            self.write_records(records_from_data_list(data_list), t)
+
+    def write_records(self, records, t=None):
+        """追加 RECORD_DTYPE 数组"""
+        t = time.time() if t is None else t
+        pos = 0
+        while pos < len(records):
+            n = min(self.block_records - self._fill, len(records) - pos)
+            self._buffer[self._fill:self._fill + n] = records[pos:pos + n]
+            if self._fill == 0:
+                self._t_first = t
+            self._t_last = t
+            self._fill += n
+            pos += n
+            if self._fill == self.block_records:
+                self._emit()
+
+    def _emit(self):
+        if self._fill == 0:
+            return
+        block = self._buffer[:self._fill]
+        self.file.write(block.tobytes())
+        self.index.append(zone_map(block, self.records, self._t_first, self._t_last))
+        self.records += self._fill
+        self._fill = 0
+
+    def flush(self):
+        """把已写完的块刷到磁盘 (未满的块仍留在内存中)"""
+        self.file.flush()
+
+    def close(self):
+        """写出最后一个 (可能不满的) 块和索引"""
+        if self.file.closed:
+            return
+        self._emit()
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+        offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.write(_FOOTER.pack(offset, len(index), _INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BlockReader:
+    """分块采集文件的读取与条件查询"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            head = f.read(_FILE_HEADER.size)
+            if len(head) < _FILE_HEADER.size:
+                raise ValueError(f"{filepath} 不是 TDC 分块采集文件")
+            magic, version, meta_len = _FILE_HEADER.unpack(head)
+            if magic != _MAGIC:
+                raise ValueError(f"{filepath} 不是 TDC 分块采集文件")
+            if version != _VERSION:
+                raise ValueError(f"不支持的分块文件版本: {version}")
+            self.metadata = json.loads(f.read(meta_len).decode('utf-8'))
+            self.data_offset = _FILE_HEADER.size + meta_len
+            self.block_records = self.metadata['block_records']
+
+            size = os.fstat(f.fileno()).st_size
+            self.index = None
+            if size >= self.data_offset + _FOOTER.size:
+                f.seek(size - _FOOTER.size)
+                index_offset, n_blocks, tail = _FOOTER.unpack(f.read(_FOOTER.size))
+                if tail == _INDEX_MAGIC and \
+                        index_offset + n_blocks * INDEX_DTYPE.itemsize + _FOOTER.size == size:
+                    f.seek(index_offset)
+                    self.index = np.frombuffer(f.read(n_blocks * INDEX_DTYPE.itemsize),
+                                               dtype=INDEX_DTYPE)
+                    data_end = index_offset
+
+        if self.index is None:
+            # 写入中断: 只保留完整的块
+            n_blocks = (size - self.data_offset) // RECORD_DTYPE.itemsize // self.block_records
+            data_end = self.data_offset + n_blocks * self.block_records * RECORD_DTYPE.itemsize
+            print(f"[WARN] {filepath} 缺少块索引 (写入未正常结束)，按 {n_blocks} 个完整块重建")
+
+        n_records = (data_end - self.data_offset) // RECORD_DTYPE.itemsize
+        if n_records > 0:
+            self.data = np.memmap(filepath, dtype=RECORD_DTYPE, mode='r',
+                                  offset=self.data_offset, shape=(n_records,))
+        else:
+            self.data = np.empty(0, dtype=RECORD_DTYPE)
+
+        if self.index is None:
+            self.index = np.array([zone_map(self.data[i * self.block_records:
+                                                      (i + 1) * self.block_records],
+                                            i * self.block_records)
+                                   for i in range(n_blocks)], dtype=INDEX_DTYPE)
+
+        self.blocks_read = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def t0(self):
+        """第一个块的接收时间 (时间窗口以此为原点)"""
+        return float(self.index['t_first'][0]) if len(self.index) else np.nan
+
+    def select_blocks(self, types=None, phases=None, coarse=None, fine=None, t_range=None):
+        """
+        用索引筛选可能包含匹配数据的块
+
+        Args:
+            types: 数据类型 (0b00=UP, 0b01=DOWN, ...) 的列表，None 表示不限
+            phases: 相位 ID 范围 (lo, hi)，闭区间
+            coarse: 粗计数范围 (lo, hi)，闭区间
+            fine: 精细时间范围 (lo, hi)，闭区间
+            t_range: 时间窗口 (start, end)，相对 t0 的秒数，None 端表示不限
+
+        Returns:
+            numpy.ndarray: 块的布尔掩码
+        """
+        idx = self.index
+        mask = np.ones(len(idx), dtype=bool)
+        if types is not None:
+            bits = sum(1 << int(t) for t in types)
+            mask &= (idx['type_mask'] & bits) != 0
+        for field, bounds in (('id', phases), ('coarse', coarse), ('fine', fine)):
+            if bounds is not None:
+                lo, hi = bounds
+                mask &= (idx[f'{field}_max'] >= lo) & (idx[f'{field}_min'] <= hi)
+        if t_range is not None:
+            start, end = t_range
+            # 时间未知的块 (重建的索引) 不能排除
+            known = ~np.isnan(idx['t_first'])
+            if start is not None:
+                mask &= ~known | (idx['t_last'] >= self.t0 + start)
+            if end is not None:
+                mask &= ~known | (idx['t_first'] <= self.t0 + end)
+        return mask
+
+    def read_blocks(self, mask):
+        """读取掩码选中的块 (相邻块合并为一次切片)"""
+        selected = np.flatnonzero(mask)
+        self.blocks_read += len(selected)
+        if len(selected) == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        # 连续的块合并为一段
+        breaks = np.flatnonzero(np.diff(selected) != 1) + 1
+        parts = []
+        for run in np.split(selected, breaks):
+            start = int(self.index['first'][run[0]])
+            end = int(self.index['first'][run[-1]] + self.index['count'][run[-1]])
+            parts.append(self.data[start:end])
+        return np.concatenate(parts)
+
+    def query(self, types=None, phases=None, coarse=None, fine=None, t_range=None):
+        """
+        条件查询，参数见 select_blocks
+
+        Returns:
+            numpy.ndarray: 匹配的 RECORD_DTYPE 记录 (时间窗口精确到块)
+        """
+        records = self.read_blocks(self.select_blocks(types, phases, coarse, fine, t_range))
+        keep = np.ones(len(records), dtype=bool)
+        if types is not None:
+            keep &= np.isin(records['type'], list(types))
+        for field, bounds in (('id', phases), ('coarse', coarse), ('fine', fine)):
+            if bounds is not None:
+                lo, hi = bounds
+                keep &= (records[field] >= lo) & (records[field] <= hi)
+        return records[keep]
+
+    def query_data_list(self, **conditions):
+        """query 的结果转换为 receive_data 格式的数据列表"""
+        records = self.query(**conditions)
+        return to_data_list({name: records[name] for name in RECORD_DTYPE.names})
+
+    def describe(self):
+        """文件信息文本"""
+        idx = self.index
+        lines = [f"文件: {self.filepath}",
+                 f"记录数: {len(self.data)}  块数: {len(idx)}  每块: {self.block_records} 条"]
+        for key, value in self.metadata.items():
+            if key != 'block_records':
+                lines.append(f"{key}: {value}")
+        if len(idx):
+            counts = idx['type_counts'].sum(axis=0)
+            lines.append("类型计数: " + ", ".join(
+                f"{name}={counts[t]}" for name, t in CHANNEL_TYPES.items() if counts[t]))
+            lines.append(f"相位范围: {idx['id_min'].min()} - {idx['id_max'].max()}")
+            if not np.isnan(idx['t_first']).all():
+                span = np.nanmax(idx['t_last']) - np.nanmin(idx['t_first'])
+                lines.append(f"时间跨度: {span:.1f} s")
+        return "\n".join(lines)
+
+
+def convert(src, dst=None, block_records=4096):
+    """
+    将文本采集文件 (save_to_file / 流式写入格式) 转换为分块文件
+
+    Returns:
+        str: 输出文件路径
+    """
+    from tdc_scan import TDCDataProcessor
+
+    if dst is None:
+        base = src
+        for ext in ('.gz', '.xz', '.bz2'):
+            if base.endswith(ext):
+                base = base[:-len(ext)]
+        dst = os.path.splitext(base)[0] + '.tdcblk'
+    data_list = TDCDataProcessor.load_from_file(src)
+    # 文本文件没有接收时间，所有块的时间范围为转换时刻
+    with BlockWriter(dst, block_records, source=os.path.basename(src)) as writer:
+        writer.write(data_list)
+    print(f"[INFO] {len(data_list)} 个数据 -> {len(writer.index)} 个块: {dst}")
+    return dst
+
+
+def _parse_range(text):
+    """'a:b' 或 'a' -> (a, b)"""
+    if text is None:
+        return None
+    lo, _, hi = text.partition(':')
+    return int(lo), int(hi or lo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 分块采集文件")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('convert', help="文本采集文件转换为分块文件")
+    p.add_argument('file')
+    p.add_argument('-o', '--output', default=None)
+    p.add_argument('--block', type=int, default=4096, help="每块记录数")
+    p = sub.add_parser('info', help="显示分块文件信息")
+    p.add_argument('file')
+    p = sub.add_parser('query', help="按条件读取数据")
+    p.add_argument('file')
+    p.add_argument('--channel', choices=list(CHANNEL_TYPES), action='append', default=None,
+                   help="通道 (可重复)")
+    p.add_argument('--phase', default=None, help="相位范围 a:b")
+    p.add_argument('--coarse', default=None, help="粗计数范围 a:b")
+    p.add_argument('--start', type=float, default=None, help="起始时间 (秒，相对开始)")
+    p.add_argument('--end', type=float, default=None, help="结束时间 (秒，相对开始)")
+    p.add_argument('-o', '--output', default=None, help="结果保存为文本采集文件")
+    p.add_argument('--analyze', action='store_true', help="对结果进行性能分析")
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert(args.file, args.output, args.block)
+        return 0
+
+    reader = BlockReader(args.file)
+    if args.command == 'info':
+        print(reader.describe())
+        return 0
+
+    types = [CHANNEL_TYPES[c] for c in args.channel] if args.channel else None
+    t_range = None if args.start is None and args.end is None else (args.start, args.end)
+    start = time.perf_counter()
+    data_list = reader.query_data_list(types=types, phases=_parse_range(args.phase),
+                                       coarse=_parse_range(args.coarse), t_range=t_range)
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] 读取 {reader.blocks_read}/{len(reader.index)} 个块，"
+          f"匹配 {len(data_list)} 个数据，耗时 {elapsed * 1000:.1f} ms")
+
+    if args.output or args.analyze:
+        from tdc_scan import TDCDataProcessor
+        processor = TDCDataProcessor(data_list)
+        if args.output:
+            processor.save_to_file(os.path.basename(args.output),
+                                   os.path.dirname(args.output) or '.')
+        if args.analyze:
+            processor.process()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
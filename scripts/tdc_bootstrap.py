@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 性能指标的 bootstrap 置信区间
+以整轮扫描为重采样单位 (有放回地抽取扫描轮次)，对每个重采样重新计算
+analyze_tdc_performance 中的全部指标 (范围、步进、LSB、DNL、INL、噪声、单调性)。
+
+与处理器相同，每个重采样先按相位合并为均值曲线 (tdc_channels.phase_groups)，
+再在曲线上计算步进/DNL/INL；重复抽到的扫描只改变均值的权重，不会产生 0 差值。
+DNL/INL RMS、噪声等指标受测量噪声影响本身有偏 (轮数少时尤甚)，重采样会把偏差再叠加一次，
+因此这些指标 (BASIC_GROUPS) 的区间取 basic (反向百分位) 形式 [2θ - q_high, 2θ - q_low]，
+用重采样估计的偏差修正点估计；测量范围、LSB、单调性计数等仍用百分位区间。
+--coverage 用已知真值的仿真数据 (tdc_chain_model) 检查区间的实际覆盖率。
+重采样按块堆叠为 (n_resamples, n_phases) 曲线，与多通道分析共用
+tdc_channels.analyze_curves 一次算完一个块；块可分发到进程池并行计算。
+
+用法:
+  python tdc_bootstrap.py tdc_results/tdc_scan_xxx.txt [-n 2000] [-j 4] [--confidence 0.95]
+  python tdc_bootstrap.py --coverage 40                     仿真数据 (已知真值) 的区间覆盖率检查
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from tdc_channels import analyze_curves, noise_stats, phase_groups
+from tdc_linearity import rms, stack_sweeps
+
+
+CLK_PERIOD = 3864   # ps
+
+# 与 TDCDataProcessor.CHANNEL_NAMES 一致
+CHANNEL_TYPES = {'UP': 0b00, 'DOWN': 0b01}
+
+# 在均值曲线/噪声上计算、受测量噪声影响有偏的指标分组 (basic 区间)
+BASIC_GROUPS = ('resolution', 'dnl', 'inl', 'noise')
+# 有取值范围的指标，basic 区间裁剪到范围内
+BOUNDS = {('resolution', 'decreasing_ratio'): (0.0, 1.0)}
+
+
+def metric_arrays(results, clk_period=CLK_PERIOD):
+    """
+    将 analyze_curves 的结果整理为与性能字典相同结构的指标数组
+
+    Returns:
+        dict: {分组: {指标: (n_rows,) 数组}}
+    """
+    lin = results['lin']
+    noise = results['noise']
+    mono = results['monotonicity']
+    span = results['max'] - results['min']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dnl_std = np.nanstd(lin['dnl'], axis=-1)
+        inl_lsb_max = np.nanmax(lin['inl_lsb'], axis=-1)
+        inl_lsb_min = np.nanmin(lin['inl_lsb'], axis=-1)
+        inl_max = np.nanmax(lin['inl_ps'], axis=-1)
+        inl_min = np.nanmin(lin['inl_ps'], axis=-1)
+        quantization = np.floor(clk_period / results['estimated_lsb'])
+
+    return {
+        'range': {
+            'min': results['min'],
+            'max': results['max'],
+            'span': span,
+            'coverage': span / clk_period * 100,
+        },
+        'resolution': {
+            'avg_step': lin['step'],
+            'std_step': lin['step_std'],
+            'decreasing_ratio': results['decreasing_ratio'],
+        },
+        'lsb': {
+            'unique_values': results['unique_values'],
+            'estimated_lsb': results['estimated_lsb'],
+            'quantization_levels': quantization,
+        },
+        'dnl': {
+            'max': np.nanmax(lin['dnl'], axis=-1),
+            'min': np.nanmin(lin['dnl'], axis=-1),
+            'rms': rms(lin['dnl']),
+            'std': dnl_std,
+        },
+        'inl': {
+            'max_lsb': inl_lsb_max,
+            'min_lsb': inl_lsb_min,
+            'rms_lsb': rms(lin['inl_lsb']),
+            'peak_to_peak_lsb': inl_lsb_max - inl_lsb_min,
+            'max_ps': inl_max,
+            'min_ps': inl_min,
+            'rms_ps': rms(lin['inl_ps']),
+            'peak_to_peak_ps': inl_max - inl_min,
+            'wrap_points': lin['wraps'],
+        },
+        'noise': {
+            'repeated_phases': noise['repeated_phases'],
+            'avg_std': noise['avg_std'],
+            'max_std': noise['max_std'],
+        },
+        'monotonicity': {
+            'increases': mono['increases'],
+            'decreases': mono['decreases'],
+            'total': mono['total'],
+            'wrap_filtered': mono['wrap_filtered'],
+        },
+    }
+
+
+def _analyze_resamples(sweeps, clk_period):
+    """(n_rows, n_sweeps, n_phases) -> 每行按相位合并为均值曲线后的全部指标"""
+    n_rows, n_sweeps, n_phases = sweeps.shape
+    fine = sweeps.reshape(n_rows, n_sweeps * n_phases)
+    ids = np.where(np.isnan(fine), np.nan, np.tile(np.arange(n_phases, dtype=float), n_sweeps))
+    groups = phase_groups(ids, fine, clk_period)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        results = analyze_curves(groups['phases'], groups['mean'], clk_period, raw=fine,
+                                 noise=noise_stats(groups), sweeps=groups['count'].max(axis=-1))
+        return metric_arrays(results, clk_period)
+
+
+def _bootstrap_chunk(sweeps, n_resamples, seed, clk_period):
+    """计算一个重采样块的指标 (可在工作进程中执行)"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(sweeps), size=(n_resamples, len(sweeps)))
+    return _analyze_resamples(sweeps[picks], clk_period)
+
+
+def _concat(parts):
+    return {group: {name: np.concatenate([p[group][name] for p in parts])
+                    for name in parts[0][group]}
+            for group in parts[0]}
+
+
+def bootstrap_sweeps(sweeps, n_resamples=2000, confidence=0.95, seed=None,
+                     workers=None, chunk_size=250, clk_period=CLK_PERIOD):
+    """
+    对一个通道的多轮扫描计算全部指标的置信区间
+
+    Args:
+        sweeps: (n_sweeps, n_phases) 数组 (tdc_linearity.stack_sweeps)，缺失相位为 NaN
+        n_resamples: 重采样次数
+        confidence: 置信水平
+        seed: 随机种子
+        workers: 进程数 (None/1 = 在当前进程中计算)
+        chunk_size: 每块的重采样数 (控制内存)
+        clk_period: 时钟周期 (ps)
+
+    Returns:
+        dict: {分组: {指标: {'value', 'low', 'high', 'std'}}}
+              value 为原始数据的点估计，low/high 为置信区间
+              (BASIC_GROUPS 为 basic 区间，其余为百分位区间)
+    """
+    sweeps = np.asarray(sweeps, dtype=float)
+    if len(sweeps) < 2:
+        raise ValueError("至少需要 2 轮扫描才能进行 bootstrap")
+
+    point = _analyze_resamples(sweeps[None], clk_period)
+
+    sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers is not None and workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_bootstrap_chunk, [sweeps] * len(sizes), sizes, seeds,
+                                  [clk_period] * len(sizes)))
+    else:
+        parts = [_bootstrap_chunk(sweeps, n, s, clk_period) for n, s in zip(sizes, seeds)]
+    samples = _concat(parts)
+
+    alpha = (1 - confidence) / 2 * 100
+    intervals = {}
+    for group, metrics in samples.items():
+        intervals[group] = {}
+        for name, values in metrics.items():
+            values = values.astype(float)
+            if np.isnan(values).all():
+                continue
+            value = float(point[group][name][0])
+            if np.isnan(value):
+                continue
+            low, high = np.nanpercentile(values, [alpha, 100 - alpha])
+            if group in BASIC_GROUPS:
+                low, high = np.clip([2 * value - high, 2 * value - low],
+                                    *BOUNDS.get((group, name), (-np.inf, np.inf)))
+            intervals[group][name] = {
+                'value': value,
+                'low': float(low),
+                'high': float(high),
+                'std': float(np.nanstd(values)),
+            }
+    return intervals
+
+
+def bootstrap_performance(data_list, n_resamples=2000, confidence=0.95, seed=None,
+                          workers=None, chunk_size=250, clk_period=CLK_PERIOD):
+    """
+    对采集数据中每个通道计算全部性能指标的置信区间
+
+    Args:
+        data_list: receive_data 格式的数据列表 (多轮全扫描)
+        其余参数见 bootstrap_sweeps
+
+    Returns:
+        dict: {通道名: bootstrap_sweeps 结果}，扫描轮数不足的通道不包含在内
+    """
+    result = {}
+    for name, data_type in CHANNEL_TYPES.items():
+        sweeps = stack_sweeps(data_list, data_type)
+        if len(sweeps) < 2:
+            continue
+        result[name] = bootstrap_sweeps(sweeps, n_resamples, confidence, seed,
+                                        workers, chunk_size, clk_period)
+    return result
+
+
+COVERAGE_METRICS = (('resolution', 'avg_step'), ('dnl', 'rms'), ('inl', 'rms_ps'),
+                    ('noise', 'avg_std'), ('noise', 'max_std'))
+
+
+def coverage_check(trials=40, sweeps=5, n_resamples=500, confidence=0.95, seed=0,
+                   metrics=COVERAGE_METRICS, clk_period=CLK_PERIOD):
+    """
+    用已知真值的仿真数据检查置信区间的实际覆盖率
+
+    真值取同一通道模型 400 轮扫描的均值曲线指标 (轮数趋于无穷时的极限)；
+    每次试验用 sweeps 轮新的仿真扫描计算区间，统计包含真值的比例。
+    noise.max_std 是极值统计量，bootstrap 对极值本身覆盖不足 (约 80%)，结果仅供参考。
+
+    Returns:
+        dict: {(分组, 指标): {'truth', 'coverage', 'mean_width'}}
+    """
+    from tdc_chain_model import DelayLineChannel, simulate_scan
+
+    rng = np.random.default_rng(seed)
+    model = DelayLineChannel(tap_jitter_ps=2.0, hit_jitter_ps=5.0, seed=int(rng.integers(1 << 31)))
+    channels = {'UP': (model, 298.0)}
+    data_list, _ = simulate_scan(channels, sweeps=400)
+    reference = _analyze_resamples(stack_sweeps(data_list, CHANNEL_TYPES['UP'])[None], clk_period)
+    truth = {key: float(reference[key[0]][key[1]][0]) for key in metrics}
+
+    hits = dict.fromkeys(metrics, 0)
+    widths = {key: [] for key in metrics}
+    for i in range(trials):
+        data_list, _ = simulate_scan(channels, sweeps=sweeps)
+        intervals = bootstrap_sweeps(stack_sweeps(data_list, CHANNEL_TYPES['UP']), n_resamples,
+                                     confidence, seed=int(rng.integers(1 << 31)),
+                                     clk_period=clk_period)
+        for key in metrics:
+            ci = intervals[key[0]][key[1]]
+            hits[key] += ci['low'] <= truth[key] <= ci['high']
+            widths[key].append(ci['high'] - ci['low'])
+    return {key: {'truth': truth[key], 'coverage': hits[key] / trials,
+                  'mean_width': float(np.mean(widths[key]))}
+            for key in metrics}
+
+
+def format_intervals(intervals, confidence=0.95):
+    """生成置信区间表格文本"""
+    lines = []
+    for channel, groups in intervals.items():
+        lines.append(f"\n{channel} 通道 ({confidence*100:.0f}% 置信区间):")
+        lines.append("-" * 70)
+        lines.append(f"  {'指标':<30}{'点估计':>12}{'下限':>12}{'上限':>12}")
+        for group, metrics in groups.items():
+            for name, ci in metrics.items():
+                lines.append(f"  {group + '.' + name:<30}{ci['value']:>12.3f}"
+                             f"{ci['low']:>12.3f}{ci['high']:>12.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 性能指标 bootstrap 置信区间")
+    parser.add_argument('file', nargs='?', help="采集文件 (多轮全扫描)")
+    parser.add_argument('-n', '--resamples', type=int, default=2000, help="重采样次数")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="并行进程数")
+    parser.add_argument('--confidence', type=float, default=0.95, help="置信水平")
+    parser.add_argument('--seed', type=int, default=None, help="随机种子")
+    parser.add_argument('--coverage', type=int, default=None, metavar='TRIALS',
+                        help="用仿真数据检查区间覆盖率 (试验次数)")
+    parser.add_argument('--sweeps', type=int, default=5, help="覆盖率检查中每次试验的扫描轮数")
+    args = parser.parse_args()
+
+    if args.coverage:
+        start = time.time()
+        result = coverage_check(args.coverage, args.sweeps, min(args.resamples, 500),
+                                args.confidence, args.seed or 0)
+        print(f"\n覆盖率检查 ({args.coverage} 次试验, 每次 {args.sweeps} 轮扫描, "
+              f"名义 {args.confidence*100:.0f}%):")
+        print(f"  {'指标':<30}{'真值':>12}{'覆盖率':>10}{'平均宽度':>12}")
+        for (group, name), r in result.items():
+            print(f"  {group + '.' + name:<30}{r['truth']:>12.3f}{r['coverage']*100:>9.0f}%"
+                  f"{r['mean_width']:>12.3f}")
+        print(f"\n[INFO] 耗时 {time.time() - start:.1f} s")
+        return 0
+    if not args.file:
+        parser.error("需要采集文件 (或 --coverage)")
+
+    from tdc_scan import TDCDataProcessor
+    data_list = TDCDataProcessor.load_from_file(args.file)
+
+    start = time.time()
+    intervals = bootstrap_performance(data_list, args.resamples, args.confidence,
+                                      args.seed, args.jobs)
+    if not intervals:
+        print("[WARN] 没有包含至少 2 轮扫描的通道")
+        return 1
+    print(format_intervals(intervals, args.confidence))
+    print(f"\n[INFO] {args.resamples} 次重采样，耗时 {time.time() - start:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
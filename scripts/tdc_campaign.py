@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 可断点续传的扫描任务 (campaign)
+将一次长时间采集描述为计划 (campaign.json)，执行时周期性写入检查点:
+  campaign.json   计划: 类型、相位范围、通道、重复次数/时长
+  data.txt        已完成步骤的数据 (与 save_to_file 相同的格式，只追加)
+  progress.json   检查点: 下一步序号、data.txt 的有效长度、已用时间等
+
+检查点先 fsync 数据文件再原子替换 progress.json。
+续传时把 data.txt 截断到检查点记录的长度，从下一步继续，
+因此连接中断或程序崩溃后既不丢失已完成的数据，也不会重复执行已完成的步骤。
+接收中连接断开的步骤在重连后重做；超时不完整的步骤记入 failed_steps，
+在任务结束前补测，补测仍不完整时任务保持未完成状态。
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+
+class ScanCampaign:
+    """可续传的扫描任务"""
+
+    VERSION = 1
+    DEFAULT_ROOT = os.path.join('tdc_results', 'campaigns')
+
+    def __init__(self, directory, plan, progress=None):
+        """请使用 create() / load() 构造"""
+        self.directory = directory
+        self.plan = plan
+        self.progress = progress or {
+            'next_step': 0,
+            'data_bytes': 0,
+            'records': 0,
+            'elapsed': 0.0,
+            'failed_steps': [],
+            'finished': False,
+            'updated': None,
+        }
+
+    # ------------------------------------------------------------------
+    # 创建与加载
+    # ------------------------------------------------------------------
+    @classmethod
+    def create(cls, kind, channel=0b11, start_phase=0, end_phase=224, repeats=1,
+               duration=None, name=None, root=None, options=None):
+        """
+        创建新任务
+
+        Args:
+            kind: 'single' = 逐相位单步命令, 'sweep' = 重复全扫描
+            channel: 通道选择 (0b01=DOWN, 0b10=UP, 0b11=BOTH)
+            start_phase/end_phase: 相位范围 (全扫描只使用 end_phase)
+            repeats: 重复次数 (single: 整个相位范围的轮数; sweep: 全扫描次数，None 表示不限)
+            duration: 最长采集时间 (秒，累计跨续传)，None 表示不限
+            name: 任务名 (默认按时间生成)
+            root: 任务根目录
+            options: 附加参数 (原样保存在计划中，续传时使用)
+        """
+        if kind not in ('single', 'sweep'):
+            raise ValueError(f"未知的任务类型: {kind}")
+        if repeats is None and duration is None:
+            raise ValueError("repeats 与 duration 至少需要指定一个")
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        name = name or f"{kind}_{timestamp}"
+        directory = os.path.join(root or cls.DEFAULT_ROOT, name)
+        os.makedirs(directory, exist_ok=False)
+
+        plan = {
+            'version': cls.VERSION,
+            'name': name,
+            'kind': kind,
+            'channel': channel,
+            'start_phase': start_phase,
+            'end_phase': end_phase,
+            'repeats': repeats,
+            'duration': duration,
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'options': options or {},
+        }
+        campaign = cls(directory, plan)
+        _write_json(campaign._path('campaign.json'), plan)
+
+        with open(campaign._path('data.txt'), 'w') as f:
+            f.write(f"# TDC 扫描数据 (任务 {name})\n")
+            f.write(f"# 生成时间: {plan['created']}\n")
+            f.write("# Index, Type, ID, Fine, Flag, Coarse, Raw_Hex\n")
+        campaign.progress['data_bytes'] = os.path.getsize(campaign._path('data.txt'))
+        campaign._checkpoint()
+        return campaign
+
+    @classmethod
+    def load(cls, directory):
+        """加载已有任务 (续传)"""
+        with open(os.path.join(directory, 'campaign.json'), 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+        if plan.get('version') != cls.VERSION:
+            raise ValueError(f"不支持的任务版本: {plan.get('version')}")
+        with open(os.path.join(directory, 'progress.json'), 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        return cls(directory, plan, progress)
+
+    @classmethod
+    def find_incomplete(cls, root=None, kind=None):
+        """列出未完成的任务目录 (按时间从新到旧)"""
+        root = root or cls.DEFAULT_ROOT
+        if not os.path.isdir(root):
+            return []
+        found = []
+        for name in sorted(os.listdir(root), reverse=True):
+            directory = os.path.join(root, name)
+            try:
+                campaign = cls.load(directory)
+            except (OSError, ValueError):
+                continue
+            if campaign.finished:
+                continue
+            if kind is not None and campaign.plan['kind'] != kind:
+                continue
+            found.append(campaign)
+        return found
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def name(self):
+        return self.plan['name']
+
+    @property
+    def finished(self):
+        return self.progress['finished']
+
+    @property
+    def data_file(self):
+        return self._path('data.txt')
+
+    # ------------------------------------------------------------------
+    # 计划
+    # ------------------------------------------------------------------
+    def total_steps(self):
+        """计划的总步数，不限次数的全扫描返回 None"""
+        plan = self.plan
+        if plan['repeats'] is None:
+            return None
+        if plan['kind'] == 'single':
+            return (plan['end_phase'] - plan['start_phase'] + 1) * plan['repeats']
+        return plan['repeats']
+
+    def step_command(self, step):
+        """
+        第 step 步对应的扫描命令
+
+        Returns:
+            tuple: (scan_mode, phase, expected_count)
+        """
+        plan = self.plan
+        per_phase = 2 if plan['channel'] == 0b11 else 1
+        if plan['kind'] == 'single':
+            n_phases = plan['end_phase'] - plan['start_phase'] + 1
+            return 0, plan['start_phase'] + step % n_phases, per_phase
+        return 1, plan['end_phase'], (plan['end_phase'] + 1) * per_phase
+
+    def describe(self):
+        total = self.total_steps()
+        done = self.progress['next_step']
+        total_str = str(total) if total is not None else '不限'
+        text = (f"{self.name}: {done}/{total_str} 步, "
+                f"{self.progress['records']} 个数据, 已用 {self.progress['elapsed']/60:.1f} 分钟")
+        if self.progress['failed_steps']:
+            text += f", 待补测 {len(self.progress['failed_steps'])} 步"
+        if self.progress['updated']:
+            text += f" (检查点 {self.progress['updated']})"
+        return text
+
+    # ------------------------------------------------------------------
+    # 检查点
+    # ------------------------------------------------------------------
+    def _checkpoint(self):
+        self.progress['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        _write_json(self._path('progress.json'), self.progress)
+
+    def _append(self, f, data):
+        """追加一步的数据 (与 save_to_file 的行格式相同)"""
+        index = self.progress['records']
+        for d in data:
+            type_str = "UP" if d['type'] == 0b00 else ("DOWN" if d['type'] == 0b01 else "INFO")
+            f.write(f"{index},{type_str},{d['id']},{d['fine']},{d.get('flag', 0)},"
+                    f"{d['coarse']},0x{d['raw']:08X}\n")
+            index += 1
+
+    def _done(self, step):
+        total = self.total_steps()
+        if total is not None and step >= total:
+            return True
+        duration = self.plan['duration']
+        return duration is not None and self.progress['elapsed'] >= duration
+
+    # ------------------------------------------------------------------
+    # 执行
+    # ------------------------------------------------------------------
+    def run(self, scanner, checkpoint_every=10, checkpoint_interval=30.0,
+            on_step=None, reconnect_attempts=3, step_timeout=5.0, pause=0.0):
+        """
+        执行 (或续传) 任务
+
+        Args:
+            scanner: TDCScanner
+            checkpoint_every: 每完成多少步写一次检查点
+            checkpoint_interval: 距上次检查点超过多少秒时写检查点
+            on_step: 每步完成后的回调 on_step(step, data)，如漂移监测
+            reconnect_attempts: 连接中断后的重连次数
+            step_timeout: 每步接收超时 (秒)
+            pause: 每步之间的间隔 (秒)
+
+        Returns:
+            bool: 任务是否全部完成
+        """
+        if self.finished:
+            print(f"[INFO] 任务 {self.name} 已完成")
+            return True
+
+        # 丢弃上次检查点之后写入的不完整数据
+        with open(self.data_file, 'r+b') as f:
+            f.truncate(self.progress['data_bytes'])
+
+        step = self.progress['next_step']
+        if step > 0:
+            print(f"[INFO] 续传任务 {self.describe()}")
+        last_checkpoint = time.time()
+        last_time = time.time()
+        steps_since = 0
+        failed = self.progress['failed_steps']
+        retry = None    # 主循环结束后待补测的步骤
+
+        f = open(self.data_file, 'a')
+        try:
+            while True:
+                if retry is None and self._done(step):
+                    retry = list(failed)
+                    if retry:
+                        print(f"[INFO] 补测 {len(retry)} 个不完整的步骤")
+                if retry is not None and not retry:
+                    break
+                current = step if retry is None else retry[0]
+
+                if not scanner.connected and not self._reconnect(scanner, reconnect_attempts):
+                    print("[ERROR] 无法恢复连接，任务已暂停，可稍后续传")
+                    return False
+
+                result = self._measure(scanner, f, current, step_timeout,
+                                       keep_partial=retry is None)
+                if result is None:
+                    # 连接中断: 重连后重做本步
+                    continue
+                data, complete = result
+                if retry is None:
+                    step += 1
+                    if not complete:
+                        failed.append(current)
+                else:
+                    retry.pop(0)
+                    if complete:
+                        failed.remove(current)
+                steps_since += 1
+                now = time.time()
+                self.progress['elapsed'] += now - last_time
+                last_time = now
+
+                if on_step is not None:
+                    on_step(current, data)
+                if pause:
+                    time.sleep(pause)
+
+                if steps_since >= checkpoint_every or now - last_checkpoint >= checkpoint_interval:
+                    self._commit(f, step)
+                    steps_since = 0
+                    last_checkpoint = now
+
+            self.progress['next_step'] = step
+            if failed:
+                print(f"[WARN] {len(failed)} 个步骤补测后仍不完整 (第 {failed[0]} 步起)，"
+                      f"任务未完成，可稍后续传再次补测")
+                return False
+            self.progress['finished'] = True
+            print(f"[INFO] 任务完成: {self.describe()}")
+            return True
+        finally:
+            # 正常结束或中断 (异常、Ctrl+C) 时都保存已完成的步骤
+            self._commit(f, step)
+            f.close()
+
+    def _measure(self, scanner, f, step, step_timeout, keep_partial=True):
+        """
+        执行一步并追加数据
+
+        Args:
+            keep_partial: 数据不完整时是否仍然记录 (补测时只记录完整的数据，
+                          避免同一步的残缺数据重复写入)
+
+        Returns:
+            tuple: (data, complete)；连接中断时为 None，本步需要重做
+        """
+        scan_mode, phase, expected = self.step_command(step)
+        if not scanner.start_scan(scan_mode=scan_mode, phase=phase,
+                                  channel=self.plan['channel']):
+            # 发送失败视为连接中断
+            scanner.connected = False
+            return None
+        data = scanner.receive_data(expected_count=expected, timeout=step_timeout)
+        complete = len(data) >= expected
+        if not complete and not scanner.connected:
+            print(f"[WARN] 第 {step} 步 (相位 {phase}) 接收中连接断开，重连后重做")
+            return None
+        if not complete:
+            print(f"[WARN] 第 {step} 步 (相位 {phase}) 只收到 {len(data)}/{expected} 个数据")
+            if not keep_partial:
+                return data, False
+
+        self._append(f, data)
+        self.progress['records'] += len(data)
+        return data, complete
+
+    def _commit(self, f, step):
+        """数据落盘后再更新检查点"""
+        f.flush()
+        os.fsync(f.fileno())
+        self.progress['next_step'] = step
+        self.progress['data_bytes'] = os.fstat(f.fileno()).st_size
+        self._checkpoint()
+
+    def _reconnect(self, scanner, attempts):
+        for i in range(attempts):
+            print(f"[INFO] 尝试重新连接 ({i+1}/{attempts})...")
+            scanner.disconnect()
+            time.sleep(min(2 ** i, 10))
+            if scanner.connect():
+                return True
+        return False
+
+    def load_data(self):
+        """读取已完成步骤的全部数据 (receive_data 格式)"""
+        # 延迟导入: 避免与 tdc_scan 循环导入
+        from tdc_scan import TDCDataProcessor
+        return TDCDataProcessor.load_from_file(self.data_file)
+
+
+def _write_json(path, obj):
+    """原子写入 JSON 文件"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 运行目录 (SQLite)
+每次 save_to_file 保存采集文件时自动登记一条运行记录，包括:
+  runs     文件路径 (相对目录所在文件夹)、时间、板卡、类型 (tdc_scan / tdc_continuous ...)、
+           通道、结束相位、各通道数据量、分析版本
+  results  analyze_tdc_performance 的全部数值指标，每行 (通道, 指标, 值)，
+           如 ('DOWN', 'inl.rms_lsb', 1.73)；联合拟合结果记为 'model.*'
+按时间、板卡、类型、通道及任意指标条件查询只访问索引，不打开采集文件；
+只有匹配的运行才会被读取。
+
+用法:
+  python tdc_catalog.py index tdc_results                     登记目录中已有的采集文件
+  python tdc_catalog.py find --channel down --kind tdc_scan --board 192.168.2.100 \\
+                             --days 7 --where "DOWN.inl.rms_lsb>1.5"
+  python tdc_catalog.py find ... --analyze                    读取并重新分析匹配的采集文件
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+CATALOG_NAME = 'catalog.sqlite'
+
+# 文件名: <类型>_<通道>_<YYYYmmdd_HHMMSS>.txt (或 .tdcarc 归档)，通道部分可缺省
+_FILENAME = re.compile(r'^(?P<kind>.+?)(?:_(?P<channel>both|up|down))?_'
+                       r'(?P<stamp>\d{8}_\d{6})\.(?:txt(?:\.(?:gz|xz|bz2))?|tdcarc)$')
+
+_OPERATORS = ('>=', '<=', '>', '<', '=')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    created TEXT NOT NULL,
+    board TEXT,
+    kind TEXT,
+    channel TEXT,
+    end_phase INTEGER,
+    samples INTEGER,
+    up_count INTEGER,
+    down_count INTEGER,
+    analysis_version INTEGER,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+CREATE INDEX IF NOT EXISTS runs_board ON runs (board, created);
+CREATE INDEX IF NOT EXISTS runs_kind ON runs (kind, channel, created);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    channel TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, channel, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_metric ON results (metric, channel, value);
+"""
+
+
+def parse_filename(filepath):
+    """
+    由文件名推断运行类型、通道和时间
+
+    Returns:
+        dict: kind / channel / created (不匹配的项为 None)
+    """
+    m = _FILENAME.match(os.path.basename(filepath))
+    if m is None:
+        return {'kind': None, 'channel': None, 'created': None}
+    created = datetime.strptime(m.group('stamp'), '%Y%m%d_%H%M%S')
+    return {'kind': m.group('kind'), 'channel': m.group('channel'),
+            'created': created.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def flatten_performance(performance):
+    """
+    性能字典 -> [(通道, 指标, 值), ...]
+
+    只登记数值指标；'channels' 中的每个通道单独展开，联合拟合结果记为 model.*
+    (通道无关的量通道为空字符串)
+    """
+    rows = []
+    if not performance:
+        return rows
+    channels = performance.get('channels') or {'': performance}
+    for channel, groups in channels.items():
+        for group, metrics in groups.items():
+            if not isinstance(metrics, dict):
+                continue
+            for name, value in metrics.items():
+                if isinstance(value, (int, float, np.integer, np.floating)) \
+                        and not isinstance(value, bool):
+                    rows.append((channel, f"{group}.{name}", float(value)))
+
+    model = performance.get('model')
+    if model:
+        for name in ('step', 'step_err', 'skew_ps'):
+            if model.get(name) is not None:
+                rows.append(('', f"model.{name}", float(model[name])))
+        for name in ('delay_ps', 'rms_ps'):
+            for channel, value in model.get(name, {}).items():
+                rows.append((channel, f"model.{name}", float(value)))
+    return rows
+
+
+def parse_condition(text):
+    """
+    'DOWN.inl.rms_lsb>1.5' -> ('DOWN', 'inl.rms_lsb', '>', 1.5)
+    'inl.rms_lsb>1.5'      -> (None, ...)  任一通道满足即可
+    'model.step<-17'       -> ('', ...)    通道无关的拟合结果
+    """
+    for op in _OPERATORS:
+        if op in text:
+            key, value = text.split(op, 1)
+            break
+    else:
+        raise ValueError(f"无效的条件: {text}")
+    parts = key.strip().split('.')
+    if len(parts) == 3:
+        channel, metric = parts[0], '.'.join(parts[1:])
+    elif len(parts) == 2:
+        channel, metric = ('' if parts[0] == 'model' and parts[1] in ('step', 'step_err', 'skew_ps')
+                           else None), key.strip()
+    else:
+        raise ValueError(f"无效的指标名: {key}")
+    return channel, metric, op, float(value)
+
+
+class RunCatalog:
+    """运行目录"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: 目录数据库文件 (通常为 tdc_results/catalog.sqlite)
+        """
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.conn = sqlite3.connect(path, timeout=10.0)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _relpath(self, filepath):
+        return os.path.relpath(os.path.abspath(filepath), self.root)
+
+    def resolve(self, row):
+        """运行记录对应的文件绝对路径"""
+        return os.path.normpath(os.path.join(self.root, row['path']))
+
+    # ------------------------------------------------------------------
+    # 登记
+    # ------------------------------------------------------------------
+    def add_run(self, filepath, data_list, performance=None, analysis_version=None, **metadata):
+        """
+        登记 (或更新) 一次运行
+
+        Args:
+            filepath: 采集文件路径
+            data_list: 采集数据 (receive_data 格式)
+            performance: analyze_tdc_performance 结果，可为 None
+            analysis_version: 生成 performance 的分析版本
+            metadata: 附加信息 board / kind / channel / created (覆盖由文件名推断的值)
+
+        Returns:
+            int: 运行 id
+        """
+        info = parse_filename(filepath)
+        info.update({k: v for k, v in metadata.items() if v is not None})
+        stat = os.stat(filepath)
+        if info['created'] is None:
+            info['created'] = datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S')
+
+        up_count = sum(1 for d in data_list if d['type'] == 0b00)
+        down_count = sum(1 for d in data_list if d['type'] == 0b01)
+        if info['channel'] is None:
+            info['channel'] = ('both' if up_count and down_count else
+                               'up' if up_count else 'down' if down_count else None)
+        end_phase = max((d['id'] for d in data_list), default=None)
+
+        relpath = self._relpath(filepath)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO runs (path, created, board, kind, channel, end_phase, samples, "
+                "up_count, down_count, analysis_version, size, mtime) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET created = excluded.created, "
+                "board = COALESCE(excluded.board, board), kind = excluded.kind, "
+                "channel = excluded.channel, "
+                "end_phase = excluded.end_phase, samples = excluded.samples, "
+                "up_count = excluded.up_count, down_count = excluded.down_count, "
+                "analysis_version = excluded.analysis_version, size = excluded.size, "
+                "mtime = excluded.mtime",
+                (relpath, info['created'], info.get('board'), info['kind'],
+                 info['channel'], end_phase, len(data_list), up_count, down_count,
+                 analysis_version if performance else None, stat.st_size, stat.st_mtime))
+            run_id = self.conn.execute("SELECT id FROM runs WHERE path = ?",
+                                       (relpath,)).fetchone()[0]
+            self.conn.execute("DELETE FROM results WHERE run_id = ?", (run_id,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results (run_id, channel, metric, value) "
+                "VALUES (?, ?, ?, ?)",
+                [(run_id, c, m, v) for c, m, v in flatten_performance(performance)])
+        return run_id
+
+    def is_current(self, filepath, analysis_version=None):
+        """文件已登记且未修改 (大小、修改时间一致，分析版本一致) 时返回 True"""
+        row = self.conn.execute("SELECT size, mtime, analysis_version FROM runs WHERE path = ?",
+                                (self._relpath(filepath),)).fetchone()
+        if row is None:
+            return False
+        stat = os.stat(filepath)
+        return (row['size'] == stat.st_size and row['mtime'] == stat.st_mtime and
+                (analysis_version is None or row['analysis_version'] == analysis_version))
+
+    def index_directory(self, directory, force=False, **metadata):
+        """
+        登记目录中已有的采集文件 (重新分析以得到性能指标)
+
+        Returns:
+            tuple: (新登记数, 跳过数)
+        """
+        from tdc_batch_analysis import find_captures
+        from tdc_scan import TDCDataProcessor
+
+        added = skipped = 0
+        for filepath in find_captures([directory]):
+            if not force and self.is_current(filepath, TDCDataProcessor.ANALYSIS_VERSION):
+                skipped += 1
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                data_list = TDCDataProcessor.load_from_file(filepath)
+                if not data_list:
+                    continue
+                performance = TDCDataProcessor(data_list).process()
+            self.add_run(filepath, data_list, performance, TDCDataProcessor.ANALYSIS_VERSION,
+                         **metadata)
+            added += 1
+        return added, skipped
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    def find(self, board=None, kind=None, channel=None, since=None, until=None,
+             conditions=(), limit=None):
+        """
+        按元数据和指标条件查询运行
+
+        Args:
+            board: 板卡
+            kind: 运行类型，可用通配符 (如 'tdc_*')
+            channel: 'up' / 'down' / 'both'；'up'/'down' 同时匹配包含该通道的 'both' 运行
+            since/until: 时间范围 ('YYYY-mm-dd' 或 'YYYY-mm-dd HH:MM:SS')
+            conditions: [(通道, 指标, 运算符, 值), ...]，见 parse_condition
+            limit: 最多返回的条数
+
+        Returns:
+            list: sqlite3.Row 列表，按时间排序
+        """
+        sql = ["SELECT * FROM runs WHERE 1"]
+        params = []
+        if board is not None:
+            sql.append("AND board = ?")
+            params.append(board)
+        if kind is not None:
+            sql.append("AND kind GLOB ?")
+            params.append(kind)
+        if channel is not None:
+            channel = channel.lower()
+            if channel in ('up', 'down'):
+                sql.append(f"AND {channel}_count > 0")
+            else:
+                sql.append("AND channel = ?")
+                params.append(channel)
+        if since is not None:
+            sql.append("AND created >= ?")
+            params.append(since)
+        if until is not None:
+            # 只给出日期时包含当天
+            sql.append("AND created <= ?")
+            params.append(until if len(until) > 10 else until + ' 23:59:59')
+        for ch, metric, op, value in conditions:
+            if op not in _OPERATORS:
+                raise ValueError(f"无效的运算符: {op}")
+            # 子查询走 (metric, channel, value) 索引的范围扫描
+            sub = "SELECT run_id FROM results WHERE metric = ?"
+            params.append(metric)
+            if ch is not None:
+                sub += " AND channel = ?"
+                params.append(ch)
+            sql.append(f"AND id IN ({sub} AND value {op} ?)")
+            params.append(value)
+        sql.append("ORDER BY created")
+        if limit is not None:
+            sql.append("LIMIT ?")
+            params.append(int(limit))
+        return self.conn.execute(" ".join(sql), params).fetchall()
+
+    def results(self, run_id):
+        """一次运行的全部指标 {(通道, 指标): 值}"""
+        rows = self.conn.execute("SELECT channel, metric, value FROM results WHERE run_id = ?",
+                                 (run_id,))
+        return {(r['channel'], r['metric']): r['value'] for r in rows}
+
+    def load(self, rows):
+        """
+        读取匹配运行的采集数据
+
+        Returns:
+            list: [(运行记录, 数据列表), ...]，文件已不存在的运行给出警告并跳过
+        """
+        from tdc_scan import TDCDataProcessor
+
+        loaded = []
+        for row in rows:
+            filepath = self.resolve(row)
+            if not os.path.exists(filepath):
+                print(f"[WARN] 文件不存在: {filepath}")
+                continue
+            loaded.append((row, TDCDataProcessor.load_from_file(filepath)))
+        return loaded
+
+
+def record_save(filepath, data_list, performance=None, analysis_version=None,
+                catalog_name=CATALOG_NAME, **metadata):
+    """
+    save_to_file 的登记钩子: 在采集文件所在目录的目录数据库中登记
+
+    登记失败只给出警告，不影响数据保存
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(filepath)), catalog_name)
+    try:
+        with RunCatalog(path) as catalog:
+            catalog.add_run(filepath, data_list, performance, analysis_version, **metadata)
+    except (sqlite3.Error, OSError) as e:
+        print(f"[WARN] 运行目录登记失败: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 运行目录")
+    parser.add_argument('--catalog', default=os.path.join('tdc_results', CATALOG_NAME),
+                        help="目录数据库文件")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('index', help="登记目录中已有的采集文件")
+    p.add_argument('directory')
+    p.add_argument('--board', default=None, help="为这些文件记录的板卡")
+    p.add_argument('--force', action='store_true', help="重新分析已登记的文件")
+    p = sub.add_parser('find', help="查询运行")
+    p.add_argument('--board', default=None)
+    p.add_argument('--kind', default=None, help="运行类型 (可用通配符，如 tdc_scan*)")
+    p.add_argument('--channel', choices=('up', 'down', 'both'), default=None)
+    p.add_argument('--since', default=None, help="起始日期 YYYY-mm-dd")
+    p.add_argument('--until', default=None, help="结束日期 YYYY-mm-dd")
+    p.add_argument('--days', type=int, default=None, help="最近 N 天")
+    p.add_argument('--where', action='append', default=[],
+                   help="指标条件，如 DOWN.inl.rms_lsb>1.5 (可重复)")
+    p.add_argument('--limit', type=int, default=None)
+    p.add_argument('--analyze', action='store_true', help="读取并重新分析匹配的采集文件")
+    args = parser.parse_args()
+
+    with RunCatalog(args.catalog) as catalog:
+        if args.command == 'index':
+            start = time.time()
+            added, skipped = catalog.index_directory(args.directory, args.force,
+                                                     board=args.board)
+            print(f"[INFO] 登记 {added} 个文件，跳过 {skipped} 个未变化的文件，"
+                  f"耗时 {time.time() - start:.1f} s")
+            return 0
+
+        since = args.since
+        if args.days is not None:
+            since = (datetime.now() - timedelta(days=args.days)).strftime('%Y-%m-%d %H:%M:%S')
+        start = time.perf_counter()
+        rows = catalog.find(args.board, args.kind, args.channel, since, args.until,
+                            [parse_condition(c) for c in args.where], args.limit)
+        elapsed = time.perf_counter() - start
+
+        print(f"{'时间':<20}{'板卡':<16}{'类型':<18}{'通道':<6}{'数据':>7}  文件")
+        for row in rows:
+            print(f"{row['created']:<20}{row['board'] or '-':<16}{row['kind'] or '-':<18}"
+                  f"{row['channel'] or '-':<6}{row['samples']:>7}  {row['path']}")
+        print(f"[INFO] 匹配 {len(rows)} 次运行，查询耗时 {elapsed * 1000:.1f} ms")
+
+        if args.analyze:
+            from tdc_scan import TDCDataProcessor
+            for row, data_list in catalog.load(rows):
+                print(f"\n[INFO] {row['path']}")
+                TDCDataProcessor(data_list).process()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 延迟线链路行为模型 (numpy 向量化)
+按硬件的处理顺序由击中时间生成 fine code，用于在已知真值下验证校准、DNL/INL 分析和主机端修正:
+  delay_line.v        4 条 96 抽头 CARRY4 延迟线 (tdc_pkg.vh: DEPTH=24)，分别由
+                      0/90/180/270 度相位时钟采样；抽头延迟、每次采样的抽头抖动可配置
+  priority_encoder.v  温度计码 -> 二进制: 16 组 × 6 位的粗定位 (therm2onehot / onehot2bin)，
+                      再对 cpos*6 起的 12 位计数 (find_msb)；有气泡时与硬件给出同样的错误码
+  dl_sync.v           选择第一个采到有效波前的相位: bin + {270:0, 180:96, 90:192, 0:288}
+                      (波前尚未越过第一个抽头时由下一个相位的延迟线采到)
+  lut.v               HIST_SIZE-1 个均匀分布的校准击中 (环形振荡器) 累加 384 bin 直方图，
+                      LUT = 累积和 + 本 bin 计数/2 (18 位)，fine = (LUT × CLK_PERIOD) >> 18
+
+时间约定: 击中时间 t 位于 0 度时钟的一个周期内，理想 fine = (3T/4 - t - d0) mod T，
+d0 为 270 度延迟线第一个抽头的延迟 (码值 0 的起点，LUT 累积分布的原点)；
+相位延迟增大时 fine 减小，与实测扫描曲线的斜率方向一致。
+
+抽头查找用分桶表代替 searchsorted (查表 + 1~2 次比较)；抽头抖动为 0 时直接得到码值。
+有抖动时只有延迟在波前 ±jitter_sigmas×σ 以内的抽头产生随机采样位，其余抽头为确定的 1/0。
+多数击中的波前两侧各只有一个抽头在该范围内: 两个采样位的联合分布由查表的正态尾概率给出，
+每个击中只需一个均匀随机数 (按联合分布的累积概率反查)；范围内有更多抽头的少数击中
+为每个抽头生成正态抖动。采样位仍为温度计码时码值就是 1 的个数，只有出现气泡的少数击中
+交给 priority_encode 逐位编码。正态随机数 (击中抖动、抽头抖动) 由 16 位随机整数查
+正态分位点表得到 (比 standard_normal 快数倍，截断于约 ±4.3σ)。
+
+用法:
+  python tdc_chain_model.py bench [-n 10000000]
+  python tdc_chain_model.py scan -o tdc_results/tdc_model_both_xxx.txt [--sweeps 20]
+"""
+
+import argparse
+import functools
+import math
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from tdc_words import decode_words, encode_words, to_data_list
+
+
+CLK_PERIOD = 3864           # ps (tdc_pkg.vh: CLK_IN_PS)
+DEPTH = 24                  # CARRY4 个数
+N_TAPS = DEPTH * 4          # 96 个抽头
+N_PHASES = 4                # 0/90/180/270 度
+N_CODES = N_TAPS * N_PHASES # 384
+LUT_SIZE = 1 << 9           # PE_INTBITS 位地址，384 以上的项不被校准写入 (保持 0)
+HIST_SIZE = 1 << 18         # lut.v 直方图总击中数 (HIST_SIZE - 1 个)
+LUT_BITS = 18
+LOOKUP_CELLS = 1 << 16      # 抽头查找表的桶数
+TAIL_CELLS = 1 << 14        # 正态尾概率表的格数 (0 ~ jitter_band)
+BATCH = 1 << 16             # codes 每批处理的击中数 (中间数组留在缓存内)
+NORMAL_CELLS = 1 << 16      # 正态分位点表的格数 (由 16 位随机整数查表)
+
+# dl_sync 中各相位的码值偏移，按 "块" 排列: 块 b 覆盖理想时间 [b, b+1) × T/4
+PHASE_OFFSETS = {270: 0, 180: N_TAPS, 90: 2 * N_TAPS, 0: 3 * N_TAPS}
+BLOCK_PHASES = (270, 180, 90, 0)
+
+
+@functools.lru_cache(maxsize=None)
+def _normal_table():
+    """标准正态分布在各格中心的分位点 (NORMAL_CELLS 个)"""
+    dist = statistics.NormalDist()
+    return np.array([dist.inv_cdf((i + 0.5) / NORMAL_CELLS) for i in range(NORMAL_CELLS)])
+
+
+def priority_encode(bins):
+    """
+    priority_encoder.v 的逐位参考实现 (用于验证，速度较慢)
+
+    Args:
+        bins: (n, 96) 布尔数组，bins[:, 0] 为第一个抽头
+
+    Returns:
+        tuple: (bin, valid)，bin = cpos*6 + popcount(bins[cpos*6 : cpos*6+12])，
+               valid = bins[0] and not bins[95]
+    """
+    bins = np.asarray(bins, dtype=bool)
+    n = len(bins)
+    v_coarse = bins.reshape(n, 16, 6).all(axis=-1)
+    therm = np.concatenate([v_coarse, np.zeros((n, 1), dtype=bool)], axis=1)
+    onehot = therm[:, :16] & ~therm[:, 1:]
+    cpos = np.bitwise_or.reduce(np.where(onehot, np.arange(1, 17), 0), axis=1)
+    extended = np.concatenate([bins, np.zeros((n, 12), dtype=bool)], axis=1)
+    cols = cpos[:, None] * 6 + np.arange(12)
+    count = np.take_along_axis(extended, cols, axis=1).sum(axis=1)
+    return cpos * 6 + count, bins[:, 0] & ~bins[:, -1]
+
+
+class DelayLineChannel:
+    """一个 TDC 通道 (4 条延迟线 + 编码器 + 相位选择 + LUT) 的行为模型"""
+
+    def __init__(self, tap_delays=None, mean_tap_ps=11.0, tap_spread=0.35, tap_jitter_ps=0.0,
+                 hit_jitter_ps=0.0, jitter_sigmas=5.0, clk_period=CLK_PERIOD, seed=None):
+        """
+        Args:
+            tap_delays: (4, 96) 或 (96,) 抽头延迟 (ps)，行顺序为 0/90/180/270 度；
+                        None 时按 mean_tap_ps / tap_spread 随机生成 (每 4 个抽头一个 CARRY4，
+                        其中第 4 个抽头偏长，模拟 CARRY4 间的走线)
+            mean_tap_ps: 平均抽头延迟 (ps)，4 × 96 × mean 需大于一个时钟周期
+            tap_spread: 抽头延迟的相对离散度
+            tap_jitter_ps: 每次采样每个抽头的时间抖动 (ps)，非零时波前附近产生气泡
+            hit_jitter_ps: 击中时间的抖动 (ps)
+            jitter_sigmas: 抽头延迟距波前不超过 jitter_sigmas × tap_jitter_ps 的抽头才生成抖动采样位
+            clk_period: 时钟周期 (ps)
+            seed: 随机种子
+        """
+        self.clk_period = float(clk_period)
+        self.rng = np.random.default_rng(seed)
+        if tap_delays is None:
+            shape = np.array([1.0, 0.8, 0.9, 1.3])      # CARRY4 内的典型不均匀性
+            base = np.tile(shape / shape.mean(), DEPTH) * mean_tap_ps
+            tap_delays = base * self.rng.lognormal(0.0, tap_spread, size=(N_PHASES, N_TAPS))
+        tap_delays = np.broadcast_to(np.asarray(tap_delays, dtype=float), (N_PHASES, N_TAPS))
+        self.tap_delays = tap_delays.copy()
+        self.cum = np.cumsum(self.tap_delays, axis=1)
+        if (self.cum[:, -1] <= self.clk_period / N_PHASES).any():
+            raise ValueError("延迟线总延迟不足四分之一时钟周期")
+        self.tap_jitter_ps = tap_jitter_ps
+        self.hit_jitter_ps = hit_jitter_ps
+        self.jitter_band = min(jitter_sigmas * tap_jitter_ps, self.clk_period / N_PHASES)
+        self.lut = None
+        self.histogram = None
+
+        # 各块的累积延迟拼接后一次 searchsorted: 块 b 的查找值加 b × stride
+        self._stride = float(self.cum.max()) + self.clk_period
+        block_rows = [(0, 90, 180, 270).index(p) for p in BLOCK_PHASES]
+        self._block_cum = self.cum[block_rows]
+        self._search = (self._block_cum + np.arange(N_PHASES)[:, None] * self._stride).ravel()
+        self._flat_cum = self._block_cum.ravel()
+        # 分桶查找表: 查找值位于 [-stride, 4 × stride)，桶 c 之前的抽头数 + 桶内最多几个抽头
+        self._x0 = -self._stride
+        self._inv_h = LOOKUP_CELLS / ((N_PHASES + 1) * self._stride)
+        tap_cells = ((self._search - self._x0) * self._inv_h).astype(np.int64)
+        self._cell_start = np.searchsorted(tap_cells, np.arange(LOOKUP_CELLS + 1))
+        self._cell_depth = int(np.bincount(tap_cells).max())
+        self._search_pad = np.append(self._search, np.inf)
+        # 波前位于抽头 k-1 与 k 之间 (k = _count_below) 时两侧相邻抽头的延迟，以及
+        # 抽头 k-2 / k+1 也在 jitter_band 以内 (需要逐抽头生成抖动) 的波前位置界限
+        ext = np.concatenate([[-np.inf, -np.inf], self._search, [np.inf, np.inf]])
+        self._tap_below = ext[1:-2]
+        self._tap_above = ext[2:-1]
+        self._band_low = ext[:-3] + self.jitter_band
+        self._band_high = ext[3:] - self.jitter_band
+        # 抽头距波前 d (0 ~ jitter_band) 时采样位与无抖动时相反的概率 Φ(-d/σ) (按格中心)，
+        # 范围外为 0
+        if tap_jitter_ps > 0:
+            self._tail_scale = TAIL_CELLS / self.jitter_band
+            d = (np.arange(TAIL_CELLS) + 0.5) / self._tail_scale
+            self._tail = np.array([0.5 * math.erfc(v / (tap_jitter_ps * math.sqrt(2))) for v in d]
+                                  + [0.0])
+        # LUT 累积分布从第一个有效码值开始，即 270 度延迟线的第一个抽头
+        self.offset = float(self._block_cum[0, 0])
+
+    # ------------------------------------------------------------------
+    # 延迟线 + 编码器
+    # ------------------------------------------------------------------
+    def _count_below(self, x):
+        """
+        np.searchsorted(self._search, x) 的分桶实现
+
+        桶号与抽头所在桶用同一公式计算，桶之前的抽头必然小于 x，只需与桶内抽头逐个比较
+        """
+        cell = ((x - self._x0) * self._inv_h).astype(np.int64)
+        k = self._cell_start[cell]
+        for _ in range(self._cell_depth):
+            k += self._search_pad[k] < x
+        return k
+
+    def _normal(self, n):
+        """n 个标准正态随机数 (查分位点表)"""
+        return _normal_table()[self.rng.integers(0, NORMAL_CELLS, n, dtype=np.uint16)]
+
+    def _flip_prob(self, d):
+        """距波前 d (ps, >= 0) 的抽头采样位与无抖动时相反的概率 (查表)"""
+        cell = (np.minimum(d, self.jitter_band) * self._tail_scale).astype(np.int64)
+        return self._tail[cell]
+
+    def _encode_block(self, block, delta):
+        """
+        块 block 的延迟线在波前传播 delta 后被采样时的编码器输出
+
+        Returns:
+            tuple: (bin, valid)
+        """
+        base = block * N_TAPS
+        x = delta + block * self._stride
+        k = self._count_below(x)
+        if self.tap_jitter_ps <= 0:
+            # 无气泡: 温度计码的编码结果就是 1 的个数
+            code = k - base
+            return code, (code > 0) & (code < N_TAPS)
+
+        # 相邻两个抽头: k-1 未触发 (miss)、k 触发 (fire) 的概率，一个均匀随机数按联合分布
+        # 的累积概率 [两者, 仅 fire, 仅 miss, 都不] 反查
+        p_miss = self._flip_prob(x - self._tap_below[k])
+        p_fire = self._flip_prob(self._tap_above[k] - x)
+        both = p_fire * p_miss
+        u = self.rng.random(len(x))
+        fire = u < p_fire
+        miss = (u < both) | (~fire & (u < p_fire + p_miss - both))
+        code = k - base + fire - miss
+        valid = (code > 0) & (code < N_TAPS)
+
+        # jitter_band 以内还有其他抽头的击中在后面逐抽头生成抖动
+        wide = (x < self._band_low[k]) | (x > self._band_high[k])
+
+        # k-1 未触发而 k 触发是气泡: 按 priority_encoder.v 逐位编码
+        bub = np.flatnonzero(fire & miss & ~wide)
+        if len(bub):
+            bins = self._block_cum[block[bub]] < delta[bub, None]
+            rows = np.arange(len(bub))
+            tap = k[bub] - base[bub]
+            bins[rows, tap - 1] = False
+            bins[rows, tap] = True
+            code[bub], valid[bub] = priority_encode(bins)
+
+        wide = np.flatnonzero(wide)
+        if len(wide):
+            code[wide], valid[wide] = self._encode_band(block[wide], delta[wide], x[wide])
+        return code, valid
+
+    def _encode_band(self, block, delta, x):
+        """
+        jitter_band 以内的每个抽头生成正态抖动后编码 (范围内有两个以上抽头的击中)
+
+        Returns:
+            tuple: (bin, valid)
+        """
+        # 抽头 [lo, lo+m) 生成随机采样位；之前全为 1，之后全为 0
+        base = block * N_TAPS
+        n = len(delta)
+        lo = self._count_below(x - self.jitter_band)
+        m = self._count_below(x + self.jitter_band) - lo
+        rows = np.repeat(np.arange(n), m)
+        taps = np.arange(len(rows)) - (np.cumsum(m) - m - lo)[rows]
+        jitter = self._normal(len(rows)) * self.tap_jitter_ps
+        fired = self._flat_cum[taps] + jitter < delta[rows]
+
+        code = lo - base + np.bincount(rows[fired], minlength=n)
+        valid = (code > 0) & (code < N_TAPS)
+
+        # 气泡 (未触发的抽头之后有触发的抽头): 按 priority_encoder.v 逐位编码
+        bubble = fired[1:] & ~fired[:-1] & (rows[1:] == rows[:-1])
+        bub = np.unique(rows[1:][bubble])
+        if len(bub):
+            index = np.zeros(n, dtype=np.int64)
+            index[bub] = np.arange(len(bub))
+            sel = np.zeros(n, dtype=bool)
+            sel[bub] = True
+            sel = sel[rows]
+            bins = self._block_cum[block[bub]] < delta[bub, None]
+            bins[index[rows[sel]], taps[sel] - base[rows[sel]]] = fired[sel]
+            code[bub], valid[bub] = priority_encode(bins)
+        return code, valid
+
+    def codes(self, t):
+        """
+        击中时间 -> dl_sync 输出的 384 级码值
+
+        Args:
+            t: 击中时间 (ps，相对 0 度时钟沿)，一维数组
+
+        Returns:
+            tuple: (code, valid)
+        """
+        t = np.asarray(t, dtype=float)
+        if len(t) > BATCH:
+            parts = [self.codes(t[i:i + BATCH]) for i in range(0, len(t), BATCH)]
+            return tuple(np.concatenate(p) for p in zip(*parts))
+        if self.hit_jitter_ps > 0:
+            t = t + self._normal(len(t)) * self.hit_jitter_ps
+        # np.mod / 浮点整除较慢，用 floor 和截断代替 (total >= 0)
+        quarter = self.clk_period / N_PHASES
+        total = 0.75 * self.clk_period - t
+        total -= np.floor(total * (1.0 / self.clk_period)) * self.clk_period
+        block = (total * (1.0 / quarter)).astype(np.int64)
+        np.minimum(block, N_PHASES - 1, out=block)
+        delta = total - block * quarter
+
+        code, valid = self._encode_block(block, delta)
+        code = code + block * N_TAPS
+
+        # 波前还没越过第一个抽头: 由下一个相位 (前一块) 的延迟线在 T/4 之后采到
+        miss = np.flatnonzero(~valid)
+        if len(miss):
+            prev = (block[miss] - 1) % N_PHASES
+            code2, valid2 = self._encode_block(prev, delta[miss] + quarter)
+            code[miss] = code2 + prev * N_TAPS
+            valid[miss] = valid2
+        return code, valid
+
+    # ------------------------------------------------------------------
+    # LUT 校准
+    # ------------------------------------------------------------------
+    def calibrate(self, n_hits=HIST_SIZE - 1, batch=BATCH):
+        """
+        lut.v 的直方图校准: 均匀分布的击中累加直方图，生成 LUT
+
+        Args:
+            n_hits: 校准击中数，须小于 HIST_SIZE (否则 18 位累积和回绕)
+            batch: 每批生成的击中数
+
+        Returns:
+            numpy.ndarray: (512,) LUT (18 位整数)
+        """
+        if not 0 < n_hits < HIST_SIZE:
+            raise ValueError(f"校准击中数须在 1 ~ {HIST_SIZE - 1} 之间: {n_hits}")
+        hist = np.zeros(LUT_SIZE, dtype=np.int64)
+        done = 0
+        while done < n_hits:
+            n = min(batch, n_hits - done)
+            code, valid = self.codes(self.rng.uniform(0, self.clk_period, n))
+            hist += np.bincount(code[valid], minlength=LUT_SIZE)
+            done += n
+        # 与硬件相同: 只有前 384 项写入 LUT，气泡产生的更大码值仍计入总击中数
+        self.histogram = hist
+        lut = np.zeros(LUT_SIZE, dtype=np.int64)
+        h = hist[:N_CODES]
+        lut[:N_CODES] = (np.cumsum(h) - h + (h >> 1)) & ((1 << LUT_BITS) - 1)
+        self.lut = lut
+        return self.lut
+
+    def measure(self, t):
+        """
+        击中时间 -> 13 位 fine time (ps)，与数据字 [21:9] 相同
+
+        Returns:
+            tuple: (fine, valid)
+        """
+        if self.lut is None:
+            self.calibrate()
+        code, valid = self.codes(t)
+        fine = (self.lut[code] * int(self.clk_period)) >> LUT_BITS
+        return (fine & 0x1FFF).astype(np.int64), valid
+
+    # ------------------------------------------------------------------
+    # 真值
+    # ------------------------------------------------------------------
+    def ideal_fine(self, t):
+        """理想 fine time (ps)"""
+        return np.mod(0.75 * self.clk_period - self.offset - np.asarray(t, dtype=float),
+                      self.clk_period)
+
+    def code_widths(self):
+        """
+        无抖动时每个码值覆盖的时间宽度 (ps)，即码值的真实 DNL 来源
+
+        Returns:
+            numpy.ndarray: (384,)
+        """
+        quarter = self.clk_period / N_PHASES
+        widths = np.zeros(N_CODES)
+        for b in range(N_PHASES):
+            cum = self._block_cum[b]
+            prev = (b - 1) % N_PHASES
+            cum_prev = self._block_cum[prev]
+            # 本块的延迟线: delta ∈ (cum[0], quarter)，码值 k 覆盖 (cum[k-1], cum[k]]
+            edges = np.clip(cum, cum[0], quarter)
+            lower = np.concatenate([[cum[0]], edges[:-1]])
+            widths[b * N_TAPS:(b + 1) * N_TAPS] += edges - lower
+            # 前一块的延迟线采到本块开头 delta ∈ [0, cum[0]) (T/4 之后)
+            lo = np.clip(np.concatenate([[0.0], cum_prev[:-1]]), quarter, quarter + cum[0])
+            hi = np.clip(cum_prev, quarter, quarter + cum[0])
+            widths[prev * N_TAPS:(prev + 1) * N_TAPS] += hi - lo
+        return widths
+
+    def true_lut(self):
+        """无限统计下的 LUT (码值中心的理想 fine time, ps)"""
+        widths = self.code_widths()
+        return np.cumsum(widths) - widths / 2
+
+
+def simulate_scan(channels=None, n_phases=225, step_ps=17.17, sweeps=1, seed=None):
+    """
+    生成与 receive_data 格式相同的扫描数据
+
+    Args:
+        channels: {通道名: (DelayLineChannel, 布线延迟 ps)}，默认 UP/DOWN 两个随机通道
+        n_phases: 每轮扫描的相位数
+        step_ps: 相位步进 (ps)
+        sweeps: 扫描轮数
+
+    Returns:
+        tuple: (data_list, truth)，truth[通道名] 为每个数据的理想 fine time
+    """
+    types = {'UP': 0b00, 'DOWN': 0b01}
+    if channels is None:
+        rng = np.random.default_rng(seed)
+        channels = {'UP': (DelayLineChannel(tap_jitter_ps=2.0, hit_jitter_ps=3.0,
+                                            seed=rng.integers(1 << 31)), 298.0),
+                    'DOWN': (DelayLineChannel(tap_jitter_ps=2.0, hit_jitter_ps=3.0,
+                                              seed=rng.integers(1 << 31)), 418.0)}
+
+    phases = np.tile(np.arange(n_phases), sweeps)
+    fields = []
+    truth = {}
+    for name, (model, delay) in channels.items():
+        T = model.clk_period
+        # 路由延迟约定: 相位 0 的 fine = (T - delay) mod T，之后每步减小 step
+        ideal = np.mod(T - delay - phases * step_ps, T)
+        t = np.mod(0.75 * T - model.offset - ideal, T)
+        fine, valid = model.measure(t)
+        data_type = types[name]
+        fields.append((np.full(valid.sum(), data_type), phases[valid], fine[valid],
+                       np.full(valid.sum(), 1 if data_type == 0b00 else 0),
+                       np.flatnonzero(valid)))
+        truth[name] = ideal[valid]
+
+    # 同一相位的 UP/DOWN 数据相邻 (与板卡的输出顺序一致)
+    data_type, ids, fine, flag, order = (np.concatenate(f) for f in zip(*fields))
+    sort = np.lexsort((data_type, order))
+    words = encode_words(data_type[sort], ids[sort], fine[sort], flag[sort], order[sort] & 0xFF)
+    return to_data_list(decode_words(words)), truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 延迟线链路行为模型")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('bench', help="测量模型吞吐量")
+    p.add_argument('-n', type=int, default=10_000_000, help="击中数")
+    p.add_argument('--tap-jitter', type=float, default=2.0, help="抽头抖动 (ps)")
+    p = sub.add_parser('scan', help="生成扫描数据文件")
+    p.add_argument('-o', '--output', default=None,
+                   help="输出文件 (默认 tdc_results/tdc_model_both_<时间>.txt)")
+    p.add_argument('--sweeps', type=int, default=1, help="扫描轮数")
+    p.add_argument('--phases', type=int, default=225, help="每轮相位数")
+    p.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        model = DelayLineChannel(tap_jitter_ps=args.tap_jitter, hit_jitter_ps=3.0, seed=1)
+        start = time.perf_counter()
+        model.calibrate()
+        calib = time.perf_counter() - start
+        t = np.random.default_rng(2).uniform(0, model.clk_period, args.n)
+        start = time.perf_counter()
+        invalid = 0
+        for i in range(0, args.n, BATCH):
+            _, valid = model.measure(t[i:i + BATCH])
+            invalid += int((~valid).sum())
+        elapsed = time.perf_counter() - start
+        err = model.lut[:N_CODES] * model.clk_period / (1 << LUT_BITS) - model.true_lut()
+        print(f"[INFO] 校准 {HIST_SIZE - 1} 个击中: {calib * 1000:.0f} ms, "
+              f"LUT 相对真值 RMS 误差 {np.sqrt(np.mean(err ** 2)):.2f} ps")
+        print(f"[INFO] {args.n} 个击中: {elapsed:.2f} s ({args.n / elapsed / 1e6:.1f} M/s), "
+              f"无效 {invalid}")
+        return 0
+
+    data_list, _ = simulate_scan(n_phases=args.phases, sweeps=args.sweeps, seed=args.seed)
+    from tdc_scan import TDCDataProcessor
+    processor = TDCDataProcessor(data_list)
+    if args.output:
+        processor.save_to_file(os.path.basename(args.output), os.path.dirname(args.output) or '.')
+    else:
+        processor.save_to_file(f"tdc_model_both_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 多通道数据模型与批量性能分析
+各通道的数据堆叠为 (n_channels, n_samples) 数组，样本数不足的通道以 NaN 补齐，
+测量范围、步进、LSB、DNL/INL、噪声、单调性等指标沿最后一维一次性计算
+(多轮扫描先按相位合并为均值曲线)，
+通道 (或板卡) 数量增加时只增加数组的行数，不增加代码分支。
+"""
+
+import numpy as np
+
+from tdc_linearity import linearity
+
+
+class ChannelArrays:
+    """按通道堆叠的数据数组"""
+
+    def __init__(self, names, records):
+        """
+        Args:
+            names: 通道名列表
+            records: 每个通道的数据列表 (receive_data 格式)，与 names 一一对应
+        """
+        self.names = list(names)
+        self.records = list(records)
+        self.counts = np.array([len(r) for r in self.records], dtype=int)
+
+        n = int(self.counts.max()) if len(self.counts) else 0
+        shape = (len(self.names), n)
+        self.ids = np.full(shape, np.nan)
+        self.fine = np.full(shape, np.nan)
+        self.coarse = np.full(shape, np.nan)
+        for i, rec in enumerate(self.records):
+            k = len(rec)
+            self.ids[i, :k] = [d['id'] for d in rec]
+            self.fine[i, :k] = [d['fine'] for d in rec]
+            self.coarse[i, :k] = [d['coarse'] for d in rec]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, name):
+        return self.records[self.names.index(name)]
+
+    def select(self, min_count=1):
+        """
+        样本数不少于 min_count 的通道子集
+
+        Returns:
+            ChannelArrays
+        """
+        keep = [i for i, c in enumerate(self.counts) if c >= min_count]
+        return ChannelArrays([self.names[i] for i in keep], [self.records[i] for i in keep])
+
+    def row(self, array, i):
+        """取第 i 个通道的有效部分 (去掉补齐的 NaN)"""
+        return array[i, :self.counts[i]]
+
+
+def phase_groups(ids, fine, clk_period):
+    """
+    每行按相位分组的均值、标准差与样本数 (多轮扫描的同一相位合并)
+
+    同一相位的样本以组内第一个样本为参考，按环绕折回到 ±clk_period/2 后再求均值与方差，
+    跨越周期边界的相位 (如 3860 与 3) 不会被当成相差一个周期的离散值。
+
+    Args:
+        ids: 相位 (n_rows, n)，补齐的 NaN 忽略
+        fine: fine time (n_rows, n)
+        clk_period: 时钟周期 (ps)
+
+    Returns:
+        dict: phases (n_phases,) 以及 mean/std/count (n_rows, n_phases)，无样本的相位为 NaN/0
+    """
+    n_rows = ids.shape[0]
+    valid = ~np.isnan(ids) & ~np.isnan(fine)
+    n_phases = int(np.nanmax(np.where(valid, ids, np.nan))) + 1 if valid.any() else 1
+
+    rows = np.broadcast_to(np.arange(n_rows)[:, None], ids.shape)[valid]
+    key = rows * n_phases + ids[valid].astype(int)
+    values = fine[valid]
+
+    size = n_rows * n_phases
+    # 逆序赋值: 重复下标时保留最后一次写入，即组内第一个样本
+    ref = np.zeros(size)
+    ref[key[::-1]] = values[::-1]
+    dev = np.mod(values - ref[key] + clk_period / 2, clk_period) - clk_period / 2
+
+    count = np.bincount(key, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_dev = np.bincount(key, weights=dev, minlength=size) / count
+        var = np.bincount(key, weights=(dev - mean_dev[key]) ** 2, minlength=size) / count
+    mean = np.mod(ref + mean_dev, clk_period)
+    shape = (n_rows, n_phases)
+    return {
+        'phases': np.arange(n_phases),
+        'mean': mean.reshape(shape),
+        'std': np.sqrt(var).reshape(shape),
+        'count': count.reshape(shape),
+    }
+
+
+def lsb_stats(fine):
+    """
+    唯一值数量与最小非零间隔 (LSB 估计)
+
+    Returns:
+        tuple: (unique_values, estimated_lsb)，estimated_lsb 在只有一个值时为 NaN
+    """
+    diffs = np.diff(np.sort(fine, axis=-1), axis=-1)
+    positive = diffs > 0
+    unique_values = positive.sum(axis=-1) + (~np.isnan(fine)).any(axis=-1)
+    lsb = np.where(positive, diffs, np.inf).min(axis=-1, initial=np.inf)
+    return unique_values, np.where(np.isinf(lsb), np.nan, lsb)
+
+
+def noise_stats(groups):
+    """
+    每行中重复测量的相位的噪声 (总体标准差)
+
+    Args:
+        groups: phase_groups 的结果
+
+    Returns:
+        dict: repeated_phases / avg_std / max_std，形状为 (n_rows,)
+    """
+    repeated = groups['count'] > 1
+    std = groups['std']
+    repeated_phases = repeated.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_std = np.where(repeated, std, 0).sum(axis=-1) / repeated_phases
+    max_std = np.where(repeated, std, -np.inf).max(axis=-1)
+    return {
+        'repeated_phases': repeated_phases,
+        'avg_std': avg_std,
+        'max_std': np.where(repeated_phases > 0, max_std, np.nan),
+    }
+
+
+def monotonicity_stats(curve, clk_period):
+    """
+    相邻点的递增/递减统计，超过半个周期的跳变视为环绕并过滤
+
+    Returns:
+        dict: increases / decreases / total / wrap_filtered / first_wrap
+            (first_wrap 为第一个环绕跳变的下标，无环绕时为 -1)
+    """
+    diffs = np.diff(curve, axis=-1)
+    present = ~np.isnan(diffs)
+    no_jump = np.abs(np.where(present, diffs, 0)) < clk_period / 2
+    valid = present & no_jump
+    jump = present & ~no_jump
+    return {
+        'increases': (valid & (diffs > 0)).sum(axis=-1),
+        'decreases': (valid & (diffs < 0)).sum(axis=-1),
+        'total': valid.sum(axis=-1),
+        'wrap_filtered': jump.sum(axis=-1),
+        'first_wrap': np.where(jump.any(axis=-1), jump.argmax(axis=-1), -1),
+    }
+
+
+def analyze_channels(channels, clk_period, lsb=None):
+    """
+    对所有通道一次性完成性能分析
+
+    Args:
+        channels: ChannelArrays
+        clk_period: 时钟周期 (ps)
+        lsb: DNL/INL 的 LSB (ps)，None 时使用各通道的平均步进
+
+    Returns:
+        dict: 见 analyze_arrays
+    """
+    return analyze_arrays(channels.ids, channels.fine, clk_period, lsb=lsb)
+
+
+def analyze_arrays(ids, fine, clk_period, lsb=None):
+    """
+    analyze_channels 的数组版本: ids/fine 为 (n_rows, n) 数组，每行独立分析
+
+    多轮扫描先按相位合并为均值曲线 (n_rows, n_phases)，步进、DNL/INL、递减比例与单调性
+    在均值曲线上计算；交错排列的原始样本会在同一相位内产生接近 0 的差值，使步进偏小、
+    DNL/INL 偏大。测量范围、LSB 与噪声使用原始样本。
+
+    Returns:
+        dict: 各项为数组，第一维为行
+            phases/curve: 相位 (n_phases,) 与各相位均值曲线，未测到的相位为 NaN
+            sweeps: 每个相位的最大样本数 (扫描轮数)
+            lin: tdc_linearity.linearity 结果 (沿相位)
+            min/max: 测量范围
+            decreasing_ratio: 展开后递减步进的比例
+            unique_values/estimated_lsb: LSB 估计
+            noise: noise_stats 结果
+            monotonicity: monotonicity_stats 结果
+    """
+    groups = phase_groups(ids, fine, clk_period)
+    return analyze_curves(groups['phases'], groups['mean'], clk_period,
+                          raw=fine, noise=noise_stats(groups), sweeps=groups['count'].max(axis=-1),
+                          lsb=lsb)
+
+
+def analyze_curves(phases, curve, clk_period, raw=None, noise=None, sweeps=None, lsb=None):
+    """
+    在按相位排列的曲线上计算性能指标 (analyze_arrays 与 bootstrap 共用)
+
+    Args:
+        phases: 相位 (n_phases,)
+        curve: (n_rows, n_phases) 每相位一个值，缺失为 NaN
+        clk_period: 时钟周期 (ps)
+        raw: 计算测量范围与 LSB 的原始样本 (默认 curve)
+        noise: noise_stats 结果 (默认视为无重复测量)
+        sweeps: 每行的扫描轮数 (默认 1)
+        lsb: DNL/INL 的 LSB (ps)，见 tdc_linearity.linearity
+
+    Returns:
+        dict: 见 analyze_arrays
+    """
+    raw = curve if raw is None else raw
+    n_rows = curve.shape[0]
+    lin = linearity(phases, curve, clk_period, lsb=lsb)
+
+    present = ~np.isnan(lin['diffs'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        decreasing_ratio = (present & (lin['diffs'] < 0)).sum(axis=-1) / present.sum(axis=-1)
+    unique_values, estimated_lsb = lsb_stats(raw)
+    if noise is None:
+        noise = {'repeated_phases': np.zeros(n_rows, dtype=int),
+                 'avg_std': np.full(n_rows, np.nan), 'max_std': np.full(n_rows, np.nan)}
+
+    return {
+        'phases': phases,
+        'curve': curve,
+        'sweeps': np.ones(n_rows, dtype=int) if sweeps is None else sweeps,
+        'lin': lin,
+        'min': np.nanmin(raw, axis=-1),
+        'max': np.nanmax(raw, axis=-1),
+        'decreasing_ratio': decreasing_ratio,
+        'unique_values': unique_values,
+        'estimated_lsb': estimated_lsb,
+        'noise': noise,
+        'monotonicity': monotonicity_stats(curve, clk_period),
+    }
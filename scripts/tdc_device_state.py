@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 设备状态: INFO 数据字解码与事件驱动的状态跟踪
+INFO 数据字格式 ([31:30] = 10):
+  [29:24] = 事件 (0=STATUS, 1=READY, 2=CALIB_START, 3=CALIB_DONE,
+                  4=SCAN_START, 5=SCAN_DONE, 6=ERROR)
+  [23]    = system_ready (TDC 延迟线与 LUT 可用)
+  [22]    = 已完成校准 (LUT 有效)
+  [21]    = 校准进行中
+  [20]    = 扫描进行中 (tdc_scan_ctrl 的 busy)
+  [19:12] = 当前相位
+  [11:0]  = 事件参数 (SCAN_DONE 为本次扫描的数据个数，ERROR 为错误码)
+每个 INFO 字都携带完整的状态位，丢失个别事件不会使状态失步。
+
+状态变化时调用注册的回调；其他线程 (共享内存读取等) 可用 wait_for 阻塞到条件成立。
+TDCScanner 在接收数据时把 INFO 字交给 device_state，并在 wait_until 中直接读取数据流，
+校准和扫描只等到设备真正就绪为止，不再依赖固定的等待时间。
+尚未上报过 INFO 的设备 (旧固件) 保持原有的固定等待行为。
+
+用法:
+  python tdc_device_state.py 0x81C00000 0x83C00000 ...     解码 INFO 数据字
+  python tdc_device_state.py --encode CALIB_DONE --ready --calibrated
+"""
+
+import argparse
+import sys
+import threading
+import time
+from collections import deque
+
+
+TYPE_INFO = 0b10
+
+EVENTS = ('STATUS', 'READY', 'CALIB_START', 'CALIB_DONE', 'SCAN_START', 'SCAN_DONE', 'ERROR')
+FLAGS = ('ready', 'calibrated', 'calibrating', 'scanning')
+
+
+def decode_info(value):
+    """
+    解析一个 INFO 数据字
+
+    Returns:
+        dict: event/ready/calibrated/calibrating/scanning/phase/arg/raw，
+              非 INFO 字返回 None
+    """
+    if (value >> 30) & 0x3 != TYPE_INFO:
+        return None
+    code = (value >> 24) & 0x3F
+    return {
+        'event': EVENTS[code] if code < len(EVENTS) else f'EVENT_{code}',
+        'ready': bool((value >> 23) & 0x1),
+        'calibrated': bool((value >> 22) & 0x1),
+        'calibrating': bool((value >> 21) & 0x1),
+        'scanning': bool((value >> 20) & 0x1),
+        'phase': (value >> 12) & 0xFF,
+        'arg': value & 0xFFF,
+        'raw': value,
+    }
+
+
+def encode_info(event, ready=False, calibrated=False, calibrating=False, scanning=False,
+                phase=0, arg=0):
+    """
+    构建 INFO 数据字 (固件仿真、回放测试用)
+
+    Args:
+        event: 事件名 (EVENTS) 或事件码
+
+    Returns:
+        int: 32位数据字
+    """
+    code = EVENTS.index(event) if isinstance(event, str) else event
+    return ((TYPE_INFO << 30) | ((code & 0x3F) << 24) |
+            (int(bool(ready)) << 23) | (int(bool(calibrated)) << 22) |
+            (int(bool(calibrating)) << 21) | (int(bool(scanning)) << 20) |
+            ((phase & 0xFF) << 12) | (arg & 0xFFF))
+
+
+class DeviceState:
+    """由 INFO 数据字驱动的设备状态"""
+
+    def __init__(self, history=256):
+        """
+        Args:
+            history: 保留的最近 INFO 记录数
+        """
+        self.ready = False
+        self.calibrated = False
+        self.calibrating = False
+        self.scanning = False
+        self.phase = 0
+        self.last_event = None
+        self.last_error = None
+        self.updated = None
+        # 是否收到过 INFO (旧固件从不上报，此时调用方应退回固定等待)
+        self.seen = False
+        # 各事件累计次数: 发送命令前记下计数，等待计数增加即可区分新旧事件
+        self.event_counts = dict.fromkeys(EVENTS, 0)
+        self.history = deque(maxlen=history)
+        self._callbacks = {}
+        self._cond = threading.Condition()
+
+    @property
+    def idle(self):
+        """设备就绪且没有进行中的校准或扫描"""
+        return self.ready and not self.calibrating and not self.scanning
+
+    def count(self, event):
+        """事件累计次数"""
+        return self.event_counts.get(event, 0)
+
+    def on(self, name, callback):
+        """
+        注册回调
+
+        Args:
+            name: 事件名 (EVENTS)，或 'change' (任一状态位变化时调用)
+            callback: callback(state, info)；'change' 为 callback(state, changed)，
+                      changed 为 {状态名: (旧值, 新值)}
+        """
+        self._callbacks.setdefault(name, []).append(callback)
+
+    def off(self, name, callback):
+        """注销回调"""
+        callbacks = self._callbacks.get(name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def update(self, value):
+        """
+        处理一个 INFO 数据字 (数值或 decode_word 的结果)
+
+        Returns:
+            dict: 解码结果，非 INFO 字返回 None
+        """
+        if isinstance(value, dict):
+            value = value['raw']
+        info = decode_info(value)
+        if info is None:
+            return None
+
+        with self._cond:
+            changed = {}
+            for name in FLAGS + ('phase',):
+                old = getattr(self, name)
+                if old != info[name]:
+                    changed[name] = (old, info[name])
+                    setattr(self, name, info[name])
+            self.seen = True
+            self.last_event = info['event']
+            self.updated = time.time()
+            self.event_counts[info['event']] = self.event_counts.get(info['event'], 0) + 1
+            if info['event'] == 'ERROR':
+                self.last_error = info['arg']
+            self.history.append((self.updated, info))
+            self._cond.notify_all()
+
+        # 回调在锁外调用，回调中可以安全地查询状态或再注册回调
+        for callback in list(self._callbacks.get(info['event'], [])):
+            callback(self, info)
+        if changed:
+            for callback in list(self._callbacks.get('change', [])):
+                callback(self, changed)
+        return info
+
+    def wait_for(self, condition, timeout=None):
+        """
+        阻塞到 condition(state) 成立 (由其他线程调用 update 推进)
+
+        Args:
+            condition: condition(state) -> bool
+            timeout: 超时时间 (秒)，None 表示一直等待
+
+        Returns:
+            bool: 条件是否成立
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: condition(self), timeout)
+
+    def describe(self):
+        """状态文本"""
+        if not self.seen:
+            return "设备状态: 未收到 INFO"
+        flags = ", ".join(name for name in FLAGS if getattr(self, name)) or "-"
+        return (f"设备状态: {flags} 相位={self.phase} 最近事件={self.last_event}"
+                + (f" 错误码={self.last_error}" if self.last_error is not None else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC INFO 数据字解码")
+    parser.add_argument('words', nargs='*', help="INFO 数据字 (十六进制)")
+    parser.add_argument('--encode', choices=EVENTS, help="构建 INFO 数据字")
+    for name in FLAGS:
+        parser.add_argument(f'--{name}', action='store_true')
+    parser.add_argument('--phase', type=int, default=0)
+    parser.add_argument('--arg', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.encode:
+        value = encode_info(args.encode, args.ready, args.calibrated, args.calibrating,
+                            args.scanning, args.phase, args.arg)
+        print(f"0x{value:08X}")
+        return 0
+
+    state = DeviceState()
+    for word in args.words:
+        info = state.update(int(word, 16))
+        if info is None:
+            print(f"[WARN] 0x{int(word, 16):08X} 不是 INFO 数据字")
+            continue
+        print(f"0x{info['raw']:08X}: {info['event']:<11} "
+              + " ".join(f"{name}={int(info[name])}" for name in FLAGS)
+              + f" phase={info['phase']} arg={info['arg']}")
+    print(state.describe())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC fine time 流式异常检测
+每批数据到达时逐条检查 (整批向量化计算，内存占用与运行时长无关):
+  outlier  相对该 (通道, 相位) 最近 window 个测量值的滚动中位数偏离超过 threshold × MAD
+           (按时钟周期折回计算，环绕点附近不会误报)，典型来源: 亚稳态、
+           priority_encoder 温度计码气泡、LUT 坏 bin
+  flag     通道标志位与类型字段不一致 (UP 应为 1，DOWN 应为 0)
+  range    fine time 超出一个时钟周期 (LUT 之外的码值)
+同一批中同一相位的多个测量值都与该批之前的历史比较，然后全部计入历史。
+
+保留各类计数、每个相位 / 每个 fine 码值的异常计数 (定位坏相位与坏 bin) 以及
+最近的若干个异常样例。
+
+用法:
+  python tdc_scan.py --glitch                                 采集时在线检测
+  python tdc_glitch.py tdc_results/tdc_scan_xxx.txt [--batch 450] [--threshold 6]
+"""
+
+import argparse
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+from tdc_words import FINE_BINS, decode_records
+
+
+CHANNEL_NAMES = {0b00: 'UP', 0b01: 'DOWN'}
+EXPECTED_FLAG = {0b00: 1, 0b01: 0}
+N_PHASES = 256
+KINDS = ('outlier', 'flag', 'range')
+
+# MAD -> 标准差 (正态分布)
+_MAD_SCALE = 1.4826
+
+
+class GlitchDetector:
+    """按 (通道, 相位) 滚动中位数 / MAD 的流式异常检测"""
+
+    def __init__(self, window=32, threshold=6.0, min_history=8, min_mad=2.0,
+                 clk_period=3864, max_examples=100):
+        """
+        Args:
+            window: 每个 (通道, 相位) 保留的最近测量值个数
+            threshold: 判为异常的偏离 (以 1.4826 × MAD 为单位)
+            min_history: 历史值少于该数时不做 outlier 判断
+            min_mad: MAD 下限 (ps)，避免量化后 MAD 为 0 时把 1 个 LSB 的抖动判为异常
+            clk_period: 时钟周期 (ps)
+            max_examples: 保留的异常样例数
+        """
+        self.window = window
+        self.threshold = threshold
+        self.min_history = min_history
+        self.min_mad = min_mad
+        self.clk_period = clk_period
+
+        n_channels = len(CHANNEL_NAMES)
+        self.history = np.full((n_channels, N_PHASES, window), np.nan)
+        self.position = np.zeros((n_channels, N_PHASES), dtype=np.int64)
+
+        self.samples = 0
+        self.counts = {name: dict.fromkeys(KINDS, 0) for name in CHANNEL_NAMES.values()}
+        self.phase_counts = np.zeros((n_channels, N_PHASES), dtype=np.int64)
+        self.code_counts = np.zeros((n_channels, FINE_BINS), dtype=np.int64)
+        self.examples = deque(maxlen=max_examples)
+
+    def _wrap(self, x):
+        return np.mod(x + self.clk_period / 2, self.clk_period) - self.clk_period / 2
+
+    def update(self, data_list):
+        """
+        检查一批数据 (receive_data 格式)
+
+        Returns:
+            numpy.ndarray: 每条数据是否异常 (bool)
+        """
+        words = np.fromiter((d['raw'] for d in data_list), dtype=np.uint32, count=len(data_list))
+        return self.update_records(decode_records(words))
+
+    def update_records(self, records):
+        """
+        检查一批 RECORD_DTYPE 记录 (共享内存环形缓冲、分块文件等)
+
+        Returns:
+            numpy.ndarray: 每条记录是否异常 (bool)
+        """
+        n = len(records)
+        flagged = np.zeros(n, dtype=bool)
+        if n == 0:
+            return flagged
+        start_index = self.samples
+        self.samples += n
+
+        types = records['type'].astype(np.int64)
+        known = types < len(CHANNEL_NAMES)
+        rows = np.flatnonzero(known)
+        ch = types[rows]
+        ids = records['id'][rows].astype(np.int64)
+        fine = records['fine'][rows].astype(np.float64)
+
+        kind = np.full(len(rows), -1)
+
+        # 标志位与类型
+        expected = np.where(ch == 0b00, EXPECTED_FLAG[0b00], EXPECTED_FLAG[0b01])
+        kind[records['flag'][rows] != expected] = KINDS.index('flag')
+
+        # 超出时钟周期
+        out_of_range = fine >= self.clk_period
+        kind[out_of_range] = KINDS.index('range')
+
+        # 滚动中位数 / MAD (只对本批出现的 (通道, 相位) 计算)
+        key = ch * N_PHASES + ids
+        keys, inverse = np.unique(key, return_inverse=True)
+        hist = self.history.reshape(-1, self.window)[keys]
+        n_hist = (~np.isnan(hist)).sum(axis=-1)
+        ready = n_hist >= self.min_history
+        score = np.zeros(len(rows))
+        center = np.full(len(rows), np.nan)
+        if ready.any():
+            h = hist[ready]
+            # 以最近一次测量为参考折回后取中位数，环绕点两侧的值不会被拉开一个周期
+            last = (self.position.reshape(-1)[keys[ready]] - 1) % self.window
+            ref = h[np.arange(len(h)), last]
+            d = self._wrap(h - ref[:, None])
+            med = np.nanmedian(d, axis=-1)
+            mad = np.nanmedian(np.abs(d - med[:, None]), axis=-1)
+            sigma = _MAD_SCALE * np.maximum(mad, self.min_mad)
+
+            key_center = np.full(len(keys), np.nan)
+            key_sigma = np.full(len(keys), np.nan)
+            key_center[ready] = np.mod(ref + med, self.clk_period)
+            key_sigma[ready] = sigma
+            center = key_center[inverse]
+            with np.errstate(invalid='ignore'):
+                score = np.abs(self._wrap(fine - center)) / key_sigma[inverse]
+            outlier = (score > self.threshold) & (kind < 0)
+            kind[outlier] = KINDS.index('outlier')
+
+        # 全部计入历史: 同一键的多个值依次写入环形缓冲 (超过 window 个时保留最后的)
+        new_key = key[~out_of_range]
+        order = np.argsort(new_key, kind='stable')
+        sorted_key = new_key[order]
+        rank = np.empty(len(new_key), dtype=np.int64)
+        rank[order] = np.arange(len(new_key)) - np.searchsorted(sorted_key, sorted_key)
+        flat_pos = self.position.reshape(-1)
+        slot = (flat_pos[new_key] + rank) % self.window
+        self.history.reshape(-1, self.window)[new_key, slot] = fine[~out_of_range]
+        np.add.at(flat_pos, new_key, 1)
+
+        # 统计与样例
+        bad = kind >= 0
+        flagged[rows[bad]] = True
+        if bad.any():
+            for k, name in enumerate(KINDS):
+                per_channel = np.bincount(ch[kind == k], minlength=len(CHANNEL_NAMES))
+                for t, count in enumerate(per_channel):
+                    self.counts[CHANNEL_NAMES[t]][name] += int(count)
+            np.add.at(self.phase_counts, (ch[bad], ids[bad]), 1)
+            np.add.at(self.code_counts, (ch[bad], np.minimum(fine[bad], FINE_BINS - 1)
+                                         .astype(np.int64)), 1)
+            for j in np.flatnonzero(bad)[-self.examples.maxlen:]:
+                self.examples.append({
+                    'index': start_index + int(rows[j]),
+                    'kind': KINDS[kind[j]],
+                    'channel': CHANNEL_NAMES[int(ch[j])],
+                    'id': int(ids[j]),
+                    'fine': int(fine[j]),
+                    'expected': None if np.isnan(center[j]) else float(center[j]),
+                    'score': float(score[j]),
+                    'raw': int(records['raw'][rows[j]]),
+                })
+        return flagged
+
+    @property
+    def total(self):
+        """异常总数"""
+        return sum(sum(c.values()) for c in self.counts.values())
+
+    def worst(self, array, n=5):
+        """
+        异常次数最多的前 n 项
+
+        Returns:
+            list: [(通道名, 下标, 次数), ...]
+        """
+        flat = array.reshape(-1)
+        top = np.argsort(flat)[::-1][:n]
+        width = array.shape[1]
+        return [(CHANNEL_NAMES[int(i // width)], int(i % width), int(flat[i]))
+                for i in top if flat[i] > 0]
+
+    def summary(self, n_examples=5):
+        """异常统计文本"""
+        lines = [f"异常检测: {self.samples} 个数据中 {self.total} 个异常"]
+        for name, counts in self.counts.items():
+            lines.append(f"  {name}: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+        if self.total:
+            lines.append("  异常最多的相位: " + ", ".join(
+                f"{c}#{i}({k})" for c, i, k in self.worst(self.phase_counts)))
+            lines.append("  异常最多的 fine 码值: " + ", ".join(
+                f"{c}:{i}ps({k})" for c, i, k in self.worst(self.code_counts)))
+            lines.append("  最近的样例:")
+            for e in list(self.examples)[-n_examples:]:
+                expected = '-' if e['expected'] is None else f"{e['expected']:.1f}"
+                lines.append(f"    #{e['index']} {e['kind']:<7} {e['channel']:<4} ID={e['id']:<3} "
+                             f"Fine={e['fine']:<5} 期望={expected:<7} 偏离={e['score']:.1f} "
+                             f"Raw=0x{e['raw']:08X}")
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC fine time 异常检测 (按批回放采集文件)")
+    parser.add_argument('file', help="采集文件")
+    parser.add_argument('--batch', type=int, default=450, help="每批数据个数")
+    parser.add_argument('--window', type=int, default=32, help="每个相位的滚动窗口长度")
+    parser.add_argument('--threshold', type=float, default=6.0, help="异常阈值 (MAD 倍数)")
+    parser.add_argument('--examples', type=int, default=10, help="显示的样例数")
+    args = parser.parse_args()
+
+    from tdc_scan import TDCDataProcessor
+    data_list = TDCDataProcessor.load_from_file(args.file)
+    words = np.fromiter((d['raw'] for d in data_list), dtype=np.uint32, count=len(data_list))
+    records = decode_records(words)
+
+    detector = GlitchDetector(window=args.window, threshold=args.threshold,
+                              max_examples=max(args.examples, 1))
+    start = time.perf_counter()
+    for i in range(0, len(records), args.batch):
+        detector.update_records(records[i:i + args.batch])
+    elapsed = time.perf_counter() - start
+
+    print(detector.summary(args.examples))
+    rate = len(records) / elapsed if elapsed > 0 else float('inf')
+    print(f"\n[INFO] {len(records)} 个数据，耗时 {elapsed * 1000:.1f} ms ({rate:.0f} 个/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 定长整数直方图
+以 fine code (ps) 为坐标的紧凑直方图，可在进程、板卡、多次运行之间合并:
+  - fill:     向量化累加原始测量值
+  - merge/+:  O(bins) 合并部分直方图
+  - rebin:    相邻 bin 合并
+  - quantile / mean / std / moment: 统计量
+  - to_bytes / from_bytes / save / load: 序列化
+默认 8192 bin × 1ps，对应 13-bit fine code。
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+from tdc_words import FINE_BINS
+
+
+class TDCHistogram:
+    """定长整数直方图"""
+
+    _MAGIC = b'TDCH'
+    _VERSION = 1
+    # magic, version, n_bins, bin_width, origin, underflow, overflow
+    _HEADER = struct.Struct('<4sHIddqq')
+
+    def __init__(self, n_bins=FINE_BINS, bin_width=1.0, origin=0.0, counts=None):
+        """
+        Args:
+            n_bins: bin 数
+            bin_width: bin 宽度 (ps)
+            origin: 第一个 bin 的中心 (ps)，bin i 覆盖 origin + (i ± 0.5) × bin_width
+            counts: 初始计数 (可选)
+        """
+        self.n_bins = int(n_bins)
+        self.bin_width = float(bin_width)
+        self.origin = float(origin)
+        if counts is None:
+            self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        else:
+            self.counts = np.asarray(counts, dtype=np.int64).copy()
+            if len(self.counts) != self.n_bins:
+                raise ValueError(f"计数长度 {len(self.counts)} 与 bin 数 {self.n_bins} 不符")
+        self.underflow = 0
+        self.overflow = 0
+
+    @classmethod
+    def from_values(cls, values, **kwargs):
+        """由原始测量值构造直方图"""
+        hist = cls(**kwargs)
+        hist.fill(values)
+        return hist
+
+    # ------------------------------------------------------------------
+    # 累加与合并
+    # ------------------------------------------------------------------
+    def fill(self, values):
+        """
+        累加一批测量值 (向量化)
+
+        Args:
+            values: fine time 数组 (ps)
+        """
+        values = np.asarray(values)
+        if values.size == 0:
+            return
+        if self.bin_width == 1.0 and self.origin == 0.0 and values.dtype.kind in 'ui':
+            idx = values.astype(np.int64, copy=False)
+        else:
+            idx = np.floor((values - self.origin) / self.bin_width + 0.5).astype(np.int64)
+        low = idx < 0
+        high = idx >= self.n_bins
+        self.underflow += int(np.count_nonzero(low))
+        self.overflow += int(np.count_nonzero(high))
+        idx = idx[~(low | high)]
+        self.counts += np.bincount(idx, minlength=self.n_bins)
+
+    def compatible(self, other):
+        """判断两个直方图的分箱是否一致"""
+        return (self.n_bins == other.n_bins and
+                self.bin_width == other.bin_width and
+                self.origin == other.origin)
+
+    def merge(self, other):
+        """
+        将另一个直方图合并到本直方图 (原地)
+
+        Returns:
+            TDCHistogram: self
+        """
+        if not self.compatible(other):
+            raise ValueError("直方图分箱不一致，无法合并")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def copy(self):
+        hist = TDCHistogram(self.n_bins, self.bin_width, self.origin, self.counts)
+        hist.underflow = self.underflow
+        hist.overflow = self.overflow
+        return hist
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return self.copy().merge(other)
+
+    def __radd__(self, other):
+        # 支持 sum(histograms)
+        if other == 0:
+            return self.copy()
+        return self.__add__(other)
+
+    def __eq__(self, other):
+        return (isinstance(other, TDCHistogram) and self.compatible(other) and
+                self.underflow == other.underflow and self.overflow == other.overflow and
+                np.array_equal(self.counts, other.counts))
+
+    def __repr__(self):
+        return (f"TDCHistogram(n_bins={self.n_bins}, bin_width={self.bin_width}, "
+                f"origin={self.origin}, total={self.total})")
+
+    # ------------------------------------------------------------------
+    # 坐标
+    # ------------------------------------------------------------------
+    @property
+    def total(self):
+        """范围内的总计数"""
+        return int(self.counts.sum())
+
+    @property
+    def edges(self):
+        return self.origin + self.bin_width * (np.arange(self.n_bins + 1) - 0.5)
+
+    @property
+    def centers(self):
+        return self.origin + self.bin_width * np.arange(self.n_bins)
+
+    def rebin(self, factor):
+        """
+        将每 factor 个相邻 bin 合并为一个
+
+        Returns:
+            TDCHistogram: 新直方图 (末尾不足 factor 的 bin 计入溢出)
+        """
+        factor = int(factor)
+        n = self.n_bins // factor
+        hist = TDCHistogram(n, self.bin_width * factor,
+                            self.origin + self.bin_width * (factor - 1) / 2,
+                            self.counts[:n * factor].reshape(n, factor).sum(axis=1))
+        hist.underflow = self.underflow
+        hist.overflow = self.overflow + int(self.counts[n * factor:].sum())
+        return hist
+
+    def crop(self, low, high):
+        """截取中心位于 [low, high) ps 范围内的 bin"""
+        i0 = max(0, int(np.ceil((low - self.origin) / self.bin_width)))
+        i1 = min(self.n_bins, int(np.ceil((high - self.origin) / self.bin_width)))
+        hist = TDCHistogram(i1 - i0, self.bin_width, self.origin + i0 * self.bin_width,
+                            self.counts[i0:i1])
+        hist.underflow = self.underflow + int(self.counts[:i0].sum())
+        hist.overflow = self.overflow + int(self.counts[i1:].sum())
+        return hist
+
+    # ------------------------------------------------------------------
+    # 统计量
+    # ------------------------------------------------------------------
+    def mean(self):
+        total = self.total
+        if total == 0:
+            return float('nan')
+        return float((self.counts * self.centers).sum() / total)
+
+    def moment(self, k, central=True):
+        """k 阶 (中心) 矩"""
+        total = self.total
+        if total == 0:
+            return float('nan')
+        x = self.centers - (self.mean() if central else 0.0)
+        return float((self.counts * x**k).sum() / total)
+
+    def var(self):
+        return self.moment(2)
+
+    def std(self):
+        return float(np.sqrt(self.var()))
+
+    def quantile(self, q):
+        """
+        分位数 (bin 内线性插值)
+
+        Args:
+            q: 0-1 之间的标量或数组
+
+        Returns:
+            float 或 numpy.ndarray: 对应的 ps 值
+        """
+        cdf = np.concatenate(([0], np.cumsum(self.counts)))
+        total = cdf[-1]
+        if total == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float('nan')
+        result = np.interp(np.asarray(q, dtype=float) * total, cdf, self.edges)
+        return result if np.ndim(q) else float(result)
+
+    def precision_stats(self, period=None):
+        """
+        单次测量精度统计: sigma、FWHM、尾部比例
+
+        Args:
+            period: 时钟周期 (ps)，给出时先按周期折叠计数 (period 应为 bin 宽度的整数倍)，
+                    再按周期处理跨越 0/period 的环绕
+
+        Returns:
+            dict: count/mean/sigma/fwhm/tail 等统计量，单位 ps
+        """
+        count = self.total
+        if count == 0:
+            return {'count': 0}
+
+        centers = self.centers
+        counts = self.counts
+        if period:
+            # 先按周期折叠计数 (bin 数多于一个周期时，相差整周期的 bin 是同一个码值)，
+            # 否则折叠后的 x 出现重复，FWHM 插值会取到重复位置上的 0 计数
+            n_fold = int(round(period / self.bin_width))
+            counts = np.bincount(np.arange(self.n_bins) % n_fold, weights=counts,
+                                 minlength=n_fold)
+            centers = self.origin + self.bin_width * np.arange(n_fold)
+        mode = centers[int(np.argmax(counts))]
+        # 以众数为中心展开，避免环绕处的分布被拆成两半
+        offset = centers - mode
+        if period:
+            offset = (offset + period / 2) % period - period / 2
+
+        order = np.argsort(offset, kind='stable')
+        x = offset[order]
+        h = counts[order].astype(float)
+
+        mean = (h * x).sum() / count
+        sigma = np.sqrt((h * (x - mean)**2).sum() / count)
+
+        # FWHM: 半高处左右边沿线性插值
+        half = h.max() / 2
+        above = np.where(h >= half)[0]
+        lo, hi = above[0], above[-1]
+        left = x[lo]
+        if lo > 0 and h[lo] != h[lo - 1]:
+            left = x[lo - 1] + (half - h[lo - 1]) / (h[lo] - h[lo - 1]) * (x[lo] - x[lo - 1])
+        right = x[hi]
+        if hi < len(h) - 1 and h[hi] != h[hi + 1]:
+            right = x[hi] + (h[hi] - half) / (h[hi] - h[hi + 1]) * (x[hi + 1] - x[hi])
+        fwhm = right - left
+
+        # 尾部: 超出 ±3σ / ±5σ 的比例 (高斯分布分别约为 0.27% / 5.7e-7)
+        dev = np.abs(x - mean)
+        tail_3 = h[dev > 3 * sigma].sum() / count if sigma > 0 else 0.0
+        tail_5 = h[dev > 5 * sigma].sum() / count if sigma > 0 else 0.0
+
+        cdf = np.cumsum(h) / count
+        q_lo = x[np.searchsorted(cdf, 0.00135)]
+        q_hi = x[min(np.searchsorted(cdf, 0.99865), len(x) - 1)]
+
+        center = mode + mean
+        if period:
+            center %= period
+
+        return {
+            'count': count,
+            'mean': float(center),
+            'sigma': float(sigma),
+            'fwhm': float(fwhm),
+            'fwhm_sigma': float(fwhm / 2.3548),
+            'tail_3sigma': float(tail_3),
+            'tail_5sigma': float(tail_5),
+            'q_0135': float(q_lo - mean),
+            'q_99865': float(q_hi - mean),
+            'min': float(x[h > 0][0] - mean),
+            'max': float(x[h > 0][-1] - mean),
+        }
+
+    # ------------------------------------------------------------------
+    # 序列化
+    # ------------------------------------------------------------------
+    def to_bytes(self):
+        """序列化为紧凑字节串 (头部 + zlib 压缩的计数)"""
+        header = self._HEADER.pack(self._MAGIC, self._VERSION, self.n_bins,
+                                   self.bin_width, self.origin,
+                                   self.underflow, self.overflow)
+        return header + zlib.compress(self.counts.astype('<i8').tobytes(), 6)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """由 to_bytes 的结果恢复直方图"""
+        magic, version, n_bins, bin_width, origin, underflow, overflow = \
+            cls._HEADER.unpack_from(data)
+        if magic != cls._MAGIC:
+            raise ValueError("不是 TDC 直方图数据")
+        if version != cls._VERSION:
+            raise ValueError(f"不支持的直方图版本: {version}")
+        counts = np.frombuffer(zlib.decompress(data[cls._HEADER.size:]), dtype='<i8')
+        hist = cls(n_bins, bin_width, origin, counts)
+        hist.underflow = underflow
+        hist.overflow = overflow
+        return hist
+
+    def save(self, filepath):
+        with open(filepath, 'wb') as f:
+            f.write(self.to_bytes())
+        return filepath
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def __getstate__(self):
+        # 进程间传递时使用紧凑格式
+        return self.to_bytes()
+
+    def __setstate__(self, state):
+        other = TDCHistogram.from_bytes(state)
+        self.__dict__.update(other.__dict__)
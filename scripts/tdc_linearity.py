@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 线性度批量计算引擎
+对任意多条扫描曲线 (多次扫描 × 多通道) 一次性完成:
+  环绕展开 -> 最小二乘直线拟合 -> 步进 / DNL / INL
+所有运算沿最后一维 (相位) 进行，前面的维度任意 (通道、扫描次数等)，
+缺失的相位用 NaN 表示。
+
+模型: fine = (phase × step + D) mod CLK_PERIOD
+相邻两点跳变超过半个周期即视为环绕，按整周期展开。
+"""
+
+import numpy as np
+
+
+def unwrap(fine, clk_period):
+    """
+    沿最后一维展开环绕
+
+    Args:
+        fine: fine time 数组 (..., n_phases)，缺失值为 NaN
+        clk_period: 时钟周期 (ps)
+
+    Returns:
+        tuple: (展开后的数组, 每条曲线的环绕次数)
+    """
+    fine = np.asarray(fine, dtype=float)
+    n = fine.shape[-1]
+    valid = ~np.isnan(fine)
+
+    # 前向填充缺失值，使跳变在相邻有效点之间计算
+    idx = np.where(valid, np.arange(n), 0)
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    filled = np.take_along_axis(fine, idx, axis=-1)
+
+    jumps = np.rint(np.nan_to_num(np.diff(filled, axis=-1)) / clk_period)
+    offsets = np.concatenate((np.zeros(fine.shape[:-1] + (1,)),
+                              np.cumsum(jumps, axis=-1)), axis=-1)
+    return fine - clk_period * offsets, np.count_nonzero(jumps, axis=-1)
+
+
+def fit_lines(x, y):
+    """
+    批量最小二乘直线拟合 y = slope × x + intercept (忽略 NaN)
+
+    Args:
+        x: 自变量，可广播到 y 的形状
+        y: 因变量 (..., n)
+
+    Returns:
+        tuple: (slope, intercept)，形状为 y.shape[:-1]
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    mask = ~(np.isnan(x) | np.isnan(y))
+    w = mask.astype(float)
+
+    count = w.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(mask, x, 0).sum(axis=-1) / count
+        y_mean = np.where(mask, y, 0).sum(axis=-1) / count
+        dx = np.where(mask, x - x_mean[..., None], 0)
+        dy = np.where(mask, y - y_mean[..., None], 0)
+        slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+    intercept = y_mean - slope * x_mean
+    return slope, intercept
+
+
+def linearity(phases, fine, clk_period, lsb=None):
+    """
+    批量计算线性度指标
+
+    Args:
+        phases: 相位索引 (n_phases,) 或与 fine 同形状
+        fine: fine time (..., n_phases)，按相位排序，缺失值为 NaN
+        clk_period: 时钟周期 (ps)
+        lsb: DNL/INL 的 LSB (ps，标量或可广播到 fine.shape[:-1])，
+             如联合拟合的相位步进；None 时使用每条曲线的平均步进
+
+    Returns:
+        dict: 各项为数组，前面的维度与 fine 相同
+            unwrapped: 展开后的曲线 (ps)
+            wraps:     环绕次数
+            slope/intercept: 拟合直线 (ps/phase, ps)
+            diffs:     展开后相邻点差值 (ps)
+            step:      平均步进 |diff| (ps)
+            step_std:  步进标准差 (ps)
+            lsb:       DNL/INL 使用的 LSB (ps)
+            dnl:       (|diff| - lsb) / lsb (LSB)
+            inl_ps:    相对拟合直线的偏差 (ps)
+            inl_lsb:   inl_ps / lsb (LSB)
+    """
+    phases = np.asarray(phases, dtype=float)
+    unwrapped, wraps = unwrap(fine, clk_period)
+    slope, intercept = fit_lines(phases, unwrapped)
+
+    inl_ps = unwrapped - (slope[..., None] * phases + intercept[..., None])
+
+    diffs = np.diff(unwrapped, axis=-1)
+    abs_diffs = np.abs(diffs)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        step = np.nanmean(abs_diffs, axis=-1)
+        step_std = np.nanstd(abs_diffs, axis=-1)
+        lsb = step if lsb is None else np.broadcast_to(np.asarray(lsb, dtype=float), step.shape)
+        dnl = (abs_diffs - lsb[..., None]) / lsb[..., None]
+        inl_lsb = inl_ps / lsb[..., None]
+
+    return {
+        'unwrapped': unwrapped,
+        'wraps': wraps,
+        'slope': slope,
+        'intercept': intercept,
+        'diffs': diffs,
+        'step': step,
+        'step_std': step_std,
+        'lsb': lsb,
+        'dnl': dnl,
+        'inl_ps': inl_ps,
+        'inl_lsb': inl_lsb,
+    }
+
+
+def rms(values, axis=-1):
+    """忽略 NaN 的均方根"""
+    return np.sqrt(np.nanmean(np.square(values), axis=axis))
+
+
+def stack_sweeps(data_list, data_type, n_phases=None):
+    """
+    将一次采集中某通道的数据按扫描拆分并堆叠成二维数组
+
+    相位 ID 回落即视为新一轮扫描开始。
+
+    Args:
+        data_list: receive_data 格式的数据列表
+        data_type: 数据类型 (0b00=UP, 0b01=DOWN)
+        n_phases: 相位数 (默认取最大 ID + 1)
+
+    Returns:
+        numpy.ndarray: (n_sweeps, n_phases)，未测到的相位为 NaN
+    """
+    ids = np.array([d['id'] for d in data_list if d['type'] == data_type], dtype=int)
+    fine = np.array([d['fine'] for d in data_list if d['type'] == data_type], dtype=float)
+    if len(ids) == 0:
+        return np.empty((0, n_phases or 0))
+
+    sweep = np.concatenate(([0], np.cumsum(np.diff(ids) <= 0)))
+    if n_phases is None:
+        n_phases = int(ids.max()) + 1
+    out = np.full((int(sweep[-1]) + 1, n_phases), np.nan)
+    keep = ids < n_phases
+    out[sweep[keep], ids[keep]] = fine[keep]
+    return out
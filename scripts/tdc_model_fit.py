@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 延迟模型联合拟合
+模型: fine = (phase × step + D_c) mod CLK_PERIOD
+所有通道共享相位步进 step，每个通道有各自的偏移 D_c，
+布线延迟按现有约定为 (CLK_PERIOD - D_c) mod CLK_PERIOD，UP/DOWN 偏差 skew = D_UP - D_DOWN。
+
+数据先按 (通道, 相位) 累加为圆周统计量 (计数、Σcos、Σsin)，拟合只在这些
+(n_channels, 256) 数组上进行，耗时与采集的数据量无关，可以在长时间采集中每轮扫描后重新拟合:
+  1. 初值: 对候选 step 网格计算各通道圆周合成长度之和 (一次矩阵乘法)，取最大值
+  2. 精修: 把各相位圆周均值相对当前模型的残差折回 ±T/2，做共享斜率的加权最小二乘，迭代至收敛
+"""
+
+import numpy as np
+
+
+N_PHASES = 256      # 8 位相位 ID
+
+
+def phase_sums(ids, fine, clk_period, n_phases=N_PHASES):
+    """
+    按 (通道, 相位) 累加圆周统计量
+
+    Args:
+        ids: 相位 ID (n_channels, n)，缺失值为 NaN
+        fine: fine time (n_channels, n)，缺失值为 NaN
+        clk_period: 时钟周期 (ps)
+
+    Returns:
+        tuple: (count, sum_cos, sum_sin)，形状均为 (n_channels, n_phases)
+    """
+    ids = np.atleast_2d(ids)
+    fine = np.atleast_2d(fine)
+    n_channels = ids.shape[0]
+    valid = ~np.isnan(ids) & ~np.isnan(fine)
+    rows = np.broadcast_to(np.arange(n_channels)[:, None], ids.shape)[valid]
+    key = rows * n_phases + ids[valid].astype(int)
+    angle = 2 * np.pi * fine[valid] / clk_period
+
+    size = n_channels * n_phases
+    shape = (n_channels, n_phases)
+    count = np.bincount(key, minlength=size).reshape(shape)
+    sum_cos = np.bincount(key, weights=np.cos(angle), minlength=size).reshape(shape)
+    sum_sin = np.bincount(key, weights=np.sin(angle), minlength=size).reshape(shape)
+    return count, sum_cos, sum_sin
+
+
+def fit_model(count, sum_cos, sum_sin, clk_period, step_range=(-40.0, 40.0),
+              init_step=None, max_iter=20, tol=1e-9):
+    """
+    由 phase_sums 的结果联合拟合 step 与各通道偏移
+
+    Args:
+        count/sum_cos/sum_sin: (n_channels, n_phases) 圆周统计量
+        clk_period: 时钟周期 (ps)
+        step_range: 网格搜索 step 的范围 (ps/phase，带符号)
+        init_step: step 初值 (给定时跳过网格搜索，用于逐轮更新)
+        max_iter: 最小二乘最大迭代次数
+        tol: step 收敛阈值 (ps/phase)
+
+    Returns:
+        dict:
+            step / step_err: 相位步进及其标准误差 (ps/phase，带符号)
+            offset:  每个通道的 D_c (ps，0..T)
+            routing_delay: 每个通道的布线延迟 (T - D_c) mod T (ps)
+            rms:     每个通道相位均值相对模型的加权 RMS 残差 (ps)
+            counts:  每个通道参与拟合的数据数
+            iterations: 迭代次数
+        数据不足 (有效相位少于 3 个) 时返回 None
+    """
+    T = float(clk_period)
+    count = np.asarray(count, dtype=float)
+    phases = np.arange(count.shape[1], dtype=float)
+    used = count > 0
+    if used.sum() < 3:
+        return None
+
+    z = np.asarray(sum_cos) + 1j * np.asarray(sum_sin)
+    mean_fine = np.mod(np.angle(z) * T / (2 * np.pi), T)
+
+    if init_step is None:
+        # 圆周合成长度在 step 方向的峰宽约为 T / 相位跨度，网格取其 1/8
+        span = max(np.ptp(phases[used.any(axis=0)]), 1.0)
+        spacing = T / span / 8
+        steps = np.arange(step_range[0], step_range[1] + spacing, spacing)
+        chirp = np.exp(-2j * np.pi * np.outer(phases, steps) / T)
+        score = np.abs(z @ chirp).sum(axis=0)
+        step = float(steps[np.argmax(score)])
+    else:
+        step = float(init_step)
+
+    # 给定 step 时每个通道偏移的圆周均值
+    rotated = (z * np.exp(-2j * np.pi * step * phases / T)).sum(axis=-1)
+    offset = np.angle(rotated) * T / (2 * np.pi)
+
+    w = count
+    w_sum = w.sum(axis=-1)
+    active = w_sum > 0
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        pred = step * phases + offset[:, None]
+        y = pred + (np.mod(mean_fine - pred + T / 2, T) - T / 2)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_mean = (w * phases).sum(axis=-1) / w_sum
+            y_mean = (w * y).sum(axis=-1) / w_sum
+        dx = np.where(used, phases - np.nan_to_num(x_mean)[:, None], 0)
+        dy = np.where(used, y - np.nan_to_num(y_mean)[:, None], 0)
+        sxx = (w * dx * dx).sum()
+        new_step = (w * dx * dy).sum() / sxx
+        offset = np.where(active, np.nan_to_num(y_mean) - new_step * np.nan_to_num(x_mean), 0)
+
+        converged = abs(new_step - step) < tol
+        step = new_step
+        if converged:
+            break
+
+    pred = step * phases + offset[:, None]
+    resid = np.mod(mean_fine - pred + T / 2, T) - T / 2
+    resid = np.where(used, resid, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rms = np.sqrt((w * resid ** 2).sum(axis=-1) / w_sum)
+    # 相位均值的方差按 σ²/计数 计，σ² 由加权残差估计
+    dof = max(int(used.sum()) - int(active.sum()) - 1, 1)
+    step_err = float(np.sqrt((w * resid ** 2).sum() / dof / sxx))
+
+    offset = np.where(active, np.mod(offset, T), np.nan)
+    return {
+        'step': float(step),
+        'step_err': step_err,
+        'offset': offset,
+        'routing_delay': np.mod(T - offset, T),
+        'rms': np.where(active, rms, np.nan),
+        'counts': w_sum.astype(int),
+        'iterations': iterations,
+    }
+
+
+def skew(offsets, names, clk_period, a='UP', b='DOWN'):
+    """两个通道偏移之差 D_a - D_b，折回 ±T/2；缺少通道时返回 None"""
+    if a not in names or b not in names:
+        return None
+    d = offsets[names.index(a)] - offsets[names.index(b)]
+    if np.isnan(d):
+        return None
+    return float(np.mod(d + clk_period / 2, clk_period) - clk_period / 2)
+
+
+def summarize(fit, names, clk_period):
+    """
+    整理为可写入性能字典的结果
+
+    Returns:
+        dict: step / step_err / delay_ps / rms_ps / skew_ps
+    """
+    return {
+        'step': fit['step'],
+        'step_err': fit['step_err'],
+        'delay_ps': {name: float(d) for name, d in zip(names, fit['routing_delay'])
+                     if not np.isnan(d)},
+        'rms_ps': {name: float(r) for name, r in zip(names, fit['rms']) if not np.isnan(r)},
+        'skew_ps': skew(list(fit['offset']), list(names), clk_period),
+    }
+
+
+class LiveModelFit:
+    """采集过程中的增量拟合: 每轮扫描后累加统计量，并以上次的 step 为初值重新拟合"""
+
+    CHANNEL_NAMES = {0b00: 'UP', 0b01: 'DOWN'}
+
+    def __init__(self, clk_period=3864, step_range=(-40.0, 40.0)):
+        self.clk_period = clk_period
+        self.step_range = step_range
+        self.names = list(self.CHANNEL_NAMES.values())
+        shape = (len(self.names), N_PHASES)
+        self.count = np.zeros(shape)
+        self.sum_cos = np.zeros(shape)
+        self.sum_sin = np.zeros(shape)
+        self.result = None
+        self.history = []
+
+    def add(self, data_list):
+        """累加一批数据 (receive_data 格式)"""
+        kept = [d for d in data_list if d['type'] in self.CHANNEL_NAMES]
+        if not kept:
+            return
+        rows = [self.names.index(self.CHANNEL_NAMES[d['type']]) for d in kept]
+        ids = np.full((len(self.names), len(kept)), np.nan)
+        fine = np.full_like(ids, np.nan)
+        cols = np.arange(len(kept))
+        ids[rows, cols] = [d['id'] for d in kept]
+        fine[rows, cols] = [d['fine'] for d in kept]
+
+        count, sum_cos, sum_sin = phase_sums(ids, fine, self.clk_period)
+        self.count += count
+        self.sum_cos += sum_cos
+        self.sum_sin += sum_sin
+
+    def refit(self):
+        """
+        重新拟合
+
+        Returns:
+            dict: summarize() 结果，数据不足时为 None
+        """
+        init = self.result['step'] if self.result is not None else None
+        fit = fit_model(self.count, self.sum_cos, self.sum_sin, self.clk_period,
+                        self.step_range, init_step=init)
+        if fit is None:
+            return None
+        self.result = fit
+        summary = summarize(fit, self.names, self.clk_period)
+        self.history.append(summary)
+        return summary
+
+    def update(self, data_list):
+        """add + refit"""
+        self.add(data_list)
+        return self.refit()
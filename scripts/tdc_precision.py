@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 高统计单相位精度测量
+固定一个相位，连续发送单步命令收集大量测量值，
+按通道累加到 8192 bin (13-bit fine code) 的整数直方图中。
+接收路径按块读取、向量化解码、流式累加，内存占用与测量次数无关。
+由直方图给出单次测量精度: sigma、FWHM、尾部比例；
+同时按到达顺序累加 Allan 偏差 (tdc_stability)，给出不同平均次数下的稳定性。
+"""
+
+import os
+import socket
+import struct
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from tdc_histogram import TDCHistogram
+from tdc_stability import AllanAccumulator, format_table, summarize
+from tdc_words import words_from_bytes, decode_words
+
+
+class PrecisionMeasurement:
+    """单相位高统计精度测量"""
+
+    CHANNEL_NAMES = {0b00: 'UP', 0b01: 'DOWN'}
+
+    def __init__(self, scanner, phase, channel=0b11, target_hits=1000000,
+                 burst=64, window=256, lost_after=0.05, max_time=600.0,
+                 recv_size=1 << 16, drain_time=2.0, clk_period=3864):
+        """
+        Args:
+            scanner: 已连接的 TDCScanner
+            phase: 测量相位 (0-255)
+            channel: 通道选择 (0b01=DOWN, 0b10=UP, 0b11=BOTH)
+            target_hits: 每个通道的目标测量次数
+            burst: 每次发送的命令条数
+            window: 允许未返回数据的最大命令数 (流控)
+            lost_after: 命令发出后多久未返回视为被丢弃 (秒)
+            max_time: 最长测量时间 (秒)
+            recv_size: 接收缓冲区大小 (字节)
+            drain_time: 结束时接收未返回数据的最长时间 (秒)
+            clk_period: 时钟周期 (ps)
+        """
+        self.scanner = scanner
+        self.phase = phase
+        self.channel = channel
+        self.target_hits = target_hits
+        self.burst = burst
+        self.window = max(window, burst)
+        self.lost_after = lost_after
+        self.max_time = max_time
+        self.recv_size = recv_size - recv_size % 4
+        self.drain_time = drain_time
+        self.CLK_PERIOD = clk_period
+
+        # [UP, DOWN] 两个通道的 fine code 直方图
+        self.hist = [TDCHistogram(), TDCHistogram()]
+        # [UP, DOWN] 两个通道的 Allan 偏差 (按到达顺序)
+        self.stability = [AllanAccumulator(clk_period=clk_period),
+                          AllanAccumulator(clk_period=clk_period)]
+        self.commands = 0
+        self.rejected = 0
+        self.elapsed = 0.0
+
+    def _words_per_command(self):
+        return 2 if self.channel == 0b11 else 1
+
+    def _active_types(self):
+        return [t for t, bit in ((0b00, 0b10), (0b01, 0b01)) if self.channel & bit]
+
+    def _accumulate(self, words):
+        """解码一批数据字并累加到直方图"""
+        fields = decode_words(words)
+        data_type = fields['type']
+        # INFO 仍交给设备状态 (本测量直接读取 socket，不经过 receive_data)
+        for value in words[data_type == self.scanner.TYPE_INFO]:
+            self.scanner._handle_info(int(value))
+        # CMD 回显、INFO 及相位不符的数据不计入
+        valid = (data_type <= 0b01) & (fields['id'] == (self.phase & 0xFF))
+        for t in self._active_types():
+            mask = valid & (data_type == t)
+            self.hist[t].fill(fields['fine'][mask])
+            self.stability[t].update(fields['fine'][mask])
+        accepted = int(np.count_nonzero(valid))
+        self.rejected += len(words) - accepted
+        return accepted
+
+    def run(self):
+        """
+        执行测量直到每个通道达到目标次数或超时
+
+        Returns:
+            dict: 每个通道的精度统计
+        """
+        if not self.scanner.connected:
+            print("[ERROR] 未连接到设备")
+            return None
+
+        cmd = struct.pack('>I', self.scanner.build_command(
+            self.scanner.CMD_SCAN, self.scanner.SCAN_SINGLE, self.channel, self.phase))
+        burst_bytes = cmd * self.burst
+        per_cmd = self._words_per_command()
+
+        sock = self.scanner.sock
+        sock.settimeout(self.lost_after)
+        buf = bytearray(self.recv_size)
+        view = memoryview(buf)
+        # 字流解析器中尚未组成完整数据字的字节属于本次数据流的开头
+        head = self.scanner.parser.take()
+        pending = len(head)
+        buf[:pending] = head
+        # 未返回数据的命令批次 [(发送时间, 剩余条数), ...]
+        inflight = deque()
+        outstanding = 0
+        last_report = 0
+
+        print(f"[INFO] 单相位精度测量: 相位={self.phase}, 目标 {self.target_hits} 次/通道")
+        start = time.time()
+
+        try:
+            while min(self.hist[t].total for t in self._active_types()) < self.target_hits:
+                if time.time() - start > self.max_time:
+                    print("[WARN] 达到最长测量时间")
+                    break
+
+                # FPGA 忙时会丢弃命令，超时未返回的批次不再计入
+                now = time.time()
+                while inflight and now - inflight[0][0] > self.lost_after:
+                    outstanding -= inflight.popleft()[1]
+
+                # 流控: 未返回数据的命令数不超过窗口
+                if outstanding + self.burst <= self.window:
+                    sock.sendall(burst_bytes)
+                    self.commands += self.burst
+                    outstanding += self.burst
+                    inflight.append((now, self.burst))
+
+                try:
+                    received, pending = self._receive(sock, view, pending)
+                except socket.timeout:
+                    continue
+                if received is None:
+                    print("[WARN] 连接断开")
+                    break
+                # 按发送顺序核销已返回的命令
+                done = received // per_cmd
+                while done > 0 and inflight:
+                    sent_at, remaining = inflight[0]
+                    used = min(done, remaining)
+                    done -= used
+                    outstanding -= used
+                    if used == remaining:
+                        inflight.popleft()
+                    else:
+                        inflight[0] = (sent_at, remaining - used)
+
+                hits = sum(h.total for h in self.hist)
+                if hits - last_report >= 100000:
+                    last_report = hits
+                    rate = hits / (time.time() - start)
+                    print(f"[RX] 进度: {hits} 个测量值 ({rate:.0f} 个/s)")
+        finally:
+            self.elapsed = time.time() - start
+            self._drain(sock, view, pending)
+            sock.settimeout(1.0)
+
+        return self.report()
+
+    def _receive(self, sock, view, pending):
+        """
+        接收一块字节并累加完整的数据字，不足一个字的尾部字节移到缓冲区开头
+
+        Returns:
+            tuple: (接受的数据个数, 剩余尾部字节数)；连接断开时数据个数为 None
+        """
+        n = sock.recv_into(view[pending:])
+        if n == 0:
+            return None, pending
+        total = pending + n
+        usable = total - total % 4
+        received = self._accumulate(words_from_bytes(view[:usable]))
+        view[:total - usable] = view[usable:total]
+        return received, total - usable
+
+    def _drain(self, sock, view, pending):
+        """
+        停止发送后接收仍在途中的数据 (照常计入直方图)，直到数据流安静或超过 drain_time，
+        避免下一次 receive_data 读到本次测量的数据字或半个字
+        """
+        deadline = time.time() + self.drain_time
+        drained = 0
+        try:
+            while time.time() < deadline:
+                try:
+                    received, pending = self._receive(sock, view, pending)
+                except socket.timeout:
+                    break
+                if received is None:
+                    break
+                drained += received
+        except OSError as e:
+            print(f"[WARN] 接收剩余数据时出错: {e}")
+        if drained:
+            print(f"[INFO] 结束时接收剩余数据 {drained} 个")
+        if pending:
+            print(f"[WARN] 数据流结束于不完整的数据字，丢弃 {pending} 字节")
+        # 接收状态回到空白: 后续 receive_data 从新的字边界开始
+        self.scanner.parser.reset()
+        self.scanner._pending = []
+
+    def report(self):
+        """打印并返回每个通道的精度统计"""
+        print("\n" + "="*70)
+        print(f"单相位精度测量结果 (相位 {self.phase})")
+        print("="*70)
+        print(f"  命令数: {self.commands}")
+        print(f"  测量时间: {self.elapsed:.1f} s")
+        print(f"  丢弃数据字: {self.rejected}")
+
+        results = {}
+        for t in self._active_types():
+            name = self.CHANNEL_NAMES[t]
+            stats = self.hist[t].precision_stats(self.CLK_PERIOD)
+            results[name] = stats
+            print(f"\n  {name} 通道:")
+            if stats['count'] == 0:
+                print("    无数据")
+                continue
+            print(f"    测量次数: {stats['count']}")
+            print(f"    均值: {stats['mean']:.2f} ps")
+            print(f"    单次精度 σ: {stats['sigma']:.3f} ps")
+            print(f"    FWHM: {stats['fwhm']:.2f} ps (等效 σ = {stats['fwhm_sigma']:.3f} ps)")
+            print(f"    尾部比例 >3σ: {stats['tail_3sigma']*100:.4f}% (高斯: 0.27%)")
+            print(f"    尾部比例 >5σ: {stats['tail_5sigma']*100:.6f}%")
+            print(f"    99.73% 区间: [{stats['q_0135']:.1f}, {stats['q_99865']:.1f}] ps")
+            adev = self.stability_result(t)
+            if len(adev['tau']):
+                stats['stability'] = summarize(adev)
+                print("\n".join("  " + line for line in format_table({name: adev})[1:]))
+        print("="*70 + "\n")
+        return results
+
+    def stability_result(self, t):
+        """通道 t 的 Allan 偏差 (tdc_stability 结果，附加 'phase')"""
+        result = self.stability[t].result()
+        result['phase'] = self.phase
+        return result
+
+    def save_to_file(self, filename=None, output_dir='tdc_results'):
+        """保存直方图 (只写非零 bin) 与 Allan 偏差"""
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        if filename is None:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"tdc_precision_p{self.phase}_{timestamp}.txt"
+        filepath = os.path.join(output_dir, filename)
+
+        up, down = self.hist[0].counts, self.hist[1].counts
+        nonzero = np.where(up + down > 0)[0]
+        with open(filepath, 'w') as f:
+            f.write("# TDC 单相位精度测量直方图\n")
+            f.write(f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"# 相位: {self.phase}, 命令数: {self.commands}\n")
+            f.write("# Fine, UP, DOWN\n")
+            for b in nonzero:
+                f.write(f"{b},{up[b]},{down[b]}\n")
+
+        print(f"[INFO] 直方图已保存到: {filepath}")
+
+        adev_path = filepath.replace('.txt', '_adev.txt')
+        with open(adev_path, 'w') as f:
+            f.write("# TDC 单相位 Allan 偏差 (τ 以测量次数计)\n")
+            f.write(f"# 相位: {self.phase}\n")
+            f.write("# Channel, Tau, OADEV_ps, ADEV_ps, Err_ps\n")
+            for t in self._active_types():
+                r = self.stability_result(t)
+                for row in zip(r['tau'], r['oadev'], r['adev'], r['err']):
+                    f.write(f"{self.CHANNEL_NAMES[t]},{row[0]},{row[1]:.4f},{row[2]:.4f},{row[3]:.4f}\n")
+        print(f"[INFO] Allan 偏差已保存到: {adev_path}")
+        return filepath
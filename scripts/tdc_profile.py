@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 扫描程序分阶段性能剖析
+为 TDCScanner / TDCDataProcessor 的各个阶段加上计时器，
+在最外层阶段内启用 cProfile，全程用 tracemalloc 统计每个阶段的内存增量与峰值，
+并用后台采样线程记录主线程调用栈 (以阶段名为栈底)。
+
+每次运行输出:
+  profile_<时间>.txt        阶段耗时/调用次数/内存表 + 每个阶段耗时最多的函数
+  profile_<时间>.prof       合并的 cProfile 数据 (可用 snakeviz / pstats 查看)
+  profile_<时间>.collapsed  折叠调用栈，可直接输入 flamegraph.pl / speedscope
+
+用法:
+  python tdc_scan.py --profile [--profile-dir DIR]
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# 被包装的方法及其阶段名
+SCANNER_STAGES = {
+    'connect': 'connect',
+    '_clear_rx_buffer': 'clear_rx_buffer',
+    'send_command': 'send',
+    'receive_data': 'receive',
+    'decode_word': 'decode',
+}
+PROCESSOR_STAGES = {
+    'process': 'process',
+    'analyze_tdc_performance': 'analyze_tdc_performance',
+    'save_to_file': 'save_to_file',
+    'plot': 'plot',
+}
+# 每个数据字调用一次的阶段只计时，不做内存统计
+LIGHT_STAGES = {'decode'}
+
+
+class StageStats:
+    """单个阶段的累计统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.mem_net = 0        # 阶段结束时相对开始时的内存增量 (字节)
+        self.mem_peak = 0       # 阶段内相对开始时的最大内存增量 (字节)
+
+
+class StageProfiler:
+    """分阶段计时 + cProfile + tracemalloc + 调用栈采样"""
+
+    def __init__(self, output_dir=os.path.join('tdc_results', 'profile'),
+                 use_cprofile=True, use_tracemalloc=True, sample_interval=0.001):
+        """
+        Args:
+            output_dir: 报告输出目录
+            use_cprofile: 是否在最外层阶段内启用 cProfile
+            use_tracemalloc: 是否统计内存
+            sample_interval: 调用栈采样间隔 (秒)，0 表示不采样
+        """
+        self.output_dir = output_dir
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.sample_interval = sample_interval
+
+        self.stats = defaultdict(StageStats)
+        self.profiles = {}
+        self.samples = Counter()
+        self._stack = []
+        self._patched = []
+        self._sampler = None
+        self._running = False
+        self._main_thread = threading.main_thread().ident
+        self.start_time = None
+
+    # ------------------------------------------------------------------
+    # 阶段
+    # ------------------------------------------------------------------
+    @contextmanager
+    def stage(self, name):
+        """计时一个阶段，可嵌套"""
+        stats = self.stats[name]
+        outermost = not self._stack
+        light = name in LIGHT_STAGES
+        self._stack.append(name)
+
+        profile = None
+        if outermost and self.use_cprofile:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+        track_mem = self.use_tracemalloc and not light and tracemalloc.is_tracing()
+        if track_mem:
+            mem_start, _ = tracemalloc.get_traced_memory()
+            if outermost:
+                tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            if track_mem:
+                mem_end, mem_peak = tracemalloc.get_traced_memory()
+                stats.mem_net += mem_end - mem_start
+                # 嵌套阶段无法单独重置峰值，其峰值为包含外层阶段的上界
+                stats.mem_peak = max(stats.mem_peak, mem_peak - mem_start)
+            self._stack.pop()
+
+    def wrap(self, func, name):
+        """返回在阶段内执行 func 的包装函数"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def instrument(self, cls, methods):
+        """
+        包装类的方法
+
+        Args:
+            cls: 类 (如 TDCScanner)
+            methods: {方法名: 阶段名}
+        """
+        for attr, name in methods.items():
+            original = cls.__dict__.get(attr)
+            if original is None:
+                continue
+            if isinstance(original, staticmethod):
+                wrapped = staticmethod(self.wrap(original.__func__, name))
+            else:
+                wrapped = self.wrap(original, name)
+            setattr(cls, attr, wrapped)
+            self._patched.append((cls, attr, original))
+
+    def instrument_scan_tool(self, scanner_cls=None, processor_cls=None):
+        """
+        包装扫描程序的各个阶段
+
+        tdc_scan.py 作为脚本运行时其类位于 __main__ 模块，需由调用方传入
+        """
+        if scanner_cls is None or processor_cls is None:
+            from tdc_scan import TDCScanner, TDCDataProcessor
+            scanner_cls = scanner_cls or TDCScanner
+            processor_cls = processor_cls or TDCDataProcessor
+        self.instrument(scanner_cls, SCANNER_STAGES)
+        self.instrument(processor_cls, PROCESSOR_STAGES)
+
+    def uninstrument(self):
+        for cls, attr, original in reversed(self._patched):
+            setattr(cls, attr, original)
+        self._patched = []
+
+    # ------------------------------------------------------------------
+    # 调用栈采样
+    # ------------------------------------------------------------------
+    def _sample_loop(self):
+        while self._running:
+            time.sleep(self.sample_interval)
+            frame = sys._current_frames().get(self._main_thread)
+            if frame is None or not self._stack:
+                continue
+            funcs = []
+            while frame is not None:
+                code = frame.f_code
+                funcs.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            funcs.reverse()
+            self.samples[';'.join(['[' + s + ']' for s in self._stack] + funcs)] += 1
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.sample_interval:
+            self._running = True
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        self._running = False
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        self.uninstrument()
+
+    # ------------------------------------------------------------------
+    # 报告
+    # ------------------------------------------------------------------
+    def format_report(self, top=15):
+        """生成文本报告"""
+        total_time = time.perf_counter() - self.start_time if self.start_time else 0.0
+        out = io.StringIO()
+        out.write("TDC 分阶段性能剖析报告\n")
+        out.write(f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        out.write(f"运行总时长: {total_time:.3f} s\n\n")
+
+        out.write(f"{'阶段':<26}{'调用':>8}{'总耗时(s)':>12}{'平均(ms)':>12}{'最大(ms)':>12}"
+                  f"{'占比':>8}{'内存增量(KB)':>14}{'内存峰值(KB)':>14}\n")
+        for name, s in sorted(self.stats.items(), key=lambda kv: -kv[1].total):
+            share = s.total / total_time * 100 if total_time else 0.0
+            mem = (f"{s.mem_net/1024:>14.1f}{s.mem_peak/1024:>14.1f}"
+                   if name not in LIGHT_STAGES else f"{'-':>14}{'-':>14}")
+            out.write(f"{name:<26}{s.calls:>8}{s.total:>12.4f}{s.total/s.calls*1000:>12.3f}"
+                      f"{s.max*1000:>12.3f}{share:>7.1f}%{mem}\n")
+        out.write("(嵌套阶段的耗时同时计入外层阶段)\n")
+
+        for name, profile in self.profiles.items():
+            stream = io.StringIO()
+            stats = pstats.Stats(profile, stream=stream)
+            if stats.total_calls == 0:
+                continue
+            stats.sort_stats('cumulative').print_stats(top)
+            out.write(f"\n{'='*70}\n阶段 {name}: 累计耗时最多的函数\n{'='*70}\n")
+            out.write(stream.getvalue())
+        return out.getvalue()
+
+    def collapsed_stacks(self):
+        """折叠调用栈文本 (每行: 栈;帧 采样数)"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def write_report(self, prefix=None):
+        """
+        写出报告文件
+
+        Returns:
+            dict: 各输出文件路径
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = prefix or f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        base = os.path.join(self.output_dir, prefix)
+        paths = {'report': base + '.txt', 'collapsed': base + '.collapsed'}
+
+        with open(paths['report'], 'w', encoding='utf-8') as f:
+            f.write(self.format_report())
+        with open(paths['collapsed'], 'w', encoding='utf-8') as f:
+            f.write(self.collapsed_stacks())
+
+        profiles = [p for p in self.profiles.values() if pstats.Stats(p).total_calls]
+        if profiles:
+            paths['prof'] = base + '.prof'
+            merged = pstats.Stats(profiles[0])
+            for p in profiles[1:]:
+                merged.add(p)
+            merged.dump_stats(paths['prof'])
+
+        print(f"[INFO] 性能剖析报告已保存到: {paths['report']}")
+        print(f"[INFO] 折叠调用栈 (flamegraph): {paths['collapsed']}")
+        return paths
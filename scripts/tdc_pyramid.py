@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 长时间采集的多分辨率摘要存储 (金字塔)
+与原始数据文件并存，采集过程中逐批增量更新:
+  level_00.bin ... level_NN.bin  第 k 层每个时间桶宽 base × factor^k 秒，
+                                 每个通道记录 count / min / max / sum / sumsq (fine time)，
+                                 事件率 = count / 桶宽
+  phase_00.bin ...               phase_level 及以上各层，每个桶额外记录每个 (通道, 相位) 的
+                                 count / sum / sumsq，用于任意时间段的逐相位均值与噪声
+  pyramid.json                   元数据 (起始时间、桶宽、层数、通道)
+
+空桶不写入 (每条记录带桶序号)。查询任意时间范围时选择桶数不超过像素数的最细层，
+只读取 O(像素数) 条摘要记录，不需要重新扫描原始数据。
+
+用法:
+  python tdc_pyramid.py info tdc_results/tdc_stream_xxx.pyr
+  python tdc_pyramid.py plot tdc_results/tdc_stream_xxx.pyr [--start 0] [--end 3600] [-o out.png]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+CHANNEL_NAMES = ['UP', 'DOWN']     # 数据类型 0b00 / 0b01
+N_PHASES = 256
+
+
+def level_dtype(n_channels):
+    return np.dtype([
+        ('bin', '<i8'),
+        ('t_first', '<f8'),
+        ('t_last', '<f8'),
+        ('count', '<i8', (n_channels,)),
+        ('min', '<f4', (n_channels,)),
+        ('max', '<f4', (n_channels,)),
+        ('sum', '<f8', (n_channels,)),
+        ('sumsq', '<f8', (n_channels,)),
+    ])
+
+
+def phase_dtype(n_channels):
+    return np.dtype([
+        ('bin', '<i8'),
+        ('count', '<u4', (n_channels, N_PHASES)),
+        ('sum', '<f8', (n_channels, N_PHASES)),
+        ('sumsq', '<f8', (n_channels, N_PHASES)),
+    ])
+
+
+class SummaryPyramid:
+    """多分辨率摘要存储"""
+
+    VERSION = 1
+
+    def __init__(self, directory, base_seconds=1.0, factor=4, n_levels=10, phase_level=3,
+                 t0=None, mode='w'):
+        """
+        Args:
+            directory: 存储目录 (通常为 <原始文件名>.pyr)
+            base_seconds: 第 0 层桶宽 (秒)
+            factor: 相邻两层桶宽之比
+            n_levels: 层数
+            phase_level: 从该层起记录逐相位统计
+            t0: 时间原点 (默认为第一批数据的时间)
+            mode: 'w' = 新建并写入, 'r' = 只读 (参数从 pyramid.json 读取)
+        """
+        self.directory = directory
+        self.mode = mode
+        if mode == 'r':
+            with open(os.path.join(directory, 'pyramid.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != self.VERSION:
+                raise ValueError(f"不支持的摘要版本: {meta.get('version')}")
+            base_seconds = meta['base_seconds']
+            factor = meta['factor']
+            n_levels = meta['n_levels']
+            phase_level = meta['phase_level']
+            t0 = meta['t0']
+            self.channels = meta['channels']
+            records = meta.get('records', 0)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.channels = list(CHANNEL_NAMES)
+            records = 0
+
+        self.base_seconds = base_seconds
+        self.factor = factor
+        self.n_levels = n_levels
+        self.phase_level = phase_level
+        self.t0 = t0
+        self.records = records
+
+        n_channels = len(self.channels)
+        self.level_dtype = level_dtype(n_channels)
+        self.phase_dtype = phase_dtype(n_channels)
+        self._open_bins = [None] * n_levels
+        self._open_phase = [None] * n_levels
+        self._files = {}
+        if mode == 'w':
+            self._write_meta()
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def width(self, level):
+        """第 level 层桶宽 (秒)"""
+        return self.base_seconds * self.factor ** level
+
+    def _path(self, kind, level):
+        return os.path.join(self.directory, f"{kind}_{level:02d}.bin")
+
+    def _write_meta(self):
+        meta = {
+            'version': self.VERSION,
+            'base_seconds': self.base_seconds,
+            'factor': self.factor,
+            'n_levels': self.n_levels,
+            'phase_level': self.phase_level,
+            't0': self.t0,
+            'channels': self.channels,
+            'records': self.records,
+        }
+        tmp = os.path.join(self.directory, 'pyramid.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, os.path.join(self.directory, 'pyramid.json'))
+
+    def _emit(self, kind, level, record):
+        key = (kind, level)
+        f = self._files.get(key)
+        if f is None:
+            f = self._files[key] = open(self._path(kind, level), 'ab')
+        f.write(record.tobytes())
+
+    def add(self, data_list, t=None):
+        """
+        累加一批数据 (receive_data 格式)
+
+        Args:
+            data_list: 数据列表
+            t: 这批数据的采集时间 (默认当前时间)
+        """
+        if self.mode != 'w':
+            raise RuntimeError("摘要存储以只读方式打开")
+        if not data_list:
+            return
+        t = time.time() if t is None else t
+        if self.t0 is None:
+            self.t0 = t
+            self._write_meta()
+
+        n = len(data_list)
+        n_channels = len(self.channels)
+        types = np.fromiter((d['type'] for d in data_list), dtype=np.int64, count=n)
+        ids = np.fromiter((d['id'] for d in data_list), dtype=np.int64, count=n)
+        fine = np.fromiter((d['fine'] for d in data_list), dtype=np.float64, count=n)
+        keep = types < n_channels
+        types, ids, fine = types[keep], ids[keep], fine[keep]
+        self.records += len(fine)
+
+        # 本批的各通道统计 (一次计算，合并到每一层的当前桶)
+        batch = np.zeros((), dtype=self.level_dtype)
+        batch['t_first'] = batch['t_last'] = t
+        batch['count'] = np.bincount(types, minlength=n_channels)
+        batch['sum'] = np.bincount(types, weights=fine, minlength=n_channels)
+        batch['sumsq'] = np.bincount(types, weights=fine * fine, minlength=n_channels)
+        lo = np.full(n_channels, np.inf)
+        hi = np.full(n_channels, -np.inf)
+        np.minimum.at(lo, types, fine)
+        np.maximum.at(hi, types, fine)
+        batch['min'] = lo
+        batch['max'] = hi
+
+        phase = None
+        if self.phase_level < self.n_levels:
+            key = types * N_PHASES + ids
+            size = n_channels * N_PHASES
+            shape = (n_channels, N_PHASES)
+            phase = np.zeros((), dtype=self.phase_dtype)
+            phase['count'] = np.bincount(key, minlength=size).reshape(shape)
+            phase['sum'] = np.bincount(key, weights=fine, minlength=size).reshape(shape)
+            phase['sumsq'] = np.bincount(key, weights=fine * fine, minlength=size).reshape(shape)
+
+        for level in range(self.n_levels):
+            b = int((t - self.t0) // self.width(level))
+            current = self._open_bins[level]
+            if current is not None and current['bin'] != b:
+                self._emit('level', level, current)
+                if self._open_phase[level] is not None:
+                    self._emit('phase', level, self._open_phase[level])
+                current = None
+            if current is None:
+                current = batch.copy()
+                current['bin'] = b
+                self._open_bins[level] = current
+                if phase is not None and level >= self.phase_level:
+                    self._open_phase[level] = phase.copy()
+                    self._open_phase[level]['bin'] = b
+                else:
+                    self._open_phase[level] = None
+                continue
+
+            current['t_last'] = t
+            current['count'] += batch['count']
+            current['sum'] += batch['sum']
+            current['sumsq'] += batch['sumsq']
+            current['min'] = np.minimum(current['min'], batch['min'])
+            current['max'] = np.maximum(current['max'], batch['max'])
+            open_phase = self._open_phase[level]
+            if open_phase is not None:
+                open_phase['count'] += phase['count']
+                open_phase['sum'] += phase['sum']
+                open_phase['sumsq'] += phase['sumsq']
+
+    def flush(self):
+        """把已关闭的桶刷到磁盘 (当前桶仍在内存中)"""
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        """写出所有当前桶并关闭文件"""
+        if self.mode == 'w':
+            for level in range(self.n_levels):
+                if self._open_bins[level] is not None:
+                    self._emit('level', level, self._open_bins[level])
+                if self._open_phase[level] is not None:
+                    self._emit('phase', level, self._open_phase[level])
+            self._open_bins = [None] * self.n_levels
+            self._open_phase = [None] * self.n_levels
+            self._write_meta()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    def _load(self, kind, level, b_start, b_end):
+        """读取 [b_start, b_end] 范围内的记录 (内存映射 + 二分查找)"""
+        dtype = self.level_dtype if kind == 'level' else self.phase_dtype
+        path = self._path(kind, level)
+        if (kind, level) in self._files:
+            self._files[(kind, level)].flush()
+        parts = []
+        if os.path.exists(path) and os.path.getsize(path) >= dtype.itemsize:
+            data = np.memmap(path, dtype=dtype, mode='r',
+                             shape=(os.path.getsize(path) // dtype.itemsize,))
+            lo, hi = np.searchsorted(data['bin'], [b_start, b_end + 1])
+            parts.append(np.array(data[lo:hi]))
+        # 写入方还可以看到尚未关闭的当前桶
+        open_rec = (self._open_bins if kind == 'level' else self._open_phase)[level]
+        if open_rec is not None and b_start <= open_rec['bin'] <= b_end:
+            parts.append(open_rec.reshape(1))
+        if not parts:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate(parts)
+
+    def choose_level(self, span, max_points, min_level=0):
+        """桶数不超过 max_points 的最细一层"""
+        for level in range(min_level, self.n_levels):
+            if span / self.width(level) <= max_points:
+                return level
+        return self.n_levels - 1
+
+    def query(self, t_start=None, t_end=None, max_points=1000):
+        """
+        查询时间范围内的摘要序列
+
+        Args:
+            t_start/t_end: 相对 t0 的时间 (秒)，None 表示不限
+            max_points: 最多返回的桶数 (约等于绘图的像素宽度)
+
+        Returns:
+            dict: level / width / time (桶中心, 秒) 以及各通道的
+                  count / rate / mean / std / min / max，形状 (n_channels, n_bins)
+        """
+        if self.t0 is None:
+            return None
+        t_start = 0.0 if t_start is None else t_start
+        if t_end is None:
+            t_end = self._last_time()
+        level = self.choose_level(max(t_end - t_start, self.base_seconds), max_points)
+        width = self.width(level)
+        rec = self._load('level', level, int(t_start // width), int(t_end // width))
+
+        count = rec['count'].T.astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = rec['sum'].T / count
+            std = np.sqrt(np.maximum(rec['sumsq'].T / count - mean ** 2, 0))
+        empty = count == 0
+        return {
+            'level': level,
+            'width': width,
+            'time': (rec['bin'] + 0.5) * width,
+            'count': count,
+            'rate': count / width,
+            'mean': mean,
+            'std': std,
+            'min': np.where(empty, np.nan, rec['min'].T),
+            'max': np.where(empty, np.nan, rec['max'].T),
+        }
+
+    def phase_profile(self, t_start=None, t_end=None, max_bins=1000):
+        """
+        时间范围内每个 (通道, 相位) 的统计
+
+        Returns:
+            dict: count / mean / std，形状 (n_channels, 256)；level 为使用的层
+        """
+        if self.t0 is None or self.phase_level >= self.n_levels:
+            return None
+        t_start = 0.0 if t_start is None else t_start
+        if t_end is None:
+            t_end = self._last_time()
+        level = self.choose_level(max(t_end - t_start, self.base_seconds), max_bins,
+                                  min_level=self.phase_level)
+        width = self.width(level)
+        rec = self._load('phase', level, int(t_start // width), int(t_end // width))
+
+        count = rec['count'].sum(axis=0).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = rec['sum'].sum(axis=0) / count
+            std = np.sqrt(np.maximum(rec['sumsq'].sum(axis=0) / count - mean ** 2, 0))
+        return {'level': level, 'count': count, 'mean': mean, 'std': std}
+
+    def _last_time(self):
+        """已记录数据的最后时间 (相对 t0)"""
+        top = self.n_levels - 1
+        rec = self._load('level', top, 0, np.iinfo(np.int64).max - 1)
+        if len(rec) == 0:
+            return 0.0
+        return float(rec['t_last'].max() - self.t0)
+
+    def describe(self):
+        lines = [f"摘要存储: {self.directory}",
+                 f"  起始时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.t0))}"
+                 if self.t0 else "  (无数据)",
+                 f"  时长: {self._last_time():.1f} s, 通道: {', '.join(self.channels)}"]
+        for level in range(self.n_levels):
+            sizes = []
+            for kind, dtype in (('level', self.level_dtype), ('phase', self.phase_dtype)):
+                path = self._path(kind, level)
+                if os.path.exists(path):
+                    sizes.append(f"{kind} {os.path.getsize(path) // dtype.itemsize} 桶")
+            if sizes:
+                lines.append(f"  第 {level} 层 (桶宽 {self.width(level):g} s): {', '.join(sizes)}")
+        return "\n".join(lines)
+
+
+def plot_range(pyramid, t_start=None, t_end=None, pixels=1000, save_file=None):
+    """绘制时间范围内各通道的 fine time 范围/均值、事件率和逐相位均值"""
+    import matplotlib.pyplot as plt
+
+    summary = pyramid.query(t_start, t_end, max_points=pixels)
+    if summary is None or len(summary['time']) == 0:
+        print("[WARN] 该时间范围内没有数据")
+        return
+    profile = pyramid.phase_profile(t_start, t_end)
+
+    fig, axes = plt.subplots(3, 1, figsize=(14, 12))
+    fig.suptitle(f"TDC 长时间趋势 (第 {summary['level']} 层, 桶宽 {summary['width']:g} s)",
+                 fontsize=14, fontweight='bold')
+    for i, name in enumerate(pyramid.channels):
+        color = f"C{i}"
+        axes[0].fill_between(summary['time'], summary['min'][i], summary['max'][i],
+                             color=color, alpha=0.2, step='mid')
+        axes[0].plot(summary['time'], summary['mean'][i], color=color, linewidth=1, label=name)
+        axes[1].plot(summary['time'], summary['rate'][i], color=color, linewidth=1, label=name)
+        if profile is not None:
+            axes[2].plot(np.arange(N_PHASES), profile['mean'][i], '.-', color=color,
+                         markersize=2, linewidth=1, label=name)
+
+    axes[0].set_xlabel('时间 (s)')
+    axes[0].set_ylabel('Fine Time (ps)')
+    axes[0].set_title('Fine Time 均值与范围')
+    axes[1].set_xlabel('时间 (s)')
+    axes[1].set_ylabel('事件率 (1/s)')
+    axes[1].set_title('事件率')
+    axes[2].set_xlabel('相位索引 (Phase ID)')
+    axes[2].set_ylabel('Fine Time 均值 (ps)')
+    axes[2].set_title('该时间段内逐相位均值')
+    for ax in axes:
+        ax.legend()
+        ax.grid(True, alpha=0.3)
+    plt.tight_layout()
+
+    if save_file:
+        plt.savefig(save_file, dpi=150, bbox_inches='tight')
+        print(f"[INFO] 图表已保存到: {save_file}")
+    else:
+        plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 多分辨率摘要存储")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('info', help="显示摘要存储信息")
+    p.add_argument('directory')
+    p = sub.add_parser('plot', help="绘制时间范围")
+    p.add_argument('directory')
+    p.add_argument('--start', type=float, default=None, help="起始时间 (秒，相对开始)")
+    p.add_argument('--end', type=float, default=None, help="结束时间 (秒，相对开始)")
+    p.add_argument('--pixels', type=int, default=1000, help="时间方向的点数")
+    p.add_argument('-o', '--output', default=None, help="保存图片路径")
+    args = parser.parse_args()
+
+    pyramid = SummaryPyramid(args.directory, mode='r')
+    if args.command == 'info':
+        print(pyramid.describe())
+    else:
+        plot_range(pyramid, args.start, args.end, args.pixels, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
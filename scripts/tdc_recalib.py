@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 漂移监测与自动重新校准
+长时间采集时以参考相位的平均 fine time 作为漂移指标 (每个通道独立):
+  - 被动监测: 扫描数据中落在参考相位的测量值直接计入，不额外占用采集时间
+  - 主动探测: 一段时间内没有参考相位数据时，在批次间隙发送少量单步命令
+漂移超过阈值时，在两批扫描之间触发校准，并记录校准造成的死时间。
+"""
+
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+
+class DriftMonitor:
+    """单通道参考相位漂移指标"""
+
+    def __init__(self, window=32, clk_period=3864):
+        """
+        Args:
+            window: 计算当前水平所用的最近测量值个数
+            clk_period: 时钟周期 (ps)
+        """
+        self.window = window
+        self.CLK_PERIOD = clk_period
+        self.recent = deque(maxlen=window)
+        self.baseline = None
+        self.last_update = None
+
+    def reset(self):
+        """校准后重新建立基线"""
+        self.recent.clear()
+        self.baseline = None
+
+    def _circular_mean(self, values):
+        # 以第一个值为参考展开，避免均值跨越 0/周期 环绕
+        values = np.asarray(values, dtype=float)
+        ref = values[0]
+        offset = (values - ref + self.CLK_PERIOD / 2) % self.CLK_PERIOD - self.CLK_PERIOD / 2
+        return (ref + offset.mean()) % self.CLK_PERIOD
+
+    def add(self, fine_values):
+        """加入一批参考相位的 fine time"""
+        if len(fine_values) == 0:
+            return
+        self.recent.extend(fine_values)
+        self.last_update = time.time()
+        if self.baseline is None and len(self.recent) >= self.window:
+            self.baseline = self._circular_mean(self.recent)
+
+    def level(self):
+        """当前水平 (ps)，数据不足时为 None"""
+        if len(self.recent) == 0:
+            return None
+        return self._circular_mean(self.recent)
+
+    def drift(self):
+        """相对基线的漂移 (ps)，基线未建立时为 None"""
+        if self.baseline is None or len(self.recent) < self.window:
+            return None
+        diff = self.level() - self.baseline
+        return float((diff + self.CLK_PERIOD / 2) % self.CLK_PERIOD - self.CLK_PERIOD / 2)
+
+    def noise(self):
+        """当前窗口均值的标准误差 (ps)"""
+        if len(self.recent) < 2:
+            return None
+        values = np.asarray(self.recent, dtype=float)
+        ref = values[0]
+        offset = (values - ref + self.CLK_PERIOD / 2) % self.CLK_PERIOD - self.CLK_PERIOD / 2
+        return float(offset.std(ddof=1) / np.sqrt(len(values)))
+
+
+class RecalibrationScheduler:
+    """按漂移触发的校准调度器 (在扫描批次之间调用)"""
+
+    CHANNEL_NAMES = {0b00: 'UP', 0b01: 'DOWN'}
+
+    def __init__(self, scanner, ref_phase=100, channel=0b11, threshold_ps=10.0,
+                 window=32, check_interval=60.0, min_interval=300.0,
+                 probe_repeats=8, settle=1.0, clk_period=3864):
+        """
+        Args:
+            scanner: 已连接的 TDCScanner
+            ref_phase: 参考相位
+            channel: 监测的通道 (0b01=DOWN, 0b10=UP, 0b11=BOTH)
+            threshold_ps: 触发校准的漂移阈值 (ps)
+            window: 漂移指标的平均测量值个数
+            check_interval: 超过该时间 (秒) 无参考相位数据时主动探测
+            min_interval: 两次校准之间的最短间隔 (秒)
+            probe_repeats: 每次主动探测的单步命令数
+            settle: 发送校准命令后等待校准完成的时间 (秒，仅用于不上报 INFO 的旧固件)
+            clk_period: 时钟周期 (ps)
+        """
+        self.scanner = scanner
+        self.ref_phase = ref_phase
+        self.channel = channel
+        self.threshold_ps = threshold_ps
+        self.window = window
+        self.check_interval = check_interval
+        self.min_interval = min_interval
+        self.probe_repeats = probe_repeats
+        self.settle = settle
+        self.CLK_PERIOD = clk_period
+
+        self.monitors = {t: DriftMonitor(window, clk_period) for t in self._active_types()}
+        self.last_calibration = time.time()
+        self.calibrations = 0
+        self.dead_time = 0.0        # 校准造成的死时间 (秒)
+        self.probe_time = 0.0       # 主动探测占用的时间 (秒)
+        self.events = []
+
+    def _active_types(self):
+        return [t for t, bit in ((0b00, 0b10), (0b01, 0b01)) if self.channel & bit]
+
+    # ------------------------------------------------------------------
+    # 漂移指标
+    # ------------------------------------------------------------------
+    def observe(self, data_list):
+        """
+        从扫描数据中提取参考相位的测量值 (被动监测)
+
+        Args:
+            data_list: receive_data 格式的数据列表
+        """
+        for t, monitor in self.monitors.items():
+            monitor.add([d['fine'] for d in data_list
+                         if d['type'] == t and d['id'] == self.ref_phase])
+
+    def probe(self, repeats=None, _in_calibration=False):
+        """在参考相位发送单步命令测量漂移指标 (主动探测)"""
+        repeats = repeats or self.probe_repeats
+        expected = 2 if self.channel == 0b11 else 1
+        start = time.time()
+        data = []
+        for _ in range(repeats):
+            if not self.scanner.start_scan(scan_mode=self.scanner.SCAN_SINGLE,
+                                           phase=self.ref_phase, channel=self.channel):
+                break
+            data.extend(self.scanner.receive_data(expected_count=expected, timeout=2.0))
+        self.observe(data)
+        if not _in_calibration:
+            # 校准后重建基线的探测计入校准死时间
+            elapsed = time.time() - start
+            self.probe_time += elapsed
+            self._log('probe', elapsed)
+        return data
+
+    def drifts(self):
+        """每个通道当前的漂移 (ps)，未知时为 None"""
+        return {self.CHANNEL_NAMES[t]: m.drift() for t, m in self.monitors.items()}
+
+    def _stale(self):
+        now = time.time()
+        return any(m.last_update is None or now - m.last_update > self.check_interval
+                   for m in self.monitors.values())
+
+    def _exceeded(self):
+        """是否有通道的漂移超过阈值 (且明显大于自身噪声)"""
+        for monitor in self.monitors.values():
+            drift = monitor.drift()
+            if drift is None:
+                continue
+            noise = monitor.noise() or 0.0
+            if abs(drift) > max(self.threshold_ps, 3 * noise):
+                return True
+        return False
+
+    # ------------------------------------------------------------------
+    # 调度
+    # ------------------------------------------------------------------
+    def calibrate(self, reason='drift'):
+        """执行校准并重新建立基线，返回本次死时间 (秒)"""
+        drifts = self.drifts()
+        start = time.time()
+        print(f"[CMD] 自动校准 ({reason}): 漂移 " +
+              ", ".join(f"{k}={v:+.1f}ps" for k, v in drifts.items() if v is not None))
+        self.scanner.start_calibration(wait=True)
+        if not self.scanner.device_state.seen:
+            time.sleep(self.settle)
+        for monitor in self.monitors.values():
+            monitor.reset()
+        # 重建基线: 基线未建立前不会再次触发
+        while any(m.baseline is None for m in self.monitors.values()):
+            before = sum(len(m.recent) for m in self.monitors.values())
+            self.probe(self.window, _in_calibration=True)
+            if sum(len(m.recent) for m in self.monitors.values()) == before:
+                print("[WARN] 校准后参考相位无数据，基线未建立")
+                break
+        elapsed = time.time() - start
+        self.dead_time += elapsed
+        self.calibrations += 1
+        self.last_calibration = time.time()
+        self._log('calibration', elapsed, drifts)
+        return elapsed
+
+    def between_batches(self, batch=None):
+        """
+        在两批扫描之间调用: 更新漂移指标，必要时探测或校准
+
+        Args:
+            batch: 刚完成的一批扫描数据 (可选)
+
+        Returns:
+            bool: 本次是否执行了校准
+        """
+        if batch:
+            self.observe(batch)
+        if self._stale():
+            self.probe()
+        if self._exceeded() and time.time() - self.last_calibration >= self.min_interval:
+            self.calibrate()
+            return True
+        return False
+
+    def _log(self, kind, duration, drifts=None):
+        self.events.append({
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'kind': kind,
+            'duration': duration,
+            'drift_ps': drifts if drifts is not None else self.drifts(),
+        })
+
+    def summary(self, total_time=None):
+        """打印并返回校准统计"""
+        print("\n" + "="*70)
+        print("漂移监测与自动校准")
+        print("="*70)
+        print(f"  参考相位: {self.ref_phase}, 阈值: {self.threshold_ps} ps")
+        print(f"  校准次数: {self.calibrations}")
+        print(f"  校准死时间: {self.dead_time:.1f} s")
+        print(f"  探测占用时间: {self.probe_time:.1f} s")
+        if total_time:
+            print(f"  死时间占比: {(self.dead_time + self.probe_time) / total_time * 100:.2f}%")
+        for name, drift in self.drifts().items():
+            text = f"{drift:+.2f} ps" if drift is not None else "未知"
+            print(f"  当前漂移 {name}: {text}")
+        print("="*70 + "\n")
+        return {
+            'calibrations': self.calibrations,
+            'dead_time': self.dead_time,
+            'probe_time': self.probe_time,
+            'events': self.events,
+        }
+
+    def save_log(self, filepath):
+        """将校准/探测事件写入文本文件"""
+        with open(filepath, 'w') as f:
+            f.write("# TDC 漂移监测日志\n")
+            f.write(f"# 参考相位: {self.ref_phase}, 阈值: {self.threshold_ps} ps\n")
+            f.write("# Time, Kind, Duration(s), Drift\n")
+            for e in self.events:
+                drift = ';'.join(f"{k}={v:.2f}" for k, v in e['drift_ps'].items() if v is not None)
+                f.write(f"{e['time']},{e['kind']},{e['duration']:.3f},{drift}\n")
+        print(f"[INFO] 漂移日志已保存到: {filepath}")
+        return filepath
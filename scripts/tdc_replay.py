@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 原始 TCP 字节流录制与回放
+录制: 记录从板卡收到的每一块字节 (保留 recv 的分块边界) 及到达时间，
+      同时记录发出的命令，写入 .tdcraw 文件
+回放: 在本地端口模拟板卡，把录制的数据按原速、缩放速度或最快速度发给 TDCScanner，
+      可复现现场问题 (突发、半包、CMD 回显)，也可用于测量客户端吞吐量和延迟
+
+文件格式 (小端):
+  头部: b'TDCRAW' + uint16 版本 + uint32 元数据长度 + JSON 元数据
+  记录: uint8 方向 (0=接收, 1=发送) + float64 时间 (秒, 相对录制开始) + uint32 长度 + 数据
+
+用法:
+  python tdc_scan.py --record session.tdcraw                 录制一次交互会话
+  python tdc_replay.py info session.tdcraw                   查看录制内容
+  python tdc_replay.py serve session.tdcraw [--speed 2]      启动模拟板卡
+  python tdc_scan.py --host 127.0.0.1 --port <端口>          连接模拟板卡
+  python tdc_replay.py bench session.tdcraw                  最快速度回放并测量客户端性能
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from tdc_stream_parser import WordStreamParser
+
+
+RX, TX = 0, 1
+
+_MAGIC = b'TDCRAW'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<6sHI')
+_RECORD_HEADER = struct.Struct('<BdI')
+
+
+# ----------------------------------------------------------------------
+# 录制
+# ----------------------------------------------------------------------
+class StreamRecorder:
+    """把 socket 收发的字节流写入录制文件"""
+
+    def __init__(self, filepath, **metadata):
+        """
+        Args:
+            filepath: 录制文件路径
+            metadata: 写入文件头的附加信息 (如 host/port)
+        """
+        self.filepath = filepath
+        self.file = open(filepath, 'wb')
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+
+        metadata.setdefault('created', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        meta = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        self.file.write(_FILE_HEADER.pack(_MAGIC, _VERSION, len(meta)) + meta)
+
+    def log(self, direction, data):
+        if not data:
+            return
+        t = time.perf_counter() - self.start
+        with self.lock:
+            self.file.write(_RECORD_HEADER.pack(direction, t, len(data)))
+            self.file.write(data)
+            if direction == RX:
+                self.rx_bytes += len(data)
+            else:
+                self.tx_bytes += len(data)
+
+    def wrap(self, sock):
+        """返回记录收发数据的 socket 包装"""
+        return RecordingSocket(sock, self)
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                print(f"[INFO] 录制完成: 接收 {self.rx_bytes} 字节, 发送 {self.tx_bytes} 字节 "
+                      f"-> {self.filepath}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordingSocket:
+    """socket 代理: 收发的数据同时交给 StreamRecorder"""
+
+    def __init__(self, sock, recorder):
+        self._sock = sock
+        self._recorder = recorder
+
+    def recv(self, bufsize, *args):
+        data = self._sock.recv(bufsize, *args)
+        self._recorder.log(RX, data)
+        return data
+
+    def recv_into(self, buffer, nbytes=0, *args):
+        n = self._sock.recv_into(buffer, nbytes, *args)
+        if n:
+            self._recorder.log(RX, bytes(memoryview(buffer)[:n]))
+        return n
+
+    def send(self, data, *args):
+        n = self._sock.send(data, *args)
+        self._recorder.log(TX, bytes(data[:n]))
+        return n
+
+    def sendall(self, data, *args):
+        self._sock.sendall(data, *args)
+        self._recorder.log(TX, bytes(data))
+
+    def __getattr__(self, name):
+        # settimeout / setblocking / shutdown / close 等直接转发
+        return getattr(self._sock, name)
+
+
+def load_capture(filepath):
+    """
+    读取录制文件
+
+    Returns:
+        tuple: (metadata, records)，records 为 [(方向, 时间, bytes), ...]
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    magic, version, meta_len = _FILE_HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError(f"{filepath} 不是 TDC 录制文件")
+    if version != _VERSION:
+        raise ValueError(f"不支持的录制文件版本: {version}")
+    offset = _FILE_HEADER.size
+    metadata = json.loads(data[offset:offset + meta_len].decode('utf-8'))
+    offset += meta_len
+
+    records = []
+    while offset + _RECORD_HEADER.size <= len(data):
+        direction, t, length = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        if offset + length > len(data):
+            # 录制中断导致的残缺记录
+            break
+        records.append((direction, t, data[offset:offset + length]))
+        offset += length
+    return metadata, records
+
+
+def count_words(records):
+    """
+    按客户端的解析方式统计录制的接收数据字
+
+    Returns:
+        tuple: (全部数据字数, UP/DOWN 测量数据字数)；CMD 回显和 INFO 不计入测量数据
+    """
+    parser = WordStreamParser()
+    words = []
+    for direction, _, data in records:
+        if direction == RX:
+            words.extend(parser.feed(data))
+    words.extend(parser.flush())
+    types = np.array(words, dtype=np.uint32) >> 30
+    return len(words), int(np.count_nonzero(types < 2))
+
+
+# ----------------------------------------------------------------------
+# 回放
+# ----------------------------------------------------------------------
+class ReplayServer:
+    """在本地端口模拟板卡，回放录制的接收数据"""
+
+    def __init__(self, filepath, speed=1.0, sync=True, host='127.0.0.1', port=0):
+        """
+        Args:
+            filepath: 录制文件
+            speed: 回放速度倍数 (1=原速, 2=两倍速)，0 或 None 表示最快速度
+            sync: 是否等待客户端发出与录制时相同字节数的命令后再发送对应的数据
+                  (关闭时忽略命令，仅按时间回放)
+            host/port: 监听地址 (port=0 自动分配)
+        """
+        self.metadata, self.records = load_capture(filepath)
+        self.speed = speed or None
+        self.sync = sync
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.host, self.port = self.server.getsockname()[:2]
+        # 每块接收数据发出的时刻 (perf_counter) 和累计字节数，用于计算延迟
+        self.sent_log = []
+        # 调用方可先 clear()，客户端就绪后再 set() 开始回放 (避免数据被连接时的清空缓冲区丢弃)
+        self.go = threading.Event()
+        self.go.set()
+        self._thread = None
+
+    def _schedule(self):
+        """
+        每块接收数据的发送条件
+
+        Returns:
+            list: [(录制时已发送的命令字节数, 相对上一事件的延迟, 数据), ...]
+        """
+        schedule = []
+        tx_bytes = 0
+        last_t = self.records[0][1] if self.records else 0.0
+        for direction, t, data in self.records:
+            if direction == TX:
+                tx_bytes += len(data)
+            else:
+                schedule.append((tx_bytes, max(0.0, t - last_t), data))
+            last_t = t
+        return schedule
+
+    def serve_once(self):
+        """接受一个客户端连接并回放全部数据"""
+        conn, _ = self.server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        received_tx = 0
+        total = 0
+        self.go.wait()
+        try:
+            for tx_needed, delay, data in self._schedule():
+                # 等待客户端发出录制时在此之前发出的命令
+                while self.sync and received_tx < tx_needed:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        return
+                    received_tx += len(chunk)
+                if self.speed is not None and delay > 0:
+                    time.sleep(delay / self.speed)
+                conn.sendall(data)
+                total += len(data)
+                self.sent_log.append((time.perf_counter(), total))
+            # 数据发完后保持连接，直到客户端关闭
+            conn.settimeout(1.0)
+            while True:
+                try:
+                    if not conn.recv(65536):
+                        break
+                except socket.timeout:
+                    continue
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def start(self):
+        """在后台线程中回放 (只服务一个连接)"""
+        self._thread = threading.Thread(target=self.serve_once, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def close(self):
+        self.server.close()
+
+
+# ----------------------------------------------------------------------
+# 基准测试
+# ----------------------------------------------------------------------
+def _default_client(scanner, expected_count):
+    return scanner.receive_data(expected_count=expected_count, timeout=30.0)
+
+
+def benchmark(filepath, speed=None, client=None, quiet=True):
+    """
+    回放录制数据并测量客户端的吞吐量与延迟
+
+    Args:
+        filepath: 录制文件
+        speed: 回放速度 (None = 最快)
+        client: 客户端函数 client(scanner, expected_count)，默认 TDCScanner.receive_data
+        quiet: 屏蔽客户端的打印输出
+
+    Returns:
+        dict: 吞吐量 (测量数据字/s)、延迟分位数 (ms)
+    """
+    from tdc_scan import TDCScanner
+
+    server = ReplayServer(filepath, speed=speed, sync=False)
+    # receive_data 只返回 UP/DOWN 数据，按此设置期望个数 (CMD 回显、INFO 不计入)
+    stream_words, words = count_words(server.records)
+    server.go.clear()
+    port = server.start()
+
+    scanner = TDCScanner('127.0.0.1', port)
+    # 客户端一侧同样记录每次 recv 完成的时刻
+    client_log = []
+
+    class _Clock:
+        total = 0
+
+        def log(self, direction, data):
+            if direction == RX:
+                self.total += len(data)
+                client_log.append((time.perf_counter(), self.total))
+
+    output = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        connected = scanner.connect()
+    if not connected:
+        server.close()
+        return None
+    scanner.sock = RecordingSocket(scanner.sock, _Clock())
+    server.go.set()
+
+    client = client or _default_client
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        result = client(scanner, words)
+    elapsed = time.perf_counter() - start
+    with contextlib.redirect_stdout(output):
+        scanner.disconnect()
+    server.close()
+
+    # 延迟: 每块数据发出到客户端读到该块末尾的时间
+    latencies = []
+    if client_log and server.sent_log:
+        recv_t = np.array([t for t, _ in client_log])
+        recv_total = np.array([n for _, n in client_log])
+        for sent_t, sent_total in server.sent_log:
+            i = np.searchsorted(recv_total, sent_total)
+            if i < len(recv_t):
+                latencies.append(recv_t[i] - sent_t)
+    latencies = np.array(latencies) * 1000
+
+    stats = {
+        'words': words,
+        'stream_words': stream_words,
+        'received': len(result) if result is not None else None,
+        'elapsed': elapsed,
+        'words_per_s': words / elapsed if elapsed > 0 else float('inf'),
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        'latency_max_ms': float(latencies.max()) if len(latencies) else None,
+    }
+    return stats
+
+
+def _print_info(filepath):
+    metadata, records = load_capture(filepath)
+    rx = [r for r in records if r[0] == RX]
+    tx = [r for r in records if r[0] == TX]
+    rx_bytes = sum(len(r[2]) for r in rx)
+    duration = records[-1][1] - records[0][1] if records else 0.0
+    sizes = np.array([len(r[2]) for r in rx]) if rx else np.zeros(1)
+    stream_words, data_words = count_words(records)
+
+    print(f"录制文件: {filepath}")
+    for key, value in metadata.items():
+        print(f"  {key}: {value}")
+    print(f"  时长: {duration:.3f} s")
+    print(f"  接收: {len(rx)} 块, {rx_bytes} 字节 ({stream_words} 个数据字, "
+          f"其中测量数据 {data_words} 个)")
+    print(f"  发送: {len(tx)} 块, {sum(len(r[2]) for r in tx)} 字节")
+    print(f"  接收块大小: 最小 {sizes.min()}, 中位 {int(np.median(sizes))}, 最大 {sizes.max()} 字节")
+    print(f"  非4字节对齐的块: {int(np.count_nonzero(sizes % 4))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 字节流录制回放")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('info', help="查看录制文件")
+    p.add_argument('capture')
+
+    p = sub.add_parser('serve', help="模拟板卡回放")
+    p.add_argument('capture')
+    p.add_argument('--port', type=int, default=1024)
+    p.add_argument('--speed', type=float, default=1.0, help="回放速度倍数，0=最快")
+    p.add_argument('--no-sync', action='store_true', help="不等待客户端命令")
+    p.add_argument('--loop', action='store_true', help="每个连接结束后重新回放")
+
+    p = sub.add_parser('bench', help="最快速度回放并测量客户端性能")
+    p.add_argument('capture')
+    p.add_argument('--speed', type=float, default=0.0, help="回放速度倍数，0=最快")
+    p.add_argument('--repeat', type=int, default=3)
+
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        _print_info(args.capture)
+
+    elif args.command == 'serve':
+        server = ReplayServer(args.capture, speed=args.speed, sync=not args.no_sync,
+                              host='0.0.0.0', port=args.port)
+        print(f"[INFO] 模拟板卡监听端口 {server.port} (Ctrl+C 退出)")
+        try:
+            while True:
+                server.serve_once()
+                print("[INFO] 回放结束")
+                if not args.loop:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+
+    elif args.command == 'bench':
+        for i in range(args.repeat):
+            stats = benchmark(args.capture, speed=args.speed or None)
+            if stats is None:
+                return 1
+            print(f"  第 {i+1} 次: {stats['received']}/{stats['words']} 字, "
+                  f"{stats['elapsed']:.3f} s, {stats['words_per_s']:.0f} 字/s, "
+                  f"延迟 p50={stats['latency_p50_ms']:.2f} ms, "
+                  f"p99={stats['latency_p99_ms']:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,6 +17,9 @@ import time
 import os
 from datetime import datetime
 
+from tdc_device_state import DeviceState
+from tdc_stream_parser import WordStreamParser
+
 try:
     import numpy as np
     import matplotlib.pyplot as plt
@@ -27,6 +30,11 @@ except ImportError:
     PLOT_AVAILABLE = False
     print("[WARN] numpy/matplotlib 未安装,数据可视化功能不可用")
 
+if PLOT_AVAILABLE:
+    # 本仓库的分析模块不放在 try 中: 其中的错误应直接报出，而不是被当作缺少依赖
+    from tdc_linearity import fit_lines, rms
+    from tdc_channels import ChannelArrays, analyze_channels
+
 
 class TDCScanner:
     """TDC 扫描控制器"""
@@ -51,11 +59,36 @@ class TDCScanner:
     TYPE_INFO = 0b10
     TYPE_CMD = 0b11
     
+    # 每次 recv 的最大字节数 (字边界由 WordStreamParser 重新拼接)
+    RECV_SIZE = 4096
+    
     def __init__(self, host='192.168.2.100', port=1024):
         self.host = host
         self.port = port
         self.sock = None
         self.connected = False
+        # 可选的字节流录制器 (tdc_replay.StreamRecorder)，每次连接后包装 socket
+        self.recorder = None
+        # 可选的流式写入器 (tdc_stream_writer.StreamWriter)，每次接收完成后提交数据
+        self.stream_writer = None
+        # 可选的流式异常检测器 (tdc_glitch.GlitchDetector)，每次接收完成后检查
+        self.glitch_detector = None
+        # 可选的稳定性分析 (tdc_stability.StabilityAnalyzer)，每次接收完成后累加
+        self.stability_analyzer = None
+        # 运行目录中记录的板卡名 (None 时使用 host)
+        self.board = None
+        # 由 INFO 数据字驱动的设备状态 (tdc_device_state)
+        self.device_state = DeviceState()
+        # wait_until 期间或超出期望个数收到的测量数据，下一次 receive_data 时先行返回
+        self._pending = []
+        # 字节流 -> 数据字 (处理半包与错位)
+        self.parser = WordStreamParser()
+        # 等待设备就绪 / 校准完成的超时时间 (秒)
+        self.ready_timeout = 10.0
+        # 可选的命令耗时模型 (tdc_scan_planner.CommandCostModel)，每次完整接收后记录实测耗时
+        self.cost_model = None
+        # 最近一条扫描命令 (scan_mode, phase, 发送时刻)，接收完成后计入 cost_model
+        self._command = None
         
     def connect(self, timeout=5.0):
         """连接到FPGA"""
@@ -63,12 +96,18 @@ class TDCScanner:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.settimeout(timeout)
             self.sock.connect((self.host, self.port))
+            if self.recorder is not None:
+                self.sock = self.recorder.wrap(self.sock)
             self.connected = True
             print(f"[INFO] 已连接到 {self.host}:{self.port}")
             
             # 清空接收缓冲区（丢弃旧数据）
             print("[INFO] 清空接收缓冲区...")
             self._clear_rx_buffer()
+            # 清空时可能丢弃了半个字，由解析器在第一批数据中重新对齐
+            self.parser.reset()
+            # 上一个连接中多收的数据不属于之后的命令
+            self._pending = []
             
             return True
         except socket.error as e:
@@ -104,6 +143,24 @@ class TDCScanner:
             self.connected = False
             print("[INFO] 连接已断开")
     
+    @staticmethod
+    def build_command(cmd_type, scan_mode=0, channel=0b11, phase=0):
+        """
+        构建32位命令字
+        
+        Returns:
+            int: 命令字
+        """
+        # [31]     = cmd_type (0=扫描, 1=校准)
+        # [30]     = scan_mode (0=单步, 1=全扫描)
+        # [29:28]  = channel (通道选择)
+        # [27:20]  = phase (相位参数)
+        # [19:0]   = 保留
+        return ((cmd_type & 0x1) << 31) | \
+               ((scan_mode & 0x1) << 30) | \
+               ((channel & 0x3) << 28) | \
+               ((phase & 0xFF) << 20)
+    
     def send_command(self, cmd_type, scan_mode=0, channel=0b11, phase=0):
         """
         发送命令到FPGA
@@ -121,16 +178,7 @@ class TDCScanner:
             print("[ERROR] 未连接到设备")
             return False
         
-        # 构建命令:
-        # [31]     = cmd_type (0=扫描, 1=校准)
-        # [30]     = scan_mode (0=单步, 1=全扫描)
-        # [29:28]  = channel (通道选择)
-        # [27:20]  = phase (相位参数)
-        # [19:0]   = 保留
-        cmd_data = ((cmd_type & 0x1) << 31) | \
-                   ((scan_mode & 0x1) << 30) | \
-                   ((channel & 0x3) << 28) | \
-                   ((phase & 0xFF) << 20)
+        cmd_data = self.build_command(cmd_type, scan_mode, channel, phase)
         
         # 详细显示命令结构
         cmd_type_str = '校准' if cmd_type else '扫描'
@@ -156,6 +204,29 @@ class TDCScanner:
             print(f"[ERROR] 发送失败: {e}")
             return False
     
+    @staticmethod
+    def decode_word(value):
+        """
+        解析一个32位数据包
+        
+        [31:30] = 类型 (00=UP, 01=DOWN, 10=INFO, 11=CMD)
+        [29:22] = ID (相位索引)
+        [21:9]  = 精细时间 (13-bit)
+        [8]     = 通道标志 (1=UP通道, 0=DOWN通道)
+        [7:0]   = 粗计数低8位
+        
+        Returns:
+            dict: type/id/fine/coarse/flag/raw
+        """
+        return {
+            'type': (value >> 30) & 0x3,
+            'id': (value >> 22) & 0xFF,
+            'fine': (value >> 9) & 0x1FFF,
+            'coarse': value & 0xFF,
+            'flag': (value >> 8) & 0x1,
+            'raw': value
+        }
+    
     def receive_data(self, expected_count, timeout=3.0):
         """
         接收指定数量的数据
@@ -171,7 +242,8 @@ class TDCScanner:
             print("[ERROR] 未连接到设备")
             return []
         
-        data_list = []
+        data_list = self._pending[:expected_count]
+        self._pending = self._pending[expected_count:]
         start_time = time.time()
         
         print(f"[INFO] 等待接收 {expected_count} 个数据包...")
@@ -182,64 +254,153 @@ class TDCScanner:
         while len(data_list) < expected_count:
             # 检查超时
             if time.time() - start_time > timeout:
-                print(f"[WARN] 接收超时,仅收到 {len(data_list)}/{expected_count} 个数据包")
+                # 等待后续字节判断对齐的尾部数据字照常输出
+                for value in self.parser.flush():
+                    self._dispatch(value, data_list, expected_count)
+                if len(data_list) < expected_count:
+                    print(f"[WARN] 接收超时,仅收到 {len(data_list)}/{expected_count} 个数据包")
                 break
             
             try:
-                raw_data = self.sock.recv(4)
-                
-                if len(raw_data) == 4:
-                    value = struct.unpack('>I', raw_data)[0]
-                    
-                    # 解析数据包
-                    # [31:30] = 类型 (00=UP, 01=DOWN, 10=INFO, 11=CMD)
-                    # [29:22] = ID (相位索引)
-                    # [21:9]  = 精细时间 (13-bit)
-                    # [8]     = 通道标志 (1=UP通道, 0=DOWN通道)
-                    # [7:0]   = 粗计数低8位
-                    data_type = (value >> 30) & 0x3
-                    data_id = (value >> 22) & 0xFF
-                    fine_time = (value >> 9) & 0x1FFF
-                    channel_flag = (value >> 8) & 0x1    # 提取bit[8]的flag
-                    coarse_time = value & 0xFF           # 粗计数低8位
-                    
-                    # 过滤命令类型的回显数据
-                    if data_type == 0b11:  # CMD 类型
-                        print(f"[RX] 忽略命令回显: 0x{value:08X}")
-                        continue
-                    
-                    data_list.append({
-                        'type': data_type,
-                        'id': data_id,
-                        'fine': fine_time,
-                        'coarse': coarse_time,
-                        'flag': channel_flag,    # 添加flag字段
-                        'raw': value
-                    })
-                    
-                    # 实时显示前几个数据包用于调试
-                    if len(data_list) <= 10:  # 增加显示数量
-                        type_str = ['UP', 'DOWN', 'INFO', 'CMD'][data_type]
-                        flag_info = f", Flag={channel_flag}, Coarse={coarse_time}"
-                        print(f"[RX] 数据包#{len(data_list)}: Type={type_str}, ID={data_id}, Fine={fine_time}{flag_info}, Raw=0x{value:08X}")
-                    
-                    # 进度显示
-                    elif len(data_list) % 50 == 0 or len(data_list) == expected_count:
-                        print(f"[RX] 进度: {len(data_list)}/{expected_count}")
-                
-                elif len(raw_data) == 0:
-                    print("[WARN] 连接断开")
-                    break
-                    
+                words = self._read_words()
             except socket.timeout:
                 continue
             except Exception as e:
                 print(f"[ERROR] 接收错误: {e}")
+                self.connected = False
                 break
+            
+            if words is None:
+                print("[WARN] 连接断开")
+                self.connected = False
+                # 解析器为判断对齐暂存的尾部数据字照常输出
+                for value in self.parser.flush():
+                    self._dispatch(value, data_list, expected_count)
+                break
+            for value in words:
+                self._dispatch(value, data_list, expected_count)
         
         print(f"[INFO] 接收完成,共 {len(data_list)} 个数据包")
+        if self.stream_writer is not None:
+            self.stream_writer.write(data_list)
+        if self.glitch_detector is not None and data_list:
+            flagged = self.glitch_detector.update(data_list)
+            if flagged.any():
+                print(f"[WARN] 异常检测: 本批 {int(flagged.sum())} 个异常数据 "
+                      f"(累计 {self.glitch_detector.total})")
+        if self.stability_analyzer is not None and data_list:
+            self.stability_analyzer.update(data_list)
+        if self.cost_model is not None and self._command is not None:
+            # 只记录完整接收的命令 (超时的耗时不代表命令本身的代价)
+            scan_mode, phase, sent = self._command
+            if len(data_list) >= expected_count:
+                self.cost_model.observe(scan_mode, phase, time.perf_counter() - sent)
+            self._command = None
         return data_list
     
+    def _read_words(self):
+        """
+        接收一块字节并切分为数据字 (自动重新同步，见 tdc_stream_parser)
+        
+        Returns:
+            list: 数据字 (int)；连接断开时为 None
+        """
+        chunk = self.sock.recv(self.RECV_SIZE)
+        if not chunk:
+            return None
+        words = self.parser.feed(chunk)
+        if self.parser.last_discarded:
+            print(f"[WARN] 数据流错位，已重新同步: 丢弃 {self.parser.last_discarded} 字节 "
+                  f"(累计 {self.parser.discarded} 字节, {self.parser.resyncs} 次)")
+        return words
+    
+    def _dispatch(self, value, data_list, expected_count):
+        """处理一个数据字: 命令回显丢弃，INFO 更新设备状态，测量数据加入 data_list (已满时留给下一次接收)"""
+        packet = self.decode_word(value)
+        data_type = packet['type']
+        
+        # 过滤命令类型的回显数据
+        if data_type == self.TYPE_CMD:
+            print(f"[RX] 忽略命令回显: 0x{value:08X}")
+            return
+        if data_type == self.TYPE_INFO:
+            self._handle_info(value)
+            return
+        if len(data_list) >= expected_count:
+            self._pending.append(packet)
+            return
+        
+        data_list.append(packet)
+        
+        # 实时显示前几个数据包用于调试
+        if len(data_list) <= 10:  # 增加显示数量
+            type_str = ['UP', 'DOWN', 'INFO', 'CMD'][data_type]
+            flag_info = f", Flag={packet['flag']}, Coarse={packet['coarse']}"
+            print(f"[RX] 数据包#{len(data_list)}: Type={type_str}, ID={packet['id']}, Fine={packet['fine']}{flag_info}, Raw=0x{value:08X}")
+        
+        # 进度显示
+        elif len(data_list) % 50 == 0 or len(data_list) == expected_count:
+            print(f"[RX] 进度: {len(data_list)}/{expected_count}")
+    
+    def _handle_info(self, value):
+        """INFO 数据字更新设备状态"""
+        info = self.device_state.update(value)
+        print(f"[RX] INFO {info['event']}: {self.device_state.describe()}")
+        return info
+    
+    def wait_until(self, condition, timeout=None):
+        """
+        读取数据流直到设备状态满足条件
+        
+        期间收到的测量数据保留给下一次 receive_data。
+        
+        Args:
+            condition: condition(device_state) -> bool
+            timeout: 超时时间(秒)，默认 ready_timeout
+        
+        Returns:
+            bool: 条件是否成立
+        """
+        if condition(self.device_state):
+            return True
+        if not self.connected:
+            return False
+        timeout = self.ready_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print(f"[WARN] 等待设备状态超时 ({timeout:.1f}s), {self.device_state.describe()}")
+                return False
+            self.sock.settimeout(min(remaining, 1.0))
+            try:
+                words = self._read_words()
+            except socket.timeout:
+                continue
+            except Exception as e:
+                print(f"[ERROR] 接收错误: {e}")
+                return False
+            if words is None:
+                print("[WARN] 连接断开")
+                return False
+            
+            for value in words:
+                # 测量数据全部留给下一次 receive_data
+                self._dispatch(value, self._pending, 0)
+            if condition(self.device_state):
+                return True
+    
+    def wait_ready(self, timeout=None):
+        """
+        等待设备空闲 (就绪且无进行中的校准/扫描)
+        
+        设备从未上报过 INFO 时直接返回 True (旧固件)。
+        """
+        if not self.device_state.seen:
+            return True
+        return self.wait_until(lambda state: state.idle, timeout)
+    
     def start_scan(self, scan_mode=1, phase=224, channel=0b11):
         """
         启动扫描测试
@@ -264,26 +425,62 @@ class TDCScanner:
         mode_str = '全扫描' if scan_mode else '单步'
         ch_names = ['无', 'DOWN', 'UP', 'BOTH']
         print(f"[CMD] 启动扫描测试 (模式={mode_str}, 相位={phase}, 通道={ch_names[channel]})")
-        return self.send_command(
+        if not self.wait_ready():
+            print("[WARN] 设备未就绪，仍然发送扫描命令")
+        sent_at = time.perf_counter()
+        sent = self.send_command(
             cmd_type=self.CMD_SCAN,
             scan_mode=scan_mode,
             channel=channel,
             phase=phase
         )
+        self._command = (scan_mode, phase, sent_at) if sent else None
+        return sent
     
-    def start_calibration(self):
-        """启动手动校准"""
+    def start_calibration(self, wait=False, timeout=None):
+        """
+        启动手动校准
+        
+        Args:
+            wait: 等待设备上报 CALIB_DONE (设备从未上报过 INFO 时不等待)
+            timeout: 等待超时时间(秒)，默认 ready_timeout
+        
+        Returns:
+            bool: 是否发送成功 (wait 时为是否在超时内完成校准)
+        """
         print("[CMD] 启动手动校准")
-        return self.send_command(
+        if not self.wait_ready(timeout):
+            print("[WARN] 设备未就绪，仍然发送校准命令")
+        done = self.device_state.count('CALIB_DONE')
+        sent = self.send_command(
             cmd_type=self.CMD_CALIB,
             scan_mode=0,
             channel=0,
             phase=0
         )
+        if not sent or not wait or not self.device_state.seen:
+            return sent
+        start = time.time()
+        if not self.wait_until(lambda state: state.count('CALIB_DONE') > done, timeout):
+            return False
+        print(f"[INFO] 校准完成 ({time.time() - start:.2f}s)")
+        return True
 
 
 class TDCDataProcessor:
     """TDC 数据处理器"""
+
+    # 分析算法版本 (修改分析结果的改动需递增，使批量分析缓存失效)
+    ANALYSIS_VERSION = 7
+
+    # 数据类型 -> 通道名 (新增通道在此登记；多板卡等其他分组方式可重写 channel_key)
+    CHANNEL_NAMES = {0b00: 'UP', 0b01: 'DOWN'}
+    CHANNEL_COLORS = {'UP': 'b', 'DOWN': 'r'}
+    
+    # 保存时登记运行的目录数据库文件名 (位于输出目录中，见 tdc_catalog；None 表示不登记)
+    CATALOG = 'catalog.sqlite'
+    # 保存时同时加入的会话缓存 (tdc_session_cache.AcquisitionCache；None 表示不缓存)
+    SESSION_CACHE = None
     
     def __init__(self, data_list):
         """
@@ -295,97 +492,142 @@ class TDCDataProcessor:
         # 时间常数 (260MHz系统)
         self.CLK_PERIOD = 3864  # ps (1/260MHz)
         self.TDC_BIN = 1        # fine值已经是ps单位，不需要转换
-        self.PHASE_STEP = 17.17 # ps/step (VCO=1040MHz, 1/1040M/56=17.17ps)
-        
-        # 分离UP和DOWN通道
-        self.up_data = [d for d in data_list if d['type'] == 0b00]
-        self.down_data = [d for d in data_list if d['type'] == 0b01]
-        
+        self.NOMINAL_PHASE_STEP = 17.17 # ps/step (VCO=1040MHz, 1/1040M/56=17.17ps)
+        # 分析使用的相位步进: 联合拟合成功后替换为拟合值 (见 fit_model)
+        self.PHASE_STEP = self.NOMINAL_PHASE_STEP
+        
+        # 联合拟合得到的步进/布线延迟 (见 fit_model)，拟合前为 None；
+        # 调用方可预先设置 (如采集中的增量拟合结果)，作为拟合初值，拟合失败时沿用
+        self.model = None
+        # process() 得到的性能指标，保存时一并登记到运行目录
+        self.performance = None
+        # 固定相位重复测量的 Allan 偏差 {通道名: tdc_stability 结果}
+        self.stability = {}
+        
+        # 按通道分组 (up_data / down_data 为 UP / DOWN 通道的数据列表)
+        self.channel_data = {name: [] for name in self.CHANNEL_NAMES.values()}
+        for d in data_list:
+            name = self.channel_key(d)
+            if name is not None:
+                self.channel_data.setdefault(name, []).append(d)
+        self.up_data = self.channel_data.get('UP', [])
+        self.down_data = self.channel_data.get('DOWN', [])
+        
+        # 各通道堆叠为 (通道, 样本) 数组，所有分析沿样本维对全部通道一次完成
+        self.channels = None
+        if PLOT_AVAILABLE:
+            self.channels = ChannelArrays(self.channel_data.keys(), self.channel_data.values())
+    
+    def channel_key(self, d):
+        """数据所属的通道名，返回 None 表示不参与分析"""
+        return self.CHANNEL_NAMES.get(d['type'])
+    
+    def _channel_color(self, name, index):
+        return self.CHANNEL_COLORS.get(name, f"C{index}")
+    
     def process(self):
-        """处理和分析数据"""
+        """
+        处理和分析数据
+        
+        Returns:
+            dict: TDC性能分析结果 (数据不足时为 None)
+        """
         print("\n" + "="*70)
         print("TDC 数据分析")
         print("="*70)
         
         print(f"总数据包: {len(self.data_list)}")
-        print(f"UP 通道: {len(self.up_data)} 个")
-        print(f"DOWN 通道: {len(self.down_data)} 个")
+        for name, records in self.channel_data.items():
+            print(f"{name} 通道: {len(records)} 个")
         
-        if len(self.up_data) == 0 and len(self.down_data) == 0:
+        if not any(self.channel_data.values()):
             print("[WARN] 没有有效数据")
-            return
+            return None
         
-        # 分析UP通道
-        if len(self.up_data) > 0:
-            self._analyze_channel(self.up_data, "UP")
+        # 各通道基本统计
+        self._analyze_channels()
         
-        # 分析DOWN通道
-        if len(self.down_data) > 0:
-            self._analyze_channel(self.down_data, "DOWN")
+        # 联合拟合步进与各通道布线延迟，之后的分析使用拟合的步进和布线延迟
+        self.fit_model()
         
-        # 如果是扫描模式(225+个相位),分析延迟曲线
-        if len(self.up_data) >= 225:
-            self._analyze_scan_curve()
+        # 扫描模式(225+个相位)的通道分析延迟曲线
+        self._analyze_scan_curve()
         
         # 如果有足够的数据，进行TDC性能分析
-        if len(self.up_data) >= 10:
-            self.analyze_tdc_performance()
+        performance = None
+        if any(len(records) >= 10 for records in self.channel_data.values()):
+            performance = self.analyze_tdc_performance()
+        
+        # 同一相位重复测量足够多次时的长期稳定性
+        self.analyze_stability()
+        if performance is not None and self.stability:
+            from tdc_stability import summarize as summarize_stability
+            channels = performance['channels']
+            for name, result in self.stability.items():
+                if name in channels:
+                    channels[name]['stability'] = summarize_stability(result)
+            primary = 'UP' if 'UP' in channels else next(iter(channels))
+            if 'stability' in channels[primary]:
+                performance['stability'] = channels[primary]['stability']
+        self.performance = performance
         
         print("="*70 + "\n")
+        return performance
     
-    def _analyze_channel(self, channel_data, channel_name):
-        """分析单个通道的数据"""
-        print(f"\n{channel_name} 通道分析:")
-        print("-" * 50)
-        
+    def _analyze_channels(self):
+        """各通道的基本统计"""
         if not PLOT_AVAILABLE:
-            # 基本统计
-            fine_vals = [d['fine'] for d in channel_data]
-            coarse_vals = [d['coarse'] for d in channel_data]
-            
-            print(f"  样本数: {len(channel_data)}")
-            print(f"  Fine 范围: {min(fine_vals)} - {max(fine_vals)}")
-            print(f"  Coarse 范围: {min(coarse_vals)} - {max(coarse_vals)}")
+            for name, channel_data in self.channel_data.items():
+                if not channel_data:
+                    continue
+                fine_vals = [d['fine'] for d in channel_data]
+                coarse_vals = [d['coarse'] for d in channel_data]
+                
+                print(f"\n{name} 通道分析:")
+                print("-" * 50)
+                print(f"  样本数: {len(channel_data)}")
+                print(f"  Fine 范围: {min(fine_vals)} - {max(fine_vals)}")
+                print(f"  Coarse 范围: {min(coarse_vals)} - {max(coarse_vals)}")
             return
         
-        # 使用numpy进行分析
-        fine = np.array([d['fine'] for d in channel_data])
-        coarse = np.array([d['coarse'] for d in channel_data])
-        ids = np.array([d['id'] for d in channel_data])
+        ch = self.channels.select(1)
         
-        # 计算时间
-        fine_time = fine * self.TDC_BIN  # ps (fine值已经是ps，乘以1保持不变)
-        coarse_time = coarse * self.CLK_PERIOD  # ps
+        # 计算时间 (所有通道一起)
+        fine_time = ch.fine * self.TDC_BIN  # ps (fine值已经是ps，乘以1保持不变)
+        coarse_time = ch.coarse * self.CLK_PERIOD  # ps
         total_time = coarse_time + fine_time
         
-        print(f"  样本数: {len(channel_data)}")
-        print(f"  ID 范围: {ids.min()} - {ids.max()}")
-        print(f"  Fine 范围: {fine.min()} - {fine.max()}")
-        print(f"  Coarse 范围: {coarse.min()} - {coarse.max()}")
-        print(f"  Fine 时间: {fine_time.min():.1f} - {fine_time.max():.1f} ps")
-        print(f"  Total 时间: {total_time.min():.1f} - {total_time.max():.1f} ps")
-        
-        if len(channel_data) > 1:
-            print(f"  Fine 标准差: {fine.std():.2f}")
-            print(f"  Time 标准差: {total_time.std():.2f} ps")
+        id_min, id_max = np.nanmin(ch.ids, axis=-1), np.nanmax(ch.ids, axis=-1)
+        fine_min, fine_max = np.nanmin(ch.fine, axis=-1), np.nanmax(ch.fine, axis=-1)
+        coarse_min, coarse_max = np.nanmin(ch.coarse, axis=-1), np.nanmax(ch.coarse, axis=-1)
+        time_min, time_max = np.nanmin(total_time, axis=-1), np.nanmax(total_time, axis=-1)
+        fine_std = np.nanstd(ch.fine, axis=-1)
+        time_std = np.nanstd(total_time, axis=-1)
+        
+        for i, name in enumerate(ch.names):
+            print(f"\n{name} 通道分析:")
+            print("-" * 50)
+            print(f"  样本数: {ch.counts[i]}")
+            print(f"  ID 范围: {id_min[i]:.0f} - {id_max[i]:.0f}")
+            print(f"  Fine 范围: {fine_min[i]:.0f} - {fine_max[i]:.0f}")
+            print(f"  Coarse 范围: {coarse_min[i]:.0f} - {coarse_max[i]:.0f}")
+            print(f"  Fine 时间: {fine_min[i] * self.TDC_BIN:.1f} - {fine_max[i] * self.TDC_BIN:.1f} ps")
+            print(f"  Total 时间: {time_min[i]:.1f} - {time_max[i]:.1f} ps")
+            
+            if ch.counts[i] > 1:
+                print(f"  Fine 标准差: {fine_std[i]:.2f}")
+                print(f"  Time 标准差: {time_std[i]:.2f} ps")
     
     def _analyze_scan_curve(self):
         """分析扫描曲线 - 考虑固定布线延迟导致的偏移和环绕"""
         if not PLOT_AVAILABLE:
             return
         
-        print(f"\n扫描模式分析 ({len(self.up_data)}个相位):")
-        print("-" * 50)
-        print(f"提示: 225步(17.17ps/step)可覆盖完整3864ps周期")
-        
-        # 提取fine time (fine值已经是ps)
-        fine = np.array([d['fine'] for d in self.up_data])
-        ids = np.array([d['id'] for d in self.up_data])
-        
-        # 实际测量的fine time (单位: ps)
-        actual_fine_time = fine  # 已经是ps，不需要转换
+        ch = self.channels.select(225)
+        if len(ch) == 0:
+            return
         
-        # 理论关系（无布线延迟）: 
+        # 理论关系（无布线延迟）:
         # Phase_Delay = Phase × PHASE_STEP
         # Fine_Time = CLK_PERIOD - Phase_Delay (单调递减)
         #
@@ -394,51 +636,130 @@ class TDCDataProcessor:
         # Fine_Time = (Actual_Delay) mod CLK_PERIOD
         # 当 Actual_Delay > CLK_PERIOD 时发生环绕
         
-        phase_indices = ids
-        theoretical_fine_no_delay = self.CLK_PERIOD - self.PHASE_STEP * phase_indices
-        
-        # 检测环绕点（曲线跳变的位置）
-        diffs = np.diff(actual_fine_time)
-        jump_threshold = self.CLK_PERIOD / 2  # 超过半个周期的跳变
-        wrap_points = np.where(np.abs(diffs) > jump_threshold)[0]
-        
-        print(f"  相位范围: {phase_indices.min()} - {phase_indices.max()}")
-        print(f"  Fine time 范围: {actual_fine_time.min():.1f} - {actual_fine_time.max():.1f} ps")
-        print(f"  Fine time 变化幅度: {actual_fine_time.max() - actual_fine_time.min():.1f} ps")
-        print(f"  理论关系（无延迟）: Fine = {self.CLK_PERIOD:.0f} - Phase × {self.PHASE_STEP:.2f}")
-        
-        # 估计布线延迟
-        if len(wrap_points) > 0:
-            print(f"  \n检测到 {len(wrap_points)} 个环绕点（固定布线延迟导致）")
-            for i, wp in enumerate(wrap_points):
-                wrap_phase = phase_indices[wp]
-                # 在环绕点，Phase × PHASE_STEP + Delay ≈ CLK_PERIOD
-                estimated_delay = self.CLK_PERIOD - wrap_phase * self.PHASE_STEP
-                print(f"    环绕点{i+1}: Phase {phase_indices[wp]} → {phase_indices[wp+1]}")
-                print(f"              估计布线延迟 ≈ {estimated_delay:.1f} ps")
-        
-        # 计算线性度（使用理论递减斜率）
-        if len(phase_indices) > 2:
-            # 对fine time进行线性拟合
-            coeffs = np.polyfit(phase_indices, actual_fine_time, 1)
-            fit_line = np.polyval(coeffs, phase_indices)
-            residuals = actual_fine_time - fit_line
+        # 按接收顺序检测环绕点（曲线跳变的位置，超过半个周期的跳变）
+        diffs = np.diff(ch.fine, axis=-1)
+        jumps = np.abs(np.nan_to_num(diffs)) > self.CLK_PERIOD / 2
+        
+        # 对fine time进行线性拟合 (所有通道一起)
+        slope, intercept = fit_lines(ch.ids, ch.fine)
+        residuals = ch.fine - (slope[:, None] * ch.ids + intercept[:, None])
+        residual_rms = rms(residuals)
+        residual_max = np.nanmax(np.abs(residuals), axis=-1)
+        
+        for i, name in enumerate(ch.names):
+            phase_indices = ch.row(ch.ids, i).astype(int)
+            actual_fine_time = ch.row(ch.fine, i)  # 已经是ps，不需要转换
+            wrap_points = np.flatnonzero(jumps[i])
+            
+            print(f"\n{name} 通道扫描模式分析 ({ch.counts[i]}个相位):")
+            print("-" * 50)
+            print(f"提示: 225步({self.NOMINAL_PHASE_STEP}ps/step)可覆盖完整{self.CLK_PERIOD}ps周期")
+            print(f"  相位范围: {phase_indices.min()} - {phase_indices.max()}")
+            print(f"  Fine time 范围: {actual_fine_time.min():.1f} - {actual_fine_time.max():.1f} ps")
+            print(f"  Fine time 变化幅度: {actual_fine_time.max() - actual_fine_time.min():.1f} ps")
+            print(f"  理论关系（无延迟）: Fine = {self.CLK_PERIOD:.0f} - Phase × {self.PHASE_STEP:.2f}")
+            
+            # 估计布线延迟: 优先使用联合拟合结果
+            fitted_delay = self.model['delay_ps'].get(name) if self.model is not None else None
+            if fitted_delay is not None:
+                print(f"  布线延迟: {fitted_delay:.1f} ps (联合拟合)")
+            if len(wrap_points) > 0:
+                print(f"  \n检测到 {len(wrap_points)} 个环绕点（固定布线延迟导致）")
+                for k, wp in enumerate(wrap_points):
+                    print(f"    环绕点{k+1}: Phase {phase_indices[wp]} → {phase_indices[wp+1]}")
+                    if fitted_delay is None:
+                        # 在环绕点，Phase × PHASE_STEP + Delay ≈ CLK_PERIOD
+                        estimated_delay = self.CLK_PERIOD - phase_indices[wp] * self.PHASE_STEP
+                        print(f"              估计布线延迟 ≈ {estimated_delay:.1f} ps")
             
-            print(f"  实际斜率: {coeffs[0]:.3f} ps/phase (理论: {-self.PHASE_STEP:.2f})")
-            print(f"  斜率误差: {abs(coeffs[0] + self.PHASE_STEP):.3f} ps/phase")
-            print(f"  RMS 误差: {np.sqrt(np.mean(residuals**2)):.2f} ps")
-            print(f"  最大偏差: {np.max(np.abs(residuals)):.2f} ps")
+            print(f"  实际斜率: {slope[i]:.3f} ps/phase (理论: {-self.PHASE_STEP:.2f})")
+            print(f"  斜率误差: {abs(slope[i] + self.PHASE_STEP):.3f} ps/phase")
+            print(f"  RMS 误差: {residual_rms[i]:.2f} ps")
+            print(f"  最大偏差: {residual_max[i]:.2f} ps")
+    
+    def fit_model(self):
+        """
+        联合拟合 fine = (phase × step + D_c) mod CLK_PERIOD (tdc_model_fit)
+        所有通道共享相位步进，每个通道一个布线延迟，并给出 UP/DOWN 偏差
+        
+        Returns:
+            dict: step / step_err / delay_ps / rms_ps / skew_ps (数据不足时为 None)
+        """
+        if not PLOT_AVAILABLE:
+            return None
+        
+        from tdc_model_fit import phase_sums, fit_model, summarize
+        
+        ch = self.channels.select(1)
+        init_step = self.model['step'] if self.model is not None else None
+        fit = fit_model(*phase_sums(ch.ids, ch.fine, self.CLK_PERIOD), self.CLK_PERIOD,
+                        init_step=init_step)
+        if fit is None:
+            if self.model is not None:
+                self.PHASE_STEP = abs(self.model['step'])
+            return self.model
+        self.model = summarize(fit, ch.names, self.CLK_PERIOD)
+        self.PHASE_STEP = abs(self.model['step'])
+        
+        print(f"\n联合模型拟合 (fine = (phase × step + D) mod {self.CLK_PERIOD}):")
+        print("-" * 50)
+        print(f"  相位步进: {abs(self.model['step']):.4f} ± {self.model['step_err']:.4f} ps "
+              f"(标称: {self.NOMINAL_PHASE_STEP:.2f})")
+        for name, delay in self.model['delay_ps'].items():
+            print(f"  {name} 布线延迟: {delay:.1f} ps (残差 RMS {self.model['rms_ps'][name]:.2f} ps)")
+        if self.model['skew_ps'] is not None:
+            print(f"  UP/DOWN 偏差: {self.model['skew_ps']:.1f} ps")
+        return self.model
+    
+    def analyze_stability(self, min_samples=16):
+        """
+        固定相位重复测量的 Allan 偏差 (tdc_stability)，每个通道取重复次数最多的相位
+        
+        Args:
+            min_samples: 相位至少重复的次数
+        
+        Returns:
+            dict: {通道名: ADEV 结果}，没有重复次数足够的相位时为空
+        """
+        self.stability = {}
+        if not PLOT_AVAILABLE:
+            return self.stability
+        
+        from tdc_stability import StabilityAnalyzer, format_table
+        
+        ch = self.channels.select(min_samples)
+        analyzer = StabilityAnalyzer(clk_period=self.CLK_PERIOD, min_samples=min_samples)
+        for i, name in enumerate(ch.names):
+            analyzer.update_channel(name, ch.row(ch.ids, i), ch.row(ch.fine, i))
+        self.stability = analyzer.results()
+        
+        if self.stability:
+            print("\n稳定性分析 (固定相位重复测量的重叠 Allan 偏差, τ 以重复次数计):")
+            print("-" * 50)
+            print("\n".join(format_table(self.stability)))
+        return self.stability
+    
+    def _lsb(self):
+        """DNL/INL 的 LSB: 联合拟合的相位步进，未拟合时为 None (各通道使用平均步进)"""
+        return self.PHASE_STEP if self.model is not None else None
     
     def analyze_tdc_performance(self):
         """
         TDC性能分析：测量范围、精度、DNL/INL、噪声
         适用于存在布线延迟导致的非理想测量曲线
+        
+        所有样本数足够的通道堆叠后一次性计算 (tdc_channels.analyze_channels)
+        
+        Returns:
+            dict: 主通道 (优先 UP) 的性能指标，
+                  'channels' 项为 {通道名: 性能指标}
         """
         if not PLOT_AVAILABLE:
             print("[WARN] numpy不可用，无法进行性能分析")
             return None
         
-        if len(self.up_data) < 10:
+        ch = self.channels.select(10)
+        if len(ch) == 0:
             print("[WARN] 数据量不足，无法进行性能分析")
             return None
         
@@ -449,82 +770,102 @@ class TDCDataProcessor:
         print("      固定布线延迟导致曲线整体偏移，超过周期时发生环绕")
         print("="*70)
         
-        # 使用UP通道数据进行分析
-        fine_values = np.array([d['fine'] for d in self.up_data])
-        phase_ids = np.array([d['id'] for d in self.up_data])
+        results = analyze_channels(ch, self.CLK_PERIOD, lsb=self._lsb())
+        channels = {}
+        for i, name in enumerate(ch.names):
+            channels[name] = self._report_performance(ch, results, i)
+        
+        print("\n" + "="*70 + "\n")
+        
+        # 顶层保留主通道的指标，兼容只读取单通道结果的调用方 (批量分析汇总等)
+        primary = 'UP' if 'UP' in channels else ch.names[0]
+        performance = dict(channels[primary])
+        performance['channels'] = channels
+        if self.model is not None:
+            performance['model'] = self.model
+        return performance
+    
+    def _report_performance(self, ch, results, i):
+        """
+        打印第 i 个通道的性能分析结果
+        
+        Returns:
+            dict: 该通道的性能指标
+        """
+        n = ch.counts[i]
+        lin = results['lin']
+        mono = results['monotonicity']
+        noise = results['noise']
+        
+        # 多轮扫描已按相位合并为均值曲线，只取测到的相位
+        measured = ~np.isnan(results['curve'][i])
+        sorted_phases = results['phases'][measured]
+        sorted_times = results['curve'][i][measured]
+        unwrapped = lin['unwrapped'][i][measured]
+        dnl_lsb = lin['dnl'][i][~np.isnan(lin['dnl'][i])]
+        inl = lin['inl_ps'][i][measured]
+        inl_lsb = lin['inl_lsb'][i][measured]
+        n_sweeps = int(results['sweeps'][i])
         
         performance = {}
         
+        print(f"\n>>> {ch.names[i]} 通道 ({n} 个数据"
+              + (f", {n_sweeps} 轮扫描按相位取均值" if n_sweeps > 1 else "") + ")")
+        
         # 1. 测量范围分析
         print("\n[1] 测量范围分析:")
         print("-" * 50)
-        measured_range = fine_values.max() - fine_values.min()
-        print(f"  最小值: {fine_values.min():.2f} ps")
-        print(f"  最大值: {fine_values.max():.2f} ps")
+        measured_range = results['max'][i] - results['min'][i]
+        print(f"  最小值: {results['min'][i]:.2f} ps")
+        print(f"  最大值: {results['max'][i]:.2f} ps")
         print(f"  测量范围: {measured_range:.2f} ps")
         print(f"  理论范围: {self.CLK_PERIOD:.2f} ps (时钟周期)")
         print(f"  范围覆盖率: {(measured_range/self.CLK_PERIOD)*100:.1f}%")
         print(f"  注: 布线延迟导致整体偏移，但不影响测量范围")
         
         performance['range'] = {
-            'min': float(fine_values.min()),
-            'max': float(fine_values.max()),
+            'min': float(results['min'][i]),
+            'max': float(results['max'][i]),
             'span': float(measured_range),
             'coverage': float((measured_range/self.CLK_PERIOD)*100)
         }
         
-        # 2. 分辨率和精度分析（使用差分方法，考虑单调递减）
+        # 2. 分辨率和精度分析（对相位排序后展开环绕并拟合）
         print("\n[2] 分辨率和精度分析:")
         print("-" * 50)
         
-        # 对相位进行排序，计算相邻相位的时间差
-        sorted_indices = np.argsort(phase_ids)
-        sorted_phases = phase_ids[sorted_indices]
-        sorted_times = fine_values[sorted_indices]
-        
-        # 计算相邻测量点的时间差（理论上应该递减，所以取绝对值）
-        time_diffs = np.diff(sorted_times)
-        
-        # 过滤环绕跳变点（超过半个周期的突变）
-        jump_mask = np.abs(time_diffs) < self.CLK_PERIOD/2
-        valid_diffs = time_diffs[jump_mask]
-        
-        if len(valid_diffs) > 0:
-            avg_resolution = np.abs(valid_diffs).mean()
-            resolution_std = np.abs(valid_diffs).std()
-            
-            # 检查是递增还是递减
-            decreasing_ratio = np.sum(valid_diffs < 0) / len(valid_diffs)
-            
-            print(f"  平均步进: {avg_resolution:.3f} ps")
-            print(f"  步进标准差: {resolution_std:.3f} ps")
-            print(f"  理论步进: {self.PHASE_STEP:.3f} ps")
-            print(f"  步进误差: {abs(avg_resolution - self.PHASE_STEP):.3f} ps")
-            print(f"  递减比例: {decreasing_ratio*100:.1f}% (理论100%为单调递减)")
-            
-            performance['resolution'] = {
-                'avg_step': float(avg_resolution),
-                'std_step': float(resolution_std),
-                'theoretical_step': float(self.PHASE_STEP),
-                'decreasing_ratio': float(decreasing_ratio)
-            }
+        avg_resolution = float(lin['step'][i])
+        resolution_std = float(lin['step_std'][i])
+        decreasing_ratio = float(results['decreasing_ratio'][i])
+        
+        step_source = '联合拟合' if self.model is not None else '标称'
+        print(f"  平均步进: {avg_resolution:.3f} ps")
+        print(f"  步进标准差: {resolution_std:.3f} ps")
+        print(f"  理论步进: {self.PHASE_STEP:.3f} ps ({step_source}; 标称 {self.NOMINAL_PHASE_STEP:.2f} ps)")
+        print(f"  步进误差: {abs(avg_resolution - self.PHASE_STEP):.3f} ps")
+        print(f"  递减比例: {decreasing_ratio*100:.1f}% (理论100%为单调递减)")
+        
+        performance['resolution'] = {
+            'avg_step': avg_resolution,
+            'std_step': resolution_std,
+            'theoretical_step': float(self.PHASE_STEP),
+            'nominal_step': float(self.NOMINAL_PHASE_STEP),
+            'decreasing_ratio': decreasing_ratio
+        }
         
         # 3. LSB（最小有效位）分析
         print("\n[3] LSB 分析:")
         print("-" * 50)
         
-        # 统计所有不同的fine值
-        unique_values = np.unique(fine_values)
-        if len(unique_values) > 1:
-            # 计算最小间隔作为LSB估计
-            value_diffs = np.diff(np.sort(unique_values))
-            lsb_estimate = value_diffs[value_diffs > 0].min()
-            print(f"  检测到的唯一值数量: {len(unique_values)}")
+        if results['unique_values'][i] > 1:
+            # 不同fine值之间的最小间隔作为LSB估计
+            lsb_estimate = results['estimated_lsb'][i]
+            print(f"  检测到的唯一值数量: {results['unique_values'][i]}")
             print(f"  估计LSB: {lsb_estimate:.3f} ps")
             print(f"  理论量化等级: {int(self.CLK_PERIOD / lsb_estimate)}")
             
             performance['lsb'] = {
-                'unique_values': int(len(unique_values)),
+                'unique_values': int(results['unique_values'][i]),
                 'estimated_lsb': float(lsb_estimate),
                 'quantization_levels': int(self.CLK_PERIOD / lsb_estimate)
             }
@@ -533,138 +874,102 @@ class TDCDataProcessor:
         print("\n[4] DNL (差分非线性) 分析:")
         print("-" * 50)
         
-        if len(valid_diffs) > 0:
-            # DNL = (实际步进 - 理想步进) / 理想步进
-            ideal_step = avg_resolution
-            dnl = (valid_diffs - ideal_step) / ideal_step
-            dnl_lsb = dnl  # 单位：LSB
-            
-            print(f"  DNL 最大值: {dnl_lsb.max():.3f} LSB")
-            print(f"  DNL 最小值: {dnl_lsb.min():.3f} LSB")
-            print(f"  DNL RMS: {np.sqrt(np.mean(dnl_lsb**2)):.3f} LSB")
-            print(f"  DNL 标准差: {dnl_lsb.std():.3f} LSB")
-            
-            performance['dnl'] = {
-                'max': float(dnl_lsb.max()),
-                'min': float(dnl_lsb.min()),
-                'rms': float(np.sqrt(np.mean(dnl_lsb**2))),
-                'std': float(dnl_lsb.std())
-            }
+        # DNL = (|实际步进| - LSB) / LSB，LSB 为联合拟合步进 (无拟合时为平均步进)
+        lsb = float(lin['lsb'][i])
+        print(f"  LSB: {lsb:.3f} ps ({'联合拟合步进' if self.model is not None else '平均步进'})")
+        print(f"  DNL 最大值: {dnl_lsb.max():.3f} LSB")
+        print(f"  DNL 最小值: {dnl_lsb.min():.3f} LSB")
+        print(f"  DNL RMS: {rms(dnl_lsb):.3f} LSB")
+        print(f"  DNL 标准差: {dnl_lsb.std():.3f} LSB")
+        
+        performance['dnl'] = {
+            'lsb_ps': lsb,
+            'max': float(dnl_lsb.max()),
+            'min': float(dnl_lsb.min()),
+            'rms': float(rms(dnl_lsb)),
+            'std': float(dnl_lsb.std())
+        }
         
         # 5. INL (Integral Non-Linearity) 分析
         print("\n[5] INL (积分非线性) 分析:")
         print("-" * 50)
         
-        # 检测环绕点，分段处理
-        if len(sorted_times) > 2:
-            time_jumps = np.diff(sorted_times)
-            wrap_indices = np.where(np.abs(time_jumps) > self.CLK_PERIOD/2)[0]
+        wrap_count = int(lin['wraps'][i])
+        fitted_delay = None
+        if self.model is not None:
+            fitted_delay = self.model['delay_ps'].get(ch.names[i])
+        if wrap_count == 0:
+            print(f"  拟合模式: 单段线性 (无环绕)")
+            if fitted_delay is not None:
+                print(f"  估计布线延迟: {fitted_delay:.1f} ps (联合拟合)")
+            else:
+                print(f"  估计布线延迟: {self.CLK_PERIOD - lin['intercept'][i]:.1f} ps (从截距计算)")
+        else:
+            # 有环绕，将环绕后的数据按整周期"展开"拼接成连续曲线
+            print(f"  拟合模式: 展开环绕 (检测到{wrap_count}个环绕点)")
             
-            if len(wrap_indices) == 0:
-                # 无环绕，直接线性拟合
-                coeffs = np.polyfit(sorted_phases, sorted_times, 1)
-                ideal_line = np.polyval(coeffs, sorted_phases)
-                inl = sorted_times - ideal_line
-                
-                print(f"  拟合模式: 单段线性 (无环绕)")
-                print(f"  估计布线延迟: {self.CLK_PERIOD - coeffs[1]:.1f} ps (从截距计算)")
+            # 估计布线延迟：优先使用联合拟合结果，
+            # 否则按环绕点 Phase × PHASE_STEP + Delay ≈ CLK_PERIOD 估计
+            wrap_phase = results['phases'][max(int(mono['first_wrap'][i]), 0)]
+            if fitted_delay is not None:
+                print(f"  估计布线延迟: {fitted_delay:.1f} ps (联合拟合)")
             else:
-                # 有环绕，将环绕后的数据"展开"拼接成连续曲线
-                print(f"  拟合模式: 展开环绕 (检测到{len(wrap_indices)}个环绕点)")
-                
-                # 估计布线延迟：在环绕点，Phase × PHASE_STEP + Delay ≈ CLK_PERIOD
-                wrap_phase = sorted_phases[wrap_indices[0]]
                 estimated_delay = self.CLK_PERIOD - wrap_phase * self.PHASE_STEP
                 print(f"  估计布线延迟: {estimated_delay:.1f} ps")
-                print(f"  环绕点位置: Phase {wrap_phase}")
-                
-                # 将环绕后的数据"展开"：加上时钟周期，使曲线连续
-                unwrapped_times = sorted_times.copy()
-                for i in range(len(wrap_indices)):
-                    wrap_idx = wrap_indices[i]
-                    # 环绕后的所有点都加上一个周期（或多个周期）
-                    if i == 0:
-                        # 第一个环绕点后，加上一个周期
-                        unwrapped_times[wrap_idx+1:] += self.CLK_PERIOD
-                    else:
-                        # 如果有多个环绕点，累加周期数
-                        unwrapped_times[wrap_idx+1:] += self.CLK_PERIOD
-                
-                print(f"  展开前范围: {sorted_times.min():.1f} - {sorted_times.max():.1f} ps")
-                print(f"  展开后范围: {unwrapped_times.min():.1f} - {unwrapped_times.max():.1f} ps")
-                
-                # 对展开后的连续数据进行线性拟合
-                coeffs = np.polyfit(sorted_phases, unwrapped_times, 1)
-                ideal_line = np.polyval(coeffs, sorted_phases)
-                
-                # 计算INL（展开后的数据相对理想线的偏差）
-                inl = unwrapped_times - ideal_line
-                
-                print(f"  数据点总数: {len(sorted_phases)}")
-            
-            inl_lsb = inl / avg_resolution if len(valid_diffs) > 0 else inl
-            
-            print(f"  拟合斜率: {coeffs[0]:.3f} ps/phase (理论: {-self.PHASE_STEP:.2f})")
-            print(f"  INL 最大值: {inl_lsb.max():.3f} LSB ({inl.max():.2f} ps)")
-            print(f"  INL 最小值: {inl_lsb.min():.3f} LSB ({inl.min():.2f} ps)")
-            print(f"  INL RMS: {np.sqrt(np.mean(inl_lsb**2)):.3f} LSB ({np.sqrt(np.mean(inl**2)):.2f} ps)")
-            print(f"  INL 峰峰值: {inl_lsb.max() - inl_lsb.min():.3f} LSB ({inl.max() - inl.min():.2f} ps)")
-            
-            performance['inl'] = {
-                'max_lsb': float(inl_lsb.max()),
-                'min_lsb': float(inl_lsb.min()),
-                'rms_lsb': float(np.sqrt(np.mean(inl_lsb**2))),
-                'peak_to_peak_lsb': float(inl_lsb.max() - inl_lsb.min()),
-                'max_ps': float(inl.max()),
-                'min_ps': float(inl.min()),
-                'rms_ps': float(np.sqrt(np.mean(inl**2))),
-                'peak_to_peak_ps': float(inl.max() - inl.min()),
-                'wrap_points': int(len(wrap_indices))
-            }
+            print(f"  环绕点位置: Phase {wrap_phase}")
+            print(f"  展开前范围: {sorted_times.min():.1f} - {sorted_times.max():.1f} ps")
+            print(f"  展开后范围: {unwrapped.min():.1f} - {unwrapped.max():.1f} ps")
+            print(f"  相位点数: {len(sorted_phases)}")
+        
+        print(f"  拟合斜率: {lin['slope'][i]:.3f} ps/phase (理论: {-self.PHASE_STEP:.2f})")
+        print(f"  INL 最大值: {inl_lsb.max():.3f} LSB ({inl.max():.2f} ps)")
+        print(f"  INL 最小值: {inl_lsb.min():.3f} LSB ({inl.min():.2f} ps)")
+        print(f"  INL RMS: {rms(inl_lsb):.3f} LSB ({rms(inl):.2f} ps)")
+        print(f"  INL 峰峰值: {inl_lsb.max() - inl_lsb.min():.3f} LSB ({inl.max() - inl.min():.2f} ps)")
+        
+        performance['inl'] = {
+            'max_lsb': float(inl_lsb.max()),
+            'min_lsb': float(inl_lsb.min()),
+            'rms_lsb': float(rms(inl_lsb)),
+            'peak_to_peak_lsb': float(inl_lsb.max() - inl_lsb.min()),
+            'max_ps': float(inl.max()),
+            'min_ps': float(inl.min()),
+            'rms_ps': float(rms(inl)),
+            'peak_to_peak_ps': float(inl.max() - inl.min()),
+            'wrap_points': wrap_count
+        }
         
         # 6. 噪声分析（多次测量同一相位）
         print("\n[6] 噪声分析:")
         print("-" * 50)
         
-        # 统计每个相位的测量次数和标准差
-        phase_noise = {}
-        for phase_id in np.unique(phase_ids):
-            measurements = fine_values[phase_ids == phase_id]
-            if len(measurements) > 1:
-                phase_noise[phase_id] = {
-                    'count': len(measurements),
-                    'mean': measurements.mean(),
-                    'std': measurements.std(),
-                    'range': measurements.max() - measurements.min()
-                }
-        
-        if phase_noise:
-            all_stds = [v['std'] for v in phase_noise.values()]
-            avg_noise = np.mean(all_stds)
-            print(f"  重复测量的相位数: {len(phase_noise)}")
+        repeated_phases = int(noise['repeated_phases'][i])
+        if repeated_phases > 0:
+            avg_noise = float(noise['avg_std'][i])
+            max_noise = float(noise['max_std'][i])
+            print(f"  重复测量的相位数: {repeated_phases}")
             print(f"  平均噪声标准差: {avg_noise:.3f} ps")
-            print(f"  最大噪声标准差: {max(all_stds):.3f} ps")
+            print(f"  最大噪声标准差: {max_noise:.3f} ps")
             
             performance['noise'] = {
-                'repeated_phases': len(phase_noise),
-                'avg_std': float(avg_noise),
-                'max_std': float(max(all_stds))
+                'repeated_phases': repeated_phases,
+                'avg_std': avg_noise,
+                'max_std': max_noise
             }
         else:
             print("  无重复测量数据，建议多次测量同一相位以评估噪声")
             performance['noise'] = {'note': 'No repeated measurements'}
         
-        # 7. 单调性检查（理论应单调递减）
+        # 7. 单调性检查（理论应单调递减，已过滤环绕跳变）
         print("\n[7] 单调性分析:")
         print("-" * 50)
         
-        # 过滤环绕跳变后统计
-        valid_transitions = time_diffs[jump_mask]
-        monotonic_increases = np.sum(valid_transitions > 0)
-        monotonic_decreases = np.sum(valid_transitions < 0)
-        total_valid = len(valid_transitions)
+        monotonic_increases = int(mono['increases'][i])
+        monotonic_decreases = int(mono['decreases'][i])
+        total_valid = int(mono['total'][i])
+        wrap_filtered = int(mono['wrap_filtered'][i])
         
-        print(f"  有效转换数: {total_valid} (已过滤{len(time_diffs)-total_valid}个环绕点)")
+        print(f"  有效转换数: {total_valid} (已过滤{wrap_filtered}个环绕点)")
         print(f"  递减转换: {monotonic_decreases} ({(monotonic_decreases/total_valid)*100:.1f}%)")
         print(f"  递增转换: {monotonic_increases} ({(monotonic_increases/total_valid)*100:.1f}%)")
         
@@ -676,18 +981,23 @@ class TDCDataProcessor:
             print(f"  结论: ⚠ 递增比例异常，检查测量配置")
         
         performance['monotonicity'] = {
-            'increases': int(monotonic_increases),
-            'decreases': int(monotonic_decreases),
-            'total': int(total_valid),
-            'wrap_filtered': int(len(time_diffs)-total_valid)
+            'increases': monotonic_increases,
+            'decreases': monotonic_decreases,
+            'total': total_valid,
+            'wrap_filtered': wrap_filtered
         }
         
-        print("\n" + "="*70 + "\n")
-        
         return performance
     
-    def save_to_file(self, filename=None, output_dir='tdc_results'):
-        """保存数据到文件"""
+    def save_to_file(self, filename=None, output_dir='tdc_results', metadata=None):
+        """
+        保存数据到文件，登记到输出目录的运行目录 (CATALOG) 并加入会话缓存 (SESSION_CACHE)
+        
+        Args:
+            filename: 文件名 (默认按时间生成)
+            output_dir: 输出目录
+            metadata: 运行目录的附加信息 (board 等)
+        """
         # 创建输出目录
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -714,13 +1024,73 @@ class TDCDataProcessor:
                     f.write(f"{i},{type_str},{d['id']},{d['fine']},{flag},{d['coarse']},0x{d['raw']:08X}\n")
             
             print(f"[INFO] 数据已保存到: {filepath}")
-            return filepath
         except Exception as e:
             print(f"[ERROR] 保存失败: {e}")
             return None
-    
+        
+        if self.CATALOG:
+            from tdc_catalog import record_save
+            version = self.ANALYSIS_VERSION if self.performance else None
+            record_save(filepath, self.data_list, self.performance, version,
+                        catalog_name=self.CATALOG, **(metadata or {}))
+        if self.SESSION_CACHE is not None:
+            self.SESSION_CACHE.add(self.data_list, filename, performance=self.performance,
+                                   metadata=metadata, path=filepath)
+        return filepath
+
+    @staticmethod
+    def load_from_file(filepath):
+        """
+        从 save_to_file 保存的文件读取数据
+
+        Args:
+            filepath: 数据文件路径
+
+        Returns:
+            list: 数据列表 (与 receive_data 格式相同)
+        """
+        if filepath.endswith('.tdcblk'):
+            from tdc_block_capture import BlockReader
+            return BlockReader(filepath).query_data_list()
+        if filepath.endswith('.tdcarc'):
+            from tdc_archive_codec import ArchiveReader
+            return ArchiveReader(filepath).data_list()
+
+        from tdc_stream_writer import open_capture
+
+        type_map = {'UP': 0b00, 'DOWN': 0b01, 'INFO': 0b10, 'CMD': 0b11}
+        data_list = []
+
+        # 支持流式写入器生成的压缩文件 (.gz/.xz/.bz2)
+        with open_capture(filepath) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split(',')
+                if len(fields) == 7:
+                    # Index, Type, ID, Fine, Flag, Coarse, Raw_Hex
+                    _, type_str, data_id, fine, flag, coarse, raw = fields
+                elif len(fields) == 6:
+                    # 旧格式: Index, Type, ID, Fine, Coarse, Raw_Hex
+                    _, type_str, data_id, fine, coarse, raw = fields
+                    flag = (int(raw, 16) >> 8) & 0x1
+                else:
+                    continue
+
+                data_list.append({
+                    'type': type_map.get(type_str.strip(), 0b10),
+                    'id': int(data_id),
+                    'fine': int(fine),
+                    'coarse': int(coarse),
+                    'flag': int(flag),
+                    'raw': int(raw, 16)
+                })
+
+        return data_list
+
     def plot(self, save_file=None):
-        """绘制数据图表，包括性能分析图"""
+        """绘制数据图表，包括性能分析图 (每个通道一列)"""
         if not PLOT_AVAILABLE:
             print("[WARN] matplotlib 不可用,无法绘图")
             return
@@ -729,159 +1099,103 @@ class TDCDataProcessor:
             print("[WARN] 没有数据可绘制")
             return
         
+        ch = self.channels.select(1)
+        colors = [self._channel_color(name, i) for i, name in enumerate(ch.names)]
+        
         # 判断是否有足够数据进行性能分析
-        show_performance = len(self.up_data) >= 10
+        perf = self.channels.select(10)
+        show_performance = len(perf) > 0
         
-        # 创建图表 - 根据数据量选择布局
-        if show_performance:
-            fig, axes = plt.subplots(4, 2, figsize=(14, 20))
-        else:
-            fig, axes = plt.subplots(3, 2, figsize=(14, 15))
+        # 创建图表 - 根据数据量和通道数选择布局
+        n_rows = 4 if show_performance else 3
+        n_cols = max(2, len(ch))
+        fig, axes = plt.subplots(n_rows, n_cols, figsize=(7 * n_cols, 5 * n_rows), squeeze=False)
         
-        fig.suptitle('TDC 扫描数据分析\n(测量值 = 相位延迟 + 固定布线延迟)', 
+        fig.suptitle('TDC 扫描数据分析\n(测量值 = 相位延迟 + 固定布线延迟)',
                     fontsize=16, fontweight='bold')
         
-        # 子图1: UP通道 Fine Time
-        if len(self.up_data) > 0:
-            up_ids = [d['id'] for d in self.up_data]
-            up_fine = np.array([d['fine'] for d in self.up_data])  # 已经是ps
-            
-            axes[0, 0].plot(up_ids, up_fine, 'b.-', markersize=3, linewidth=1)
-            axes[0, 0].set_xlabel('相位索引 (Phase ID)')
-            axes[0, 0].set_ylabel('Fine Time (ps)')
-            axes[0, 0].set_title('UP 通道 - Fine Time\n(理论: 递减曲线 + 固定偏移)')
-            axes[0, 0].grid(True, alpha=0.3)
-        
-        # 子图2: DOWN通道 Fine Time
-        if len(self.down_data) > 0:
-            down_ids = [d['id'] for d in self.down_data]
-            down_fine = np.array([d['fine'] for d in self.down_data])  # 已经是ps
-            
-            axes[0, 1].plot(down_ids, down_fine, 'r.-', markersize=3, linewidth=1)
-            axes[0, 1].set_xlabel('相位索引 (Phase ID)')
-            axes[0, 1].set_ylabel('Fine Time (ps)')
-            axes[0, 1].set_title('DOWN 通道 - Fine Time\n(理论: 递减曲线 + 固定偏移)')
-            axes[0, 1].grid(True, alpha=0.3)
-        
-        # 子图3: UP通道 Coarse Time
-        if len(self.up_data) > 0:
-            up_ids = [d['id'] for d in self.up_data]
-            up_coarse = np.array([d['coarse'] for d in self.up_data])
+        # 第1/2行: 各通道 Fine Time / Coarse Count
+        for i, name in enumerate(ch.names):
+            ids = ch.row(ch.ids, i)
+            fine = ch.row(ch.fine, i)  # 已经是ps
+            coarse = ch.row(ch.coarse, i)
             
-            axes[1, 0].plot(up_ids, up_coarse, 'b.-', markersize=3, linewidth=1)
-            axes[1, 0].set_xlabel('相位索引 (Phase ID)')
-            axes[1, 0].set_ylabel('Coarse Count (低8位)')
-            axes[1, 0].set_title('UP 通道 - Coarse Count')
-            axes[1, 0].grid(True, alpha=0.3)
-        
-        # 子图4: DOWN通道 Coarse Time
-        if len(self.down_data) > 0:
-            down_ids = [d['id'] for d in self.down_data]
-            down_coarse = np.array([d['coarse'] for d in self.down_data])
+            axes[0, i].plot(ids, fine, '.-', color=colors[i], markersize=3, linewidth=1)
+            axes[0, i].set_xlabel('相位索引 (Phase ID)')
+            axes[0, i].set_ylabel('Fine Time (ps)')
+            axes[0, i].set_title(f'{name} 通道 - Fine Time\n(理论: 递减曲线 + 固定偏移)')
+            axes[0, i].grid(True, alpha=0.3)
             
-            axes[1, 1].plot(down_ids, down_coarse, 'r.-', markersize=3, linewidth=1)
-            axes[1, 1].set_xlabel('相位索引 (Phase ID)')
-            axes[1, 1].set_ylabel('Coarse Count (低8位)')
-            axes[1, 1].set_title('DOWN 通道 - Coarse Count')
-            axes[1, 1].grid(True, alpha=0.3)
-        
-        # 子图5: Fine Time 分布
-        if len(self.up_data) > 0:
-            up_fine = np.array([d['fine'] for d in self.up_data])
-            axes[2, 0].hist(up_fine, bins=50, alpha=0.7, color='blue', edgecolor='black', label='UP')
-        
-        if len(self.down_data) > 0:
-            down_fine = np.array([d['fine'] for d in self.down_data])
-            axes[2, 0].hist(down_fine, bins=50, alpha=0.7, color='red', edgecolor='black', label='DOWN')
-        
+            axes[1, i].plot(ids, coarse, '.-', color=colors[i], markersize=3, linewidth=1)
+            axes[1, i].set_xlabel('相位索引 (Phase ID)')
+            axes[1, i].set_ylabel('Coarse Count (低8位)')
+            axes[1, i].set_title(f'{name} 通道 - Coarse Count')
+            axes[1, i].grid(True, alpha=0.3)
+        
+        # 第3行第1列: Fine Time 分布
+        for i, name in enumerate(ch.names):
+            axes[2, 0].hist(ch.row(ch.fine, i), bins=50, alpha=0.7, color=colors[i],
+                            edgecolor='black', label=name)
         axes[2, 0].set_xlabel('Fine Count')
         axes[2, 0].set_ylabel('频数')
         axes[2, 0].set_title('Fine Count 分布')
         axes[2, 0].legend()
         axes[2, 0].grid(True, alpha=0.3)
         
-        # 子图6: 扫描曲线对比
-        if len(self.up_data) > 0 and len(self.down_data) > 0:
-            up_ids = np.array([d['id'] for d in self.up_data])
-            up_fine = np.array([d['fine'] for d in self.up_data])  # 已经是ps
-            
-            down_ids = np.array([d['id'] for d in self.down_data])
-            down_fine = np.array([d['fine'] for d in self.down_data])  # 已经是ps
-            
-            axes[2, 1].plot(up_ids, up_fine, 'b.-', markersize=2, linewidth=1, label='UP', alpha=0.7)
-            axes[2, 1].plot(down_ids, down_fine, 'r.-', markersize=2, linewidth=1, label='DOWN', alpha=0.7)
-            axes[2, 1].set_xlabel('相位索引 (Phase ID)')
-            axes[2, 1].set_ylabel('Fine Time (ps)')
-            axes[2, 1].set_title('Fine Time 扫描曲线对比')
-            axes[2, 1].legend()
-            axes[2, 1].grid(True, alpha=0.3)
-        elif len(self.up_data) > 0:
-            # 只有UP通道数据
-            up_ids = np.array([d['id'] for d in self.up_data])
-            up_fine = np.array([d['fine'] for d in self.up_data])  # 已经是ps
-            axes[2, 1].plot(up_ids, up_fine, 'b.-', markersize=2, linewidth=1, label='UP', alpha=0.7)
+        # 第3行第2列: 扫描曲线对比
+        if len(ch) > 0:
+            for i, name in enumerate(ch.names):
+                axes[2, 1].plot(ch.row(ch.ids, i), ch.row(ch.fine, i), '.-', color=colors[i],
+                                markersize=2, linewidth=1, label=name, alpha=0.7)
             axes[2, 1].set_xlabel('相位索引 (Phase ID)')
             axes[2, 1].set_ylabel('Fine Time (ps)')
-            axes[2, 1].set_title('Fine Time 扫描曲线 (UP通道)')
-            axes[2, 1].legend()
-            axes[2, 1].grid(True, alpha=0.3)
-        elif len(self.down_data) > 0:
-            # 只有DOWN通道数据
-            down_ids = np.array([d['id'] for d in self.down_data])
-            down_fine = np.array([d['fine'] for d in self.down_data])  # 已经是ps
-            axes[2, 1].plot(down_ids, down_fine, 'r.-', markersize=2, linewidth=1, label='DOWN', alpha=0.7)
-            axes[2, 1].set_xlabel('相位索引 (Phase ID)')
-            axes[2, 1].set_ylabel('Fine Time (ps)')
-            axes[2, 1].set_title('Fine Time 扫描曲线 (DOWN通道)')
+            if len(ch) > 1:
+                axes[2, 1].set_title('Fine Time 扫描曲线对比')
+            else:
+                axes[2, 1].set_title(f'Fine Time 扫描曲线 ({ch.names[0]}通道)')
             axes[2, 1].legend()
             axes[2, 1].grid(True, alpha=0.3)
         else:
             axes[2, 1].text(0.5, 0.5, '无数据',
                           ha='center', va='center', transform=axes[2, 1].transAxes, fontsize=12)
         
-        # 如果有足够数据，绘制DNL和INL图
-        if show_performance and len(self.up_data) >= 10:
-            up_fine = np.array([d['fine'] for d in self.up_data])
-            up_ids = np.array([d['id'] for d in self.up_data])
+        # 第4行: DNL 和 INL (与 analyze_tdc_performance 使用同一批量计算)
+        if show_performance:
+            results = analyze_channels(perf, self.CLK_PERIOD, lsb=self._lsb())
+            lin = results['lin']
+            dnl_rms = rms(lin['dnl'])
+            inl_rms = rms(lin['inl_lsb'])
             
-            # 排序
-            sorted_indices = np.argsort(up_ids)
-            sorted_phases = up_ids[sorted_indices]
-            sorted_times = up_fine[sorted_indices]
+            phases = results['phases']
+            for i, name in enumerate(perf.names):
+                color = self._channel_color(name, ch.names.index(name))
+                axes[3, 0].plot(phases[:-1], lin['dnl'][i], '.-', color=color,
+                                markersize=2, linewidth=1, label=name)
+                axes[3, 1].plot(phases, lin['inl_lsb'][i], '.-', color=color,
+                                markersize=2, linewidth=1, label=name)
             
-            # 子图7: DNL
-            if len(sorted_times) > 1:
-                time_diffs = np.diff(sorted_times)
-                valid_mask = np.abs(time_diffs) < self.CLK_PERIOD/2
-                valid_diffs = time_diffs[valid_mask]
-                valid_phases = sorted_phases[:-1][valid_mask]
-                
-                if len(valid_diffs) > 0:
-                    ideal_step = np.abs(valid_diffs).mean()
-                    dnl = (valid_diffs - ideal_step) / ideal_step
-                    
-                    axes[3, 0].plot(valid_phases, dnl, 'g.-', markersize=2, linewidth=1)
-                    axes[3, 0].axhline(y=0, color='r', linestyle='--', linewidth=1, alpha=0.5)
-                    axes[3, 0].set_xlabel('相位索引 (Phase ID)')
-                    axes[3, 0].set_ylabel('DNL (LSB)')
-                    axes[3, 0].set_title(f'DNL 分析 (RMS={np.sqrt(np.mean(dnl**2)):.3f} LSB)')
-                    axes[3, 0].grid(True, alpha=0.3)
+            # 子图: DNL
+            axes[3, 0].axhline(y=0, color='k', linestyle='--', linewidth=1, alpha=0.5)
+            axes[3, 0].set_xlabel('相位索引 (Phase ID)')
+            axes[3, 0].set_ylabel('DNL (LSB)')
+            axes[3, 0].set_title('DNL 分析 (RMS ' + ', '.join(
+                f'{name}={v:.3f}' for name, v in zip(perf.names, dnl_rms)) + ' LSB)')
+            axes[3, 0].legend()
+            axes[3, 0].grid(True, alpha=0.3)
             
-            # 子图8: INL
-            if len(sorted_times) > 2:
-                coeffs = np.polyfit(sorted_phases, sorted_times, 1)
-                ideal_line = np.polyval(coeffs, sorted_phases)
-                inl = sorted_times - ideal_line
-                
-                if len(valid_diffs) > 0:
-                    inl_lsb = inl / ideal_step
-                    
-                    axes[3, 1].plot(sorted_phases, inl_lsb, 'm.-', markersize=2, linewidth=1)
-                    axes[3, 1].axhline(y=0, color='r', linestyle='--', linewidth=1, alpha=0.5)
-                    axes[3, 1].set_xlabel('相位索引 (Phase ID)')
-                    axes[3, 1].set_ylabel('INL (LSB)')
-                    axes[3, 1].set_title(f'INL 分析 (RMS={np.sqrt(np.mean(inl_lsb**2)):.3f} LSB)')
-                    axes[3, 1].grid(True, alpha=0.3)
+            # 子图: INL (展开环绕后)
+            axes[3, 1].axhline(y=0, color='k', linestyle='--', linewidth=1, alpha=0.5)
+            axes[3, 1].set_xlabel('相位索引 (Phase ID)')
+            axes[3, 1].set_ylabel('INL (LSB)')
+            axes[3, 1].set_title('INL 分析 (RMS ' + ', '.join(
+                f'{name}={v:.3f}' for name, v in zip(perf.names, inl_rms)) + ' LSB)')
+            axes[3, 1].legend()
+            axes[3, 1].grid(True, alpha=0.3)
+        
+        # 通道数多于2时，第3/4行多出的子图留空
+        for row in range(2, n_rows):
+            for col in range(2, n_cols):
+                axes[row, col].axis('off')
         
         plt.tight_layout()
         
@@ -891,6 +1205,12 @@ class TDCDataProcessor:
             print(f"[INFO] 图表已保存到: {save_file}")
         else:
             plt.show()
+        
+        # Allan 偏差单独成图
+        if self.stability:
+            from tdc_stability import plot_stability
+            adev_file = os.path.splitext(save_file)[0] + '_adev.png' if save_file else None
+            plot_stability(self.stability, save_file=adev_file)
 
 
 def show_menu():
@@ -906,7 +1226,11 @@ def show_menu():
     print("  5. 单通道测试 (DOWN only)")
     print("  6. 连续单步扫描 (0-224, 模拟全扫描)")
     print("  7. 校准 TDC")
-    print("  8. TDC性能分析 (需要先进行扫描测试)")
+    print("  8. TDC性能分析 (本次会话最近的采集: 重新分析/绘图/比较)")
+    print("  9. 自适应扫描 (粗到细, 单步命令)")
+    print("  10. 高统计单相位精度测量")
+    print("  11. 长时间重复全扫描 (漂移监测 + 自动校准)")
+    print("  12. 指定相位扫描 (任意相位集合, 自动规划全扫描/单步命令)")
     print("  0. 退出程序")
     print("="*70)
 
@@ -938,8 +1262,105 @@ def get_user_input(prompt, default=None, value_type=int, valid_range=None):
             return None
 
 
+def select_campaign_to_resume(kind):
+    """列出未完成的同类任务，询问是否续传"""
+    from tdc_campaign import ScanCampaign
+    
+    pending = ScanCampaign.find_incomplete(kind=kind)[:9]
+    if not pending:
+        return None
+    
+    print("\n发现未完成的任务:")
+    for i, campaign in enumerate(pending, 1):
+        print(f"  {i}. {campaign.describe()}")
+    print("  0. 新建任务")
+    index = get_user_input("请选择", default=1, value_type=int, valid_range=(0, len(pending)))
+    if not index:
+        return None
+    return pending[index - 1]
+
+
+def run_campaign(scanner, campaign, file_prefix, scheduler=None):
+    """执行 (或续传) 扫描任务，完成后处理、保存并绘图"""
+    ch_names = ['无', 'DOWN', 'UP', 'BOTH']
+    
+    try:
+        live_fit = None
+        if PLOT_AVAILABLE and campaign.plan['kind'] == 'sweep':
+            from tdc_model_fit import LiveModelFit
+            live_fit = LiveModelFit()
+        
+        def on_step(step, data):
+            if scheduler is not None:
+                # 每步之后即为批次间隙: 更新漂移指标，必要时校准
+                scheduler.between_batches(data)
+            if live_fit is not None:
+                # 每轮全扫描后更新步进/布线延迟的联合拟合
+                model = live_fit.update(data)
+                if model is not None and step % 10 == 0:
+                    delays = ", ".join(f"{k}={v:.1f}" for k, v in model['delay_ps'].items())
+                    print(f"[INFO] 模型更新: 步进 {abs(model['step']):.4f} ps, 布线延迟 {delays} ps")
+        
+        start = time.time()
+        try:
+            pause = 0.05 if campaign.plan['kind'] == 'single' else 0.0
+            completed = campaign.run(scanner, on_step=on_step, pause=pause)
+        except KeyboardInterrupt:
+            print("\n[INFO] 用户中断，已保存检查点")
+            completed = False
+        
+        if scheduler is not None:
+            scheduler.summary(time.time() - start)
+        
+        if not completed:
+            print(f"[INFO] 任务未完成: {campaign.describe()}")
+            print(f"[INFO] 再次选择同一菜单项即可从断点续传 (目录: {campaign.directory})")
+            return False
+        
+        all_data = campaign.load_data()
+        print(f"\n[INFO] 扫描完成! 共收到 {len(all_data)} 个数据")
+        
+        if len(all_data) == 0:
+            print("[ERROR] 没有接收到任何数据")
+            return False
+        
+        # 处理数据
+        print(f"\n[INFO] 处理数据...")
+        processor = TDCDataProcessor(all_data)
+        if live_fit is not None and live_fit.history:
+            # 增量拟合结果作为最终联合拟合的初值 (拟合失败时直接使用)
+            processor.model = live_fit.history[-1]
+        processor.process()
+        
+        # 保存数据到tdc_results文件夹
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        ch_suffix = ch_names[campaign.plan['channel']].lower()
+        data_filename = f"{file_prefix}_{ch_suffix}_{timestamp}.txt"
+        data_file = processor.save_to_file(data_filename,
+                                           metadata={'board': scanner.board or scanner.host})
+        if data_file and scheduler is not None:
+            scheduler.save_log(data_file.replace('.txt', '_drift.txt'))
+        
+        # 绘制图表并保存到同一文件夹
+        if PLOT_AVAILABLE and len(all_data) > 10:
+            plot_filename = data_filename.replace('.txt', '.png')
+            plot_file = os.path.join('tdc_results', plot_filename)
+            processor.plot(save_file=plot_file)
+        
+        print("\n[INFO] 测试完成!")
+        return True
+        
+    except Exception as e:
+        print(f"\n[ERROR] 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def execute_continuous_single_scan(scanner, start_phase, end_phase, channel):
-    """执行连续单步扫描 - 通过发送多个单步命令实现全扫描"""
+    """执行连续单步扫描 - 通过发送多个单步命令实现全扫描 (可断点续传)"""
+    from tdc_campaign import ScanCampaign
+    
     ch_names = ['无', 'DOWN', 'UP', 'BOTH']
     
     samples = end_phase - start_phase + 1
@@ -955,62 +1376,123 @@ def execute_continuous_single_scan(scanner, start_phase, end_phase, channel):
     print(f"  通道: {ch_names[channel]}")
     print(f"  总命令数: {samples} 条")
     print(f"  期望数据: {expected_total} 个")
+    if scanner.cost_model is not None:
+        from tdc_scan_planner import ScanPlanner
+        plan = ScanPlanner(scanner.cost_model, single_pause=0.05).plan(
+            range(start_phase, end_phase + 1))
+        print(f"  预计用时: {plan.single_cost:.1f} s (菜单 12 自动规划: {plan.cost:.1f} s)")
     print("="*70)
     
     # 确认执行
+    confirm = input("\n是否开始测试? (y/n) [y]: ").strip().lower()
+    if confirm and confirm not in ['y', 'yes']:
+        print("[INFO] 测试已取消")
+        return False
+    
+    print(f"\n[INFO] 开始连续单步扫描...")
+    campaign = ScanCampaign.create('single', channel=channel,
+                                   start_phase=start_phase, end_phase=end_phase)
+    return run_campaign(scanner, campaign, 'tdc_continuous')
+
+
+def execute_planned_scan(scanner, phases, repeats, channel):
+    """执行指定相位集合的扫描 - 自动选择全扫描/单步命令的组合 (丢弃未请求相位的数据)"""
+    from tdc_scan_planner import CommandCostModel, ScanPlanner
+    
+    ch_names = ['无', 'DOWN', 'UP', 'BOTH']
+    
+    # 设备上报 INFO 时由 wait_ready 等待空闲，否则单步之间保留与连续单步扫描相同的间隔
+    planner = ScanPlanner(scanner.cost_model or CommandCostModel(),
+                          single_pause=0.0 if scanner.device_state.seen else 0.05)
+    plan = planner.plan(phases, repeats)
+    
+    print(f"\n" + "="*70)
+    print("指定相位扫描配置:")
+    print(f"  通道: {ch_names[channel]}")
+    for line in plan.describe().splitlines():
+        print(f"  {line}")
+    print(f"  {planner.cost_model.describe()}")
+    print("="*70)
+    
     confirm = input("\n是否开始测试? (y/n) [y]: ").strip().lower()
     if confirm and confirm not in ['y', 'yes']:
         print("[INFO] 测试已取消")
         return False
     
     try:
-        all_data = []
-        print(f"\n[INFO] 开始连续单步扫描...")
+        print(f"\n[1/2] 执行 {len(plan.commands)} 条命令...")
+        data = planner.run(scanner, plan, channel=channel)
+        if len(data) == 0:
+            print("[ERROR] 没有接收到数据")
+            return False
         
-        for phase in range(start_phase, end_phase + 1):
-            # 显示进度
-            if phase % 10 == 0 or phase == start_phase:
-                print(f"\n[进度] 相位 {phase}/{end_phase}")
-            
-            # 发送单步命令
-            if not scanner.start_scan(scan_mode=0, phase=phase, channel=channel):
-                print(f"[ERROR] 相位 {phase} 命令发送失败")
-                continue
-            
-            # 等待接收数据
-            expected_count = 2 if channel == 0b11 else 1
-            data = scanner.receive_data(expected_count=expected_count, timeout=5.0)
-            
-            if len(data) == 0:
-                print(f"[WARN] 相位 {phase} 未收到数据")
-                continue
-            
-            all_data.extend(data)
-            
-            # 短暂延迟避免命令太快
-            time.sleep(0.05)
+        print(f"\n[2/2] 处理数据...")
+        processor = TDCDataProcessor(data)
+        processor.process()
         
-        print(f"\n[INFO] 扫描完成! 共收到 {len(all_data)}/{expected_total} 个数据")
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        ch_suffix = ch_names[channel].lower()
+        data_filename = f"tdc_planned_{ch_suffix}_{timestamp}.txt"
+        processor.save_to_file(data_filename, metadata={'board': scanner.board or scanner.host})
+        
+        if PLOT_AVAILABLE and len(data) > 10:
+            plot_file = os.path.join('tdc_results', data_filename.replace('.txt', '.png'))
+            processor.plot(save_file=plot_file)
+        
+        print("\n[INFO] 测试完成!")
+        return True
+        
+    except Exception as e:
+        print(f"\n[ERROR] 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def execute_adaptive_scan(scanner, channel, coarse_step=8, target_inl_ps=5.0, max_commands=600):
+    """执行自适应扫描 - 稀疏粗扫描后在环绕点和异常点附近细化"""
+    from tdc_adaptive_scan import AdaptiveScanner
+    
+    ch_names = ['无', 'DOWN', 'UP', 'BOTH']
+    
+    print(f"\n" + "="*70)
+    print("自适应扫描配置:")
+    print(f"  模式: 粗到细 (单步命令)")
+    print(f"  扫描范围: 0 到 224")
+    print(f"  通道: {ch_names[channel]}")
+    print(f"  粗扫描间隔: {coarse_step}")
+    print(f"  目标INL标准误差: {target_inl_ps} ps")
+    print(f"  命令预算: {max_commands} 条")
+    print("="*70)
+    
+    confirm = input("\n是否开始测试? (y/n) [y]: ").strip().lower()
+    if confirm and confirm not in ['y', 'yes']:
+        print("[INFO] 测试已取消")
+        return False
+    
+    try:
+        adaptive = AdaptiveScanner(scanner, channel=channel, coarse_step=coarse_step,
+                                   target_inl_ps=target_inl_ps, max_commands=max_commands)
+        all_data = adaptive.run()
         
         if len(all_data) == 0:
             print("[ERROR] 没有接收到任何数据")
             return False
         
-        # 处理数据
-        print(f"\n[INFO] 处理数据...")
+        adaptive.summary()
+        
+        # 处理数据 (性能结果随保存登记到运行目录和会话缓存)
         processor = TDCDataProcessor(all_data)
         processor.process()
         
         # 保存数据到tdc_results文件夹
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         ch_suffix = ch_names[channel].lower()
-        data_filename = f"tdc_continuous_{ch_suffix}_{timestamp}.txt"
-        data_file = processor.save_to_file(data_filename)
+        data_filename = f"tdc_adaptive_{ch_suffix}_{timestamp}.txt"
+        processor.save_to_file(data_filename, metadata={'board': scanner.board or scanner.host})
         
-        # 绘制图表并保存到同一文件夹
         if PLOT_AVAILABLE and len(all_data) > 10:
-            plot_filename = data_filename.replace('.txt', '.png')
-            plot_file = os.path.join('tdc_results', plot_filename)
+            plot_file = os.path.join('tdc_results', data_filename.replace('.txt', '.png'))
             processor.plot(save_file=plot_file)
         
         print("\n[INFO] 测试完成!")
@@ -1023,6 +1505,79 @@ def execute_continuous_single_scan(scanner, start_phase, end_phase, channel):
         return False
 
 
+def execute_precision_measurement(scanner, phase, channel, target_hits):
+    """执行单相位高统计精度测量"""
+    from tdc_precision import PrecisionMeasurement
+    
+    ch_names = ['无', 'DOWN', 'UP', 'BOTH']
+    
+    print(f"\n" + "="*70)
+    print("单相位精度测量配置:")
+    print(f"  测试相位: {phase}")
+    print(f"  通道: {ch_names[channel]}")
+    print(f"  目标测量次数: {target_hits} 次/通道")
+    print("="*70)
+    
+    confirm = input("\n是否开始测试? (y/n) [y]: ").strip().lower()
+    if confirm and confirm not in ['y', 'yes']:
+        print("[INFO] 测试已取消")
+        return False
+    
+    try:
+        measurement = PrecisionMeasurement(scanner, phase, channel=channel,
+                                           target_hits=target_hits)
+        if measurement.run() is None:
+            return False
+        measurement.save_to_file()
+        
+        print("\n[INFO] 测试完成!")
+        return True
+        
+    except Exception as e:
+        print(f"\n[ERROR] 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def execute_long_run(scanner, end_phase, channel, duration_min, threshold_ps=10.0, ref_phase=100):
+    """执行长时间重复全扫描 - 批次间隙监测漂移，超过阈值时自动校准 (可断点续传)"""
+    from tdc_campaign import ScanCampaign
+    
+    ch_names = ['无', 'DOWN', 'UP', 'BOTH']
+    ref_phase = min(ref_phase, end_phase)
+    
+    print(f"\n" + "="*70)
+    print("长时间扫描配置:")
+    print(f"  扫描范围: 0 到 {end_phase}")
+    print(f"  通道: {ch_names[channel]}")
+    print(f"  时长: {duration_min} 分钟")
+    print(f"  漂移参考相位: {ref_phase}, 校准阈值: {threshold_ps} ps")
+    print("="*70)
+    
+    confirm = input("\n是否开始测试? (y/n) [y]: ").strip().lower()
+    if confirm and confirm not in ['y', 'yes']:
+        print("[INFO] 测试已取消")
+        return False
+    
+    print(f"\n[INFO] 开始长时间扫描 (Ctrl+C 暂停，可稍后续传)...")
+    campaign = ScanCampaign.create('sweep', channel=channel, end_phase=end_phase,
+                                   repeats=None, duration=duration_min * 60,
+                                   options={'ref_phase': ref_phase, 'threshold_ps': threshold_ps})
+    return resume_long_run(scanner, campaign)
+
+
+def resume_long_run(scanner, campaign):
+    """执行 (或续传) 长时间扫描任务"""
+    from tdc_recalib import RecalibrationScheduler
+    
+    options = campaign.plan['options']
+    scheduler = RecalibrationScheduler(scanner, ref_phase=options.get('ref_phase', 100),
+                                       channel=campaign.plan['channel'],
+                                       threshold_ps=options.get('threshold_ps', 10.0))
+    return run_campaign(scanner, campaign, 'tdc_longrun', scheduler=scheduler)
+
+
 def execute_scan(scanner, scan_mode, phase, channel):
     """执行扫描测试"""
     mode_names = {0: '单步测试', 1: '全扫描'}
@@ -1084,7 +1639,8 @@ def execute_scan(scanner, scan_mode, phase, channel):
         mode_suffix = 'single' if scan_mode == 0 else 'scan'
         ch_suffix = ch_names[channel].lower()
         data_filename = f"tdc_{mode_suffix}_{ch_suffix}_{timestamp}.txt"
-        data_file = processor.save_to_file(data_filename)
+        data_file = processor.save_to_file(data_filename,
+                                           metadata={'board': scanner.board or scanner.host})
         
         # 绘制图表并保存到同一文件夹
         if PLOT_AVAILABLE and len(data) > 10:
@@ -1102,20 +1658,181 @@ def execute_scan(scanner, scan_mode, phase, channel):
         return False
 
 
+def execute_cached_analysis(cache):
+    """对会话缓存中的采集重新分析、重新绘图或比较 (不重新扫描，不读取文件)"""
+    if cache is None:
+        print("[WARN] 会话缓存不可用 (需要 numpy，且未设置 --cache-runs 0)")
+        return False
+    if not cache.runs:
+        print("\n[INFO] 本次会话还没有采集数据，请先执行扫描测试 (选项1或2进行全扫描)")
+        return False
+    
+    print("\n" + cache.describe())
+    key = get_user_input("请选择采集", default=cache.latest(), value_type=int,
+                         valid_range=(min(cache.runs), max(cache.runs)))
+    if key is None:
+        return False
+    if key not in cache.runs:
+        print(f"[ERROR] 采集 [{key}] 已不在缓存中")
+        return False
+    
+    print("\n  1. 重新分析 (完整报告)")
+    print("  2. 重新绘图")
+    print("  3. 与其他采集比较")
+    action = get_user_input("请选择", default=1, value_type=int, valid_range=(1, 3))
+    if action is None:
+        return False
+    
+    run = cache.get(key)
+    if action == 1:
+        cache.reanalyze(key)
+    elif action == 2:
+        processor = cache.reanalyze(key)
+        if len(processor.data_list) > 10:
+            plot_file = None
+            if run.path:
+                plot_file = os.path.splitext(run.path)[0] + '_replot.png'
+            processor.plot(save_file=plot_file)
+    else:
+        others = input("请输入要比较的采集编号 (空格分隔) [全部]: ").strip()
+        try:
+            keys = [int(k) for k in others.split()] if others else sorted(cache.runs)
+        except ValueError:
+            print("[错误] 无效输入")
+            return False
+        keys = [key] + [k for k in keys if k != key and k in cache.runs]
+        for k in keys:
+            if not cache.runs[k].performance:
+                cache.reanalyze(k)
+        table = cache.compare(keys)
+        if not table:
+            print("[WARN] 所选采集都没有性能分析结果")
+            return False
+        print("\n" + f"{'通道':<6}{'指标':<32}" + "".join(f"{'[' + str(k) + ']':>12}" for k in keys))
+        for (channel, metric), values in table.items():
+            cells = "".join(f"{'-':>12}" if v is None else f"{v:>12.4g}" for v in values)
+            print(f"{channel or '-':<6}{metric:<32}{cells}")
+    return True
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    import argparse
+    
+    def fsync_policy(text):
+        """--stream-fsync 的取值: none / batch / rotate / 正的间隔秒数"""
+        if text in ('none', 'batch', 'rotate'):
+            return text
+        try:
+            interval = float(text)
+        except ValueError:
+            interval = 0.0
+        if not interval > 0:
+            raise argparse.ArgumentTypeError(f"应为 none / batch / rotate 或正的间隔秒数: {text!r}")
+        return interval
+    
+    parser = argparse.ArgumentParser(description="TDC 扫描测试程序")
+    parser.add_argument('--host', default='192.168.2.100', help="FPGA 地址")
+    parser.add_argument('--port', type=int, default=1024, help="FPGA 端口")
+    parser.add_argument('--board', default=None,
+                        help="运行目录中记录的板卡名 (默认使用 FPGA 地址)")
+    parser.add_argument('--no-catalog', action='store_true',
+                        help="保存数据时不登记到运行目录 (tdc_results/catalog.sqlite)")
+    parser.add_argument('--record', default=None, metavar='FILE',
+                        help="录制收发的原始字节流 (.tdcraw，可用 tdc_replay.py 回放)")
+    parser.add_argument('--stream', default=None, metavar='DIR',
+                        help="采集过程中把接收到的数据流式写入该目录 (后台线程，按大小/时间轮转)")
+    parser.add_argument('--stream-compress', choices=('gzip', 'lzma', 'bz2'), default=None,
+                        help="流式写入的压缩方式")
+    parser.add_argument('--stream-rotate-mb', type=float, default=64.0,
+                        help="流式写入单个文件的最大大小 (MB)")
+    parser.add_argument('--stream-fsync', type=fsync_policy, default='rotate',
+                        help="fsync 策略: none / batch / rotate / 间隔秒数")
+    parser.add_argument('--stream-pyramid', action='store_true',
+                        help="流式写入时同时生成多分辨率摘要 (tdc_pyramid)")
+    parser.add_argument('--stream-blocks', type=int, default=None, metavar='N',
+                        help="流式写入时同时写入带块索引的分块文件 (每块 N 条，tdc_block_capture)")
+    parser.add_argument('--glitch', action='store_true',
+                        help="采集时在线检测异常数据 (滚动中位数/MAD、标志位、超周期码值)")
+    parser.add_argument('--glitch-threshold', type=float, default=6.0,
+                        help="异常检测阈值 (MAD 倍数)")
+    parser.add_argument('--stability', action='store_true',
+                        help="采集时累加每个 (通道, 相位) 的 Allan 偏差，退出时输出并绘图")
+    parser.add_argument('--cache-runs', type=int, default=20,
+                        help="会话缓存保留的采集次数 (菜单 8 重新分析/比较，0 表示不缓存)")
+    parser.add_argument('--cache-mb', type=float, default=64.0,
+                        help="会话缓存的内存预算 (MB)，超出时最久未使用的采集溢出到磁盘")
+    parser.add_argument('--no-cost-learning', action='store_true',
+                        help="不记录命令实测耗时 (菜单 12 的命令规划使用默认代价)")
+    parser.add_argument('--profile', action='store_true',
+                        help="分阶段性能剖析 (计时 + cProfile + tracemalloc + 折叠调用栈)")
+    parser.add_argument('--profile-dir', default=os.path.join('tdc_results', 'profile'),
+                        help="性能剖析报告输出目录")
+    return parser.parse_args(argv)
+
+
 def main():
     """主程序"""
     import sys
     
+    args = parse_args()
+    
     print("="*70)
     print("TDC 扫描测试程序")
     print("="*70)
     
+    profiler = None
+    if args.profile:
+        from tdc_profile import StageProfiler
+        profiler = StageProfiler(output_dir=args.profile_dir)
+        profiler.instrument_scan_tool(TDCScanner, TDCDataProcessor)
+        profiler.start()
+    
     # 创建扫描器
-    scanner = TDCScanner(host='192.168.2.100', port=1024)
+    scanner = TDCScanner(host=args.host, port=args.port)
+    scanner.board = args.board
+    if args.no_catalog:
+        TDCDataProcessor.CATALOG = None
+    if PLOT_AVAILABLE and args.cache_runs > 0:
+        from tdc_session_cache import AcquisitionCache
+        TDCDataProcessor.SESSION_CACHE = AcquisitionCache(max_runs=args.cache_runs,
+                                                          memory_mb=args.cache_mb)
+    
+    if args.record:
+        from tdc_replay import StreamRecorder
+        scanner.recorder = StreamRecorder(args.record, host=args.host, port=args.port)
+    
+    if args.stream:
+        from tdc_stream_writer import StreamWriter
+        scanner.stream_writer = StreamWriter(output_dir=args.stream,
+                                             max_bytes=int(args.stream_rotate_mb * (1 << 20)),
+                                             compression=args.stream_compress,
+                                             fsync=args.stream_fsync,
+                                             pyramid=args.stream_pyramid,
+                                             block_records=args.stream_blocks)
+    
+    if args.glitch:
+        from tdc_glitch import GlitchDetector
+        scanner.glitch_detector = GlitchDetector(threshold=args.glitch_threshold)
+    
+    if args.stability:
+        from tdc_stability import StabilityAnalyzer
+        scanner.stability_analyzer = StabilityAnalyzer()
+    
+    if not args.no_cost_learning:
+        from tdc_scan_planner import CommandCostModel
+        scanner.cost_model = CommandCostModel.load(scanner.board or scanner.host)
     
     # 连接到FPGA
     if not scanner.connect():
         print("[ERROR] 无法连接到FPGA")
+        if scanner.recorder is not None:
+            scanner.recorder.close()
+        if scanner.stream_writer is not None:
+            scanner.stream_writer.close()
+        if profiler is not None:
+            profiler.stop()
+            profiler.write_report()
         return 1
     
     try:
@@ -1123,7 +1840,7 @@ def main():
         while True:
             show_menu()
             
-            choice = get_user_input("请输入选项", default=1, value_type=int, valid_range=(0, 8))
+            choice = get_user_input("请输入选项", default=1, value_type=int, valid_range=(0, 12))
             if choice is None:
                 continue
             
@@ -1191,7 +1908,49 @@ def main():
                         execute_scan(scanner, scan_mode=1, phase=phase, channel=0b01)
             
             elif choice == 6:
-                # 连续单步扫描
+                # 连续单步扫描 (有未完成的任务时可续传)
+                campaign = select_campaign_to_resume('single')
+                if campaign is not None:
+                    run_campaign(scanner, campaign, 'tdc_continuous')
+                else:
+                    print("\n选择通道:")
+                    print("  1. UP 通道")
+                    print("  2. DOWN 通道")
+                    print("  3. 双通道 (BOTH)")
+                    ch_choice = get_user_input("请选择", default=3, value_type=int, valid_range=(1, 3))
+                    if ch_choice is None:
+                        continue
+                    
+                    channel_map = {1: 0b10, 2: 0b01, 3: 0b11}
+                    channel = channel_map[ch_choice]
+                    
+                    print("\n提示: 225步(0-224)可覆盖完整3864ps周期")
+                    start_phase = get_user_input("请输入起始相位 (0-255)", default=0, 
+                                                value_type=int, valid_range=(0, 255))
+                    if start_phase is None:
+                        continue
+                    
+                    end_phase = get_user_input("请输入结束相位 (0-255, 推荐224)", default=224, 
+                                              value_type=int, valid_range=(start_phase, 255))
+                    if end_phase is not None:
+                        execute_continuous_single_scan(scanner, start_phase, end_phase, channel)
+            
+            elif choice == 7:
+                # 校准
+                print("\n[INFO] 启动 TDC 校准...")
+                confirm = input("确认启动校准? (y/n) [y]: ").strip().lower()
+                if not confirm or confirm in ['y', 'yes']:
+                    if scanner.start_calibration(wait=True):
+                        print("[INFO] 校准命令已发送")
+                    else:
+                        print("[ERROR] 校准命令发送失败")
+            
+            elif choice == 8:
+                # TDC性能分析 (会话缓存中的采集)
+                execute_cached_analysis(TDCDataProcessor.SESSION_CACHE)
+            
+            elif choice == 9:
+                # 自适应扫描
                 print("\n选择通道:")
                 print("  1. UP 通道")
                 print("  2. DOWN 通道")
@@ -1201,34 +1960,87 @@ def main():
                     continue
                 
                 channel_map = {1: 0b10, 2: 0b01, 3: 0b11}
-                channel = channel_map[ch_choice]
-                
-                print("\n提示: 225步(0-224)可覆盖完整3864ps周期")
-                start_phase = get_user_input("请输入起始相位 (0-255)", default=0, 
-                                            value_type=int, valid_range=(0, 255))
-                if start_phase is None:
+                coarse_step = get_user_input("请输入粗扫描间隔 (1-32)", default=8,
+                                            value_type=int, valid_range=(1, 32))
+                if coarse_step is None:
+                    continue
+                target_inl = get_user_input("请输入目标INL标准误差 (ps)", default=5.0,
+                                           value_type=float, valid_range=(0.1, 100.0))
+                if target_inl is not None:
+                    execute_adaptive_scan(scanner, channel_map[ch_choice],
+                                          coarse_step=coarse_step, target_inl_ps=target_inl)
+            
+            elif choice == 10:
+                # 单相位精度测量
+                print("\n选择通道:")
+                print("  1. UP 通道")
+                print("  2. DOWN 通道")
+                print("  3. 双通道 (BOTH)")
+                ch_choice = get_user_input("请选择", default=3, value_type=int, valid_range=(1, 3))
+                if ch_choice is None:
                     continue
                 
-                end_phase = get_user_input("请输入结束相位 (0-255, 推荐224)", default=224, 
-                                          value_type=int, valid_range=(start_phase, 255))
-                if end_phase is not None:
-                    execute_continuous_single_scan(scanner, start_phase, end_phase, channel)
+                channel_map = {1: 0b10, 2: 0b01, 3: 0b11}
+                phase = get_user_input("请输入测试相位 (0-255)", default=100,
+                                      value_type=int, valid_range=(0, 255))
+                if phase is None:
+                    continue
+                target_hits = get_user_input("请输入每通道测量次数", default=1000000,
+                                            value_type=int, valid_range=(100, 100000000))
+                if target_hits is not None:
+                    execute_precision_measurement(scanner, phase, channel_map[ch_choice], target_hits)
             
-            elif choice == 7:
-                # 校准
-                print("\n[INFO] 启动 TDC 校准...")
-                confirm = input("确认启动校准? (y/n) [y]: ").strip().lower()
-                if not confirm or confirm in ['y', 'yes']:
-                    if scanner.start_calibration():
-                        print("[INFO] 校准命令已发送")
-                    else:
-                        print("[ERROR] 校准命令发送失败")
+            elif choice == 11:
+                # 长时间扫描 + 自动校准 (有未完成的任务时可续传)
+                campaign = select_campaign_to_resume('sweep')
+                if campaign is not None:
+                    resume_long_run(scanner, campaign)
+                else:
+                    print("\n选择通道:")
+                    print("  1. UP 通道")
+                    print("  2. DOWN 通道")
+                    print("  3. 双通道 (BOTH)")
+                    ch_choice = get_user_input("请选择", default=3, value_type=int, valid_range=(1, 3))
+                    if ch_choice is None:
+                        continue
+                    
+                    channel_map = {1: 0b10, 2: 0b01, 3: 0b11}
+                    end_phase = get_user_input("请输入结束相位 (0-255, 推荐224)", default=224,
+                                              value_type=int, valid_range=(0, 255))
+                    if end_phase is None:
+                        continue
+                    duration = get_user_input("请输入采集时长 (分钟)", default=60.0,
+                                             value_type=float, valid_range=(0.1, 10000.0))
+                    if duration is None:
+                        continue
+                    threshold = get_user_input("请输入校准触发阈值 (ps)", default=10.0,
+                                              value_type=float, valid_range=(0.5, 1000.0))
+                    if threshold is not None:
+                        execute_long_run(scanner, end_phase, channel_map[ch_choice], duration,
+                                         threshold_ps=threshold)
             
-            elif choice == 8:
-                # TDC性能分析
-                print("\n[INFO] 请首先执行全扫描测试获取数据...")
-                print("建议：选择选项1或选2进行0-255全扫描")
-                print("此功能将分析最近一次测试的数据")
+            elif choice == 12:
+                # 指定相位集合扫描 (自动规划命令)
+                from tdc_scan_planner import parse_phases
+                print("\n选择通道:")
+                print("  1. UP 通道")
+                print("  2. DOWN 通道")
+                print("  3. 双通道 (BOTH)")
+                ch_choice = get_user_input("请选择", default=3, value_type=int, valid_range=(1, 3))
+                if ch_choice is None:
+                    continue
+                
+                channel_map = {1: 0b10, 2: 0b01, 3: 0b11}
+                spec = input("请输入相位集合 (如 100-180 或 0-10,50,200-224) [默认=0-224]: ").strip()
+                try:
+                    phases = parse_phases(spec or '0-224')
+                except ValueError as e:
+                    print(f"[ERROR] {e}")
+                    continue
+                repeats = get_user_input("请输入每个相位的重复次数", default=1,
+                                        value_type=int, valid_range=(1, 10000))
+                if repeats is not None:
+                    execute_planned_scan(scanner, phases, repeats, channel_map[ch_choice])
             
             # 询问是否继续
             print("\n" + "-"*70)
@@ -1249,6 +2061,30 @@ def main():
         return 1
     finally:
         scanner.disconnect()
+        if scanner.recorder is not None:
+            scanner.recorder.close()
+        if scanner.stream_writer is not None:
+            scanner.stream_writer.close()
+        if scanner.glitch_detector is not None:
+            print(scanner.glitch_detector.summary())
+        if scanner.stability_analyzer is not None:
+            print(scanner.stability_analyzer.summary())
+            results = scanner.stability_analyzer.results()
+            if results and PLOT_AVAILABLE:
+                from tdc_stability import plot_stability
+                os.makedirs('tdc_results', exist_ok=True)
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                plot_stability(results, save_file=os.path.join(
+                    'tdc_results', f"tdc_stability_{timestamp}.png"))
+        if TDCDataProcessor.SESSION_CACHE is not None:
+            TDCDataProcessor.SESSION_CACHE.close()
+        if scanner.cost_model is not None and any(scanner.cost_model.observations.values()):
+            print(f"[INFO] {scanner.cost_model.describe()}")
+            scanner.cost_model.save(scanner.board or scanner.host)
+        if profiler is not None:
+            profiler.stop()
+            profiler.write_report()
+            profiler.uninstrument()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 扫描命令规划
+固件只有两种扫描命令: 全扫描 (SCAN_FULL，总是从相位 0 扫到指定相位) 和单步 (SCAN_SINGLE)。
+任意相位集合 (如 100-180) 逐相位单步需要每个相位一次往返；一次扫到最高相位再丢弃
+不需要的点往往更快。规划器把 "每个相位需要的重复次数" 转换为总耗时最小的命令序列:
+
+  覆盖数 c(p) = 结束相位 >= p 的全扫描次数 (随 p 单调不增)
+  代价 = Σ全扫描 (a_full + b_full × 点数) + a_single × Σ max(0, need(p) - c(p))
+  从最高相位向下动态规划 c(p)，O(相位数 × 最大重复次数)，结果为全局最优
+  (可能是纯全扫描、纯单步，或 "全扫描覆盖低相位 + 单步补高相位" 的组合)
+
+每条命令的耗时由实测学习 (CommandCostModel): TDCScanner 在每次完整接收后记录
+从发送命令到收齐数据的时间，单步取指数加权均值，全扫描对点数做指数加权线性回归。
+学习结果按板卡保存在 tdc_results/scan_costs.json，下次会话直接使用。
+
+用法:
+  python tdc_scan.py                                       菜单 12: 指定相位扫描 (自动规划)
+  python tdc_scan_planner.py 100-180 --repeats 4           查看规划 (使用已学习的代价)
+  python tdc_scan_planner.py 0-20,200-224 --single 0.01 --full 0.02 0.0001
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+SCAN_SINGLE = 0
+SCAN_FULL = 1
+MAX_PHASE = 255
+
+COST_FILE = os.path.join('tdc_results', 'scan_costs.json')
+
+
+def parse_phases(spec):
+    """
+    解析相位集合: "100-180", "0-10,50,200-224"
+
+    Returns:
+        list: 升序、去重的相位
+    """
+    phases = set()
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = (int(v) for v in part.split('-', 1))
+            if lo > hi:
+                lo, hi = hi, lo
+            phases.update(range(lo, hi + 1))
+        else:
+            phases.add(int(part))
+    if not phases or min(phases) < 0 or max(phases) > MAX_PHASE:
+        raise ValueError(f"相位必须在 0-{MAX_PHASE} 之间: {spec}")
+    return sorted(phases)
+
+
+def format_phases(phases):
+    """相位列表 -> 区间文本 (parse_phases 的逆运算)"""
+    phases = sorted(phases)
+    parts = []
+    start = prev = None
+    for p in phases + [None]:
+        if start is not None and p == prev + 1:
+            prev = p
+            continue
+        if start is not None:
+            parts.append(str(start) if start == prev else f"{start}-{prev}")
+        start = prev = p
+    return ",".join(parts)
+
+
+class CommandCostModel:
+    """每条扫描命令耗时的在线估计"""
+
+    def __init__(self, single=0.02, full=(0.02, 5e-5), prior_weight=2.0, decay=0.98):
+        """
+        Args:
+            single: 单步命令耗时先验 (秒)
+            full: 全扫描耗时先验 (固定开销 秒, 每个相位 秒)
+            prior_weight: 先验相当于的观测次数
+            decay: 每次观测后旧数据的权重衰减 (适应网络/主机负载的变化)
+        """
+        self.decay = decay
+        self.observations = {SCAN_SINGLE: 0, SCAN_FULL: 0}
+        # 单步: 加权和 [Σw, Σwy]
+        self._single = np.array([prior_weight, prior_weight * single])
+        # 全扫描: 加权和 [Σw, Σwx, Σwxx, Σwy, Σwxy]，x = 相位数；先验放在两端的伪观测上
+        self._full = np.zeros(5)
+        intercept, slope = full
+        for x in (1, 225):
+            self._accumulate_full(x, intercept + slope * x, prior_weight / 2)
+
+    def _accumulate_full(self, x, y, w=1.0):
+        self._full += w * np.array([1.0, x, x * x, y, x * y])
+
+    def observe(self, scan_mode, phase, seconds):
+        """
+        记录一条命令的实测耗时
+
+        Args:
+            scan_mode: SCAN_SINGLE / SCAN_FULL
+            phase: 命令的相位参数 (全扫描为结束相位)
+            seconds: 从发送命令到收齐数据的时间
+        """
+        if scan_mode == SCAN_FULL:
+            self._full *= self.decay
+            self._accumulate_full(phase + 1, seconds)
+        else:
+            self._single *= self.decay
+            self._single += [1.0, seconds]
+        self.observations[scan_mode] += 1
+
+    @property
+    def single(self):
+        """单步命令耗时估计 (秒)"""
+        return self._single[1] / self._single[0]
+
+    @property
+    def full(self):
+        """
+        全扫描耗时模型
+
+        Returns:
+            tuple: (固定开销, 每个相位的耗时) 秒，均不小于 0
+        """
+        w, sx, sxx, sy, sxy = self._full
+        var = w * sxx - sx * sx
+        slope = (w * sxy - sx * sy) / var if var > 1e-12 * w * sxx else 0.0
+        slope = max(slope, 0.0)
+        intercept = max((sy - slope * sx) / w, 0.0)
+        return intercept, slope
+
+    def cost(self, scan_mode, phase):
+        """一条命令的预计耗时 (秒)"""
+        if scan_mode == SCAN_FULL:
+            intercept, slope = self.full
+            return intercept + slope * (phase + 1)
+        return self.single
+
+    def describe(self):
+        intercept, slope = self.full
+        return (f"命令耗时: 单步 {self.single * 1000:.1f} ms ({self.observations[SCAN_SINGLE]} 次实测), "
+                f"全扫描 {intercept * 1000:.1f} ms + {slope * 1e6:.1f} us/相位 "
+                f"({self.observations[SCAN_FULL]} 次实测)")
+
+    # ------------------------------------------------------------------
+    # 保存与加载 (按板卡)
+    # ------------------------------------------------------------------
+    def to_dict(self):
+        return {
+            'single': self._single.tolist(),
+            'full': self._full.tolist(),
+            'observations': [self.observations[SCAN_SINGLE], self.observations[SCAN_FULL]],
+            'decay': self.decay,
+            'updated': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        model = cls(decay=state.get('decay', 0.98))
+        model._single = np.array(state['single'], dtype=float)
+        model._full = np.array(state['full'], dtype=float)
+        model.observations = dict(zip((SCAN_SINGLE, SCAN_FULL), state['observations']))
+        return model
+
+    @classmethod
+    def load(cls, board, path=COST_FILE):
+        """读取板卡已学习的代价 (没有记录时返回先验模型)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls.from_dict(json.load(f)[board])
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls()
+
+    def save(self, board, path=COST_FILE):
+        """保存到代价文件 (保留其他板卡的记录)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                table = json.load(f)
+        except (OSError, ValueError):
+            table = {}
+        table[board] = self.to_dict()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(table, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+class ScanPlan:
+    """规划结果: 命令序列与预计耗时"""
+
+    def __init__(self, need, commands, cost, cost_model):
+        self.need = need
+        self.commands = commands
+        self.cost = cost
+        self.phases = [int(p) for p in np.flatnonzero(need)]
+        self.sweeps = sum(1 for mode, _ in commands if mode == SCAN_FULL)
+        self.singles = len(commands) - self.sweeps
+        # 对照: 全部单步 / 全部全扫描 (扫到最高相位)
+        self.single_cost = int(need.sum()) * cost_model.cost(SCAN_SINGLE, 0)
+        self.full_cost = int(need.max()) * cost_model.cost(SCAN_FULL, self.phases[-1])
+
+    def expected_count(self, scan_mode, phase, channel):
+        """一条命令应收到的数据个数"""
+        per_phase = 2 if channel == 0b11 else 1
+        return per_phase * (phase + 1 if scan_mode == SCAN_FULL else 1)
+
+    def describe(self):
+        lines = [f"相位 {format_phases(self.phases)} ({len(self.phases)} 个), "
+                 f"重复 {int(self.need.max())} 次",
+                 f"规划: {self.sweeps} 次全扫描 + {self.singles} 条单步命令, 预计 {self.cost:.2f} s"]
+        ends = sorted({phase for mode, phase in self.commands if mode == SCAN_FULL})
+        if ends:
+            lines.append("  全扫描结束相位: " + ", ".join(map(str, ends)))
+        lines.append(f"  对照: 全部单步 {self.single_cost:.2f} s, 全部全扫描 {self.full_cost:.2f} s")
+        return "\n".join(lines)
+
+
+class ScanPlanner:
+    """相位集合 -> 总耗时最小的扫描命令序列"""
+
+    def __init__(self, cost_model=None, single_pause=0.0):
+        """
+        Args:
+            cost_model: CommandCostModel (默认先验)
+            single_pause: 每条单步命令之后的等待 (秒，计入单步代价)
+        """
+        self.cost_model = cost_model or CommandCostModel()
+        self.single_pause = single_pause
+
+    def plan(self, phases, repeats=1):
+        """
+        规划命令序列
+
+        Args:
+            phases: 相位列表，或 {相位: 重复次数}
+            repeats: phases 为列表时每个相位的重复次数
+
+        Returns:
+            ScanPlan
+        """
+        need = np.zeros(MAX_PHASE + 1, dtype=np.int64)
+        if isinstance(phases, dict):
+            for phase, count in phases.items():
+                need[phase] = count
+        else:
+            need[list(phases)] = repeats
+        if not need.any():
+            raise ValueError("没有需要测量的相位")
+
+        model = self.cost_model
+        single = model.cost(SCAN_SINGLE, 0) + self.single_pause
+        intercept, slope = model.full
+        top = int(np.flatnonzero(need)[-1])
+        max_repeat = int(need.max())
+
+        # dp[c] = 相位 p..top 在 c(p) = c 时的最小代价；choice[p][c] = 此时 c(p+1) 的最优取值
+        levels = np.arange(max_repeat + 1)
+        dp = np.full(max_repeat + 1, np.inf)
+        dp[0] = 0.0
+        choice = np.zeros((top + 1, max_repeat + 1), dtype=np.int64)
+        for p in range(top, -1, -1):
+            # c(p) >= c(p+1): 对上一层取前缀最小值
+            best = np.minimum.accumulate(dp)
+            is_new = np.r_[True, dp[1:] < best[:-1]]
+            choice[p] = np.maximum.accumulate(np.where(is_new, levels, 0))
+            dp = best + slope * levels + single * np.maximum(need[p] - levels, 0)
+        total = dp + intercept * levels
+        coverage = [int(np.argmin(total))]
+        cost = float(total[coverage[0]])
+        for p in range(top):
+            coverage.append(int(choice[p][coverage[-1]]))
+        coverage.append(0)
+
+        # c(p) - c(p+1) 次全扫描结束于相位 p (从高到低发送)；其余由单步补足，按轮次交替相位
+        commands = []
+        for p in range(top, -1, -1):
+            commands += [(SCAN_FULL, p)] * (coverage[p] - coverage[p + 1])
+        deficit = np.maximum(need[:top + 1] - np.array(coverage[:top + 1]), 0)
+        for r in range(int(deficit.max()) if deficit.any() else 0):
+            commands += [(SCAN_SINGLE, int(p)) for p in np.flatnonzero(deficit > r)]
+        return ScanPlan(need, commands, cost, model)
+
+    def run(self, scanner, plan, channel=0b11, timeout=5.0):
+        """
+        执行规划: 发送命令、收集数据，丢弃未请求相位的数据
+
+        Args:
+            scanner: 已连接的 TDCScanner (其 cost_model 在接收完成后自动更新)
+            plan: ScanPlan
+            channel: 通道选择
+            timeout: 每条命令的接收超时 (秒)
+
+        Returns:
+            list: 请求相位的数据 (receive_data 格式)
+        """
+        wanted = plan.need > 0
+        data_list = []
+        discarded = 0
+        start = time.time()
+        for i, (scan_mode, phase) in enumerate(plan.commands):
+            expected = plan.expected_count(scan_mode, phase, channel)
+            if not scanner.start_scan(scan_mode=scan_mode, phase=phase, channel=channel):
+                print(f"[ERROR] 第 {i + 1}/{len(plan.commands)} 条命令发送失败，停止执行")
+                break
+            data = scanner.receive_data(expected_count=expected, timeout=timeout)
+            if len(data) < expected:
+                print(f"[WARN] 第 {i + 1} 条命令 (相位 {phase}) 只收到 {len(data)}/{expected} 个数据")
+            kept = [d for d in data if d['id'] <= MAX_PHASE and wanted[d['id']]]
+            discarded += len(data) - len(kept)
+            data_list.extend(kept)
+            if scan_mode == SCAN_SINGLE and self.single_pause:
+                time.sleep(self.single_pause)
+        print(f"[INFO] 执行 {len(plan.commands)} 条命令用时 {time.time() - start:.2f} s "
+              f"(预计 {plan.cost:.2f} s), 丢弃未请求相位的数据 {discarded} 个")
+        return data_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 扫描命令规划")
+    parser.add_argument('phases', help="相位集合，如 100-180 或 0-10,50,200-224")
+    parser.add_argument('--repeats', type=int, default=1, help="每个相位的重复次数")
+    parser.add_argument('--board', default='192.168.2.100', help="使用该板卡已学习的代价")
+    parser.add_argument('--costs', default=COST_FILE, help="代价文件")
+    parser.add_argument('--single', type=float, default=None, help="单步命令耗时 (秒)")
+    parser.add_argument('--full', type=float, nargs=2, default=None, metavar=('FIXED', 'PER_PHASE'),
+                        help="全扫描耗时: 固定开销与每个相位的耗时 (秒)")
+    parser.add_argument('--commands', action='store_true', help="列出全部命令")
+    args = parser.parse_args()
+
+    if args.single is not None or args.full is not None:
+        default = CommandCostModel()
+        model = CommandCostModel(single=args.single if args.single is not None else default.single,
+                                 full=tuple(args.full) if args.full else default.full)
+    else:
+        model = CommandCostModel.load(args.board, args.costs)
+    print(f"[INFO] {model.describe()}")
+
+    plan = ScanPlanner(model).plan(parse_phases(args.phases), args.repeats)
+    print(plan.describe())
+    if args.commands:
+        for scan_mode, phase in plan.commands:
+            print(f"  {'SCAN_FULL  ' if scan_mode == SCAN_FULL else 'SCAN_SINGLE'} {phase}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
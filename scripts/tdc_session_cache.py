@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 采集会话缓存
+保留本次会话最近 N 次采集，重新分析、比较、重新绘图无需重新扫描或解析文本文件:
+  - 每次采集只保存原始数据字 (uint32 列，4 字节/条)，需要时向量化解码
+  - 同时保存采集时的性能分析结果，比较多次采集不需要重新分析
+  - 内存预算: 超出时把最久未使用的采集溢出到磁盘 (.npy)，再次访问时读回
+  - 超出 max_runs 时丢弃最旧的采集 (采集文件本身仍在 tdc_results 中)
+
+用法:
+  python tdc_scan.py [--cache-runs 20] [--cache-mb 64]     菜单 8: 分析最近的采集
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from tdc_words import decode_records, decode_words, to_data_list
+
+
+class CachedRun:
+    """缓存中的一次采集"""
+
+    def __init__(self, key, label, words, performance=None, metadata=None, path=None):
+        self.key = key
+        self.label = label
+        self.created = time.time()
+        self.words = words
+        self.count = len(words)
+        self.performance = performance
+        self.metadata = dict(metadata or {})
+        self.path = path
+        # 溢出到磁盘后的文件 (words 为 None)
+        self.spill_path = None
+
+    @property
+    def in_memory(self):
+        return self.words is not None
+
+    @property
+    def nbytes(self):
+        return self.count * 4
+
+
+class AcquisitionCache:
+    """最近 N 次采集的 LRU 缓存 (内存预算 + 磁盘溢出)"""
+
+    def __init__(self, max_runs=20, memory_mb=64.0, spill_dir=None):
+        """
+        Args:
+            max_runs: 保留的采集次数上限
+            memory_mb: 内存中数据字的预算 (MB)
+            spill_dir: 溢出目录 (默认临时目录，close 时删除)
+        """
+        self.max_runs = max_runs
+        self.memory_budget = int(memory_mb * (1 << 20))
+        self._own_spill_dir = spill_dir is None
+        self.spill_dir = spill_dir
+        # 按最近使用排序: 末尾为最近使用
+        self.runs = OrderedDict()
+        self._next_key = 1
+        self.spills = 0
+        self.reloads = 0
+
+    @property
+    def memory_bytes(self):
+        """内存中数据字的总大小"""
+        return sum(run.nbytes for run in self.runs.values() if run.in_memory)
+
+    def add(self, data_list, label, performance=None, metadata=None, path=None):
+        """
+        加入一次采集
+
+        Args:
+            data_list: receive_data 格式的数据列表
+            label: 显示名 (通常为采集文件名)
+            performance: 性能分析结果 (TDCDataProcessor.process 的返回值)
+            metadata: 附加信息 (board 等)
+            path: 采集文件路径
+
+        Returns:
+            int: 缓存键
+        """
+        words = np.fromiter((d['raw'] for d in data_list), dtype=np.uint32, count=len(data_list))
+        key = self._next_key
+        self._next_key += 1
+        self.runs[key] = CachedRun(key, label, words, performance, metadata, path)
+        while len(self.runs) > self.max_runs:
+            _, oldest = self.runs.popitem(last=False)
+            self._discard(oldest)
+        self._enforce_budget(keep=key)
+        return key
+
+    def get(self, key):
+        """
+        取出一次采集 (标记为最近使用，已溢出时从磁盘读回)
+
+        Returns:
+            CachedRun
+        """
+        run = self.runs[key]
+        self.runs.move_to_end(key)
+        if not run.in_memory:
+            run.words = np.load(run.spill_path)
+            self.reloads += 1
+            self._enforce_budget(keep=key)
+        return run
+
+    def latest(self):
+        """最近一次加入的采集的键 (缓存为空时为 None)"""
+        return max(self.runs) if self.runs else None
+
+    def records(self, key):
+        """RECORD_DTYPE 结构化数组"""
+        return decode_records(self.get(key).words)
+
+    def data_list(self, key):
+        """receive_data 格式的数据列表"""
+        return to_data_list(decode_words(self.get(key).words))
+
+    def processor(self, key):
+        """由缓存数据构造 TDCDataProcessor (未调用 process)"""
+        from tdc_scan import TDCDataProcessor
+        return TDCDataProcessor(self.data_list(key))
+
+    def reanalyze(self, key):
+        """
+        重新分析一次采集并更新缓存的性能结果
+
+        Returns:
+            TDCDataProcessor: 已完成 process 的处理器 (可直接 plot)
+        """
+        processor = self.processor(key)
+        self.runs[key].performance = processor.process()
+        return processor
+
+    def compare(self, keys, metrics=None):
+        """
+        比较多次采集的性能指标 (使用缓存的分析结果)
+
+        Args:
+            keys: 缓存键列表
+            metrics: 只比较这些指标 (如 'inl.rms_lsb')，默认全部
+
+        Returns:
+            dict: {(通道, 指标): [各采集的值 (无此指标为 None)]}
+        """
+        from tdc_catalog import flatten_performance
+        table = {}
+        for i, key in enumerate(keys):
+            for channel, metric, value in flatten_performance(self.runs[key].performance):
+                if metrics is not None and metric not in metrics:
+                    continue
+                table.setdefault((channel, metric), [None] * len(keys))[i] = value
+        return dict(sorted(table.items()))
+
+    def describe(self):
+        """缓存内容文本 (按加入顺序)"""
+        lines = [f"会话缓存: {len(self.runs)} 次采集, 内存 {self.memory_bytes / (1 << 20):.1f}/"
+                 f"{self.memory_budget / (1 << 20):.0f} MB, 溢出 {self.spills} 次, 读回 {self.reloads} 次"]
+        for key in sorted(self.runs):
+            run = self.runs[key]
+            where = '内存' if run.in_memory else '磁盘'
+            analyzed = '已分析' if run.performance else '未分析'
+            lines.append(f"  [{key}] {time.strftime('%H:%M:%S', time.localtime(run.created))} "
+                         f"{run.label} ({run.count} 条, {where}, {analyzed})")
+        return "\n".join(lines)
+
+    def close(self):
+        """删除溢出文件"""
+        for run in self.runs.values():
+            self._discard(run)
+        self.runs.clear()
+        if self._own_spill_dir and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+    def _enforce_budget(self, keep):
+        """按最久未使用的顺序溢出，直到内存占用不超过预算 (keep 本身不溢出)"""
+        for key, run in list(self.runs.items()):
+            if self.memory_bytes <= self.memory_budget:
+                break
+            if key != keep and run.in_memory:
+                self._spill(run)
+
+    def _spill(self, run):
+        if run.spill_path is None:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix='tdc_cache_')
+            os.makedirs(self.spill_dir, exist_ok=True)
+            run.spill_path = os.path.join(self.spill_dir, f"run_{run.key}.npy")
+            np.save(run.spill_path, run.words)
+        run.words = None
+        self.spills += 1
+
+    def _discard(self, run):
+        if run.spill_path is not None:
+            try:
+                os.remove(run.spill_path)
+            except OSError:
+                pass
+            run.spill_path = None
+        run.words = None
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 共享内存环形缓冲区 (多进程扇出)
+一个接收进程从 TCP 读取数据字、向量化解码后写入 multiprocessing.shared_memory 环；
+多个消费进程 (写文件、统计、显示) 各自持有独立的读游标，零拷贝读取同一批数据。
+
+  - 写入方从不等待读者: 读者落后超过环长度时跳到最旧的可用批次，
+    并通过 lost / on_overrun 得知丢失的批次数
+  - 每个槽位带序号 (seqlock): 读者可用 still_valid() 检查零拷贝视图是否已被覆盖
+
+共享内存布局:
+  头部    int64[8]           写序号、槽位数、槽位容量、关闭标志、魔数
+  槽位表  int64[n_slots, 2]  每个槽位的 (批次序号, 记录数)
+  数据区  RECORD_DTYPE[n_slots, slot_records]
+
+用法:
+  python tdc_shm_ring.py --seconds 10 [--phase 224] [--out capture.bin] [--status 1.0]
+"""
+
+import argparse
+import os
+import queue
+import socket
+import sys
+import time
+from multiprocessing import Process, Queue, parent_process, shared_memory
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from tdc_histogram import TDCHistogram
+from tdc_words import RECORD_DTYPE, words_from_bytes, decode_records
+
+
+class ShmRing:
+    """共享内存中的单写多读批次环"""
+
+    _MAGIC = 0x54444352     # 'TDCR'
+    _HEADER_WORDS = 8
+    # 头部字段索引
+    _WRITE_SEQ, _N_SLOTS, _SLOT_RECORDS, _CLOSED, _MAGIC_IDX = range(5)
+    # 本进程创建的共享内存名称 (已由本进程的 resource_tracker 登记)
+    _created = set()
+
+    def __init__(self, shm, owner):
+        """请使用 create() / attach() 构造"""
+        self.shm = shm
+        self.owner = owner
+        self._header = np.ndarray((self._HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if self._header[self._MAGIC_IDX] != self._MAGIC:
+            raise ValueError(f"共享内存 {shm.name} 不是 TDC 环形缓冲区")
+        self.n_slots = int(self._header[self._N_SLOTS])
+        self.slot_records = int(self._header[self._SLOT_RECORDS])
+
+        meta_offset = self._HEADER_WORDS * 8
+        data_offset = self._data_offset(self.n_slots)
+        self._meta = np.ndarray((self.n_slots, 2), dtype=np.int64,
+                                buffer=shm.buf, offset=meta_offset)
+        self._data = np.ndarray((self.n_slots, self.slot_records), dtype=RECORD_DTYPE,
+                                buffer=shm.buf, offset=data_offset)
+
+    @classmethod
+    def _data_offset(cls, n_slots):
+        offset = cls._HEADER_WORDS * 8 + n_slots * 16
+        return (offset + 63) // 64 * 64
+
+    @classmethod
+    def create(cls, n_slots=64, slot_records=16384, name=None):
+        """
+        创建新的环形缓冲区 (写入方调用)
+
+        Args:
+            n_slots: 槽位数 (可回溯的批次数)
+            slot_records: 每个槽位最多容纳的记录数
+            name: 共享内存名称 (默认自动生成)
+        """
+        size = cls._data_offset(n_slots) + n_slots * slot_records * RECORD_DTYPE.itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((cls._HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[cls._N_SLOTS] = n_slots
+        header[cls._SLOT_RECORDS] = slot_records
+        np.ndarray((n_slots, 2), dtype=np.int64, buffer=shm.buf,
+                   offset=cls._HEADER_WORDS * 8)[:] = -1
+        header[cls._MAGIC_IDX] = cls._MAGIC
+        cls._created.add(shm.name)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """按名称连接已有的环形缓冲区 (其他进程调用)"""
+        try:
+            # Python 3.13+: 连接方不注册到 resource_tracker，由创建方负责删除
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            # 创建方进程及其由 multiprocessing 启动的子进程共用 resource_tracker，注册是幂等的；
+            # 独立启动的进程有自己的 tracker，退出时会删除共享内存，需要取消注册
+            # (POSIX 上注册的名称带前导 '/')
+            shared = parent_process() is not None or name in cls._created
+            if os.name == 'posix' and not shared:
+                resource_tracker.unregister('/' + shm.name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_seq(self):
+        """下一个要写入的批次序号 (即已发布的批次数)"""
+        return int(self._header[self._WRITE_SEQ])
+
+    @property
+    def closed(self):
+        return bool(self._header[self._CLOSED])
+
+    # ------------------------------------------------------------------
+    # 写入方
+    # ------------------------------------------------------------------
+    def _begin(self):
+        seq = self.write_seq
+        slot = seq % self.n_slots
+        # 先作废槽位序号，读者据此发现正在被覆盖的槽位
+        self._meta[slot, 0] = -1
+        return seq, slot
+
+    def _commit(self, seq, slot, count):
+        self._meta[slot, 1] = count
+        self._meta[slot, 0] = seq
+        self._header[self._WRITE_SEQ] = seq + 1
+
+    def publish_words(self, words):
+        """
+        解码数据字并直接写入槽位 (超过槽位容量时拆分为多个批次)
+
+        Returns:
+            int: 发布的批次数
+        """
+        batches = 0
+        for i in range(0, len(words), self.slot_records):
+            chunk = words[i:i + self.slot_records]
+            seq, slot = self._begin()
+            decode_records(chunk, out=self._data[slot])
+            self._commit(seq, slot, len(chunk))
+            batches += 1
+        return batches
+
+    def publish(self, records):
+        """写入已解码的 RECORD_DTYPE 记录"""
+        batches = 0
+        for i in range(0, len(records), self.slot_records):
+            chunk = records[i:i + self.slot_records]
+            seq, slot = self._begin()
+            self._data[slot, :len(chunk)] = chunk
+            self._commit(seq, slot, len(chunk))
+            batches += 1
+        return batches
+
+    def mark_closed(self):
+        """通知所有读者数据流结束"""
+        self._header[self._CLOSED] = 1
+
+    # ------------------------------------------------------------------
+    # 读取方
+    # ------------------------------------------------------------------
+    def reader(self, start='oldest', on_overrun=None):
+        """
+        创建独立游标的读者
+
+        Args:
+            start: 'oldest' 从最旧的可用批次开始, 'latest' 只读新批次
+            on_overrun: 落后丢批时的回调 on_overrun(lost_batches)
+        """
+        return RingReader(self, start, on_overrun)
+
+    def close(self):
+        """释放本进程的映射 (创建方同时删除共享内存)"""
+        # 先释放 numpy 视图，否则 mmap 无法关闭
+        self._header = self._meta = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            self._created.discard(self.shm.name)
+
+
+class RingReader:
+    """环形缓冲区上的一个读游标"""
+
+    def __init__(self, ring, start='oldest', on_overrun=None):
+        self.ring = ring
+        self.on_overrun = on_overrun
+        write_seq = ring.write_seq
+        if start == 'latest':
+            self.cursor = write_seq
+        else:
+            self.cursor = max(0, write_seq - ring.n_slots)
+        self.lost = 0
+        self.batches = 0
+        self.records = 0
+        self._last = None
+
+    def _skip(self, n):
+        self.lost += n
+        self.cursor += n
+        if self.on_overrun is not None:
+            self.on_overrun(n)
+
+    def read(self, timeout=None, poll=0.0005):
+        """
+        读取下一批记录 (零拷贝视图)
+
+        视图在写入方绕环一周后会被覆盖，需要长期保留时请 copy()，
+        或处理后调用 still_valid() 确认。
+
+        Args:
+            timeout: 等待新数据的最长时间 (秒)，None 表示一直等待
+            poll: 轮询间隔 (秒)
+
+        Returns:
+            numpy.ndarray: RECORD_DTYPE 记录视图；超时或数据流结束时返回 None
+        """
+        ring = self.ring
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            write_seq = ring.write_seq
+            if self.cursor >= write_seq:
+                if ring.closed:
+                    return None
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                time.sleep(poll)
+                continue
+
+            # 落后超过环长度: 跳到最旧的可用批次
+            behind = write_seq - self.cursor
+            if behind > ring.n_slots:
+                self._skip(behind - ring.n_slots)
+
+            slot = self.cursor % ring.n_slots
+            count = int(ring._meta[slot, 1])
+            if ring._meta[slot, 0] != self.cursor:
+                # 读取期间槽位已被写入方覆盖
+                self._skip(1)
+                continue
+
+            batch = ring._data[slot, :count]
+            self._last = (slot, self.cursor)
+            self.cursor += 1
+            self.batches += 1
+            self.records += count
+            return batch
+
+    def still_valid(self):
+        """上一次 read() 返回的视图是否仍未被覆盖"""
+        if self._last is None:
+            return False
+        slot, seq = self._last
+        return self.ring._meta[slot, 0] == seq
+
+    def lag(self):
+        """落后写入方的批次数"""
+        return self.ring.write_seq - self.cursor
+
+    def __iter__(self):
+        while True:
+            batch = self.read()
+            if batch is None:
+                return
+            yield batch
+
+
+# ----------------------------------------------------------------------
+# 进程入口
+# ----------------------------------------------------------------------
+def run_receiver(ring_name, host, port, scan_mode=1, phase=224, channel=0b11,
+                 duration=10.0, lost_after=0.5, recv_size=1 << 16):
+    """
+    接收进程: 循环发送扫描命令，把返回的数据字解码写入环
+
+    每条命令的数据收齐 (或 lost_after 秒无数据) 后发送下一条。
+
+    Args:
+        ring_name: 环形缓冲区的共享内存名称
+        host/port: 设备地址
+        scan_mode/phase/channel: 扫描命令参数 (同 TDCScanner.start_scan)
+        duration: 采集时长 (秒)
+        lost_after: 无数据多久后认为本条命令结束 (秒)
+        recv_size: 接收缓冲区大小 (字节)
+    """
+    # 延迟导入: 只有接收进程需要网络部分
+    from tdc_scan import TDCScanner
+
+    ring = ShmRing.attach(ring_name)
+    scanner = TDCScanner(host, port)
+    if not scanner.connect():
+        ring.mark_closed()
+        ring.close()
+        return
+
+    n_phases = phase + 1 if scan_mode == TDCScanner.SCAN_FULL else 1
+    per_cmd = n_phases * (2 if channel == 0b11 else 1)
+    cmd = scanner.build_command(TDCScanner.CMD_SCAN, scan_mode, channel, phase)
+    cmd_bytes = cmd.to_bytes(4, 'big')
+
+    sock = scanner.sock
+    sock.settimeout(lost_after)
+    buf = bytearray(recv_size - recv_size % 4)
+    view = memoryview(buf)
+    pending = 0
+    words_total = 0
+    commands = 0
+    start = time.time()
+
+    try:
+        while time.time() - start < duration:
+            sock.sendall(cmd_bytes)
+            commands += 1
+            received = 0
+            while received < per_cmd:
+                try:
+                    n = sock.recv_into(view[pending:])
+                except socket.timeout:
+                    break
+                if n == 0:
+                    print("[WARN] 连接断开")
+                    return
+                total = pending + n
+                usable = total - total % 4
+                words = words_from_bytes(view[:usable])
+                ring.publish_words(words)
+                received += len(words)
+                words_total += len(words)
+                pending = total - usable
+                buf[:pending] = buf[usable:total]
+    finally:
+        elapsed = time.time() - start
+        print(f"[INFO] 接收进程结束: {commands} 条命令, {words_total} 个数据字, "
+              f"{words_total / max(elapsed, 1e-9):.0f} 字/s, {ring.write_seq} 个批次")
+        ring.mark_closed()
+        scanner.disconnect()
+        ring.close()
+
+
+def run_histogram_consumer(ring_name, result_queue, start='oldest'):
+    """
+    统计消费者: 按通道累加 fine 直方图，结束时把结果放入队列
+
+    结果为 {'UP': TDCHistogram, 'DOWN': TDCHistogram, 'lost': 丢失批次数}
+    """
+    ring = ShmRing.attach(ring_name)
+    reader = ring.reader(start)
+    hists = {'UP': TDCHistogram(), 'DOWN': TDCHistogram()}
+    for batch in reader:
+        hists['UP'].fill(batch['fine'][batch['type'] == 0b00])
+        hists['DOWN'].fill(batch['fine'][batch['type'] == 0b01])
+    hists['lost'] = reader.lost
+    ring.close()
+    result_queue.put(hists)
+
+
+def run_file_consumer(ring_name, filepath, start='oldest'):
+    """写文件消费者: 把原始数据字 (大端) 追加写入二进制文件"""
+    ring = ShmRing.attach(ring_name)
+    reader = ring.reader(start, on_overrun=lambda n: print(f"[WARN] 写文件进程落后, 丢失 {n} 个批次"))
+    with open(filepath, 'wb') as f:
+        for batch in reader:
+            f.write(batch['raw'].astype('>u4').tobytes())
+    print(f"[INFO] 已写入 {reader.records} 个数据字到: {filepath}")
+    ring.close()
+
+
+def run_status_consumer(ring_name, interval=1.0, start='latest'):
+    """
+    状态显示消费者: 每 interval 秒打印一行吞吐量、各通道数据数和 fine 中位数、环的读写状态
+
+    默认只读取新批次；落后时与其他读者一样跳过被覆盖的批次，不影响写入方和其他消费者
+    """
+    ring = ShmRing.attach(ring_name)
+    reader = ring.reader(start)
+    channels = {'UP': 0b00, 'DOWN': 0b01}
+    fines = {name: [] for name in channels}
+    last = time.monotonic()
+    last_records = last_lost = 0
+    while True:
+        batch = reader.read(timeout=interval)
+        finished = batch is None and ring.closed and reader.lag() <= 0
+        if batch is not None:
+            for name, data_type in channels.items():
+                fines[name].append(batch['fine'][batch['type'] == data_type].copy())
+
+        now = time.monotonic()
+        if now - last >= interval or finished:
+            parts = []
+            for name in channels:
+                fine = np.concatenate(fines[name]) if fines[name] else np.zeros(0)
+                if len(fine):
+                    parts.append(f"{name} {len(fine)} 个 (中位 {np.median(fine):.0f} ps)")
+                fines[name] = []
+            rate = (reader.records - last_records) / (now - last)
+            print(f"[STATUS] {rate:.0f} 字/s, " + (", ".join(parts) or "无数据")
+                  + f", 批次 {ring.write_seq}, 落后 {reader.lag()}, "
+                  f"丢失 {reader.lost - last_lost}")
+            last = now
+            last_records, last_lost = reader.records, reader.lost
+        if finished:
+            break
+    ring.close()
+
+
+def _collect(results, process, poll=1.0):
+    """
+    等待消费进程放入队列的结果
+
+    Returns:
+        结果对象；进程已退出且没有留下结果时为 None
+    """
+    while True:
+        try:
+            return results.get(timeout=poll)
+        except queue.Empty:
+            if process.exitcode is None:
+                continue
+        # 进程刚退出时结果可能仍在队列的发送缓冲中，再等一次
+        try:
+            return results.get(timeout=poll)
+        except queue.Empty:
+            print(f"[ERROR] 统计进程异常退出 (exitcode {process.exitcode})")
+            return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 多进程采集 (共享内存扇出)")
+    parser.add_argument('--host', default='192.168.2.100')
+    parser.add_argument('--port', type=int, default=1024)
+    parser.add_argument('--seconds', type=float, default=10.0, help="采集时长")
+    parser.add_argument('--mode', type=int, choices=(0, 1), default=1, help="0=单步, 1=全扫描")
+    parser.add_argument('--phase', type=int, default=224)
+    parser.add_argument('--channel', type=int, choices=(1, 2, 3), default=3,
+                        help="1=DOWN, 2=UP, 3=BOTH")
+    parser.add_argument('--slots', type=int, default=256, help="环形缓冲区槽位数")
+    parser.add_argument('--out', default=None, help="原始数据字输出文件 (可选)")
+    parser.add_argument('--status', type=float, default=1.0,
+                        help="状态显示间隔 (秒)，0 表示不显示")
+    args = parser.parse_args()
+
+    ring = ShmRing.create(n_slots=args.slots)
+    results = Queue()
+    histogram = Process(target=run_histogram_consumer, args=(ring.name, results))
+    consumers = [histogram]
+    if args.out:
+        consumers.append(Process(target=run_file_consumer, args=(ring.name, args.out)))
+    if args.status > 0:
+        consumers.append(Process(target=run_status_consumer, args=(ring.name, args.status)))
+    receiver = Process(target=run_receiver,
+                       args=(ring.name, args.host, args.port, args.mode, args.phase,
+                             args.channel, args.seconds))
+
+    try:
+        for p in consumers:
+            p.start()
+        receiver.start()
+        receiver.join()
+        if receiver.exitcode != 0:
+            # 接收进程异常退出时没有标记结束，由主进程通知读者
+            print(f"[ERROR] 接收进程异常退出 (exitcode {receiver.exitcode})")
+            ring.mark_closed()
+        hists = _collect(results, histogram)
+        for p in consumers:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                print(f"[WARN] 消费进程 {p.pid} 未能退出，强制结束")
+                p.terminate()
+                p.join()
+    finally:
+        ring.close()
+
+    if hists is None:
+        return 1
+    if hists['lost']:
+        print(f"[WARN] 统计进程丢失 {hists['lost']} 个批次")
+    for name in ('UP', 'DOWN'):
+        stats = hists[name].precision_stats()
+        if stats['count']:
+            print(f"  {name}: {stats['count']} 个测量值, 众数附近 σ = {stats['sigma']:.2f} ps")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 长期稳定性分析: Allan 偏差 (ADEV) 与重叠 Allan 偏差 (OADEV)
+对固定相位的 fine time 序列 x_i (ps)，平均 m 个样本后相邻平均值之差:
+  d_j(m) = (S[j+2m] - 2 S[j+m] + S[j]) / m，S 为累积和
+  σ²(m)  = <d_j(m)²> / 2
+OADEV 对所有起点 j 求平均，ADEV 只取 j 为 m 的整数倍 (不重叠的平均窗口)。
+
+每个 τ 由累积和 O(N) 计算，按批增量更新，内存与样本数无关:
+  - τ 取 2 的整数次幂 (1, 2, 4, ... 个样本)
+  - τ > resolution 时只在步长 s = τ / resolution 的累积和采样点上取起点
+    (部分重叠估计，与完全重叠的差别远小于统计误差)，每个步长只保留最近 2×resolution 个采样点
+  - fine time 相对参考值按时钟周期折回，环绕点附近的相位不会出现一个周期的跳变
+误差估计 err = σ / sqrt(不重叠项数) (白噪声下 ADEV 的 1σ 统计误差，用作 OADEV 的保守估计)。
+
+用法:
+  python tdc_stability.py tdc_results/tdc_longrun_xxx.txt [--phase 100] [--channel UP] [-o adev.png]
+  python tdc_stability.py --bench 100000000           1e8 个样本的吞吐量测试
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+
+CHANNEL_NAMES = {0b00: 'UP', 0b01: 'DOWN'}
+
+
+def octave_taus(max_tau):
+    """1, 2, 4, ... 不超过 max_tau 的 τ (样本数)"""
+    return [1 << k for k in range(int(max_tau).bit_length()) if (1 << k) <= max_tau]
+
+
+class AllanAccumulator:
+    """单个序列的增量 Allan 偏差"""
+
+    # 每次内部计算的样本数
+    CHUNK = 1 << 15
+
+    def __init__(self, max_tau=1 << 24, resolution=64, clk_period=3864):
+        """
+        Args:
+            max_tau: 最大平均样本数 (取 2 的整数次幂)
+            resolution: 每个 τ 的起点间隔不超过 τ / resolution (2 的整数次幂)
+            clk_period: 时钟周期 (ps)，fine time 按此折回
+        """
+        self.resolution = resolution
+        self.clk_period = clk_period
+        self.taus = octave_taus(max_tau)
+        # 每个 τ 的采样步长
+        self.strides = [max(1, m // resolution) for m in self.taus]
+        self.n = 0
+        self.reference = None
+        self._total = 0.0
+        # 每个步长: 最近 2×resolution 个累积和采样点 (步长的整数倍下标)
+        self._tails = {s: np.zeros(1) for s in set(self.strides)}
+        n_taus = len(self.taus)
+        self._sum_overlap = np.zeros(n_taus)
+        self._n_overlap = np.zeros(n_taus, dtype=np.int64)
+        self._sum_disjoint = np.zeros(n_taus)
+        self._n_disjoint = np.zeros(n_taus, dtype=np.int64)
+
+    def update(self, values):
+        """
+        追加一批样本 (按时间顺序)
+
+        Args:
+            values: fine time (ps)
+        """
+        x = np.asarray(values, dtype=np.float64)
+        if len(x) == 0:
+            return
+        if len(x) > self.CHUNK:
+            # 分块处理: 中间数组留在 CPU 缓存中，比整批一次计算快数倍
+            for i in range(0, len(x), self.CHUNK):
+                self.update(x[i:i + self.CHUNK])
+            return
+        if self.reference is None:
+            # 以第一批的环绕均值为参考，累积和保持在较小的量级
+            angle = x * (2 * np.pi / self.clk_period)
+            self.reference = float(np.mod(np.arctan2(np.sin(angle).mean(), np.cos(angle).mean())
+                                          * self.clk_period / (2 * np.pi), self.clk_period))
+        # 相对参考值折回到 (-T/2, T/2] (输入在 [0, T) 内，最多修正一个周期；
+        # 比较后原地修正比 np.mod 快一个数量级)
+        half = self.clk_period / 2
+        x = np.subtract(x, self.reference)
+        np.subtract(x, self.clk_period, out=x, where=x > half)
+        np.add(x, self.clk_period, out=x, where=x <= -half)
+
+        start = self.n
+        cumsum = np.cumsum(x, out=x)
+        cumsum += self._total
+        self.n += len(x)
+        self._total = float(cumsum[-1])
+
+        for s, tail in self._tails.items():
+            # 累积和 S[i] (i 为已累加的样本数) 中 i 为 s 的整数倍的新采样点
+            first = (start // s + 1) * s
+            if first > self.n:
+                continue
+            new = cumsum[first - start - 1::s]
+            series = np.concatenate([tail, new])
+            # series[0] 对应的采样点序号 (S 下标 / s)
+            g0 = first // s - len(tail)
+            for k, m in enumerate(self.taus):
+                if self.strides[k] != s:
+                    continue
+                q = m // s
+                lo = max(0, len(tail) - 2 * q)
+                hi = len(series) - 2 * q
+                if hi <= lo:
+                    continue
+                d = np.add(series[lo + 2 * q:hi + 2 * q], series[lo:hi])
+                d -= series[lo + q:hi + q]
+                d -= series[lo + q:hi + q]
+                self._sum_overlap[k] += np.dot(d, d)
+                self._n_overlap[k] += len(d)
+                disjoint = d[(-(g0 + lo)) % q::q]
+                self._sum_disjoint[k] += np.dot(disjoint, disjoint)
+                self._n_disjoint[k] += len(disjoint)
+            self._tails[s] = series[-2 * self.resolution - 1:]
+
+    def result(self, tau0=None):
+        """
+        Args:
+            tau0: 样本间隔 (秒)，给出时同时返回以秒为单位的 τ
+
+        Returns:
+            dict: tau (样本数) / tau_s / adev / oadev / err (ps) / n_overlap / n_disjoint / samples，
+                  只包含至少有一个不重叠项的 τ
+        """
+        ok = self._n_disjoint > 0
+        taus = np.array(self.taus, dtype=np.float64)[ok]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            oadev = np.sqrt(self._sum_overlap[ok] / (2 * self._n_overlap[ok])) / taus
+            adev = np.sqrt(self._sum_disjoint[ok] / (2 * self._n_disjoint[ok])) / taus
+            err = adev / np.sqrt(self._n_disjoint[ok])
+        return {
+            'tau': taus.astype(np.int64),
+            'tau_s': None if tau0 is None else taus * tau0,
+            'adev': adev,
+            'oadev': oadev,
+            'err': err,
+            'n_overlap': self._n_overlap[ok].copy(),
+            'n_disjoint': self._n_disjoint[ok].copy(),
+            'samples': self.n,
+        }
+
+
+def allan_deviation(values, max_tau=None, resolution=64, clk_period=3864, batch=1 << 22):
+    """
+    一次性计算一个序列的 Allan 偏差 (分批累加，内存与序列长度无关)
+
+    Returns:
+        dict: 同 AllanAccumulator.result
+    """
+    n = len(values)
+    acc = AllanAccumulator(max_tau or max(1, n // 2), resolution, clk_period)
+    for i in range(0, n, batch):
+        acc.update(values[i:i + batch])
+    return acc.result()
+
+
+def summarize(result):
+    """
+    ADEV 结果的标量摘要 (登记到运行目录、批量比较)
+
+    Returns:
+        dict: samples / adev_tau1_ps / oadev_min_ps / tau_min / oadev_max_tau_ps / max_tau
+    """
+    if result is None or len(result['tau']) == 0:
+        return {'samples': 0 if result is None else int(result['samples'])}
+    best = int(np.nanargmin(result['oadev']))
+    return {
+        'samples': int(result['samples']),
+        'adev_tau1_ps': float(result['oadev'][0]),
+        'oadev_min_ps': float(result['oadev'][best]),
+        'tau_min': int(result['tau'][best]),
+        'oadev_max_tau_ps': float(result['oadev'][-1]),
+        'max_tau': int(result['tau'][-1]),
+    }
+
+
+class StabilityAnalyzer:
+    """按 (通道, 相位) 分别累加的 Allan 偏差，可在采集过程中逐批更新"""
+
+    def __init__(self, max_tau=1 << 24, resolution=64, clk_period=3864, min_samples=16):
+        """
+        Args:
+            max_tau / resolution / clk_period: 同 AllanAccumulator
+            min_samples: 报告中只包含样本数不少于该值的相位
+        """
+        self.max_tau = max_tau
+        self.resolution = resolution
+        self.clk_period = clk_period
+        self.min_samples = min_samples
+        self.accumulators = {}
+
+    def update_channel(self, name, ids, fine):
+        """
+        追加一个通道的一批测量值 (按到达顺序)
+
+        Args:
+            name: 通道名
+            ids: 相位
+            fine: fine time (ps)
+        """
+        ids = np.asarray(ids).astype(np.int64)
+        fine = np.asarray(fine)
+        # 稳定排序: 每个相位内保持到达顺序
+        order = np.argsort(ids, kind='stable')
+        phases, starts = np.unique(ids[order], return_index=True)
+        for phase, values in zip(phases, np.split(fine[order], starts[1:])):
+            key = (name, int(phase))
+            acc = self.accumulators.get(key)
+            if acc is None:
+                acc = self.accumulators[key] = AllanAccumulator(
+                    self.max_tau, self.resolution, self.clk_period)
+            acc.update(values)
+
+    def update_records(self, records):
+        """追加一批 RECORD_DTYPE 记录 (或 decode_words 的结果)"""
+        types = np.asarray(records['type'])
+        for t, name in CHANNEL_NAMES.items():
+            mask = types == t
+            if mask.any():
+                self.update_channel(name, np.asarray(records['id'])[mask],
+                                    np.asarray(records['fine'])[mask])
+
+    def update(self, data_list):
+        """追加一批数据 (receive_data 格式)"""
+        from tdc_words import decode_words
+        words = np.fromiter((d['raw'] for d in data_list), dtype=np.uint32, count=len(data_list))
+        self.update_records(decode_words(words))
+
+    def busiest(self):
+        """
+        每个通道样本数最多的相位
+
+        Returns:
+            dict: {通道名: 相位}
+        """
+        best = {}
+        for (name, phase), acc in self.accumulators.items():
+            if acc.n < self.min_samples:
+                continue
+            if name not in best or acc.n > self.accumulators[(name, best[name])].n:
+                best[name] = phase
+        return best
+
+    def results(self, phase=None):
+        """
+        Args:
+            phase: 指定相位，默认每个通道样本数最多的相位
+
+        Returns:
+            dict: {通道名: AllanAccumulator.result (附加 'phase')}
+        """
+        if phase is None:
+            selected = self.busiest()
+        else:
+            selected = {name: phase for name, p in self.accumulators if p == phase}
+        out = {}
+        for name, p in selected.items():
+            acc = self.accumulators[(name, p)]
+            if acc.n < self.min_samples:
+                continue
+            result = acc.result()
+            result['phase'] = p
+            out[name] = result
+        return out
+
+    def summary(self):
+        """稳定性统计文本"""
+        results = self.results()
+        if not results:
+            return "稳定性分析: 没有样本数足够的相位"
+        lines = ["稳定性分析 (重叠 Allan 偏差):"]
+        lines.extend(format_table(results))
+        return "\n".join(lines)
+
+
+def format_table(results):
+    """ADEV 结果表格的文本行"""
+    lines = []
+    for name, r in results.items():
+        lines.append(f"  {name} 通道 相位 {r['phase']} ({r['samples']} 个样本):")
+        lines.append(f"    {'τ (样本)':>10} {'OADEV (ps)':>12} {'ADEV (ps)':>12} {'误差 (ps)':>10}")
+        for tau, oadev, adev, err in zip(r['tau'], r['oadev'], r['adev'], r['err']):
+            lines.append(f"    {tau:>10} {oadev:>12.3f} {adev:>12.3f} {err:>10.3f}")
+    return lines
+
+
+def plot_stability(results, save_file=None, title='TDC 稳定性 (Allan 偏差)'):
+    """
+    绘制 ADEV / OADEV 对 τ 的双对数图
+
+    Args:
+        results: {通道名: AllanAccumulator.result}
+        save_file: 保存路径 (None 时显示)
+    """
+    import matplotlib.pyplot as plt
+    plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS']
+    plt.rcParams['axes.unicode_minus'] = False
+
+    colors = {'UP': 'b', 'DOWN': 'r'}
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for name, r in results.items():
+        if len(r['tau']) == 0:
+            continue
+        color = colors.get(name)
+        label = f"{name} (相位 {r['phase']})" if 'phase' in r else name
+        ax.errorbar(r['tau'], r['adev'], yerr=r['err'], fmt='o', color=color,
+                    markersize=4, capsize=2, alpha=0.5, label=f"{label} ADEV")
+        ax.loglog(r['tau'], r['oadev'], '.-', color=color, label=f"{label} OADEV")
+        # 白噪声参考线: σ(1) / sqrt(τ)
+        ax.loglog(r['tau'], r['oadev'][0] / np.sqrt(r['tau']), ':', color=color, alpha=0.5)
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel('τ (样本数)')
+    ax.set_ylabel('σ(τ) (ps)')
+    ax.set_title(title + '\n(虚线: 白噪声 τ^-1/2)')
+    ax.grid(True, which='both', alpha=0.3)
+    ax.legend()
+    plt.tight_layout()
+
+    if save_file:
+        plt.savefig(save_file, dpi=150, bbox_inches='tight')
+        print(f"[INFO] 稳定性图已保存到: {save_file}")
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 稳定性分析 (Allan 偏差)")
+    parser.add_argument('file', nargs='?', help="采集文件")
+    parser.add_argument('--phase', type=int, default=None, help="相位 (默认样本数最多的相位)")
+    parser.add_argument('--channel', choices=list(CHANNEL_NAMES.values()), default=None)
+    parser.add_argument('--resolution', type=int, default=64, help="每个 τ 的起点分辨率")
+    parser.add_argument('-o', '--output', default=None, help="保存图表")
+    parser.add_argument('--bench', type=int, default=None, metavar='N',
+                        help="对 N 个随机样本测量计算速度")
+    args = parser.parse_args()
+
+    if args.bench:
+        rng = np.random.default_rng(0)
+        acc = AllanAccumulator(max(1, args.bench // 2), args.resolution)
+        batch = 1 << 22
+        elapsed = 0.0
+        for i in range(0, args.bench, batch):
+            values = 1000.0 + rng.normal(0, 8.0, min(batch, args.bench - i))
+            start = time.perf_counter()
+            acc.update(values)
+            elapsed += time.perf_counter() - start
+        result = acc.result()
+        print(f"[INFO] {args.bench} 个样本: {elapsed:.2f} s ({args.bench / elapsed / 1e6:.1f} M/s)，"
+              f"{len(result['tau'])} 个 τ")
+        k = min(10, len(result['tau']) - 1)
+        print(f"[INFO] 白噪声 8 ps: σ(1) = {result['oadev'][0]:.3f} ps, "
+              f"σ({result['tau'][k]}) × sqrt(τ) = {result['oadev'][k] * np.sqrt(result['tau'][k]):.3f} ps")
+        return 0
+
+    if not args.file:
+        parser.error("需要采集文件或 --bench")
+
+    from tdc_scan import TDCDataProcessor
+    from tdc_words import decode_words
+    data_list = TDCDataProcessor.load_from_file(args.file)
+    words = np.fromiter((d['raw'] for d in data_list), dtype=np.uint32, count=len(data_list))
+    analyzer = StabilityAnalyzer(resolution=args.resolution)
+    analyzer.update_records(decode_words(words))
+    results = analyzer.results(args.phase)
+    if args.channel:
+        results = {k: v for k, v in results.items() if k == args.channel}
+    if not results:
+        print("[WARN] 没有样本数足够的相位")
+        return 1
+    print("\n".join(format_table(results)))
+    plot_stability(results, save_file=args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 数据字流解析 (自动重新同步)
+TCP 不保留 4 字节的字边界: recv 可能返回任意长度，连接时清空接收缓冲区也可能
+丢弃非 4 整数倍的字节。解析器把收到的字节拼接后按字切分，并按批检查对齐:
+  flag  UP/DOWN 数据字的通道标志 [8] 必须与类型 [31:30] 一致 (UP=1, DOWN=0)
+  order 同一批中相邻数据字的 ID 只能保持、加 1 或回到 0 (全扫描的相位顺序)，
+        权重较低 (单步命令之间的相位跳变是正常的)
+  info  INFO 字的事件码必须是已定义的事件 (tdc_device_state)
+  cmd   固件不发送 CMD 类型的字，偶尔出现的回显按低权重计
+错位时随机字节约有 1/4 违反 flag 条件，order 几乎总是违反。
+
+一个数据字要由其后的数据字检查 ID 顺序才算确认: 第一个违反之前的字照常输出，违反前
+最后一个数据字 (可能跨过错位点、只是碰巧满足条件) 留到以它为起点的窗口重新判断。
+窗口起点附近的违反得分达到 threshold、且其后的字连续违反时判为错位: 逐字节向后搜索
+下一个完全满足条件、且以 UP/DOWN 数据字开头的窗口 (INFO 字不受 ID 顺序约束)。
+对齐改变时其间的字节全部丢弃并记录 (与新对齐点不对齐的字无法确认不是错位后的随机字节)。
+单个亚稳态等硬件异常只产生零星的违反，不会触发重新同步 (由 tdc_glitch 负责检测)。
+
+用法:
+  python tdc_stream_parser.py tdc_results/xxx.tdcraw      检查录制的字节流 (tdc_replay)
+  python tdc_stream_parser.py --selftest                 随机切分 + 插入错位字节的自检
+"""
+
+import argparse
+import random
+import struct
+import sys
+
+from tdc_device_state import EVENTS
+
+TYPE_UP = 0b00
+TYPE_DOWN = 0b01
+TYPE_INFO = 0b10
+
+# 相邻数据字 ID 顺序违反、CMD 字的权重 (flag 违反为 1)
+ORDER_WEIGHT = 0.5
+CMD_WEIGHT = 0.5
+# 对齐未变但其间超过一半的字违反条件: 两处错位恰好相互抵消 (错位的字几乎都违反 ID 顺序)
+SHIFTED_FRACTION = 0.5
+
+
+class WordStreamParser:
+    """字节流 -> 32 位数据字，检测错位并自动重新同步"""
+
+    def __init__(self, window=16, threshold=2.0, max_search=256):
+        """
+        Args:
+            window: 检查对齐的窗口长度 (字)
+            threshold: 窗口内违反得分达到该值判为错位
+            max_search: 重新同步时最多向后搜索的字节数 (超出仍未找到时从该处继续)
+        """
+        self.window = window
+        self.threshold = threshold
+        self.max_search = max_search
+        self._buf = bytearray()
+        self.words = 0
+        self.discarded = 0
+        self.resyncs = 0
+        # 最近一次 feed/flush 丢弃的字节数 (调用方据此打印警告)
+        self.last_discarded = 0
+
+    def reset(self):
+        """丢弃缓冲的字节 (重新连接时调用)，统计保留"""
+        self._buf.clear()
+
+    def take(self):
+        """
+        取出并清空缓冲的字节 (调用方改为直接读取数据流时，这些字节是数据流的开头)
+
+        Returns:
+            bytes
+        """
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+    @property
+    def buffered(self):
+        """尚未输出的字节数"""
+        return len(self._buf)
+
+    @staticmethod
+    def _word(buf, pos):
+        return struct.unpack_from('>I', buf, pos)[0]
+
+    def _scores(self, buf, pos, n):
+        """从 pos 开始 n 个字的逐字违反得分"""
+        scores = []
+        prev_id = None
+        for i in range(n):
+            value = self._word(buf, pos + 4 * i)
+            data_type = value >> 30
+            if data_type == TYPE_INFO:
+                scores.append(0.0 if (value >> 24) & 0x3F < len(EVENTS) else 1.0)
+                continue
+            if data_type > TYPE_INFO:
+                scores.append(CMD_WEIGHT)
+                continue
+            score = 0.0
+            if (value >> 8) & 0x1 != (data_type == TYPE_UP):
+                score += 1.0
+            data_id = (value >> 22) & 0xFF
+            if prev_id is not None and data_id not in (prev_id, prev_id + 1, 0):
+                score += ORDER_WEIGHT
+            prev_id = data_id
+            scores.append(score)
+        return scores
+
+    def _find_alignment(self, buf, pos, final):
+        """
+        从 pos+1 起逐字节寻找满足条件的窗口 (第一个字之前没有可比较 ID 的字，
+        要求它是 UP/DOWN 数据字，由下一个数据字的 ID 顺序确认)
+
+        Returns:
+            int: 新对齐点相对 pos 的字节数；数据不足以判断时为 None
+        """
+        for shift in range(1, self.max_search + 1):
+            start = pos + shift
+            n = min(self.window, (len(buf) - start) // 4)
+            if n < self.window and not final:
+                return None
+            if n == 0:
+                return len(buf) - pos
+            if n > 1 and self._word(buf, start) >> 30 >= TYPE_INFO:
+                continue
+            if sum(self._scores(buf, start, n)) == 0:
+                return shift
+        return self.max_search
+
+    def _parse(self, final):
+        buf = self._buf
+        out = []
+        pos = 0
+        discarded = 0
+        while len(buf) - pos >= 4:
+            n = min(self.window, (len(buf) - pos) // 4)
+            scores = self._scores(buf, pos, n)
+            # 最后一个数据字及其后的 INFO 字还没有后续数据字检查 ID 顺序 (可能跨过错位点、
+            # 只是碰巧满足条件)，缓冲区中还有后续字节时留到以它为起点重新判断
+            # (缓冲区末尾不足一个窗口时照常输出，不等待下一条命令的数据)
+            first = next((i for i, s in enumerate(scores) if s), n)
+            keep = max((i for i in range(first)
+                        if self._word(buf, pos + 4 * i) >> 30 < TYPE_INFO), default=0)
+            if first == n:
+                count = keep if keep and n == self.window else n
+                out.extend(self._word(buf, pos + 4 * i) for i in range(count))
+                pos += 4 * count
+                continue
+            if n < self.window and not final:
+                # 不足一个窗口且已有违反: 等待更多数据再判断
+                break
+            # 违反可能是错位的开始: 先输出之前的字，以违反前最后一个数据字为窗口起点重新判断
+            if keep:
+                out.extend(self._word(buf, pos + 4 * i) for i in range(keep))
+                pos += 4 * keep
+                continue
+            # 违反的是 UP/DOWN 数据字且其后三个字最多一个违反: 零星的异常字而不是错位
+            # (错位的字几乎连续违反)
+            after = scores[first + 1:first + 4]
+            isolated = (len(after) == 3 and sum(1 for s in after if s) <= 1
+                        and self._word(buf, pos + 4 * first) >> 30 < TYPE_INFO)
+            if sum(scores) < self.threshold or isolated:
+                # 单个异常字 (及之前的字) 照常输出
+                count = first or 1
+                out.extend(self._word(buf, pos + 4 * i) for i in range(count))
+                pos += 4 * count
+                continue
+
+            # 错位: 错位点在窗口起点附近，逐字节寻找下一个对齐的窗口
+            shift = self._find_alignment(buf, pos, final)
+            if shift is None:
+                break
+            gap = self._scores(buf, pos, shift // 4) if shift % 4 == 0 else []
+            bad = sum(1 for s in gap if s)
+            if gap and (len(gap) <= self.threshold or shift == self.max_search
+                        or bad <= SHIFTED_FRACTION * len(gap)):
+                # 对齐未变，只是几个异常字 (与单个异常字一样照常输出)；
+                # 搜索范围内找不到满足条件的窗口时同样按原对齐继续
+                out.extend(self._word(buf, pos + 4 * i) for i in range(shift // 4))
+                pos += shift
+                continue
+            # 对齐改变: 其间的原对齐字与新对齐点不对齐，全部丢弃
+            # (对齐未变但其间几乎全是违反的字时同样是错位的字节)
+            pos += shift
+            discarded += shift
+            self.resyncs += 1
+
+        if final and pos < len(buf):
+            # 数据流结束时不足一个字的尾部字节
+            discarded += len(buf) - pos
+            pos = len(buf)
+        del buf[:pos]
+        self.words += len(out)
+        self.discarded += discarded
+        self.last_discarded = discarded
+        return out
+
+    def feed(self, data):
+        """
+        追加收到的字节
+
+        Returns:
+            list: 可以输出的数据字 (int)；错位判断需要更多数据时部分字节留在缓冲区
+        """
+        self._buf += data
+        return self._parse(final=False)
+
+    def flush(self):
+        """
+        输出缓冲区中剩余的全部数据字 (数据流结束或接收超时时调用)
+
+        Returns:
+            list: 数据字 (int)
+        """
+        return self._parse(final=True)
+
+    def summary(self):
+        """统计文本"""
+        return (f"字流解析: {self.words} 个数据字, 重新同步 {self.resyncs} 次, "
+                f"丢弃 {self.discarded} 字节")
+
+
+def _selftest(n_words=20000, seed=0):
+    """随机切分字节流并插入错位字节，检查输出与原始数据字一致"""
+    rng = random.Random(seed)
+    words = []
+    for sweep in range(n_words // 450 + 1):
+        for phase in range(225):
+            for data_type in (TYPE_UP, TYPE_DOWN):
+                flag = 1 if data_type == TYPE_UP else 0
+                words.append((data_type << 30) | (phase << 22) | (rng.randrange(3864) << 9)
+                             | (flag << 8) | rng.randrange(256))
+    words = words[:n_words]
+
+    stream = bytearray()
+    junk_at = set(rng.sample(range(1, n_words), 20))
+    junk = 0
+    for i, value in enumerate(words):
+        if i in junk_at:
+            k = rng.choice((1, 2, 3, 5, 6))
+            stream += bytes(rng.randrange(256) for _ in range(k))
+            junk += k
+        stream += struct.pack('>I', value)
+
+    parser = WordStreamParser()
+    out = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.randint(1, 700)
+        out.extend(parser.feed(stream[pos:pos + size]))
+        pos += size
+    out.extend(parser.flush())
+
+    expected = set(words)
+    lost = len(expected - set(out))
+    garbage = sum(1 for w in out if w not in expected)
+    print(f"[INFO] {n_words} 个数据字, 插入 {len(junk_at)} 处共 {junk} 个错位字节")
+    print(f"[INFO] {parser.summary()}")
+    print(f"[INFO] 输出 {len(out)} 个字: 丢失 {lost}, 错误 {garbage}")
+    return lost <= 2 * len(junk_at) and garbage == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TDC 数据字流解析 (检查错位与重新同步)")
+    parser.add_argument('file', nargs='?', help="录制的字节流 (.tdcraw)")
+    parser.add_argument('--window', type=int, default=16, help="检查窗口长度 (字)")
+    parser.add_argument('--selftest', action='store_true', help="随机切分与错位字节自检")
+    args = parser.parse_args()
+
+    if args.selftest or not args.file:
+        return 0 if _selftest() else 1
+
+    from tdc_replay import RX, load_capture
+    _, records = load_capture(args.file)
+    stream_parser = WordStreamParser(window=args.window)
+    n = 0
+    for direction, _, chunk in records:
+        if direction != RX:
+            continue
+        n += len(stream_parser.feed(chunk))
+        if stream_parser.last_discarded:
+            print(f"[WARN] 第 {n} 个字附近重新同步，丢弃 {stream_parser.last_discarded} 字节")
+    n += len(stream_parser.flush())
+    print(f"[INFO] {stream_parser.summary()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 采集数据流式写入
+接收线程只把一批数据放入队列，由后台线程格式化并追加写入磁盘:
+  - 行格式与 save_to_file 相同，Index 跨文件连续，可用 load_from_file 读取
+  - 按大小 / 时间轮转文件
+  - 可选流式压缩 (gzip / lzma / bz2)
+  - 可配置的 fsync 策略: 不同步 / 每批 / 轮转时 / 按时间间隔
+    (lzma / bz2 的压缩器无法中途刷出，同步时结束当前压缩流并在同一文件中开始新的流)
+  - 可选同时生成多分辨率摘要 (tdc_pyramid)，长时间数据的绘图/查询无需重读原始文件
+  - 可选同时写入带块索引的分块文件 (tdc_block_capture)，按通道/相位/时间查询只读取命中的块
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime
+
+
+COMPRESSORS = {
+    None: ('', None),
+    'gzip': ('.gz', lambda raw: gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6)),
+    'lzma': ('.xz', lambda raw: lzma.LZMAFile(raw, mode='wb', preset=3)),
+    'bz2': ('.bz2', lambda raw: bz2.BZ2File(raw, mode='wb', compresslevel=9)),
+}
+
+_TYPE_NAMES = {0b00: 'UP', 0b01: 'DOWN'}
+_STOP = object()
+
+
+class StreamWriter:
+    """后台追加写入器"""
+
+    def __init__(self, output_dir='tdc_results', prefix='tdc_stream', max_bytes=64 << 20,
+                 max_seconds=3600.0, compression=None, fsync='rotate', max_queue=1024,
+                 pyramid=False, block_records=None):
+        """
+        Args:
+            output_dir: 输出目录
+            prefix: 文件名前缀，文件名为 <prefix>_<时间>_<序号>.txt[.gz]
+            max_bytes: 单个文件的最大 (未压缩) 字节数，None 表示不按大小轮转
+            max_seconds: 单个文件的最长时间 (秒)，None 表示不按时间轮转
+            compression: None / 'gzip' / 'lzma' / 'bz2'
+            fsync: 'none' = 交给操作系统, 'batch' = 每批写入后, 'rotate' = 关闭文件时,
+                   数值 = 间隔秒数
+            max_queue: 队列中最多缓存的批次数 (写盘跟不上时接收方等待而不丢数据)
+            pyramid: 是否在 <prefix>_<时间>.pyr 目录中同时生成多分辨率摘要
+            block_records: 给定时同时写入 <prefix>_<时间>.tdcblk 分块文件，每块该数量的记录
+        """
+        if compression not in COMPRESSORS:
+            raise ValueError(f"不支持的压缩方式: {compression}")
+        if not (fsync in ('none', 'batch', 'rotate') or isinstance(fsync, (int, float))):
+            raise ValueError(f"无效的 fsync 策略: {fsync}")
+
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+        self.fsync = fsync
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.files = []
+        self.records = 0
+        self.bytes_written = 0
+        self.stalls = 0         # 队列满导致接收方等待的次数
+        self.error = None
+
+        self._raw = None
+        self._stream = None
+        self._file_bytes = 0
+        self._file_opened = 0.0
+        self._last_sync = 0.0
+        self._session = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.pyramid = None
+        if pyramid:
+            from tdc_pyramid import SummaryPyramid
+            self.pyramid = SummaryPyramid(
+                os.path.join(output_dir, f"{prefix}_{self._session}.pyr"))
+        self.blocks = None
+        if block_records:
+            from tdc_block_capture import BlockWriter
+            self.blocks = BlockWriter(
+                os.path.join(output_dir, f"{prefix}_{self._session}.tdcblk"), block_records)
+        self._thread = threading.Thread(target=self._run, name='tdc-stream-writer', daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # 接收方接口
+    # ------------------------------------------------------------------
+    def write(self, data_list):
+        """
+        提交一批数据 (receive_data 格式)，立即返回
+
+        列表会被写入线程持有，调用方之后不应再修改它
+        """
+        if self.error is not None:
+            raise RuntimeError(f"写入线程已出错: {self.error}")
+        if not data_list:
+            return
+        # 记录接收时间，摘要按时间分桶
+        item = (time.time(), data_list)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.stalls += 1
+            # 写入线程出错退出后队列不会再被取走，定时检查以免接收方永久阻塞
+            while True:
+                try:
+                    self.queue.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    if self.error is not None or not self._thread.is_alive():
+                        raise RuntimeError(f"写入线程已出错: {self.error}")
+
+    def close(self):
+        """写完队列中的数据并关闭文件"""
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+        print(f"[INFO] 流式写入完成: {self.records} 个数据, {len(self.files)} 个文件")
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # 写入线程
+    # ------------------------------------------------------------------
+    def _open(self):
+        suffix, wrap = COMPRESSORS[self.compression]
+        filename = f"{self.prefix}_{self._session}_{len(self.files):04d}.txt{suffix}"
+        path = os.path.join(self.output_dir, filename)
+        self._raw = open(path, 'wb')
+        self._stream = wrap(self._raw) if wrap else self._raw
+        self.files.append(path)
+        self._file_bytes = 0
+        self._file_opened = time.time()
+
+        header = ("# TDC 扫描数据 (流式写入)\n"
+                  f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+                  "# Index, Type, ID, Fine, Flag, Coarse, Raw_Hex\n").encode('utf-8')
+        self._stream.write(header)
+        self._file_bytes += len(header)
+
+    def _sync(self):
+        if self._stream is not self._raw:
+            # 压缩流: 刷出已压缩的数据块 (gzip 写入同步点)
+            if isinstance(self._stream, gzip.GzipFile):
+                self._stream.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                # LZMAFile / BZ2File 的 flush() 不刷出压缩器内部的数据: 结束当前流，
+                # 之后的数据写入同一文件中的新流 (多个流首尾相接，解压时连续读出)
+                self._stream.close()
+                self._stream = COMPRESSORS[self.compression][1](self._raw)
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._last_sync = time.time()
+
+    def _close_file(self):
+        if self._stream is None:
+            return
+        if self._stream is not self._raw:
+            self._stream.close()       # 写入压缩尾部，不关闭底层文件
+        if self.fsync != 'none':
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._stream = self._raw = None
+
+    def _need_rotate(self):
+        if self._stream is None:
+            return True
+        if self.max_bytes is not None and self._file_bytes >= self.max_bytes:
+            return True
+        return self.max_seconds is not None and time.time() - self._file_opened >= self.max_seconds
+
+    def _format(self, data_list):
+        lines = []
+        index = self.records
+        for d in data_list:
+            lines.append(f"{index},{_TYPE_NAMES.get(d['type'], 'INFO')},{d['id']},{d['fine']},"
+                         f"{d.get('flag', 0)},{d['coarse']},0x{d['raw']:08X}\n")
+            index += 1
+        return ''.join(lines).encode('ascii')
+
+    def _run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _STOP:
+                    break
+                # 合并队列中已有的批次，一次写入
+                batches = [item]
+                stop = False
+                while True:
+                    try:
+                        more = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if more is _STOP:
+                        stop = True
+                        break
+                    batches.append(more)
+
+                for t, data_list in batches:
+                    if self._need_rotate():
+                        self._close_file()
+                        self._open()
+                    chunk = self._format(data_list)
+                    self._stream.write(chunk)
+                    self._file_bytes += len(chunk)
+                    self.bytes_written += len(chunk)
+                    self.records += len(data_list)
+                    if self.pyramid is not None:
+                        self.pyramid.add(data_list, t)
+                    if self.blocks is not None:
+                        self.blocks.write(data_list, t)
+
+                if self.fsync == 'batch':
+                    self._sync()
+                elif isinstance(self.fsync, (int, float)) and not isinstance(self.fsync, bool) \
+                        and time.time() - self._last_sync >= self.fsync:
+                    self._sync()
+                if stop:
+                    break
+        except Exception as e:
+            self.error = e
+            print(f"[ERROR] 流式写入失败: {e}")
+        finally:
+            self._close_file()
+            if self.pyramid is not None:
+                self.pyramid.close()
+            if self.blocks is not None:
+                self.blocks.close()
+
+
+def open_capture(filepath):
+    """按扩展名打开 (可能压缩的) 采集文件，返回文本流"""
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'rt', encoding='utf-8', errors='replace')
+    if filepath.endswith('.xz'):
+        return lzma.open(filepath, 'rt', encoding='utf-8', errors='replace')
+    if filepath.endswith('.bz2'):
+        return bz2.open(filepath, 'rt', encoding='utf-8', errors='replace')
+    return open(filepath, 'r', encoding='utf-8', errors='replace')
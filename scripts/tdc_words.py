@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TDC 32位数据字的批量编解码 (numpy 向量化)
+数据字格式 (大端):
+  [31:30] = 类型 (00=UP, 01=DOWN, 10=INFO, 11=CMD)
+  [29:22] = ID (相位索引)
+  [21:9]  = 精细时间 (13-bit)
+  [8]     = 通道标志 (1=UP通道, 0=DOWN通道)
+  [7:0]   = 粗计数低8位
+"""
+
+import numpy as np
+
+
+WORD_DTYPE = np.dtype('>u4')
+FINE_BINS = 1 << 13     # 13-bit 精细时间
+
+# 解码后的定长记录 (用于共享内存、块文件等需要连续布局的场合)
+RECORD_DTYPE = np.dtype([
+    ('raw', '<u4'),
+    ('fine', '<u2'),
+    ('type', 'u1'),
+    ('id', 'u1'),
+    ('flag', 'u1'),
+    ('coarse', 'u1'),
+])
+
+
+def words_from_bytes(buf):
+    """
+    将字节缓冲区转换为数据字数组 (零拷贝视图)
+
+    Args:
+        buf: bytes/bytearray/memoryview，长度须为4的整数倍
+
+    Returns:
+        numpy.ndarray: uint32 (大端) 数组
+    """
+    return np.frombuffer(buf, dtype=WORD_DTYPE)
+
+
+def decode_words(words):
+    """
+    解析数据字数组
+
+    Args:
+        words: uint32 数组
+
+    Returns:
+        dict: 各字段数组 type/id/fine/flag/coarse/raw
+    """
+    words = np.asarray(words).astype(np.uint32, copy=False)
+    return {
+        'type': (words >> 30).astype(np.uint8),
+        'id': ((words >> 22) & 0xFF).astype(np.uint8),
+        'fine': ((words >> 9) & 0x1FFF).astype(np.uint16),
+        'flag': ((words >> 8) & 0x1).astype(np.uint8),
+        'coarse': (words & 0xFF).astype(np.uint8),
+        'raw': words,
+    }
+
+
+def decode_records(words, out=None):
+    """
+    将数据字解码为 RECORD_DTYPE 结构化数组
+
+    Args:
+        words: uint32 数组
+        out: 可选的输出数组 (长度 >= len(words))，直接写入以避免额外拷贝
+
+    Returns:
+        numpy.ndarray: 结构化数组 (out 给出时为其前 len(words) 项的视图)
+    """
+    words = np.asarray(words).astype(np.uint32, copy=False)
+    if out is None:
+        out = np.empty(len(words), dtype=RECORD_DTYPE)
+    out = out[:len(words)]
+    out['raw'] = words
+    out['type'] = words >> 30
+    out['id'] = (words >> 22) & 0xFF
+    out['fine'] = (words >> 9) & 0x1FFF
+    out['flag'] = (words >> 8) & 0x1
+    out['coarse'] = words & 0xFF
+    return out
+
+
+def encode_words(data_type, data_id, fine, flag, coarse):
+    """由字段数组构造数据字 (decode_words 的逆运算)"""
+    return ((np.asarray(data_type, dtype=np.uint32) & 0x3) << 30 |
+            (np.asarray(data_id, dtype=np.uint32) & 0xFF) << 22 |
+            (np.asarray(fine, dtype=np.uint32) & 0x1FFF) << 9 |
+            (np.asarray(flag, dtype=np.uint32) & 0x1) << 8 |
+            (np.asarray(coarse, dtype=np.uint32) & 0xFF)).astype(np.uint32)
+
+
+def to_data_list(fields):
+    """将 decode_words 的结果转换为 receive_data 格式的字典列表"""
+    return [
+        {'type': int(t), 'id': int(i), 'fine': int(f),
+         'coarse': int(c), 'flag': int(g), 'raw': int(r)}
+        for t, i, f, g, c, r in zip(fields['type'], fields['id'], fields['fine'],
+                                    fields['flag'], fields['coarse'], fields['raw'])
+    ]